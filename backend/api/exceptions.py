@@ -84,6 +84,12 @@ class UnsupportedDocument(exceptions.APIException):
     default_code = 'unsupported_document'
 
 
+class DocumentTooLarge(exceptions.APIException):
+    status_code = 413
+    default_detail = 'The provided document is too large.'
+    default_code = 'document_too_large'
+
+
 class InvalidStatus(exceptions.APIException):
     status_code = 422
     default_detail =  'Invalid Job status for this request.'
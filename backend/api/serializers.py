@@ -2,7 +2,7 @@ from rest_framework import serializers
 
 from common.models import User
 from control.models import GutenbergJob, Printer, TwoSidedPrinting, validate_pages_to_print, validate_n_up, \
-    ImpositionTemplate, OrientationRequested, JobArtefact
+    ImpositionTemplate, OrientationRequested, JobArtefact, JobStageTiming
 from gutenberg.worker_capabilities import get_formats_supported_by_workers
 
 
@@ -20,6 +20,16 @@ class GutenbergJobSerializer(serializers.ModelSerializer):
         return JobArtefactSerializer(artefacts, many=True, context={'request': request}).data
 
 
+class GutenbergJobDetailSerializer(GutenbergJobSerializer):
+    stage_timings = serializers.SerializerMethodField()
+
+    class Meta(GutenbergJobSerializer.Meta):
+        fields = GutenbergJobSerializer.Meta.fields + ['stage_timings']
+
+    def get_stage_timings(self, obj):
+        return JobStageTimingSerializer(obj.stage_timings.all().order_by('id'), many=True).data
+
+
 def _get_supported_extensions_default():
     return ",".join(sorted(
         get_formats_supported_by_workers()["extensions"],
@@ -86,4 +96,10 @@ class JobArtefactSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = JobArtefact
-        fields = ['id', 'file', 'artefact_type', 'mime_type', 'document_number']
+        fields = ['id', 'file', 'artefact_type', 'mime_type', 'document_number', 'page_count', 'encrypted']
+
+
+class JobStageTimingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = JobStageTiming
+        fields = ['document_number', 'stage', 'wall_time_s', 'cpu_time_s', 'input_bytes', 'output_bytes', 'pages']
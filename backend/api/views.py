@@ -15,17 +15,20 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from api.exceptions import UnsupportedDocument, InvalidStatus
-from api.serializers import GutenbergJobSerializer, PrinterSerializer, UserInfoSerializer, \
-    CreatePrintJobRequestSerializer, UploadJobArtefactRequestSerializer, LoginSerializer, \
+from api.exceptions import UnsupportedDocument, InvalidStatus, DocumentTooLarge
+from api.serializers import GutenbergJobSerializer, GutenbergJobDetailSerializer, PrinterSerializer, \
+    UserInfoSerializer, CreatePrintJobRequestSerializer, UploadJobArtefactRequestSerializer, LoginSerializer, \
     DeleteJobArtefactRequestSerializer, ChangeArtefactOrderRequestSerializer, JobArtefactSerializer, \
     ChangePrintJobPropertiesRequestSerializer
 from common.models import User
 from control.models import GutenbergJob, Printer, JobStatus, PrintingProperties, TwoSidedPrinting, JobArtefact, \
     JobArtefactType, JobType
 from gutenberg.worker_capabilities import get_formats_supported_by_workers
-from printing.printing import print_file
+from printing.cancellation import notify_job_canceled
+from printing.ingestion import IngestedUploadedFile, RejectedUploadedFile, create_source_artefact, index_artefact
+from printing.printing import enqueue_print_file, enqueue_preconversion
 from printing.processing.converter import detect_file_format
+from printing.processing.final_pages import count_pages_to_print
 
 logger = logging.getLogger('gutenberg.api.printing')
 
@@ -50,13 +53,20 @@ class PrintJobViewSet(viewsets.ReadOnlyModelViewSet):
         queryset = GutenbergJob.objects.filter(owner=user)
         return queryset.all().order_by('date_created')
 
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return GutenbergJobDetailSerializer
+        return GutenbergJobSerializer
+
     @action(detail=True, methods=['post'], name='Cancel job')
     def cancel(self, request, pk=None):
         job = self.get_object()
         GutenbergJob.objects.filter(id=job.id).filter(status=JobStatus.INCOMING).update(
             status=JobStatus.CANCELED)
-        GutenbergJob.objects.filter(id=job.id).exclude(status__in=GutenbergJob.COMPLETED_STATUSES).update(
+        rows = GutenbergJob.objects.filter(id=job.id).exclude(status__in=GutenbergJob.COMPLETED_STATUSES).update(
             status=JobStatus.CANCELING)
+        if rows > 0:
+            notify_job_canceled(job.id)
         job.refresh_from_db()
         return Response(self.get_serializer(job).data)
 
@@ -214,14 +224,26 @@ class PrintJobViewSet(viewsets.ReadOnlyModelViewSet):
         return job
 
     def _upload_artefact(self, job, file, **_):
-        artefact = JobArtefact.objects.create(job=job, artefact_type=JobArtefactType.SOURCE, file=file, document_number=job.next_document_number)
+        if isinstance(file, RejectedUploadedFile):
+            raise DocumentTooLarge(file.error)
+        if isinstance(file, IngestedUploadedFile):
+            # The file has already been written to its final location by the upload handler
+            document = file.claim()
+            artefact = create_source_artefact(job, document, document_number=job.next_document_number)
+            file_type = document.mime_type
+        else:
+            artefact = JobArtefact.objects.create(job=job, artefact_type=JobArtefactType.SOURCE, file=file, document_number=job.next_document_number)
+            file_type = detect_file_format(artefact.file.path)
         job.next_document_number += 1
         job.save()
-        file_type = detect_file_format(artefact.file.path)
         if file_type not in get_formats_supported_by_workers()["mime_types"]:
             raise UnsupportedDocumentError("Unsupported file type: {}".format(file_type))
         artefact.mime_type = file_type
+        if not isinstance(file, IngestedUploadedFile):
+            index_artefact(artefact)
         artefact.save()
+        # The document is converted while the user chooses the printing options
+        enqueue_preconversion(artefact)
 
     def _change_order(self, new_order):
         job = self.get_object()
@@ -242,7 +264,7 @@ class PrintJobViewSet(viewsets.ReadOnlyModelViewSet):
     def _run_job(self, job):
         job.status = JobStatus.PENDING
         job.save()
-        print_file.delay(job.id)
+        enqueue_print_file(job)
         logger.info('User %s submitted job: %s', self.request.user.username, job.id)
         return job
 
@@ -257,6 +279,13 @@ class PrintJobViewSet(viewsets.ReadOnlyModelViewSet):
             raise exceptions.ValidationError("Color printing is not allowed on the selected printer")
         if properties.two_sides != TwoSidedPrinting.ONE_SIDED and not printer_with_perms.duplex_supported:
             raise exceptions.ValidationError("Two-sided printing is not supported on the selected printer")
+        if job.pk is not None:
+            # Only the documents indexed when they were uploaded are checked, see `printing.ingestion`
+            indexed_artefacts = job.artefacts.filter(artefact_type=JobArtefactType.SOURCE, page_count__isnull=False)
+            for artefact in indexed_artefacts:
+                if count_pages_to_print(properties.pages_to_print, artefact.page_count) == 0:
+                    raise exceptions.ValidationError(
+                        "No pages of document {} are selected to print".format(artefact.document_number))
 
 
 class PrinterViewSet(viewsets.ReadOnlyModelViewSet):
@@ -3,7 +3,7 @@ from django.contrib import admin
 from control.forms import LocalPrinterParamsForm
 # Register your models here.
 from control.models import GutenbergJob, PrintingProperties, PrinterPermissions, LocalPrinterParams, Printer, \
-    JobArtefact
+    JobArtefact, JobStageTiming, BackendPrintJob
 
 
 class PrintingPropertiesInline(admin.TabularInline):
@@ -14,8 +14,31 @@ class JobArtefactAdmin(admin.TabularInline):
     model = JobArtefact
 
 
+class JobStageTimingInline(admin.TabularInline):
+    model = JobStageTiming
+    fields = ('document_number', 'stage', 'wall_time_s', 'cpu_time_s', 'input_bytes', 'output_bytes', 'pages',
+              'date_created')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class BackendPrintJobInline(admin.TabularInline):
+    model = BackendPrintJob
+    fields = ('document_number', 'backend_job_id', 'date_submitted', 'date_finished')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 class GutenbergJobAdmin(admin.ModelAdmin):
-    inlines = [PrintingPropertiesInline, JobArtefactAdmin]
+    inlines = [PrintingPropertiesInline, JobArtefactAdmin, JobStageTimingInline, BackendPrintJobInline]
     readonly_fields = ('pages', 'date_created', 'date_processed', 'date_finished')
     list_display = ('date_created', 'owner', 'name', 'job_type', 'status', 'pages')
     list_filter = ('date_created', 'owner', 'job_type', 'status')
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0016_gutenbergjob_next_document_number_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobStageTiming',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_number', models.IntegerField(default=0)),
+                ('stage', models.CharField(choices=[('preprocess', 'preprocess'), ('input_pdf', 'create input pdf'), ('layout', 'n-up and imposition'), ('submit', 'submit to printer'), ('print_wait', 'wait for printer')], max_length=16)),
+                ('wall_time_s', models.FloatField()),
+                ('cpu_time_s', models.FloatField()),
+                ('input_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('output_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('pages', models.IntegerField(blank=True, null=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stage_timings', to='control.gutenbergjob')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0017_jobstagetiming'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackendPrintJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_number', models.IntegerField(default=0)),
+                ('backend_job_id', models.CharField(max_length=128)),
+                ('date_submitted', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='backend_jobs', to='control.gutenbergjob')),
+            ],
+        ),
+    ]
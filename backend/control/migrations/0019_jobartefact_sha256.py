@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0018_backendprintjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobartefact',
+            name='sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
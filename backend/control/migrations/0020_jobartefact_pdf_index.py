@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0019_jobartefact_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobartefact',
+            name='encrypted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='jobartefact',
+            name='page_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobartefact',
+            name='page_orientation',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='jobartefact',
+            name='page_sizes',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
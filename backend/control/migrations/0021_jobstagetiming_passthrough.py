@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0020_jobartefact_pdf_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='jobstagetiming',
+            name='stage',
+            field=models.CharField(choices=[('preprocess', 'preprocess'), ('input_pdf', 'create input pdf'), ('layout', 'n-up and imposition'), ('passthrough', 'layout skipped'), ('submit', 'submit to printer'), ('print_wait', 'wait for printer')], max_length=16),
+        ),
+    ]
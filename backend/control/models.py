@@ -173,11 +173,69 @@ class JobArtefact(models.Model):
     mime_type = models.CharField(max_length=100, default='application/octet-stream')
     #document ordering starts from 1, 0 means something went wrong
     document_number = models.IntegerField(default=0)
+    # The hex digest of the SHA-256 hash of the file, computed while the file is uploaded
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    # The index of PDF documents created when the file is uploaded, see `printing.processing.pdf_index`.
+    # `page_count` is null if the file has not been indexed.
+    page_count = models.IntegerField(null=True, blank=True)
+    # The number of pages of each size, e.g. `{"595x842": 3}`, in points
+    page_sizes = models.JSONField(null=True, blank=True)
+    # The value of `PageOrientation` of most pages, empty if the file has not been indexed
+    page_orientation = models.CharField(max_length=16, blank=True, default='')
+    encrypted = models.BooleanField(default=False)
 
     def __str__(self):
         return self.file.name
 
 
+class JobStage(models.TextChoices):
+    PREPROCESS = 'preprocess', _('preprocess')
+    INPUT_PDF = 'input_pdf', _('create input pdf')
+    LAYOUT = 'layout', _('n-up and imposition')
+    # The layout was skipped and the input PDF was sent to the printer unchanged
+    PASSTHROUGH = 'passthrough', _('layout skipped')
+    SUBMIT = 'submit', _('submit to printer')
+    PRINT_WAIT = 'print_wait', _('wait for printer')
+
+
+class JobStageTiming(models.Model):
+    """
+    The time spent by the worker in a single processing stage of a job.
+    """
+
+    job = models.ForeignKey(GutenbergJob, on_delete=models.CASCADE, related_name='stage_timings')
+    # The document number of the processed artefact, 0 for stages which are not related to a single document
+    document_number = models.IntegerField(default=0)
+    stage = models.CharField(max_length=16, choices=JobStage.choices)
+    wall_time_s = models.FloatField()
+    # Includes the CPU time of the subprocesses (e.g. converters) which finished during the stage
+    cpu_time_s = models.FloatField()
+    input_bytes = models.BigIntegerField(null=True, blank=True)
+    output_bytes = models.BigIntegerField(null=True, blank=True)
+    pages = models.IntegerField(null=True, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{} - {} - {:.3f}s'.format(self.job_id, self.stage, self.wall_time_s)
+
+
+class BackendPrintJob(models.Model):
+    """
+    A document of a job submitted to the printer backend.
+    It is monitored by `printing.printing.monitor_print_jobs` until the backend finishes processing it.
+    """
+
+    job = models.ForeignKey(GutenbergJob, on_delete=models.CASCADE, related_name='backend_jobs')
+    document_number = models.IntegerField(default=0)
+    # The identifier returned by `PrinterBackend.submit_job`
+    backend_job_id = models.CharField(max_length=128)
+    date_submitted = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} - {}'.format(self.job_id, self.backend_job_id)
+
+
 def validate_pages_to_print(value):
     if value == "":
         return
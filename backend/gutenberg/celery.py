@@ -1,6 +1,8 @@
 import os
+import threading
 
 from celery import Celery, signals
+from django.conf import settings
 
 from gutenberg.worker_capabilities import update_supported_document_formats
 
@@ -25,7 +27,13 @@ def setup_periodic_tasks(sender: Celery, **kwargs):
         'cleanup_print_jobs': {
             'task': 'printing.printing.cleanup_print_jobs',
             'schedule': 60. * 60 * 24,
-        }
+        },
+        'monitor_print_jobs': {
+            'task': 'printing.printing.monitor_print_jobs',
+            'schedule': float(settings.PRINT_MONITOR_INTERVAL_S),
+            # The next run checks the same jobs, so the delayed runs can be skipped
+            'options': {'expires': float(settings.PRINT_MONITOR_INTERVAL_S)},
+        },
     }
     sender.conf.timezone = 'UTC'
 
@@ -35,6 +43,16 @@ def debug_task(self):
     print(f'Request: {self.request!r}')
 
 
+@signals.celeryd_after_setup.connect
+def subscribe_converter_queues(sender, instance, **kwargs):
+    # The worker consumes the print tasks of the documents it can convert, see `PRINT_CONVERTER_QUEUES`
+    if not settings.PRINT_CONVERTER_QUEUES:
+        return
+    from printing.processing.converter import CONVERTERS_LOCAL, CONVERTER_QUEUE_PREFIX
+    for conv in CONVERTERS_LOCAL:
+        instance.app.amqp.queues.select_add(CONVERTER_QUEUE_PREFIX + conv.queue_name)
+
+
 @signals.worker_ready.connect
 def on_connect(sender: Celery, **kwargs):
     # After this worker is ready, query all workers for their supported document formats
@@ -42,3 +60,14 @@ def on_connect(sender: Celery, **kwargs):
 
     # We add this job to the queue to be able to accept it ourselves
     update_supported_document_formats.delay()
+
+    # The import is delayed, as the `printing` app can only be loaded after Django is set up.
+    # The LibreOffice instances are started in the background, so they do not delay the worker startup.
+    from printing.processing.office_pool import prewarm_office_pool
+    threading.Thread(target=prewarm_office_pool, daemon=True).start()
+
+
+@signals.worker_shutdown.connect
+def on_shutdown(sender, **kwargs):
+    from printing.processing.office_pool import shutdown_office_pool
+    shutdown_office_pool()
@@ -210,6 +210,12 @@ LOGGING = {
 # Directory to store the printed files in
 MEDIA_ROOT = '/tmp/print/'
 MEDIA_URL = '/media/'
+
+# The uploaded documents are written directly to MEDIA_ROOT, see backend/printing/ingestion.py
+FILE_UPLOAD_HANDLERS = ['printing.ingestion.DocumentUploadHandler']
+
+# The maximum size of a single document uploaded with IPP or the REST API.
+MAX_DOCUMENT_SIZE_BYTES = 256 * 1024 * 1024
 # Format of date to append to each filename
 PRINT_DATE_FORMAT = '%Y-%m-%dT%H-%M-%S-%f'
 
@@ -222,3 +228,118 @@ OIDC_SSO_CHECK_COOLDOWN_SECONDS = 300
 # The hostname of the CUPS server.
 # This value will be used as the value of the -h argument for cups-client commands (lp, cancel, etc.).
 CUPS_SERVERNAME = '/run/cups/cups.sock'
+
+# If enabled, the workers submit, monitor and cancel the jobs in CUPS by sending IPP requests to CUPS_SERVERNAME
+# over a persistent connection, instead of running the lp, lpstat and cancel commands.
+CUPS_USE_IPP_CLIENT = False
+
+# The interval of the periodic task which checks the status of the jobs submitted to the printers
+# and marks them as completed. Requires Celery beat.
+PRINT_MONITOR_INTERVAL_S = 2
+
+# If enabled, each document of a multi-document job is processed by a separate Celery task
+# and the results are sent to the printer by a chord callback once all documents are ready.
+# The job then takes roughly as long as the slowest document instead of the sum of all processing times.
+# Requires a Celery result backend (CELERY_RESULT_BACKEND) and MEDIA_ROOT shared by all workers.
+PRINT_PARALLEL_DOCUMENT_PROCESSING = False
+
+# If enabled, the documents are processed by the workers consuming the Celery queue of the converter they need
+# (`convert.pdf`, `convert.image`, `convert.office`, `convert.ps`, `convert.pwg`). The workers subscribe
+# to the queues of their available converters on startup.
+# Jobs with documents needing different converters are sent whole to the queue with the lowest concurrency limit,
+# so a format is only supported if all workers support it. With PRINT_PARALLEL_DOCUMENT_PROCESSING each document
+# is sent to its own queue and a format is supported if any worker supports it.
+PRINT_CONVERTER_QUEUES = True
+
+# Maximum number of documents converted at the same time on a single host, for each converter queue.
+# A task which exceeds the limit is retried after CONVERTER_SLOT_RETRY_S seconds, so it does not occupy
+# a worker thread which could process a document of another format. Queues missing here are not limited.
+CONVERTER_CONCURRENCY_LIMITS = {
+    'convert.office': 2,
+    'convert.ps': 4,
+    'convert.pwg': 4,
+    'convert.image': 8,
+    'convert.pdf': 16,
+}
+CONVERTER_SLOT_RETRY_S = 2
+# A job still waiting for a slot after this many seconds fails
+CONVERTER_SLOT_MAX_WAIT_S = 10 * 60
+# The directory of the lock files used to enforce the limits, shared by the workers on the host
+CONVERTER_SLOTS_DIR = '/tmp/gutenberg-converter-slots/'
+
+# If enabled, the PDF documents which would not be changed by the layout (e.g. A4 portrait pages printed
+# without n-up, imposition and page ranges) are sent to the printer as they are, instead of being rewritten page by page.
+# The jobs using this path have a `passthrough` stage instead of the `layout` stage in their stage timings.
+PRINT_PDF_PASSTHROUGH = True
+
+# The library used to read the page geometry of the documents and to place their pages on the printed sheets:
+# 'pypdf' or 'pikepdf'. pikepdf uses libqpdf, which is considerably faster for large documents,
+# but it is not installed by default (`uv sync --extra pikepdf`).
+PDF_ENGINE = 'pypdf'
+
+# The layout of documents with at least LAYOUT_CHUNKING_MIN_PAGES pages or LAYOUT_CHUNKING_MIN_BYTES bytes
+# is created in chunks of at most LAYOUT_CHUNK_MAX_MEDIA_PAGES Media Sheet Pages, which are written
+# to the output file one by one, so the memory used by the worker does not grow with the size of the document.
+# The chunks are made smaller if the memory used by the pages of a chunk, estimated from the size of the document,
+# would exceed LAYOUT_CHUNK_MAX_MEMORY_BYTES.
+LAYOUT_CHUNKING_MIN_PAGES = 1000
+LAYOUT_CHUNKING_MIN_BYTES = 100 * 1024 * 1024
+LAYOUT_CHUNK_MAX_MEDIA_PAGES = 200
+LAYOUT_CHUNK_MAX_MEMORY_BYTES = 256 * 1024 * 1024
+# Number of processes laying out the chunks of a single document in parallel, shared by the jobs processed
+# by a worker. Each process holds a single chunk, so the layout can use up to
+# LAYOUT_PROCESSES * LAYOUT_CHUNK_MAX_MEMORY_BYTES of memory. Set to 1 to lay out the chunks in the worker.
+LAYOUT_PROCESSES = min(4, os.cpu_count() or 1)
+
+# Directory used to cache the results of document conversion (e.g. DOCX to PDF).
+# The entries are keyed by the SHA-256 hash of the source document and the converter settings,
+# so a document printed by many users is only converted once.
+# Workers on different hosts can share this directory. The cache is disabled when set to None,
+# set it to a directory writable by the worker user, e.g. '/var/cache/gutenberg/conversion_cache/', to enable it.
+# The directory is created readable only by the worker user, as it contains copies of the printed documents.
+CONVERSION_CACHE_DIR = None
+# The least recently used entries are removed when the cache size exceeds this limit
+CONVERSION_CACHE_MAX_SIZE_BYTES = 1024 * 1024 * 1024
+
+# If enabled, the documents uploaded with the REST API are converted to PDF by a low-priority task while the job
+# is still being configured in the webapp, and the result is stored in the conversion cache.
+# The job then only needs the layout and imposition steps when it is submitted.
+# Only used for the formats converted independently of the printing options (office documents, PostScript
+# and PWG Raster), requires CONVERSION_CACHE_DIR.
+PRECONVERT_UPLOADED_DOCUMENTS = True
+# The Celery priority of the preconversion tasks. With the Redis broker 0 is the highest priority
+# and the print tasks use the default priority 0, so the preconversion does not delay the submitted jobs.
+PRECONVERSION_TASK_PRIORITY = 9
+# Required for the task priorities with the Redis broker
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority'}
+
+# Number of threads compressing the pages of a PWG Raster document while the next pages are decoded.
+# Set to 1 to convert the pages sequentially, which keeps only a single decoded page in memory.
+PWG_RASTER_ENCODING_THREADS = 1
+
+# If enabled, the sandboxed commands processing a document (e.g. ImageMagick, Ghostscript, cupsfilter) are run
+# by an agent inside a single sandbox started for the document, instead of creating a new sandbox for each command.
+# The statistics of each session (lifetime, number of commands, CPU time, peak memory) are logged to print.log.
+SANDBOX_SESSIONS = True
+
+# Number of warm LibreOffice instances kept running by each worker to convert office documents.
+# Starting LibreOffice takes most of the time of a conversion, so a pool reduces the conversion latency
+# from seconds to hundreds of milliseconds. The pool is shared by the threads of a worker
+# (`celery worker -P threads`). Set to 0 to run the LibreOffice CLI for every document.
+LIBREOFFICE_POOL_SIZE = 0
+# An instance is restarted after this many conversions to limit the effects of memory leaks
+LIBREOFFICE_POOL_MAX_CONVERSIONS = 200
+# Maximum time of a single conversion, the instance is restarted if it is exceeded
+LIBREOFFICE_POOL_TIMEOUT_S = 120
+# Python interpreter used inside the sandbox to control LibreOffice.
+# It must be able to import the LibreOffice UNO bridge (the `python3-uno` package on Debian).
+LIBREOFFICE_POOL_PYTHON = '/usr/bin/python3'
+
+# Redis server used to notify the workers about canceled jobs, e.g. 'redis://localhost:6379'.
+# A worker processing a canceled job kills its subprocesses immediately after receiving the notification
+# and does not need to poll the job status from the database.
+# Set to None to only detect cancellation by polling the database.
+JOB_CANCELLATION_REDIS_URL = None
+# Notifications are not guaranteed to be delivered, so while the listener is connected the status of a job
+# is still read from the database at most this often, and always before the job is sent to the printer.
+JOB_CANCELLATION_RECHECK_S = 30
@@ -30,6 +30,8 @@ LOGGING['handlers']['django_file']['filename'] = '/var/log/gutenberg/django.log'
 # Printing
 # Directory to store the printed files in
 MEDIA_ROOT = '/var/lib/gutenberg/media_root/'
+CONVERSION_CACHE_DIR = '/var/lib/gutenberg/conversion_cache/'
+LIBREOFFICE_POOL_SIZE = 2
 
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
@@ -23,6 +23,9 @@ CACHES = {
     }
 }
 
+# The converter tests rely on the converters running for every call
+CONVERSION_CACHE_DIR = None
+
 # Celery
 CELERY_BROKER_URL = 'redis://localhost:6379'
 
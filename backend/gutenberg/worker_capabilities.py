@@ -1,7 +1,9 @@
 import logging
+from itertools import chain
 from time import sleep
 
 from celery.app.control import flatten_reply
+from django.conf import settings
 from django.core.cache import cache
 
 from celery import shared_task
@@ -32,24 +34,32 @@ def update_supported_document_formats() -> dict:
     else:
         logger.debug(f"Received {len(replies)} valid replies from workers: {str(replies)}")
 
-        # The `sorted` calls are used to keep the formats ordered in the order they appear in `CONVERTERS_LOCAL`.
+        # The formats are kept in the order they appear in `CONVERTERS_LOCAL`.
         # This keeps related formats grouped together.
-        #
-        # All elements of the intersection must, by definition, also be present in the list in the first reply,
-        # so the `.index(x)` call should not fail.
-        #
-        # The global supported formats are resolved as the intersection of all workers' supported formats
-        # because the tasks might be executed by any worker.
-        supported_formats = {
-            "mime_types": sorted(
-                set.intersection(*[set(reply["mime_types"]) for reply in replies]),
-                key=lambda x: replies[0]["mime_types"].index(x),
-            ),
-            "extensions": sorted(
-                set.intersection(*[set(reply["extensions"]) for reply in replies]),
-                key=lambda x: replies[0]["extensions"].index(x),
-            ),
-        }
+        if settings.PRINT_CONVERTER_QUEUES and settings.PRINT_PARALLEL_DOCUMENT_PROCESSING:
+            # Each document is processed only by the workers consuming the queue of its converter,
+            # so a format is supported if any worker supports it.
+            # Without parallel processing a job with documents of different formats is processed by a single worker.
+            supported_formats = {
+                "mime_types": list(dict.fromkeys(chain.from_iterable(reply["mime_types"] for reply in replies))),
+                "extensions": list(dict.fromkeys(chain.from_iterable(reply["extensions"] for reply in replies))),
+            }
+        else:
+            # All elements of the intersection must, by definition, also be present in the list in the first reply,
+            # so the `.index(x)` call should not fail.
+            #
+            # The global supported formats are resolved as the intersection of all workers' supported formats
+            # because the tasks might be executed by any worker.
+            supported_formats = {
+                "mime_types": sorted(
+                    set.intersection(*[set(reply["mime_types"]) for reply in replies]),
+                    key=lambda x: replies[0]["mime_types"].index(x),
+                ),
+                "extensions": sorted(
+                    set.intersection(*[set(reply["extensions"]) for reply in replies]),
+                    key=lambda x: replies[0]["extensions"].index(x),
+                ),
+            }
     cache.set("gutenberg_supported_formats", supported_formats, None)
     return supported_formats
 
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class IppConfig(AppConfig):
     name = 'ipp'
+
+    def ready(self):
+        from ipp import signals  # noqa: F401
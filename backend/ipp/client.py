@@ -0,0 +1,277 @@
+"""
+A minimal IPP client used by the workers to talk to CUPS directly, without the cups-client commands.
+
+The requests and responses are encoded with the same field classes as the IPP server in this app.
+The HTTP connection is kept open between requests, and the documents are streamed from disk.
+"""
+
+import http.client
+import os
+import socket
+from typing import Dict, List, Optional, Type
+from urllib.parse import quote
+
+from ipp.constants import SectionEnum, OperationEnum, StatusCodeEnum, JobStateEnum
+from ipp.fields import TAG_STRUCT, ParserState, IntegerField, KeywordField, TextWLField, EnumField, OneSetField, \
+    UriField, as_reader, as_writer, encode_name, IppWriter
+from ipp.proto import AttributeGroup, BaseOperationGroup, IppMessage
+from ipp.proto_operations import PrintJobRequestOperationGroup, GetJobAttributesRequestOperationGroup, \
+    CancelJobRequestOperationGroup, GetJobsRequestOperationGroup
+
+IPP_PORT = 631
+IPP_CONTENT_TYPE = 'application/ipp'
+DOCUMENT_BLOCK_SIZE = 64 * 1024
+JOB_STATUS_ATTRIBUTES = ['job-id', 'job-state', 'job-state-reasons', 'job-state-message']
+FINISHED_JOB_STATES = {JobStateEnum.canceled, JobStateEnum.aborted, JobStateEnum.completed}
+
+
+class IppClientError(Exception):
+    def __init__(self, status: int, message: str = ''):
+        self.status = status
+        super().__init__('IPP request failed with status 0x{:04x}: {}'.format(status, message))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ResponseOperationGroup(BaseOperationGroup):
+    status_message = TextWLField()
+    detailed_status_message = TextWLField()
+
+
+class JobStatusGroup(AttributeGroup):
+    _tag = SectionEnum.job
+
+    job_id = IntegerField()
+    job_uri = UriField()
+    job_state = EnumField()
+    job_state_reasons = OneSetField(accepted_fields=[KeywordField()], default=[])
+    job_state_message = TextWLField(default='')
+    job_printer_state_message = TextWLField()
+
+    def is_finished(self) -> bool:
+        return self.job_state in FINISHED_JOB_STATES
+
+    def get_reasons(self) -> List[str]:
+        return [value for _, value in self.job_state_reasons if value != 'none']
+
+
+class IgnoredGroup(AttributeGroup):
+    """Any group of the response which is not used by the client, e.g. the unsupported attributes."""
+
+
+RESPONSE_GROUPS: Dict[int, Type[AttributeGroup]] = {
+    SectionEnum.operation: ResponseOperationGroup,
+    SectionEnum.job: JobStatusGroup,
+}
+
+
+class JobOptionsGroup(AttributeGroup):
+    """
+    The job template attributes of a Print-Job request.
+
+    The options are the `name=value` pairs passed to `lp -o`, so they are not known in advance
+    and are sent as keywords, like `lp` does for the attributes it does not recognize.
+    """
+    _tag = SectionEnum.job
+    __slots__ = ('options',)
+
+    copies = IntegerField()
+
+    def __init__(self, options: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.options = options or {}
+
+    def write_to(self, writable, requested_attrs: Optional[List[str]] = None):
+        writer = as_writer(writable)
+        super().write_to(writer, requested_attrs)
+        keyword_field = KeywordField()
+        for name, value in self.options.items():
+            keyword_field.write_encoded(writer, encode_name(name), value)
+        writer.copy_to(writable)
+
+
+class IppResponseMessage(IppMessage):
+    def __init__(self, version, opid_or_status, request_id, groups: List[AttributeGroup]):
+        super().__init__(version, opid_or_status, request_id)
+        self.groups = groups
+
+    @classmethod
+    def read_from(cls, readable):
+        readable = as_reader(readable)
+        version_major, version_minor, status, request_id = readable.unpack(cls.HEADER_STRUCT)
+        state = ParserState()
+        state.read_field_header(readable)
+        groups = []
+        while state.current_tag != SectionEnum.END:
+            group_type = RESPONSE_GROUPS.get(state.current_tag, IgnoredGroup)
+            groups.append(group_type.read_from(readable, state))
+        return cls((version_major, version_minor), status, request_id, groups)
+
+    def get_group(self, group_type: Type[AttributeGroup]) -> Optional[AttributeGroup]:
+        return next((group for group in self.groups if isinstance(group, group_type)), None)
+
+    def get_groups(self, group_type: Type[AttributeGroup]) -> List[AttributeGroup]:
+        return [group for group in self.groups if isinstance(group, group_type)]
+
+    def is_successful(self) -> bool:
+        return self.opid_or_status < StatusCodeEnum.client_error_bad_request
+
+
+class IppClient:
+    """
+    Sends IPP requests to a single CUPS server over a persistent HTTP connection.
+
+    `server` is either the path of the CUPS unix socket or a hostname with an optional port,
+    like the `-h` argument of the cups-client commands. The client is not thread-safe.
+    """
+
+    def __init__(self, server: str, user_name: str, timeout: float):
+        self.server = server
+        self.user_name = user_name
+        self.timeout = timeout
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self._request_id = 0
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.server.startswith('/'):
+            return UnixHTTPConnection(self.server, self.timeout)
+        host, _, port = self.server.partition(':')
+        return http.client.HTTPConnection(host, int(port) if port else IPP_PORT, timeout=self.timeout)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def printer_uri(printer_name: str) -> str:
+        return 'ipp://localhost/printers/{}'.format(quote(printer_name))
+
+    @staticmethod
+    def job_uri(job_id: int) -> str:
+        return 'ipp://localhost/jobs/{}'.format(job_id)
+
+    def _encode(self, operation: OperationEnum, groups: List[AttributeGroup]) -> bytes:
+        self._request_id += 1
+        writer = IppWriter()
+        writer.pack(IppMessage.HEADER_STRUCT, *IppMessage.IPP1_1, operation, self._request_id)
+        for group in groups:
+            writer.pack(TAG_STRUCT, group.get_tag())
+            group.write_to(writer)
+        writer.pack(TAG_STRUCT, SectionEnum.END)
+        return writer.take()
+
+    def _send(self, path: str, message: bytes, document_path: Optional[str]) -> IppResponseMessage:
+        length = len(message)
+        document = None
+        if document_path is not None:
+            document = open(document_path, 'rb')
+            length += os.fstat(document.fileno()).st_size
+        try:
+            def body():
+                yield message
+                if document is not None:
+                    while block := document.read(DOCUMENT_BLOCK_SIZE):
+                        yield block
+
+            self._connection.request('POST', path, body=body(), headers={
+                'Content-Type': IPP_CONTENT_TYPE,
+                'Content-Length': str(length),
+            })
+            response = self._connection.getresponse()
+            if response.status != 200:
+                response.read()
+                raise IppClientError(StatusCodeEnum.server_error_internal_error,
+                                     'HTTP {} {}'.format(response.status, response.reason))
+            ipp_response = IppResponseMessage.read_from(response)
+            # The rest of the response must be consumed before the connection can be reused
+            response.read()
+            return ipp_response
+        finally:
+            if document is not None:
+                document.close()
+
+    def request(self, operation: OperationEnum, groups: List[AttributeGroup], path: str = '/',
+                document_path: Optional[str] = None) -> IppResponseMessage:
+        message = self._encode(operation, groups)
+        reused = self._connection is not None
+        if not reused:
+            self._connection = self._connect()
+        try:
+            response = self._send(path, message, document_path)
+        except (http.client.HTTPException, ConnectionError) as ex:
+            self.close()
+            # The server closes idle connections, which is only noticed when the next request is sent.
+            # The request was not processed then, so it can be sent again on a new connection.
+            if not reused or not isinstance(ex, (http.client.RemoteDisconnected, BrokenPipeError,
+                                                 ConnectionResetError)):
+                raise
+            self._connection = self._connect()
+            response = self._send(path, message, document_path)
+        except BaseException:
+            self.close()
+            raise
+        if not response.is_successful():
+            operation_group = response.get_group(ResponseOperationGroup)
+            raise IppClientError(response.opid_or_status,
+                                 operation_group.status_message if operation_group else '')
+        return response
+
+    def print_job(self, printer_name: str, file_path: str, job_name: str, copies: int = 1,
+                  options: Optional[Dict[str, str]] = None, document_format: str = 'application/pdf') -> int:
+        """Submits the file as a new job. Returns the id of the job."""
+
+        operation = PrintJobRequestOperationGroup(
+            printer_uri=self.printer_uri(printer_name),
+            requesting_user_name=self.user_name,
+            job_name=job_name,
+            document_format=document_format,
+        )
+        job_options = JobOptionsGroup(options, copies=copies)
+        response = self.request(OperationEnum.print_job, [operation, job_options],
+                                '/printers/{}'.format(quote(printer_name)), file_path)
+        job_status = response.get_group(JobStatusGroup)
+        if job_status is None or job_status.job_id is None:
+            raise IppClientError(response.opid_or_status, 'missing job-id in the Print-Job response')
+        return job_status.job_id
+
+    def get_job_status(self, job_id: int) -> JobStatusGroup:
+        operation = GetJobAttributesRequestOperationGroup(
+            job_uri=self.job_uri(job_id),
+            requesting_user_name=self.user_name,
+            requested_attributes=JOB_STATUS_ATTRIBUTES,
+        )
+        response = self.request(OperationEnum.get_job_attributes, [operation])
+        job_status = response.get_group(JobStatusGroup)
+        if job_status is None:
+            raise IppClientError(response.opid_or_status, 'missing job attributes in the response')
+        return job_status
+
+    def get_jobs(self) -> List[JobStatusGroup]:
+        """Returns the status of all not completed jobs on the server."""
+
+        operation = GetJobsRequestOperationGroup(
+            printer_uri='ipp://localhost/',
+            requesting_user_name=self.user_name,
+            requested_attributes=JOB_STATUS_ATTRIBUTES,
+            limit=None,
+            first_index=None,
+        )
+        response = self.request(OperationEnum.get_jobs, [operation])
+        return response.get_groups(JobStatusGroup)
+
+    def cancel_job(self, job_id: int):
+        operation = CancelJobRequestOperationGroup(
+            job_uri=self.job_uri(job_id),
+            requesting_user_name=self.user_name,
+        )
+        self.request(OperationEnum.cancel_job, [operation])
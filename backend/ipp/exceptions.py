@@ -51,6 +51,11 @@ class DocumentFormatError(IppError):
         return StatusCodeEnum.client_error_document_format_not_supported
 
 
+class RequestEntityTooLargeError(IppError):
+    def error_code(self):
+        return StatusCodeEnum.client_error_request_entity_too_large
+
+
 class NotPossibleError(IppError):
     def error_code(self):
         return StatusCodeEnum.client_error_not_possible
@@ -1,17 +1,259 @@
 import math
-from abc import ABC, abstractmethod
+from abc import ABC, ABCMeta, abstractmethod
 from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from enum import IntEnum
 from struct import Struct
-from typing import List, Any, Type, Union, Tuple
+from typing import List, Any, Type, Union, Tuple, Optional, Dict, NamedTuple
 
 from ipp.constants import TagEnum, SectionEnum, ValueTagsEnum
 from ipp.exceptions import FieldOrderError, InvalidTagError, MissingFieldError, BadRequestError
 
 TAG_STRUCT = Struct('>B')
 LENGTH_STRUCT = Struct('>h')
+READ_CHUNK_SIZE = 8 * 1024
+WRITE_BUFFER_SIZE = 8 * 1024
+EMPTY_NAME = LENGTH_STRUCT.pack(0)
+
+
+def encode_name(name: str) -> bytes:
+    """
+    Returns the attribute name in the wire format, prefixed with its length.
+    """
+
+    data = name.replace('_', '-').encode('utf-8')
+    return LENGTH_STRUCT.pack(len(data)) + data
+
+
+class DocumentStream:
+    """
+    The document data following the attributes of an IPP message: the bytes left in the buffer of the `IppReader`,
+    followed by the rest of its stream.
+    """
+
+    def __init__(self, buffered: memoryview, stream):
+        self._buffered = buffered
+        self._stream = stream
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if not self._buffered:
+            return self._stream.read() if size is None or size < 0 else self._stream.read(size)
+        if size is None or size < 0:
+            data = bytes(self._buffered) + self._stream.read()
+            self._buffered = memoryview(b'')
+            return data
+        data = bytes(self._buffered[:size])
+        self._buffered = self._buffered[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+
+class IppReader:
+    """
+    Reads an IPP message from `stream` through a buffer.
+
+    The stream is read in chunks of `chunk_size` bytes and the tags, lengths and values are decoded
+    from a memoryview of the buffer, so reading an attribute does not call `stream.read`.
+    The document data following the attributes is read from `document_stream`, which reads `stream` directly
+    after the bytes left in the buffer, so the document is not copied through the buffer.
+    """
+
+    def __init__(self, stream, chunk_size: int = READ_CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._data = memoryview(b'')
+        self._pos = 0
+        self._document_stream = None
+
+    def _fill(self, size: int) -> bool:
+        """
+        Buffers at least `size` bytes after the current position. Returns False if the stream ends before.
+        """
+
+        available = len(self._data) - self._pos
+        if available >= size:
+            return True
+        chunks = [self._data[self._pos:]]
+        while available < size:
+            chunk = self._stream.read(max(self._chunk_size, size - available))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            available += len(chunk)
+        self._data = memoryview(b''.join(chunks))
+        self._pos = 0
+        return available >= size
+
+    def unpack(self, struct: Struct) -> tuple:
+        """
+        :raises struct.error: If the stream ends before the end of the structure.
+        """
+
+        self._fill(struct.size)
+        values = struct.unpack_from(self._data, self._pos)
+        self._pos += struct.size
+        return values
+
+    def read_tag(self) -> Optional[int]:
+        """
+        Returns the next tag or None at the end of the stream.
+        """
+
+        if not self._fill(TAG_STRUCT.size):
+            return None
+        tag = self._data[self._pos]
+        self._pos += TAG_STRUCT.size
+        return tag
+
+    def _read_length(self) -> int:
+        length, = self.unpack(LENGTH_STRUCT)
+        if length < 0:
+            raise BadRequestError("Invalid value length {}".format(length))
+        return length
+
+    def read_value(self) -> memoryview:
+        """
+        Returns the next length-prefixed value. The value is a view of the buffer, it is shorter than its length
+        if the stream ends before the end of the value.
+        """
+
+        length = self._read_length()
+        self._fill(length)
+        value = self._data[self._pos:self._pos + length]
+        self._pos += len(value)
+        return value
+
+    def unpack_value(self, struct: Struct) -> tuple:
+        """
+        :raises ValueError: If the length of the next value is not the size of `struct`.
+        """
+
+        value = self.read_value()
+        if len(value) != struct.size:
+            raise ValueError
+        return struct.unpack(value)
+
+    def skip_value(self):
+        """
+        Skips the next length-prefixed value without buffering it.
+        """
+
+        remaining = self._read_length()
+        skipped = min(remaining, len(self._data) - self._pos)
+        self._pos += skipped
+        remaining -= skipped
+        while remaining > 0:
+            chunk = self._stream.read(min(remaining, self._chunk_size))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+    def document_stream(self):
+        """
+        Returns the stream of the data following the last read attribute.
+        The attributes must not be read from the reader after calling this method.
+        """
+
+        if self._document_stream is None:
+            if self._pos == len(self._data):
+                self._document_stream = self._stream
+            else:
+                self._document_stream = DocumentStream(self._data[self._pos:], self._stream)
+            self._data = memoryview(b'')
+            self._pos = 0
+        return self._document_stream
+
+
+def as_reader(readable) -> IppReader:
+    if isinstance(readable, IppReader):
+        return readable
+    return IppReader(readable)
+
+
+class IppWriter:
+    """
+    Encodes an IPP message into a single buffer of `size_hint` bytes, which is grown as needed.
+
+    The lengths and the structured values are packed directly into the buffer.
+    The encoded message is written to the destination at once by `copy_to`, or in chunks returned by `take`.
+    """
+
+    def __init__(self, size_hint: int = WRITE_BUFFER_SIZE):
+        self._buffer = bytearray(size_hint)
+        self._pos = 0
+
+    def __len__(self):
+        return self._pos
+
+    def _reserve(self, size: int) -> int:
+        """
+        Makes room for `size` more bytes, returns the position after them.
+        """
+
+        end = self._pos + size
+        if end > len(self._buffer):
+            self._buffer.extend(bytes(max(end, 2 * len(self._buffer)) - len(self._buffer)))
+        return end
+
+    def write(self, data: bytes):
+        end = self._reserve(len(data))
+        self._buffer[self._pos:end] = data
+        self._pos = end
+
+    def write_value(self, value: bytes):
+        """
+        Writes `value` prefixed with its length.
+        """
+
+        end = self._reserve(LENGTH_STRUCT.size + len(value))
+        LENGTH_STRUCT.pack_into(self._buffer, self._pos, len(value))
+        self._buffer[self._pos + LENGTH_STRUCT.size:end] = value
+        self._pos = end
+
+    def pack(self, struct: Struct, *values):
+        end = self._reserve(struct.size)
+        struct.pack_into(self._buffer, self._pos, *values)
+        self._pos = end
+
+    def pack_value(self, struct: Struct, *values):
+        """
+        Writes `values` packed with `struct`, prefixed with its size.
+        """
+
+        end = self._reserve(LENGTH_STRUCT.size + struct.size)
+        LENGTH_STRUCT.pack_into(self._buffer, self._pos, struct.size)
+        struct.pack_into(self._buffer, self._pos + LENGTH_STRUCT.size, *values)
+        self._pos = end
+
+    def take(self) -> bytes:
+        """
+        Returns the encoded data and empties the buffer.
+        """
+
+        data = bytes(memoryview(self._buffer)[:self._pos])
+        self._pos = 0
+        return data
+
+    def copy_to(self, writable):
+        """
+        Writes the encoded data to `writable` in a single call, unless `writable` is this writer.
+        """
+
+        if writable is not self:
+            writable.write(memoryview(self._buffer)[:self._pos])
+
+
+def as_writer(writable) -> IppWriter:
+    """
+    Returns `writable` if it is an `IppWriter`, otherwise a new writer, which must be copied to `writable` with
+    `IppWriter.copy_to` after writing.
+    """
+
+    if isinstance(writable, IppWriter):
+        return writable
+    return IppWriter()
 
 
 class ParserState:
@@ -19,16 +261,15 @@ class ParserState:
         self.current_name = None
         self.current_tag = SectionEnum.END
 
-    def read_field_header(self, readable) -> None:
-        data = readable.read(TAG_STRUCT.size)
-        if len(data) < TAG_STRUCT.size:
+    def read_field_header(self, readable: IppReader) -> None:
+        tag = readable.read_tag()
+        if tag is None:
             self.current_tag = SectionEnum.END
             return
-        self.current_tag, = TAG_STRUCT.unpack(data)
+        self.current_tag = tag
         if SectionEnum.is_section_tag(self.current_tag):
             return
-        length, = LENGTH_STRUCT.unpack(readable.read(LENGTH_STRUCT.size))
-        self.current_name = readable.read(length).decode('utf-8', errors='ignore').replace('-', '_')
+        self.current_name = str(readable.read_value(), 'utf-8', errors='ignore').replace('-', '_')
 
     def is_next_set_attr(self) -> bool:
         return \
@@ -43,8 +284,17 @@ class IppField(ABC):
         self.default = default
         self.order = order
 
-    @abstractmethod
     def write(self, writable, name, value):
+        writer = as_writer(writable)
+        self.write_encoded(writer, encode_name(name), value)
+        writer.copy_to(writable)
+
+    @abstractmethod
+    def write_encoded(self, writable: IppWriter, encoded_name: bytes, value):
+        """
+        Writes the attribute, `encoded_name` is its name returned by `encode_name`.
+        """
+
         raise NotImplementedError()
 
     @abstractmethod
@@ -62,26 +312,77 @@ class IppField(ABC):
             other) and self.required == other.required and self.default == other.default and self.order == self.order
 
 
-class IppFieldsStruct:
-    def __init__(self, use_defaults=True, **kwargs):
-        self.proto_fields = self._get_proto_fields()
+class SchemaField(NamedTuple):
+    name: str
+    field: IppField
+    # The name in the wire format, see `encode_name`
+    encoded_name: bytes
+    # The order of the field, `math.inf` if it can be written at any position
+    order: float
+
+
+class IppFieldsStructMeta(ABCMeta):
+    """
+    Compiles the fields of an `IppFieldsStruct` class once, when the class is created.
+
+    The `IppField` class attributes are replaced by slots storing the values of the instances.
+    The fields are available by name in `_proto_fields` and sorted by their order in `_write_schema`.
+    """
+
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        inherited = {}
+        for base in reversed(bases):
+            inherited.update(getattr(base, '_proto_fields', {}))
+        own = {key: value for key, value in namespace.items() if isinstance(value, IppField)}
+        for key in own:
+            del namespace[key]
+        fields = mcs.collect_fields(namespace, inherited, own)
+        namespace['__slots__'] = tuple(namespace.get('__slots__', ())) + tuple(
+            key for key in fields if key not in inherited)
+
+        cls = super().__new__(mcs, name, bases, namespace, **kwargs)
+        cls._proto_fields = fields
+        schema = [
+            SchemaField(key, field, encode_name(key), field.order if field.order else math.inf)
+            for key, field in fields.items()
+        ]
+        cls._write_schema = tuple(sorted(schema, key=lambda schema_field: schema_field.order))
+        return cls
+
+    @classmethod
+    def collect_fields(mcs, namespace: dict, inherited: Dict[str, IppField],
+                       own: Dict[str, IppField]) -> Dict[str, IppField]:
+        # The fields are sorted by name, like the attributes returned by `dir`
+        return dict(sorted({**inherited, **own}.items()))
+
 
-        for name, val in kwargs.items():
-            if name not in self.proto_fields:
+class IppFieldsStruct(metaclass=IppFieldsStructMeta):
+    _proto_fields: Dict[str, IppField] = {}
+    _write_schema: Tuple[SchemaField, ...] = ()
+
+    def __init__(self, use_defaults=True, **kwargs):
+        proto_fields = self._proto_fields
+        for name in kwargs:
+            if name not in proto_fields:
                 raise TypeError("got an unexpected keyword argument '{}'".format(name))
-            setattr(self, name, val)
-        for name, val in self.proto_fields.items():
-            if name not in self.__dict__:
-                if not (val.default and use_defaults) and val.required:
-                    raise TypeError("missing required keyword argument '{}'".format(name))
-                if use_defaults:
-                    setattr(self, name, val.default)
-                else:
-                    setattr(self, name, None)
+        for name, val in proto_fields.items():
+            if name in kwargs:
+                setattr(self, name, kwargs[name])
+                continue
+            if not (val.default and use_defaults) and val.required:
+                raise TypeError("missing required keyword argument '{}'".format(name))
+            if use_defaults:
+                setattr(self, name, val.default)
+            else:
+                setattr(self, name, None)
+
+    @property
+    def proto_fields(self) -> Dict[str, IppField]:
+        return self._proto_fields
 
     @classmethod
     def _validate(cls, read_fields: OrderedDict):
-        proto_fields = cls._get_proto_fields()
+        proto_fields = cls._proto_fields
         for name, val in proto_fields.items():
             if name not in read_fields:
                 if val.required:
@@ -98,15 +399,14 @@ class IppFieldsStruct:
             previous = name
 
     def get_field_dict(self):
-        return {k: getattr(self, k) for k in self._get_proto_fields().keys()}
+        return {k: getattr(self, k) for k in self._proto_fields}
 
     @classmethod
     def _get_proto_fields(cls):
-        all_fields = dir(cls)
-        return {name: getattr(cls, name) for name in all_fields if isinstance(getattr(cls, name), IppField)}
+        return cls._proto_fields
 
     def __str__(self):
-        return '\n'.join('   {}: {}'.format(field, getattr(self, field)) for field in self._get_proto_fields())
+        return '\n'.join('   {}: {}'.format(field, getattr(self, field)) for field in self._proto_fields)
 
     def __eq__(self, other):
         return type(self) == type(other) and self.get_field_dict() == other.get_field_dict()
@@ -114,20 +414,22 @@ class IppFieldsStruct:
 
 class ValueField(IppField, ABC):
     @abstractmethod
-    def write_value(self, writable, value):
-        writable.write(LENGTH_STRUCT.pack(len(value)))
-        writable.write(value)
+    def write_value(self, writable: IppWriter, value):
+        writable.write_value(value)
 
-    def write(self, writable, name, value):
-        writable.write(TAG_STRUCT.pack(self.get_tag()))
-        writable.write(LENGTH_STRUCT.pack(len(name)))
-        writable.write(name.replace('_', '-').encode('utf-8'))
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        tag = getattr(cls, '_tag', None)
+        cls._encoded_tag = TAG_STRUCT.pack(tag) if tag is not None else None
+
+    def write_encoded(self, writable: IppWriter, encoded_name: bytes, value):
+        writable.write(self._encoded_tag)
+        writable.write(encoded_name)
         self.write_value(writable, value)
 
     @abstractmethod
-    def read_value(self, readable):
-        length, = LENGTH_STRUCT.unpack(readable.read(LENGTH_STRUCT.size))
-        return readable.read(length)
+    def read_value(self, readable: IppReader):
+        return readable.read_value()
 
     def read(self, readable, state: ParserState):
         if self.get_tag() and state.current_tag != self.get_tag():
@@ -140,14 +442,11 @@ class ValueField(IppField, ABC):
 class StructField(ValueField, ABC):
     struct = None
 
-    def write_value(self, writable, value):
-        super().write_value(writable, self.struct.pack(*value))
+    def write_value(self, writable: IppWriter, value):
+        writable.pack_value(self.struct, *value)
 
-    def read_value(self, readable):
-        data = super().read_value(readable)
-        if self.struct.size != len(data):
-            raise ValueError
-        return self.struct.unpack(data)
+    def read_value(self, readable: IppReader):
+        return readable.unpack_value(self.struct)
 
 
 class NullField(ValueField):
@@ -156,19 +455,23 @@ class NullField(ValueField):
     def write_value(self, writable, value):
         raise NotImplementedError("unsupported")
 
-    def read_value(self, readable):
-        _ = super().read_value(readable)
+    def read_value(self, readable: IppReader):
+        readable.skip_value()
         return None
 
 
+# Reads and ignores the attributes which are not fields of the read structure
+NULL_FIELD = NullField()
+
+
 class UnknownField(ValueField):
     _tag = ValueTagsEnum.unknown
 
     def write_value(self, writable, value):
         super().write_value(writable, b'')
 
-    def read_value(self, readable):
-        _ = super().read_value(readable)
+    def read_value(self, readable: IppReader):
+        readable.skip_value()
         return None
 
 
@@ -209,8 +512,8 @@ class TextField(ValueField, ABC):
         assert isinstance(value, str)
         super().write_value(writable, value.encode('utf-8'))
 
-    def read_value(self, readable) -> str:
-        return super().read_value(readable).decode('utf-8', errors='ignore')
+    def read_value(self, readable: IppReader) -> str:
+        return str(super().read_value(readable), 'utf-8', errors='ignore')
 
 
 class OctetStringField(ValueField):
@@ -220,8 +523,8 @@ class OctetStringField(ValueField):
         assert isinstance(value, bytes)
         super().write_value(writable, value)
 
-    def read_value(self, readable) -> bytes:
-        return super().read_value(readable)
+    def read_value(self, readable: IppReader) -> bytes:
+        return bytes(super().read_value(readable))
 
 
 class TextWLField(TextField):
@@ -321,7 +624,7 @@ class OneSetField(IppField):
         self.tag_ids_map = {field.get_tag(): field for field in accepted_fields}
         super().__init__(*args, **kwargs)
 
-    def write(self, writable, name: str, value: List[Union[Tuple[Type[ValueField], Any], Any]]):
+    def write_encoded(self, writable: IppWriter, encoded_name: bytes, value: List[Union[Tuple[Type[ValueField], Any], Any]]):
         for idx, val in enumerate(value):
             if isinstance(val, tuple):
                 field = val[0]()
@@ -330,9 +633,9 @@ class OneSetField(IppField):
                 field = self.accepted_fields[0]
                 v = val
             if idx == 0:
-                field.write(writable, name, v)
+                field.write_encoded(writable, encoded_name, v)
             else:
-                field.write(writable, '', v)
+                field.write_encoded(writable, EMPTY_NAME, v)
 
     def read(self, readable, state: ParserState):
         values = []
@@ -355,14 +658,14 @@ class UnionField(IppField):
         self.tag_ids_map = {field.get_tag(): field for field in accepted_fields}
         super().__init__(*args, **kwargs)
 
-    def write(self, writable, name: str, value: Union[Tuple[Type[ValueField], Any], Any]):
+    def write_encoded(self, writable: IppWriter, encoded_name: bytes, value: Union[Tuple[Type[ValueField], Any], Any]):
         if isinstance(value, tuple):
             field = value[0]()
             v = value[1]
         else:
             field = self.accepted_fields[0]
             v = value
-        field.write(writable, name, v)
+        field.write_encoded(writable, encoded_name, v)
 
     def read(self, readable, state: ParserState):
         if state.current_tag not in self.tag_ids_map:
@@ -374,17 +677,19 @@ class UnionField(IppField):
         return super(UnionField, self).__eq__(other) and self.accepted_fields == other.accepted_fields
 
 
+MEMBER_ATTR_HEADER = TAG_STRUCT.pack(TagEnum.member_attr_name) + EMPTY_NAME
+END_COLLECTION = TAG_STRUCT.pack(TagEnum.end_collection) + EMPTY_NAME + EMPTY_NAME
+
+
 class Collection(IppFieldsStruct):
-    def write(self, writable):
-        fields = [(name, clazz, getattr(self, name)) for name, clazz in self.proto_fields.items() if
-                  getattr(self, name)]
-        fields = sorted(fields, key=lambda x: x[1].order if x[1].order else math.inf)
-        for name, field, value in fields:
-            writable.write(TAG_STRUCT.pack(TagEnum.member_attr_name))
-            writable.write(LENGTH_STRUCT.pack(0))
-            writable.write(LENGTH_STRUCT.pack(len(name)))
-            writable.write(name.replace('_', '-').encode('utf-8'))
-            field.write(writable, '', value)
+    def write(self, writable: IppWriter):
+        for name, field, encoded_name, _ in self._write_schema:
+            value = getattr(self, name)
+            if not value:
+                continue
+            writable.write(MEMBER_ATTR_HEADER)
+            writable.write(encoded_name)
+            field.write_encoded(writable, EMPTY_NAME, value)
 
     @classmethod
     def read(cls, readable, state: ParserState):
@@ -395,12 +700,11 @@ class Collection(IppFieldsStruct):
                 cls._validate(read_fields)
                 return cls(**read_fields)
             if state.current_tag == TagEnum.member_attr_name:
-                length, = LENGTH_STRUCT.unpack(readable.read(LENGTH_STRUCT.size))
-                name = readable.read(length).decode('utf-8', errors='ignore').replace('-', '_')
+                name = str(readable.read_value(), 'utf-8', errors='ignore').replace('-', '_')
                 field = fields.get(name)
                 state.read_field_header(readable)
                 if not field:
-                    NullField().read(readable, state)
+                    NULL_FIELD.read(readable, state)
                     continue
                 read_fields[name] = field.read(readable, state)
             else:
@@ -409,32 +713,28 @@ class Collection(IppFieldsStruct):
 
 class CollectionField(IppField):
     _tag = TagEnum.begin_collection
+    _encoded_tag = TAG_STRUCT.pack(TagEnum.begin_collection)
 
     def __init__(self, collection_type: Type[Collection], *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.collection_type = collection_type
 
-    def write(self, writable, name, value):
-        writable.write(TAG_STRUCT.pack(self.get_tag()))
-        writable.write(LENGTH_STRUCT.pack(len(name)))
-        writable.write(name.replace('_', '-').encode('utf-8'))
-        writable.write(LENGTH_STRUCT.pack(0))
-
+    def write_encoded(self, writable: IppWriter, encoded_name: bytes, value):
+        writable.write(self._encoded_tag)
+        writable.write(encoded_name)
+        writable.write(EMPTY_NAME)
         value.write(writable)
-
-        writable.write(TAG_STRUCT.pack(TagEnum.end_collection))
-        writable.write(LENGTH_STRUCT.pack(0))
-        writable.write(LENGTH_STRUCT.pack(0))
+        writable.write(END_COLLECTION)
 
     def read(self, readable, state: ParserState):
         if state.current_tag != self.get_tag():
             raise InvalidTagError()
-        readable.read(LENGTH_STRUCT.size)
+        readable.skip_value()
         state.read_field_header(readable)
         val = self.collection_type.read(readable, state)
         if state.current_tag != TagEnum.end_collection:
             raise InvalidTagError()
-        readable.read(LENGTH_STRUCT.size)
+        readable.skip_value()
         state.read_field_header(readable)
         return val
 
@@ -1,16 +1,17 @@
-import math
 import struct
 from abc import ABC
 from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime
 from struct import Struct
-from typing import Tuple, List, Type, Any, Iterable, Optional
+from typing import Tuple, List, Type, Any, Iterable, Optional, Dict, Iterator
 
 from ipp.constants import SectionEnum, StatusCodeEnum
 from ipp.exceptions import InvalidCharsetError, BadRequestError, UnsupportedIppVersionError, BadRequestIDError, \
     InvalidGroupError
 from ipp.fields import CharsetField, NaturalLangField, TAG_STRUCT, IppFieldsStruct, \
-    ParserState, OneSetField, KeywordField, NameWLField, NullField
+    ParserState, OneSetField, KeywordField, NameWLField, NULL_FIELD, IppReader, as_reader, IppField, \
+    IppFieldsStructMeta, SchemaField, IppWriter, as_writer
 
 
 def ipp_timestamp(date: datetime) -> int:
@@ -26,15 +27,19 @@ class AttributeGroup(IppFieldsStruct):
         super().__init__(**kwargs)
 
     def write_to(self, writable, requested_attrs: Optional[List[str]] = None):
-        fields = [(name, clazz, getattr(self, name)) for name, clazz in self._filter_fields(requested_attrs).items() if
-                  getattr(self, name) is not None]
-        fields = sorted(fields, key=lambda x: x[1].order if x[1].order else math.inf)
-        for name, field, value in fields:
-            field.write(writable, name, value)
+        writer = as_writer(writable)
+        fields = self._filter_fields(requested_attrs)
+        for name, field, encoded_name, _ in self._write_schema:
+            if name not in fields:
+                continue
+            value = getattr(self, name)
+            if value is not None:
+                field.write_encoded(writer, encoded_name, value)
+        writer.copy_to(writable)
 
     @classmethod
-    def read_from(cls, readable, state: ParserState):
-        fields = cls._get_proto_fields()
+    def read_from(cls, readable: IppReader, state: ParserState):
+        fields = cls._proto_fields
         read_fields = OrderedDict()
         state.read_field_header(readable)
         while True:
@@ -45,15 +50,15 @@ class AttributeGroup(IppFieldsStruct):
                 field_name = state.current_name
                 field = fields.get(field_name)
                 if not field:
-                    NullField().read(readable, state)
+                    NULL_FIELD.read(readable, state)
                     continue
                 read_fields[field_name] = field.read(readable, state)
             else:
-                NullField().read(readable, state)
+                NULL_FIELD.read(readable, state)
 
     @classmethod
     def _filter_fields(cls, requested_attrs: List[str]):
-        fields = cls._get_proto_fields()
+        fields = cls._proto_fields
         if requested_attrs is None:
             requested_attrs = cls._default_filter
         if 'all' in requested_attrs or cls._filter in requested_attrs:
@@ -68,16 +73,21 @@ class AttributeGroup(IppFieldsStruct):
         return None
 
 
-class MergedGroup(AttributeGroup, ABC):
-    merged_groups: List[AttributeGroup] = []
-
+class MergedGroupMeta(IppFieldsStructMeta):
     @classmethod
-    def _get_proto_fields(cls):
+    def collect_fields(mcs, namespace: dict, inherited: Dict[str, IppField],
+                       own: Dict[str, IppField]) -> Dict[str, IppField]:
+        if 'merged_groups' not in namespace:
+            return super().collect_fields(namespace, inherited, own)
         fields = {}
-        for group in cls.merged_groups:
+        for group in namespace['merged_groups']:
             fields.update(group._get_proto_fields())
         return fields
 
+
+class MergedGroup(AttributeGroup, ABC, metaclass=MergedGroupMeta):
+    merged_groups: List[AttributeGroup] = []
+
     @classmethod
     def _filter_fields(cls, requested_attrs: Optional[List[str]]):
         fields = {}
@@ -88,6 +98,67 @@ class MergedGroup(AttributeGroup, ABC):
         return fields
 
 
+@dataclass(frozen=True)
+class EncodedAttributes:
+    """
+    The attributes of `group` encoded once for the requested attributes, so they can be cached and sent
+    in many responses, see `EncodedGroup`.
+    """
+
+    group: AttributeGroup
+    data: bytes
+    # The requested fields which are not encoded in `data`, their values are written for every response
+    volatile_fields: Tuple[SchemaField, ...]
+
+    @classmethod
+    def encode(cls, group: AttributeGroup, requested_attrs: Optional[List[str]],
+               volatile: Iterable[str]) -> "EncodedAttributes":
+        """
+        :param volatile: The names of the fields which change between the responses, they must be None in `group`.
+        """
+
+        writer = IppWriter()
+        group.write_to(writer, requested_attrs)
+        requested_fields = group._filter_fields(requested_attrs)
+        volatile = set(volatile)
+        volatile_fields = tuple(
+            schema_field for schema_field in group._write_schema
+            if schema_field.name in volatile and schema_field.name in requested_fields
+        )
+        return cls(group, writer.take(), volatile_fields)
+
+
+class EncodedGroup:
+    """
+    An attribute group of a response written from `EncodedAttributes`, followed by the current values
+    of their volatile fields. The attributes are available like the attributes of an `AttributeGroup`.
+    """
+
+    def __init__(self, attributes: EncodedAttributes, **volatile_values):
+        self._attributes = attributes
+        self._volatile_values = volatile_values
+
+    def get_tag(self):
+        return self._attributes.group.get_tag()
+
+    def write_to(self, writable, requested_attrs: Optional[List[str]] = None):
+        writer = as_writer(writable)
+        # The requested attributes are already filtered in the encoded attributes
+        writer.write(self._attributes.data)
+        for name, field, encoded_name, _ in self._attributes.volatile_fields:
+            value = self._volatile_values.get(name)
+            if value is not None:
+                field.write_encoded(writer, encoded_name, value)
+        writer.copy_to(writable)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._volatile_values:
+            return self._volatile_values[name]
+        return getattr(self._attributes.group, name)
+
+
 class BaseOperationGroup(AttributeGroup):
     _tag = SectionEnum.operation
     _permanent_members = ['attributes_charset', 'attributes_natural_language']
@@ -125,18 +196,18 @@ class IppRequest(IppMessage):
                  opid_or_status: int = StatusCodeEnum.ok,
                  request_id: int = 0):
         super().__init__(version, opid_or_status, request_id)
+        self._reader = as_reader(http_request)
         self._parser_state = ParserState()
-        self._parser_state.read_field_header(http_request)
-        self._http_request = http_request
+        self._parser_state.read_field_header(self._reader)
 
     @classmethod
     def from_http_request(cls, request):
+        reader = as_reader(request)
         try:
-            version_major, version_minor, opid_or_status, request_id = cls.HEADER_STRUCT.unpack(
-                request.read(cls.HEADER_STRUCT.size))
+            version_major, version_minor, opid_or_status, request_id = reader.unpack(cls.HEADER_STRUCT)
         except struct.error as ex:
             raise BadRequestError(ex)
-        return cls(request, (version_major, version_minor), opid_or_status, request_id)
+        return cls(reader, (version_major, version_minor), opid_or_status, request_id)
 
     def validate(self):
         if self.version not in self.IPP_VERSIONS:
@@ -155,11 +226,15 @@ class IppRequest(IppMessage):
         if self._parser_state.current_tag != attribute_group_type.get_tag():
             raise InvalidGroupError(
                 "Expected {}, got {}".format(attribute_group_type.get_tag(), self._parser_state.current_tag))
-        return attribute_group_type.read_from(self._http_request, self._parser_state)
+        return attribute_group_type.read_from(self._reader, self._parser_state)
 
     @property
     def http_request(self):
-        return self._http_request
+        """
+        The HTTP request body positioned at the document data following the read attribute groups.
+        """
+
+        return self._reader.document_stream()
 
 
 class IppResponse(IppMessage):
@@ -174,20 +249,49 @@ class IppResponse(IppMessage):
     def add_attribute_group(self, attr_group: AttributeGroup):
         self._attribute_groups.append(attr_group)
 
+    @property
+    def attribute_group_count(self) -> int:
+        return len(self._attribute_groups)
+
     def write_to(self, writable):
-        writable.write(self.HEADER_STRUCT.pack(self.version[0], self.version[1], self.opid_or_status, self.request_id))
+        """
+        Encodes the response into a single buffer and writes it to `writable` at once.
+        """
+
+        writer = as_writer(writable)
+        writer.pack(self.HEADER_STRUCT, self.version[0], self.version[1], self.opid_or_status, self.request_id)
+        for group in self._attribute_groups:
+            writer.pack(TAG_STRUCT, group.get_tag())
+            group.write_to(writer, self._requested_attrs)
+        writer.pack(TAG_STRUCT, SectionEnum.END)
+        writer.copy_to(writable)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[bytes]:
+        """
+        Encodes the response in chunks of about `chunk_size` bytes, so only one chunk is kept in memory.
+        A chunk is longer than `chunk_size` if a single attribute group does not fit in it.
+        """
+
+        writer = IppWriter(chunk_size)
+        writer.pack(self.HEADER_STRUCT, self.version[0], self.version[1], self.opid_or_status, self.request_id)
         for group in self._attribute_groups:
-            writable.write(TAG_STRUCT.pack(group.get_tag()))
-            group.write_to(writable, self._requested_attrs)
-        writable.write(TAG_STRUCT.pack(SectionEnum.END))
+            writer.pack(TAG_STRUCT, group.get_tag())
+            group.write_to(writer, self._requested_attrs)
+            if len(writer) >= chunk_size:
+                yield writer.take()
+        writer.pack(TAG_STRUCT, SectionEnum.END)
+        yield writer.take()
 
 
 def minimal_valid_response(request: IppRequest, status: int = StatusCodeEnum.ok):
     return IppResponse(request.version, status, request.request_id, [BaseOperationGroup()])
 
 
+def get_requested_attrs(requested_attrs_oneset) -> Optional[List[str]]:
+    return [kv[1] for kv in requested_attrs_oneset] if isinstance(requested_attrs_oneset, Iterable) else None
+
+
 def response_for(request: IppRequest, attr_groups: List[AttributeGroup], status: int = StatusCodeEnum.ok,
                  requested_attrs_oneset=None):
     return IppResponse(request.version, status, request.request_id, attr_groups,
-                       [kv[1] for kv in requested_attrs_oneset] if isinstance(requested_attrs_oneset,
-                                                                              Iterable) else None)
+                       get_requested_attrs(requested_attrs_oneset))
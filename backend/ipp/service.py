@@ -1,11 +1,15 @@
 import logging
+import threading
 from abc import ABC, abstractmethod
-from typing import Tuple, Callable, Optional, Dict, Any, List
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Tuple, Callable, Optional, Dict, Any, List, Hashable
 
 from ipp.constants import OperationEnum, StatusCodeEnum, PrinterStateEnum, JobStateEnum
 from ipp.exceptions import IppError, DocumentFormatError, NotFoundError
 from ipp.proto import IppRequest, IppResponse, BaseOperationGroup, \
-    BadRequestError, minimal_valid_response, response_for, AttributeGroup
+    BadRequestError, minimal_valid_response, response_for, AttributeGroup, EncodedAttributes, EncodedGroup, \
+    get_requested_attrs, ipp_timestamp
 from ipp.proto_operations import GetPrinterAttributesRequestOperationGroup, PrinterAttributesGroup, \
     PrintJobRequestOperationGroup, JobTemplateAttributeGroup, GetJobsRequestOperationGroup, \
     JobPrintResponseAttributes, GetJobAttributesRequestOperationGroup, CreateJobRequestOperationGroup, \
@@ -14,6 +18,42 @@ from ipp.proto_operations import GetPrinterAttributesRequestOperationGroup, Prin
 
 logger = logging.getLogger('gutenberg.ipp')
 
+# The attributes of the printer which change between the Get-Printer-Attributes responses, they are not cached
+VOLATILE_PRINTER_ATTRIBUTES = ('printer_current_time', 'printer_up_time', 'queued_job_count')
+
+
+class EncodedAttributesCache:
+    """
+    A cache of `EncodedAttributes` with at most `max_size` entries, the least recently used entries are evicted.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[Hashable, EncodedAttributes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_encode(self, key: Hashable, encode: Callable[[], EncodedAttributes]) -> EncodedAttributes:
+        with self._lock:
+            attributes = self._entries.get(key)
+            if attributes is not None:
+                self._entries.move_to_end(key)
+                return attributes
+        attributes = encode()
+        with self._lock:
+            self._entries[key] = attributes
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return attributes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# The encoded printer attributes by the printer, the properties of the service and the requested attributes.
+# It is cleared when a printer or its permissions are saved, see `ipp.signals`.
+PRINTER_ATTRIBUTES_CACHE = EncodedAttributesCache(max_size=256)
+
 
 def internal_error(request: IppRequest) -> IppResponse:
     return minimal_valid_response(request, StatusCodeEnum.server_error_internal_error)
@@ -151,35 +191,62 @@ class BaseIppEverywhereService(BaseIppService, ABC):
         logger.debug("GetPrinterAttrs:\n" + str(operation))
         if operation.document_format and operation.document_format not in self.supported_ipp_formats:
             raise DocumentFormatError("Unsupported format: {}".format(operation.document_format))
+        requested_attrs = get_requested_attrs(operation.requested_attributes)
+        attributes = PRINTER_ATTRIBUTES_CACHE.get_or_encode(
+            self._printer_attributes_key(requested_attrs),
+            lambda: EncodedAttributes.encode(self._build_printer_attributes(), requested_attrs,
+                                             VOLATILE_PRINTER_ATTRIBUTES),
+        )
+        now = datetime.now(tz=timezone.utc)
         return response_for(request, [
             BaseOperationGroup(),
-            PrinterAttributesGroup(
-                printer_uri_supported=[self.printer_uri],
-                printer_name="Gutenberg-{}".format(self.printer_name).replace(' ', '-'),
-                printer_info="Gutenberg - {}".format(self.printer_name),
-                printer_more_info=self.webpage_uri,
-                # TODO: this is fine?
-                printer_state=PrinterStateEnum.idle,
-                printer_state_message="idle",
+            EncodedGroup(
+                attributes,
+                printer_current_time=now,
+                printer_up_time=ipp_timestamp(now),
                 # TODO: https://www.shutterstock.com/search/sisyphus
                 queued_job_count=1,
-                # TODO: WHAT?
-                printer_uuid='urn:uuid:12345678-9ABC-DEF0-1234-56789ABCDEF0',
-                device_uuid='urn:uuid:12345678-9ABC-DEF0-1234-56789ABCDEF0',
-                printer_icons=[self.printer_icon],
-                printer_supply_info_uri=self.webpage_uri,
-                uri_security_supported=['tls'] if self.printer_tls else ['none'],
-                uri_authentication_supported=['basic'] if self.printer_basic_auth else ['none'],
-                print_color_mode_supported=['auto', 'color', 'monochrome'] if self.printer_color else ['auto',
-                                                                                                       'monochrome'],
-                sides_supported=['one-sided', 'two-sided-long-edge',
-                                 'two-sided-short-edge'] if self.printer_duplex else ['one-sided'],
-                operations_supported=self.SUPPORTED_OPERATIONS.keys(),
-                document_format_supported=self.supported_ipp_formats,
-                document_format_default=self.default_ipp_format,
             )
         ], requested_attrs_oneset=operation.requested_attributes)
 
+    def _printer_attributes_key(self, requested_attrs: Optional[List[str]]) -> Hashable:
+        return (
+            type(self), self.printer_name, self.printer_uri, self.printer_tls, self.printer_basic_auth,
+            self.printer_color, self.printer_duplex, self.printer_icon, tuple(self.supported_ipp_formats),
+            self.default_ipp_format, self.webpage_uri,
+            frozenset(requested_attrs) if requested_attrs is not None else None,
+        )
+
+    def _build_printer_attributes(self) -> PrinterAttributesGroup:
+        """
+        Returns the attributes of the printer without the values of `VOLATILE_PRINTER_ATTRIBUTES`.
+        """
+
+        return PrinterAttributesGroup(
+            printer_uri_supported=[self.printer_uri],
+            printer_name="Gutenberg-{}".format(self.printer_name).replace(' ', '-'),
+            printer_info="Gutenberg - {}".format(self.printer_name),
+            printer_more_info=self.webpage_uri,
+            # TODO: this is fine?
+            printer_state=PrinterStateEnum.idle,
+            printer_state_message="idle",
+            # TODO: WHAT?
+            printer_uuid='urn:uuid:12345678-9ABC-DEF0-1234-56789ABCDEF0',
+            device_uuid='urn:uuid:12345678-9ABC-DEF0-1234-56789ABCDEF0',
+            printer_icons=[self.printer_icon],
+            printer_supply_info_uri=self.webpage_uri,
+            uri_security_supported=['tls'] if self.printer_tls else ['none'],
+            uri_authentication_supported=['basic'] if self.printer_basic_auth else ['none'],
+            print_color_mode_supported=['auto', 'color', 'monochrome'] if self.printer_color else ['auto',
+                                                                                                   'monochrome'],
+            sides_supported=['one-sided', 'two-sided-long-edge',
+                             'two-sided-short-edge'] if self.printer_duplex else ['one-sided'],
+            operations_supported=self.SUPPORTED_OPERATIONS.keys(),
+            document_format_supported=self.supported_ipp_formats,
+            document_format_default=self.default_ipp_format,
+            **{name: None for name in VOLATILE_PRINTER_ATTRIBUTES},
+        )
+
     def print_job(self, request: IppRequest) -> IppResponse:
         operation = request.read_group(PrintJobRequestOperationGroup)
         logger.debug("PrintJob\n" + str(operation))
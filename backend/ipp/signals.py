@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from control.models import Printer, PrinterPermissions
+from ipp.service import PRINTER_ATTRIBUTES_CACHE
+
+
+@receiver([post_save, post_delete], sender=Printer)
+@receiver([post_save, post_delete], sender=PrinterPermissions)
+def clear_printer_attributes_cache(**kwargs):
+    PRINTER_ATTRIBUTES_CACHE.clear()
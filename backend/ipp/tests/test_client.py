@@ -0,0 +1,154 @@
+import io
+import os
+import socketserver
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+
+from ipp.client import IppClient, IppClientError, JobOptionsGroup
+from ipp.constants import OperationEnum, JobStateEnum, StatusCodeEnum
+from ipp.fields import KeywordField
+from ipp.proto import IppRequest, IppResponse, BaseOperationGroup
+from ipp.proto_operations import PrintJobRequestOperationGroup, GetJobAttributesRequestOperationGroup, \
+    CancelJobRequestOperationGroup, GetJobsRequestOperationGroup, JobPrintResponseAttributes
+
+OPERATION_GROUPS = {
+    OperationEnum.print_job: PrintJobRequestOperationGroup,
+    OperationEnum.get_job_attributes: GetJobAttributesRequestOperationGroup,
+    OperationEnum.cancel_job: CancelJobRequestOperationGroup,
+    OperationEnum.get_jobs: GetJobsRequestOperationGroup,
+}
+
+
+class FakeCupsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        request = IppRequest.from_http_request(io.BytesIO(body))
+        operation = request.read_group(OPERATION_GROUPS[request.opid_or_status])
+        # The job template attributes are not parsed, the raw request is kept instead
+        server.requests.append((self.path, request.opid_or_status, operation, body))
+        server.connections.add(self.connection.fileno())
+
+        groups = [BaseOperationGroup()]
+        if request.opid_or_status != OperationEnum.cancel_job:
+            groups.append(JobPrintResponseAttributes(
+                job_id=42, job_uri='ipp://localhost/jobs/42', job_state=server.job_state,
+                job_state_reasons=server.job_state_reasons, job_state_message='printing',
+            ))
+        response = io.BytesIO()
+        IppResponse(request.version, server.status, request.request_id, groups).write_to(response)
+        data = response.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/ipp')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCupsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, FakeCupsHandler)
+        self.requests = []
+        self.connections = set()
+        self.status = StatusCodeEnum.ok
+        self.job_state = JobStateEnum.processing
+        self.job_state_reasons = ['job-printing']
+
+
+class IppClientTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.server = FakeCupsServer(os.path.join(self.tmp_dir.name, 'cups.sock'))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = IppClient(self.server.server_address, 'worker', 5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_print_job(self):
+        document = os.path.join(self.tmp_dir.name, 'document.pdf')
+        with open(document, 'wb') as f:
+            f.write(b'%PDF-1.4 document data')
+
+        job_id = self.client.print_job('printer 1', document, 'job name', copies=3,
+                                       options={'sides': 'two-sided-long-edge'})
+
+        self.assertEqual(job_id, 42)
+        path, operation_id, operation, body = self.server.requests[0]
+        self.assertEqual(path, '/printers/printer%201')
+        self.assertEqual(operation_id, OperationEnum.print_job)
+        self.assertEqual(operation.printer_uri, 'ipp://localhost/printers/printer%201')
+        self.assertEqual(operation.requesting_user_name, 'worker')
+        self.assertEqual(operation.job_name, 'job name')
+        self.assertEqual(operation.document_format, 'application/pdf')
+        self.assertIn(b'copies', body)
+        self.assertIn(b'two-sided-long-edge', body)
+        self.assertTrue(body.endswith(b'%PDF-1.4 document data'))
+
+    def test_get_job_status(self):
+        job_status = self.client.get_job_status(42)
+
+        self.assertEqual(job_status.job_state, JobStateEnum.processing)
+        self.assertEqual(job_status.get_reasons(), ['job-printing'])
+        self.assertEqual(job_status.job_state_message, 'printing')
+        self.assertFalse(job_status.is_finished())
+        operation = self.server.requests[0][2]
+        self.assertEqual(operation.job_uri, 'ipp://localhost/jobs/42')
+
+    def test_finished_job(self):
+        self.server.job_state = JobStateEnum.completed
+        self.server.job_state_reasons = ['job-completed-successfully']
+
+        self.assertTrue(self.client.get_job_status(42).is_finished())
+
+    def test_get_jobs(self):
+        jobs = self.client.get_jobs()
+
+        self.assertEqual([job.job_id for job in jobs], [42])
+        _, operation_id, operation, _ = self.server.requests[0]
+        self.assertEqual(operation_id, OperationEnum.get_jobs)
+        self.assertEqual(operation.which_jobs, 'not-completed')
+
+    def test_cancel_job(self):
+        self.client.cancel_job(42)
+
+        _, operation_id, operation, _ = self.server.requests[0]
+        self.assertEqual(operation_id, OperationEnum.cancel_job)
+        self.assertEqual(operation.job_uri, 'ipp://localhost/jobs/42')
+
+    def test_connection_reused(self):
+        for _ in range(3):
+            self.client.get_job_status(42)
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_error_status(self):
+        self.server.status = StatusCodeEnum.client_error_not_found
+
+        with self.assertRaises(IppClientError) as cm:
+            self.client.get_job_status(42)
+        self.assertEqual(cm.exception.status, StatusCodeEnum.client_error_not_found)
+
+
+class JobOptionsGroupTests(TestCase):
+    def test_write(self):
+        buffer = io.BytesIO()
+        JobOptionsGroup({'ColorModel': 'Gray'}, copies=2).write_to(buffer)
+
+        expected = io.BytesIO()
+        JobOptionsGroup(copies=2).write_to(expected)
+        KeywordField().write(expected, 'ColorModel', 'Gray')
+        self.assertEqual(buffer.getvalue(), expected.getvalue())
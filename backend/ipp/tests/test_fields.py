@@ -1,13 +1,15 @@
 import datetime
 import io
+import math
 import struct
 from collections import OrderedDict
 from unittest import TestCase
+from unittest.mock import Mock
 from ipp.constants import SectionEnum, TagEnum, ValueTagsEnum
-from ipp.exceptions import InvalidTagError, MissingFieldError, FieldOrderError
+from ipp.exceptions import InvalidTagError, MissingFieldError, FieldOrderError, BadRequestError
 from ipp.fields import ParserState, TAG_STRUCT, NullField, UnknownField, BooleanField, IntegerField, \
     TextWLField, DateTimeField, Resolution, ResolutionField, IntRangeField, OneSetField, UnionField, \
-    Collection, CollectionField, IntRange, OctetStringField, IppFieldsStruct
+    Collection, CollectionField, IntRange, OctetStringField, IppFieldsStruct, IppReader, IppWriter
 from ipp.tests.utils import as_buffer, len_tag, DNR, as_terminated_buffer, read_buffer
 
 
@@ -36,7 +38,7 @@ class ParserStateTests(TestCase):
         self.assertEqual(state.current_tag, TagEnum.integer)
         self.assertEqual(state.current_name, 'test')
         self.assertFalse(state.is_next_set_attr())
-        self.assertEqual(buffer.read(), DNR)
+        self.assertEqual(buffer.document_stream().read(), DNR)
 
     def test_repeated_field_tag(self):
         state = ParserState()
@@ -48,7 +50,70 @@ class ParserStateTests(TestCase):
         state.read_field_header(buffer)
         self.assertEqual(state.current_tag, TagEnum.integer)
         self.assertTrue(state.is_next_set_attr())
-        self.assertEqual(buffer.read(), DNR)
+        self.assertEqual(buffer.document_stream().read(), DNR)
+
+
+class IppReaderTests(TestCase):
+    def test_values_across_chunks(self):
+        reader = IppReader(io.BytesIO(b''.join([
+            TAG_STRUCT.pack(TagEnum.keyword),
+            len_tag(10),
+            b'field-name',
+            len_tag(4),
+            struct.pack('>i', 123456),
+        ])), chunk_size=3)
+        state = ParserState()
+        state.read_field_header(reader)
+        self.assertEqual(state.current_name, 'field_name')
+        self.assertEqual(reader.unpack_value(struct.Struct('>i')), (123456,))
+        self.assertIsNone(reader.read_tag())
+
+    def test_skip_value_beyond_buffer(self):
+        stream = io.BytesIO(b''.join([len_tag(1000), b'x' * 1000, DNR]))
+        reader = IppReader(stream, chunk_size=16)
+        reader.skip_value()
+        self.assertEqual(reader.document_stream().read(), DNR)
+
+    def test_negative_length(self):
+        reader = IppReader(io.BytesIO(len_tag(-1) + DNR))
+        with self.assertRaises(BadRequestError):
+            reader.read_value()
+
+    def test_document_stream_without_buffered_data(self):
+        stream = io.BytesIO(TAG_STRUCT.pack(SectionEnum.END) + DNR)
+        reader = IppReader(stream, chunk_size=1)
+        self.assertEqual(reader.read_tag(), SectionEnum.END)
+        self.assertIs(reader.document_stream(), stream)
+        self.assertEqual(stream.read(), DNR)
+
+    def test_document_stream_reads(self):
+        stream = io.BytesIO(TAG_STRUCT.pack(SectionEnum.END) + b'0123456789')
+        reader = IppReader(stream, chunk_size=4)
+        reader.read_tag()
+        document = reader.document_stream()
+        self.assertIs(reader.document_stream(), document)
+        self.assertEqual(document.read(2), b'01')
+        self.assertEqual(document.read(5), b'23456')
+        self.assertEqual(document.read(), b'789')
+        self.assertEqual(document.read(1), b'')
+
+
+class IppWriterTests(TestCase):
+    def test_grows_buffer(self):
+        writer = IppWriter(size_hint=4)
+        writer.write(b'abc')
+        writer.write_value(b'test1234')
+        writer.pack_value(struct.Struct('>ii'), 1, 2)
+        writer.pack(TAG_STRUCT, SectionEnum.END)
+        self.assertEqual(writer.take(),
+                         b'abc\x00\x08test1234\x00\x08\x00\x00\x00\x01\x00\x00\x00\x02\x03')
+        self.assertEqual(len(writer), 0)
+
+    def test_copy_to_single_write(self):
+        writable = Mock()
+        IntegerField().write(writable, 'test', 1)
+        self.assertEqual(writable.write.call_count, 1)
+        self.assertEqual(bytes(writable.write.call_args[0][0]), b'!\x00\x04test\x00\x04\x00\x00\x00\x01')
 
 
 class ReadFieldsTests(TestCase):
@@ -59,7 +124,7 @@ class ReadFieldsTests(TestCase):
         return state
 
     def _assert_buffer_safe(self, buffer, state):
-        self.assertEqual(buffer.read(), DNR)
+        self.assertEqual(buffer.document_stream().read(), DNR)
         self.assertEqual(state.current_tag, SectionEnum.END)
 
     def test_invalid_tag(self):
@@ -544,3 +609,24 @@ class IppFieldsStructTests(TestCase):
         )
         val1 = self.TestStruct(field_c=30)
         self.assertNotEqual(val1, val2)
+
+    def test_write_schema(self):
+        schema = [(field.name, field.encoded_name, field.order) for field in self.TestStruct._write_schema]
+        self.assertListEqual(schema, [
+            ('field_a', b'\x00\x07field-a', 1),
+            ('field_b', b'\x00\x07field-b', 2),
+            ('field_c', b'\x00\x07field-c', math.inf),
+            ('field_d', b'\x00\x07field-d', math.inf),
+        ])
+
+    def test_slots(self):
+        class ExtendedStruct(self.TestStruct):
+            field_e = IntegerField()
+
+        val = ExtendedStruct(field_c=30, field_e=50)
+        self.assertFalse(hasattr(val, '__dict__'))
+        self.assertEqual((val.field_c, val.field_e), (30, 50))
+        self.assertEqual(list(ExtendedStruct._get_proto_fields()),
+                         ['field_a', 'field_b', 'field_c', 'field_d', 'field_e'])
+        with self.assertRaises(AttributeError):
+            val.field_x = 1
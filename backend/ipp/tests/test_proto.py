@@ -68,7 +68,7 @@ class AttributeGroupTests(TestCase):
         self.assertEqual(val.field_a, 123456)
         self.assertEqual(val.field_b, 234567)
         self.assertEqual(val.field_c, 345678)
-        self.assertEqual(buffer.read(), DNR)
+        self.assertEqual(buffer.document_stream().read(), DNR)
         self.assertEqual(state.current_tag, SectionEnum.END)
 
     def test_write_default(self):
@@ -306,6 +306,15 @@ class IppResponseTests(TestCase):
                          b'\x02\x00\x00\x00\x00\x00\x00\x01\x01!\x00\x07field-a\x00\x04\x00\x00\x00\x01!\x00\x07field-b'
                          b'\x00\x04\x00\x00\x00\x02\x03')
 
+    def test_write_chunks(self):
+        response = IppResponse((2, 0), StatusCodeEnum.ok, 1, [self.TestAttributeGroup() for _ in range(100)])
+        buffer = io.BytesIO()
+        response.write_to(buffer)
+        chunks = list(response.iter_chunks(256))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) < 256 + 64 for chunk in chunks))
+        self.assertEqual(b''.join(chunks), read_buffer(buffer))
+
     def test_write_requested(self):
         buffer = io.BytesIO()
         response = IppResponse((2, 0), StatusCodeEnum.ok, 1, requested_attrs=['field-a'])
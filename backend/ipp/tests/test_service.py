@@ -4,14 +4,18 @@ from typing import Any, List, Optional, Tuple
 from unittest import TestCase
 from unittest.mock import Mock
 
+from django.test import TestCase as DjangoTestCase
+
+from control.models import Printer
 from ipp.constants import StatusCodeEnum, JobStateEnum
 from ipp.exceptions import BadRequestError, UnsupportedIppVersionError, DocumentFormatError
-from ipp.proto import IppResponse, IppRequest, minimal_valid_response, AttributeGroup
+from ipp.fields import KeywordField
+from ipp.proto import IppResponse, IppRequest, minimal_valid_response, AttributeGroup, BaseOperationGroup
 from ipp.proto_operations import JobObjectAttributeGroupFull, JobObjectAttributeGroup, \
     GetPrinterAttributesRequestOperationGroup, PrintJobRequestOperationGroup, JobTemplateAttributeGroup, \
     SendDocumentRequestOperationGroup, GetJobsRequestOperationGroup, GetJobAttributesRequestOperationGroup, \
     CancelJobRequestOperationGroup, CloseJobRequestOperationGroup, IdentifyPrinterRequestOperationGroup
-from ipp.service import BaseIppService, BaseIppEverywhereService
+from ipp.service import BaseIppService, BaseIppEverywhereService, PRINTER_ATTRIBUTES_CACHE
 
 
 def _get_mocked_request_factory(return_value):
@@ -196,6 +200,53 @@ class BaseIppEverywhereServiceTests(TestCase):
         self.assertEqual(response._attribute_groups[1].printer_name, 'Gutenberg-test-printer')
         self.assertIn('ipps://test', response._attribute_groups[1].printer_uri_supported)
 
+    def _get_printer_attrs_response(self, service, requested_attributes=None) -> bytes:
+        request = IppRequest(io.BytesIO(), request_id=100, opid_or_status=1)
+        request.read_group = Mock(return_value=GetPrinterAttributesRequestOperationGroup(
+            printer_uri='unused',
+            requested_attributes=requested_attributes,
+        ))
+        buffer = io.BytesIO()
+        service.get_printer_attrs(request).write_to(buffer)
+        return buffer.getvalue()
+
+    def test_get_printer_attrs_cached(self):
+        PRINTER_ATTRIBUTES_CACHE.clear()
+        service = self.TestIppServiceWrapper(Mock())
+        service._build_printer_attributes = Mock(wraps=service._build_printer_attributes)
+        requested = [(KeywordField, 'printer-name'), (KeywordField, 'printer-up-time')]
+
+        first = self._get_printer_attrs_response(service, requested)
+        second = self._get_printer_attrs_response(service, list(reversed(requested)))
+
+        self.assertEqual(service._build_printer_attributes.call_count, 1)
+        self.assertIn(b'printer-up-time', second)
+        self.assertEqual(len(first), len(second))
+        self.assertNotIn(b'printer-current-time', second)
+
+    def test_get_printer_attrs_same_as_uncached(self):
+        PRINTER_ATTRIBUTES_CACHE.clear()
+        service = self.TestIppServiceWrapper(Mock())
+        self._get_printer_attrs_response(service)
+        cached = self._get_printer_attrs_response(service)
+
+        expected = io.BytesIO()
+        IppResponse((2, 0), StatusCodeEnum.ok, 100, [
+            BaseOperationGroup(),
+            service._build_printer_attributes(),
+        ]).write_to(expected)
+        # The cached attributes are followed by the volatile attributes and the end tag
+        self.assertTrue(cached.startswith(expected.getvalue()[:-1]))
+        self.assertIn(b'queued-job-count', cached[len(expected.getvalue()) - 1:])
+
+    def test_get_printer_attrs_key(self):
+        PRINTER_ATTRIBUTES_CACHE.clear()
+        service = self.TestIppServiceWrapper(Mock())
+        self.assertIn(b'\x00\x05color', self._get_printer_attrs_response(service))
+        service.printer_color = False
+        response = self._get_printer_attrs_response(service)
+        self.assertNotIn(b'\x00\x05color', response)
+
     def test_get_printer_attrs_unsupported_format(self):
         buffer = io.BytesIO()
         argument_captor = Mock()
@@ -547,3 +598,17 @@ class BaseIppEverywhereServiceTests(TestCase):
         # No-op, just test the header.
         self.assertEqual(response.opid_or_status, StatusCodeEnum.ok)
         self.assertEqual(response.request_id, 100)
+
+
+class PrinterAttributesCacheTests(DjangoTestCase):
+    def test_cleared_on_printer_save(self):
+        PRINTER_ATTRIBUTES_CACHE.get_or_encode('key', Mock())
+        printer = Printer.objects.create(name='printer')
+        encode = Mock()
+        PRINTER_ATTRIBUTES_CACHE.get_or_encode('key', encode)
+        self.assertEqual(encode.call_count, 1)
+
+        printer.color_supported = True
+        printer.save()
+        PRINTER_ATTRIBUTES_CACHE.get_or_encode('key', encode)
+        self.assertEqual(encode.call_count, 2)
@@ -1,14 +1,14 @@
 import io
 
 from ipp.constants import SectionEnum
-from ipp.fields import TAG_STRUCT, LENGTH_STRUCT
+from ipp.fields import TAG_STRUCT, LENGTH_STRUCT, IppReader
 
 DNR = b'DO_NOT_READ'
 END = TAG_STRUCT.pack(SectionEnum.END)
 
 
 def as_buffer(*data: bytes):
-    return io.BytesIO(b''.join(data))
+    return IppReader(io.BytesIO(b''.join(data)))
 
 
 def as_terminated_buffer(*data: bytes):
@@ -2,7 +2,7 @@ import base64
 from datetime import datetime, timezone
 from typing import Optional, Tuple, Any, List
 
-from django.http import HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, StreamingHttpResponse
 from django.template.defaultfilters import slugify
 from django.templatetags.static import static
 from django.urls import reverse
@@ -14,14 +14,22 @@ import printing
 from common.models import User
 from control.models import Printer, TwoSidedPrinting, GutenbergJob, JobStatus
 from ipp.constants import JobStateEnum, ValueTagsEnum
-from ipp.exceptions import NotPossibleError, DocumentFormatError
+from ipp.exceptions import NotPossibleError, DocumentFormatError, RequestEntityTooLargeError
 from ipp.proto import IppRequest, ipp_timestamp, AttributeGroup, IppResponse
 from ipp.proto_operations import JobObjectAttributeGroupFull, JobObjectAttributeGroup
 from ipp.service import BaseIppEverywhereService
+from printing.cancellation import notify_job_canceled
+from printing.ingestion import DocumentTooLargeError
 from printing.printing import create_print_job, submit_print_job
 from printing.utils import SUPPORTED_IPP_FORMATS, DEFAULT_IPP_FORMAT
 
 
+# The responses with many attribute groups, e.g. Get-Jobs of a user with many jobs,
+# are encoded and sent in chunks instead of being encoded into a single buffer
+STREAMING_RESPONSE_MIN_GROUPS = 500
+STREAMING_RESPONSE_CHUNK_SIZE = 64 * 1024
+
+
 class GutenbergIppService(BaseIppEverywhereService):
     def __init__(self, printer, user: User, is_secure: bool, basic_auth: bool, base_uri: str,
                  printer_icon: str, webpage_uri: str) -> None:
@@ -91,6 +99,8 @@ class GutenbergIppService(BaseIppEverywhereService):
             )
         except printing.utils.DocumentFormatError as ex:
             raise DocumentFormatError(ex)
+        except DocumentTooLargeError as ex:
+            raise RequestEntityTooLargeError(ex)
 
     def _get_job_uri(self, job_id) -> str:
         return f'{self.base_uri}job/{job_id}'
@@ -137,8 +147,12 @@ class GutenbergIppService(BaseIppEverywhereService):
             status=JobStatus.CANCELING)
         if rows == 0:
             raise NotPossibleError('no jobs cancelled')
+        notify_job_canceled(job.id)
 
     def _http_response(self, ipp_response: IppResponse, http_code=200):
+        if ipp_response.attribute_group_count >= STREAMING_RESPONSE_MIN_GROUPS:
+            return StreamingHttpResponse(ipp_response.iter_chunks(STREAMING_RESPONSE_CHUNK_SIZE),
+                                         status=http_code, content_type='application/ipp')
         http_response = HttpResponse(status=http_code, content_type='application/ipp')
         ipp_response.write_to(http_response)
         return http_response
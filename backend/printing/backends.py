@@ -1,15 +1,18 @@
+import getpass
 import logging
 import re
 import subprocess
-import time
+import threading
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Dict, List, Optional
 
 from django.conf import settings
 from django.utils import timezone
 
-from control.models import GutenbergJob, TwoSidedPrinting, JobStatus
-from printing.utils import JobCanceledException, TASK_TIMEOUT_S, PRINTING_TIMEOUT_S, handle_cancellation
+from control.models import GutenbergJob, TwoSidedPrinting, JobStatus, JobStage, Printer, PrinterType, BackendPrintJob
+from ipp.client import IppClient
+from printing.stage_timing import StageTimer
+from printing.utils import JobCanceledException, TASK_TIMEOUT_S
 
 logger = logging.getLogger('gutenberg.worker')
 
@@ -20,8 +23,11 @@ class PrinterBackend(ABC):
         self.backend_name = self.__class__.__name__
 
     @abstractmethod
-    def check_status(self, job: GutenbergJob, backend_job_id: Any) -> bool:
-        """Checks if the backend has finished processing the job. Returns `true` on finish."""
+    def check_statuses(self, backend_job_ids: List[str]) -> Dict[str, str]:
+        """
+        Checks which of the jobs are still processed by the backend.
+        Returns the status descriptions of the unfinished jobs, the finished jobs are omitted.
+        """
         pass
 
     @abstractmethod
@@ -30,51 +36,49 @@ class PrinterBackend(ABC):
         pass
 
     @abstractmethod
-    def cancel_job(self, job: GutenbergJob, backend_job_id: Any) -> None:
+    def cancel_job(self, job: GutenbergJob, backend_job_id: str) -> None:
         """Attempt canceling processing the job on backend."""
         pass
 
-    def print(self, job: GutenbergJob, file_path: str):
+    def spool(self, job: GutenbergJob, file_path: str, timer: Optional[StageTimer] = None) -> BackendPrintJob:
+        """
+        Submits the file to the backend without waiting for it to be printed.
+        The returned `BackendPrintJob` is followed by `printing.printing.monitor_print_jobs`.
+        """
+
         logger.info("Printing job {} via {}".format(job, self.backend_name))
-        backend_job_id = self.submit_job(job, file_path)
-        cnt = 0
-        while self.check_status(job, backend_job_id):
-            logger.info("Job {} is still printing via {}".format(job, self.backend_name))
-            handle_cancellation(job, lambda: self.cancel_job(job, backend_job_id))
-            time.sleep(1)
-            cnt += 1
-            if cnt > PRINTING_TIMEOUT_S:
-                self.cancel_job(job, backend_job_id)
-                raise TimeoutError("Job {} took too long to complete".format(job))
-        job.status = JobStatus.COMPLETED
-        job.status_reason = ''
-        job.date_finished = timezone.now()
-        job.save()
+        if timer is None:
+            timer = StageTimer(job)
+        with timer.measure(JobStage.SUBMIT, file_path):
+            backend_job_id = self.submit_job(job, file_path)
+        return BackendPrintJob.objects.create(
+            job=job,
+            document_number=timer.document_number,
+            backend_job_id=str(backend_job_id),
+        )
 
 
 class LocalCupsPrinter(PrinterBackend):
     common_options = ['-h', settings.CUPS_SERVERNAME]
 
-    def check_status(self, job: GutenbergJob, backend_job_id: Any) -> bool:
+    def check_statuses(self, backend_job_ids: List[str]) -> Dict[str, str]:
         output = subprocess.check_output(
             ['lpstat'] + self.common_options + ['-l'],
             stderr=subprocess.STDOUT,
             timeout=TASK_TIMEOUT_S,
         )
-        output_lines = output.decode('utf-8', errors='ignore').splitlines()
-        for idx, val in enumerate(output_lines):
-            if not re.match('^{}\\s'.format(backend_job_id), val):
+        # Every job is listed as a line starting with its id, followed by indented lines with its status
+        statuses = {}
+        status_lines = None
+        for line in output.decode('utf-8', errors='ignore').splitlines():
+            if re.match(r'^\s+', line):
+                if status_lines is not None:
+                    status_lines.append(line.strip())
                 continue
-            max_idx = idx
-            for i in range(idx + 1, len(output_lines)):
-                if re.match(r'^\s+', output_lines[i]):
-                    max_idx = i
-                else:
-                    break
-            status = '\n'.join(x.strip() for x in output_lines[idx + 1: max_idx + 1])
-            GutenbergJob.objects.filter(id=job.id).update(status_reason=status)
-            return True
-        return False
+            status_lines = [] if line.strip() else None
+            if status_lines is not None:
+                statuses[line.split()[0]] = status_lines
+        return {job_id: '\n'.join(statuses[job_id]) for job_id in backend_job_ids if job_id in statuses}
 
     @staticmethod
     def _cups_params(job: GutenbergJob):
@@ -107,7 +111,7 @@ class LocalCupsPrinter(PrinterBackend):
             return '{0}-{1}'.format(cups_name, mt.group(1))
         raise ValueError('Invalid lp output: {}'.format(output))
 
-    def cancel_job(self, job: GutenbergJob, backend_job_id: Any):
+    def cancel_job(self, job: GutenbergJob, backend_job_id: str):
         subprocess.check_output(
             ['cancel'] + self.common_options + [backend_job_id],
             stderr=subprocess.STDOUT,
@@ -124,10 +128,61 @@ class LocalCupsPrinter(PrinterBackend):
             return []
 
 
+class IppCupsPrinter(LocalCupsPrinter):
+    """
+    Sends the jobs to CUPS using the IPP client from the `ipp` app instead of the cups-client commands.
+
+    Every worker thread keeps an open connection to `CUPS_SERVERNAME`, which is reused by all its jobs.
+    """
+
+    _local = threading.local()
+
+    @classmethod
+    def _get_client(cls) -> IppClient:
+        client = getattr(cls._local, 'client', None)
+        if client is None or client.server != settings.CUPS_SERVERNAME:
+            client = IppClient(settings.CUPS_SERVERNAME, getpass.getuser(), TASK_TIMEOUT_S)
+            cls._local.client = client
+        return client
+
+    @staticmethod
+    def _ipp_options(job: GutenbergJob) -> dict[str, str]:
+        cups_params = LocalCupsPrinter._cups_params(job)
+        options = {}
+        for flag, value in zip(cups_params[::2], cups_params[1::2]):
+            if flag == '-o':
+                name, _, option_value = value.partition('=')
+                options[name] = option_value
+        return options
+
+    def check_statuses(self, backend_job_ids: List[str]) -> Dict[str, str]:
+        statuses = {}
+        for job_status in self._get_client().get_jobs():
+            if job_status.is_finished():
+                continue
+            lines = job_status.get_reasons()
+            if job_status.job_state_message:
+                lines.append(job_status.job_state_message)
+            statuses[str(job_status.job_id)] = '\n'.join(lines)
+        return {job_id: statuses[job_id] for job_id in backend_job_ids if job_id in statuses}
+
+    def submit_job(self, job: GutenbergJob, file_path: str) -> Any:
+        return self._get_client().print_job(
+            job.printer.localprinterparams.cups_printer_name,
+            file_path,
+            job.name,
+            copies=job.properties.copies,
+            options=self._ipp_options(job),
+        )
+
+    def cancel_job(self, job: GutenbergJob, backend_job_id: str):
+        self._get_client().cancel_job(int(backend_job_id))
+
+
 class DisabledPrinter(PrinterBackend):
 
-    def check_status(self, job: GutenbergJob, backend_job_id: Any) -> bool:
-        return False
+    def check_statuses(self, backend_job_ids: List[str]) -> Dict[str, str]:
+        return {}
 
     def submit_job(self, job: GutenbergJob, file_path: str):
         job.status = JobStatus.CANCELED
@@ -136,5 +191,11 @@ class DisabledPrinter(PrinterBackend):
         job.save()
         raise JobCanceledException()
 
-    def cancel_job(self, job: GutenbergJob, backend_job_id: Any):
+    def cancel_job(self, job: GutenbergJob, backend_job_id: str):
         pass
+
+
+def get_printer_backend(printer: Optional[Printer]) -> PrinterBackend:
+    if printer is not None and printer.printer_type == PrinterType.LOCAL_CUPS:
+        return IppCupsPrinter() if settings.CUPS_USE_IPP_CLIENT else LocalCupsPrinter()
+    return DisabledPrinter()
@@ -0,0 +1,394 @@
+"""
+A benchmark of the document processing steps on a synthetic corpus, run with `manage.py benchmark_processing`.
+
+Every converter and `LayoutEngine.create_output_pdf`, as used by the workers, for every valid n-up and both
+imposition templates are run on generated documents with different page counts. The layout is measured without
+chunking, with chunking in the process running the case and with chunking in the pool of layout processes.
+Each case is run in a forked process, so its peak resident set size can be measured. The results can be compared
+with a stored baseline to detect regressions.
+"""
+
+import json
+import os
+import struct
+import tempfile
+import time
+import traceback
+import zipfile
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from django.conf import settings
+from django.test import override_settings
+from pypdf import PdfWriter
+from pypdf.generic import DictionaryObject, NameObject, StreamObject
+
+from control.models import validate_n_up
+from printing.processing.converter import (
+    Converter, DocConverter, ImageConverter, PdfConverter, PostScriptConverter, PwgRasterConverter,
+)
+from printing.processing.final_pages import FinalPageProcessor
+from printing.processing.imposition import get_imposition_processor
+from printing.processing.layout import LayoutChunking, LayoutEngine, shutdown_layout_pool
+from printing.processing.pages import PageOrientation, PageSize
+from printing.processing.placement import add_indirect_object
+from printing.processing.pwg import PWG_HEADER_SIZE, PWG_SYNC_WORD
+
+A4 = PageSize(width_mm=210, height_mm=297)
+DEFAULT_PAGE_COUNTS = [1, 10, 100, 1000]
+# The page sizes of the generated documents in points, used in turn, in both orientations
+CORPUS_PAGE_SIZES = [(595, 842), (842, 595), (612, 792), (420, 595), (792, 612), (298, 420)]
+IMPOSITION_TEMPLATES = ['none', 'booklet']
+# The ways of creating the layout: in a single pass, in chunks laid out by the process running the case
+# and in chunks laid out by the pool of LAYOUT_PROCESSES processes
+LAYOUT_MODES = ['single', 'chunked', 'parallel']
+
+# The maximum relative increase of each tracked metric over the baseline
+DEFAULT_THRESHOLDS = {
+    'time_s': 0.25,
+    'peak_rss_kb': 0.15,
+    'output_bytes': 0.05,
+}
+# Smaller absolute increases are not regressions, they are within the measurement noise of the small cases
+MIN_REGRESSIONS = {
+    'time_s': 0.05,
+    'peak_rss_kb': 4096,
+    'output_bytes': 1024,
+}
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def valid_n_up_values(max_n: int = 16) -> List[int]:
+    result = []
+    for n in range(1, max_n + 1):
+        try:
+            validate_n_up(n)
+        except ValueError:
+            continue
+        result.append(n)
+    return result
+
+
+def write_pdf(path: str, page_count: int, page_sizes: List[Tuple[int, int]] = None):
+    """
+    Writes a PDF document with `page_count` pages of mixed sizes and orientations, with text using a shared font.
+    The sizes are taken in turn from `page_sizes`, `CORPUS_PAGE_SIZES` by default.
+    """
+
+    page_sizes = page_sizes or CORPUS_PAGE_SIZES
+    writer = PdfWriter()
+    font = add_indirect_object(writer, DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for i in range(page_count):
+        width, height = page_sizes[i % len(page_sizes)]
+        page = writer.add_blank_page(width, height)
+        lines = ' '.join('0 -14 Td (Page {} line {}) Tj'.format(i + 1, line) for line in range(40))
+        content = StreamObject()
+        content.set_data('BT /F1 12 Tf 36 {} Td {} ET 0.5 g 20 20 {} {} re S'.format(
+            height - 36, lines, width - 40, height - 40,
+        ).encode())
+        page[NameObject('/Contents')] = add_indirect_object(writer, content.flate_encode())
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def write_png(path: str, width: int = 1600, height: int = 1200):
+    """
+    Writes an RGB PNG image with a gradient.
+    """
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    rows = b''.join(
+        b'\x00' + bytes((x * 255 // width, y * 255 // height, (x + y) % 256)[c] for x in range(width) for c in range(3))
+        for y in range(height)
+    )
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows)))
+        f.write(chunk(b'IEND', b''))
+
+
+def write_docx(path: str, page_count: int):
+    """
+    Writes an office document with `page_count` pages of text separated by page breaks.
+    """
+
+    paragraphs = []
+    for i in range(page_count):
+        paragraphs.extend('<w:p><w:r><w:t>Page {} line {}</w:t></w:r></w:p>'.format(i + 1, line) for line in range(30))
+        if i < page_count - 1:
+            paragraphs.append('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as f:
+        f.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        f.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="word/document.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+            '</Relationships>'
+        ))
+        f.writestr('word/document.xml', (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            '<w:body>{}</w:body></w:document>'
+        ).format(''.join(paragraphs)))
+
+
+def write_postscript(path: str, page_count: int):
+    """
+    Writes a PostScript document with `page_count` pages of mixed sizes and orientations.
+    """
+
+    with open(path, 'w') as f:
+        f.write('%!PS-Adobe-3.0\n/Helvetica findfont 12 scalefont setfont\n')
+        for i in range(page_count):
+            width, height = CORPUS_PAGE_SIZES[i % len(CORPUS_PAGE_SIZES)]
+            f.write('<< /PageSize [{} {}] >> setpagedevice\n'.format(width, height))
+            for line in range(40):
+                f.write('36 {} moveto (Page {} line {}) show\n'.format(height - 36 - 14 * line, i + 1, line))
+            f.write('showpage\n')
+
+
+def write_pwg_raster(path: str, page_count: int, resolution: int = 150):
+    """
+    Writes an 8-bit grayscale PWG Raster document with `page_count` A4 pages with horizontal stripes.
+    """
+
+    width = 210 * resolution * 10 // 254
+    height = 297 * resolution * 10 // 254
+    header = bytearray(PWG_HEADER_SIZE)
+    struct.pack_into('>II', header, 276, resolution, resolution)
+    struct.pack_into('>8I', header, 372, width, height, 0, 8, 8, width, 0, 18)
+    struct.pack_into('>I', header, 420, 1)
+
+    def encode_line(value: int) -> bytes:
+        # A line with a single color is encoded as runs of at most 128 pixels
+        runs = bytearray()
+        remaining = width
+        while remaining > 0:
+            run = min(remaining, 128)
+            runs += bytes((run - 1, value))
+            remaining -= run
+        return bytes(runs)
+
+    # Each stripe is 16 identical lines, encoded as a single line with a repeat count
+    stripes = b''.join(bytes((15,)) + encode_line(255 if stripe % 2 else 32) for stripe in range(height // 16))
+    with open(path, 'wb') as f:
+        f.write(PWG_SYNC_WORD)
+        for _ in range(page_count):
+            f.write(header)
+            f.write(stripes)
+            for _ in range(height % 16):
+                f.write(bytes((0,)) + encode_line(255))
+
+
+@dataclass(frozen=True)
+class CorpusDocument:
+    name: str
+    converter_class: Type[Converter]
+    path: str
+    page_count: int
+
+
+# The writers of the documents for each converter and the largest page count of its documents.
+# The slow converters are limited to keep the benchmark short, there is a single image.
+CORPUS_WRITERS = [
+    ('pdf', PdfConverter, '.pdf', write_pdf, None),
+    ('image', ImageConverter, '.png', lambda path, page_count: write_png(path), 1),
+    ('office', DocConverter, '.docx', write_docx, 100),
+    ('ps', PostScriptConverter, '.ps', write_postscript, 100),
+    ('pwg', PwgRasterConverter, '.pwg', write_pwg_raster, 100),
+]
+
+
+def create_corpus(corpus_dir: str, page_counts: List[int]) -> List[CorpusDocument]:
+    """
+    Generates the documents of the corpus for the available converters.
+    """
+
+    documents = []
+    for kind, converter_class, extension, writer, max_page_count in CORPUS_WRITERS:
+        if not converter_class.is_available():
+            continue
+        for page_count in sorted({min(count, max_page_count or count) for count in page_counts}):
+            path = os.path.join(corpus_dir, '{}-{}{}'.format(kind, page_count, extension))
+            writer(path, page_count)
+            documents.append(CorpusDocument('{}-{}'.format(kind, page_count), converter_class, path, page_count))
+    return documents
+
+
+def measure(func: Callable[[], Optional[str]]) -> dict:
+    """
+    Runs `func` in a forked process and returns its wall-clock time, the peak resident set size of the process
+    and the size of the output file, whose path is returned by `func`.
+
+    :raises BenchmarkError: If `func` raised an exception.
+    """
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            start = time.perf_counter()
+            output_file = func()
+            result = {
+                'time_s': time.perf_counter() - start,
+                'output_bytes': os.path.getsize(output_file) if output_file else 0,
+            }
+        except BaseException:
+            result = {'error': traceback.format_exc()}
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(result, f)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        data = f.read()
+    _, status, usage = os.wait4(pid, 0)
+    if not data:
+        raise BenchmarkError('The benchmark process exited with status {}'.format(status))
+    result = json.loads(data)
+    if 'error' in result:
+        raise BenchmarkError(result['error'])
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss_kb'] = usage.ru_maxrss
+    return result
+
+
+def _convert(document: CorpusDocument, work_dir: str) -> str:
+    converter = document.converter_class(work_dir)
+    preprocess_result = converter.preprocess(document.path)
+    return converter.create_input_pdf(preprocess_result, A4)
+
+
+def _get_layout_chunking(mode: str) -> Optional[LayoutChunking]:
+    """
+    Returns the chunking of the layout `mode`. The chunked modes use the chunk limits of the workers,
+    but chunk the documents of any size.
+    """
+
+    if mode == 'single':
+        return None
+    return LayoutChunking(
+        min_pages=0,
+        min_bytes=0,
+        max_media_pages=settings.LAYOUT_CHUNK_MAX_MEDIA_PAGES,
+        max_memory_bytes=settings.LAYOUT_CHUNK_MAX_MEMORY_BYTES,
+        processes=settings.LAYOUT_PROCESSES if mode == 'parallel' else 1,
+    )
+
+
+def _create_layout(input_file: str, work_dir: str, imposition_template: str, n_up: int, mode: str) -> str:
+    imposition_processor = get_imposition_processor(imposition_template, A4, work_dir)
+    final_page_processor = FinalPageProcessor(
+        work_dir, n_up, imposition_processor.get_final_page_sizes(), PageOrientation.PORTRAIT, True,
+    )
+    layout_engine = LayoutEngine(
+        work_dir, final_page_processor, imposition_processor,
+        allow_passthrough=settings.PRINT_PDF_PASSTHROUGH, chunking=_get_layout_chunking(mode),
+    )
+    try:
+        return layout_engine.create_output_pdf(input_file, '', imposition_template != 'none').output_file
+    finally:
+        # The pool is started by the case and would outlive its process
+        shutdown_layout_pool()
+
+
+def run_benchmarks(page_counts: List[int] = None, log: Callable[[str], None] = lambda message: None) -> dict:
+    """
+    Runs all benchmark cases on a generated corpus and returns the results in the format stored in the JSON file.
+
+    The peak resident set size of the `parallel` layout cases does not include the processes of the pool.
+    """
+
+    page_counts = page_counts or DEFAULT_PAGE_COUNTS
+    cases = {}
+    with tempfile.TemporaryDirectory() as tmp_dir, override_settings(CONVERSION_CACHE_DIR=None):
+        corpus_dir = os.path.join(tmp_dir, 'corpus')
+        os.mkdir(corpus_dir)
+        documents = create_corpus(corpus_dir, page_counts)
+
+        def run_case(name: str, func: Callable[[str], Optional[str]]):
+            work_dir = os.path.join(tmp_dir, name.replace('/', '_'))
+            os.mkdir(work_dir)
+            cases[name] = measure(lambda: func(work_dir))
+            log('{}: {time_s:.3f} s, {peak_rss_kb} kB peak RSS, {output_bytes} B'.format(name, **cases[name]))
+
+        for document in documents:
+            run_case('converter/{}/{}'.format(document.converter_class.__name__, document.name),
+                     lambda work_dir, document=document: _convert(document, work_dir))
+
+        layouts = [('none', n) for n in valid_n_up_values()] + [
+            (imposition_template, 1) for imposition_template in IMPOSITION_TEMPLATES if imposition_template != 'none'
+        ]
+        for document in documents:
+            if document.converter_class is not PdfConverter:
+                continue
+            for imposition_template, n_up in layouts:
+                for mode in LAYOUT_MODES:
+                    def create_layout(work_dir, document=document, imposition_template=imposition_template,
+                                      n_up=n_up, mode=mode):
+                        return _create_layout(document.path, work_dir, imposition_template, n_up, mode)
+
+                    run_case('layout/{}/n{}/{}/{}'.format(imposition_template, n_up, mode, document.name),
+                             create_layout)
+
+            # The pages matching the media are sent to the printer unchanged if PRINT_PDF_PASSTHROUGH is enabled
+            passthrough_path = os.path.join(corpus_dir, 'pdf-a4-{}.pdf'.format(document.page_count))
+            write_pdf(passthrough_path, document.page_count, [(595, 842)])
+            run_case('layout/passthrough/pdf-a4-{}'.format(document.page_count),
+                     lambda work_dir, path=passthrough_path: _create_layout(path, work_dir, 'none', 1, 'single'))
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'page_counts': page_counts,
+        'cases': cases,
+    }
+
+
+def compare_results(results: dict, baseline: dict, thresholds: Dict[str, float] = None) -> List[str]:
+    """
+    Compares the tracked metrics of the cases present in both `results` and `baseline`.
+
+    :return: The descriptions of the metrics which increased by more than their threshold.
+    """
+
+    thresholds = thresholds if thresholds is not None else DEFAULT_THRESHOLDS
+    regressions = []
+    for name, metrics in sorted(results['cases'].items()):
+        baseline_metrics = baseline['cases'].get(name)
+        if baseline_metrics is None:
+            continue
+        for metric, threshold in thresholds.items():
+            value = metrics.get(metric)
+            baseline_value = baseline_metrics.get(metric)
+            if value is None or baseline_value is None:
+                continue
+            if value > baseline_value * (1 + threshold) and value - baseline_value > MIN_REGRESSIONS.get(metric, 0):
+                regressions.append('{} {}: {:g} -> {:g} (+{:.0%}, threshold {:.0%})'.format(
+                    name, metric, baseline_value, value, value / baseline_value - 1 if baseline_value else float('inf'),
+                    threshold,
+                ))
+    return regressions
@@ -0,0 +1,227 @@
+"""
+Push-based cancellation of print jobs.
+
+The API and the IPP server publish the id of a job on a Redis channel after setting its status to `CANCELING`.
+Every worker runs a listener thread subscribed to this channel. When the canceled job is being processed
+by the worker, the listener kills the subprocesses of the job immediately,
+instead of waiting for the next database check in `printing.utils.handle_cancellation`.
+
+While the listener is connected, `handle_cancellation` only reads the job status from the database
+when a notification has been received or every `JOB_CANCELLATION_RECHECK_S` seconds, in case a notification
+has been lost (e.g. the publisher failed to reach Redis). If Redis is not configured (`JOB_CANCELLATION_REDIS_URL = None`) or the connection is lost,
+the status is polled from the database as before.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Set
+
+import redis
+from django.conf import settings
+
+from control.models import GutenbergJob
+
+logger = logging.getLogger('gutenberg.worker')
+
+CHANNEL = 'gutenberg:job-cancellation'
+RECONNECT_DELAY_S = 5
+
+
+class CancellationToken:
+    """
+    The cancellation state of a job processed by the current thread.
+    """
+
+    def __init__(self, job: GutenbergJob):
+        self.job = job
+        self.event = threading.Event()
+        # The listener generation in which the job status has been read from the database.
+        # Notifications published while the listener was disconnected are lost,
+        # so the status must be checked again after every reconnection.
+        self.checked_generation: Optional[int] = None
+        # The `time.monotonic()` of the last database check
+        self.checked_at: Optional[float] = None
+        self._handlers = []
+        self._lock = threading.Lock()
+
+    def is_canceled(self) -> bool:
+        return self.event.is_set()
+
+    def add_handler(self, handler: Callable[[], None]):
+        with self._lock:
+            self._handlers.append(handler)
+
+    def remove_handler(self, handler: Callable[[], None]):
+        with self._lock:
+            self._handlers.remove(handler)
+
+    def cancel(self):
+        self.event.set()
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            try:
+                handler()
+            except Exception:
+                logger.exception("Cancellation handler of job {} failed".format(self.job.id))
+
+
+class CancellationListener(threading.Thread):
+    def __init__(self, redis_url: str):
+        super().__init__(name='gutenberg-cancellation-listener', daemon=True)
+        self.redis_url = redis_url
+        self.pid = os.getpid()
+        self.connected = False
+        self.generation = 0
+        self._tokens: Dict[int, Set[CancellationToken]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, token: CancellationToken):
+        with self._lock:
+            self._tokens.setdefault(token.job.id, set()).add(token)
+
+    def remove(self, token: CancellationToken):
+        with self._lock:
+            tokens = self._tokens.get(token.job.id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens[token.job.id]
+
+    def _dispatch(self, job_id: int):
+        with self._lock:
+            tokens = list(self._tokens.get(job_id, ()))
+        for token in tokens:
+            logger.info("Received cancellation of job {}".format(job_id))
+            token.cancel()
+
+    def run(self):
+        while True:
+            try:
+                pubsub = redis.Redis.from_url(self.redis_url).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                self.generation += 1
+                self.connected = True
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._dispatch(int(message['data']))
+            except (redis.RedisError, ValueError):
+                if self.connected:
+                    logger.exception("Job cancellation listener disconnected, falling back to database polling")
+            self.connected = False
+            time.sleep(RECONNECT_DELAY_S)
+
+
+_listener: Optional[CancellationListener] = None
+_listener_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_listener() -> Optional[CancellationListener]:
+    global _listener
+    if not settings.JOB_CANCELLATION_REDIS_URL:
+        return None
+    with _listener_lock:
+        # The listener thread is not inherited by forked processes (e.g. the prefork worker pool)
+        if _listener is None or _listener.pid != os.getpid():
+            _listener = CancellationListener(settings.JOB_CANCELLATION_REDIS_URL)
+            _listener.start()
+        return _listener
+
+
+def get_current_token() -> Optional[CancellationToken]:
+    return getattr(_local, 'token', None)
+
+
+@contextmanager
+def watch_cancellation(job: GutenbergJob):
+    """
+    Marks `job` as processed by the current thread until the end of the `with` block,
+    so that cancellation notifications for the job are delivered to it.
+    """
+
+    token = CancellationToken(job)
+    listener = _get_listener()
+    if listener is not None:
+        listener.add(token)
+    previous_token = get_current_token()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous_token
+        if listener is not None:
+            listener.remove(token)
+
+
+@contextmanager
+def on_cancel(handler: Callable[[], None]):
+    """
+    Calls `handler` from the listener thread if the job processed by the current thread is canceled
+    during the `with` block. Used to kill the subprocesses of the job.
+    """
+
+    token = get_current_token()
+    if token is None:
+        yield
+        return
+    token.add_handler(handler)
+    try:
+        yield
+    finally:
+        token.remove_handler(handler)
+
+
+def is_status_check_needed(job: GutenbergJob) -> bool:
+    """
+    Returns `False` if a cancellation of `job` would have been delivered to the current thread
+    by the listener, so the status does not have to be read from the database.
+    """
+
+    token = get_current_token()
+    if token is None or token.job.id != job.id or token.is_canceled():
+        return True
+    listener = _listener
+    if listener is None or listener.pid != os.getpid() or not listener.connected:
+        return True
+    if token.checked_at is None or time.monotonic() - token.checked_at >= settings.JOB_CANCELLATION_RECHECK_S:
+        return True
+    return token.checked_generation != listener.generation
+
+
+def mark_status_checked(job: GutenbergJob, generation: Optional[int]):
+    token = get_current_token()
+    if token is not None and token.job.id == job.id:
+        token.checked_generation = generation
+        token.checked_at = time.monotonic()
+
+
+def get_listener_generation() -> Optional[int]:
+    listener = _listener
+    if listener is None or not listener.connected:
+        return None
+    return listener.generation
+
+
+@functools.cache
+def _get_publisher(redis_url: str) -> redis.Redis:
+    return redis.Redis.from_url(redis_url, socket_timeout=1, socket_connect_timeout=1)
+
+
+def notify_job_canceled(job_id: int):
+    """
+    Notifies the workers that the status of the job has been set to `CANCELING`.
+
+    Delivery is not guaranteed, the workers also check the status in the database.
+    """
+
+    if not settings.JOB_CANCELLATION_REDIS_URL:
+        return
+    try:
+        _get_publisher(settings.JOB_CANCELLATION_REDIS_URL).publish(CHANNEL, str(job_id))
+    except redis.RedisError:
+        logger.exception("Failed to publish the cancellation of job {}".format(job_id))
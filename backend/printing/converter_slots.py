@@ -0,0 +1,73 @@
+"""
+Limits of the number of documents converted at the same time on a single host by each converter.
+
+The limits are shared by all worker processes and threads on the host. Each converter has a directory
+with one lock file per slot, and a slot is held by locking its file with `flock`. The locks are released
+by the operating system when the worker process exits, so a crashed worker never leaks its slots.
+"""
+
+import fcntl
+import logging
+import os
+from contextlib import contextmanager, ExitStack
+from typing import Iterable, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger('gutenberg.worker')
+
+
+class ConverterSlotsUnavailableError(Exception):
+    def __init__(self, queue: str):
+        super().__init__('All slots of {} are in use'.format(queue))
+        self.queue = queue
+
+
+class HostSemaphore:
+    """
+    A counting semaphore shared by the processes on a host, which is only acquired without blocking.
+    """
+
+    def __init__(self, name: str, limit: int, lock_dir: str):
+        self.name = name
+        self.limit = limit
+        self.lock_dir = lock_dir
+
+    def try_acquire(self) -> Optional[int]:
+        """
+        Returns the file descriptor of the locked slot, which should be closed to release the slot,
+        or `None` if all slots are in use.
+        """
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        for slot in range(self.limit):
+            fd = os.open(os.path.join(self.lock_dir, '{}.{}.lock'.format(self.name, slot)), os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+
+@contextmanager
+def converter_slots(queues: Iterable[str]):
+    """
+    Holds a slot of each of the converter queues (see `get_converter_queue`) while the context is active.
+
+    :raises ConverterSlotsUnavailableError: If any of the converters is already used by
+        `CONVERTER_CONCURRENCY_LIMITS` documents on this host. No slots are held then.
+    """
+
+    with ExitStack() as stack:
+        # The slots are always acquired in the same order
+        for queue in sorted(set(queues)):
+            limit = settings.CONVERTER_CONCURRENCY_LIMITS.get(queue)
+            if limit is None:
+                continue
+            fd = HostSemaphore(queue, limit, settings.CONVERTER_SLOTS_DIR).try_acquire()
+            if fd is None:
+                raise ConverterSlotsUnavailableError(queue)
+            stack.callback(os.close, fd)
+        yield
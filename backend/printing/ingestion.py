@@ -0,0 +1,250 @@
+"""
+Ingestion of the documents uploaded by the users.
+
+The documents sent with IPP and uploaded with the REST API are written directly to their final location
+in the media storage, where they are stored as `JobArtefact` files. The SHA-256 hash, the size and the format
+of a document are determined while it is being written, so every uploaded byte is written once
+and the file is not read again after the upload.
+
+The page tree of PDF documents is indexed when they are stored (see `printing.processing.pdf_index`),
+so the page count and the orientation are known without parsing the document again.
+"""
+
+import hashlib
+import io
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from control.models import JobArtefact, JobArtefactType, GutenbergJob
+from printing.processing.converter import detect_buffer_format
+from printing.processing.pages import PageOrientation
+from printing.processing.pdf_index import PdfIndex, PdfIndexError, index_pdf
+
+logger = logging.getLogger('gutenberg.worker')
+
+CHUNK_SIZE = 64 * 1024
+# The number of bytes used to detect the document format, the default buffer size of libmagic
+SNIFF_BYTES = 1024 * 1024
+
+
+class DocumentTooLargeError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class IngestedDocument:
+    # The name of the file in the storage of `JobArtefact.file`
+    name: str
+    size: int
+    sha256: str
+    mime_type: str
+
+
+def _get_storage():
+    return JobArtefact._meta.get_field('file').storage
+
+
+class DocumentWriter:
+    """
+    Writes a document to a new file in the storage of `JobArtefact.file`.
+    """
+
+    def __init__(self, file_name: str):
+        field = JobArtefact._meta.get_field('file')
+        self.storage = field.storage
+        self.name, self._file = self._create_file(field.generate_filename(None, file_name or 'document'))
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._head = bytearray()
+
+    def _create_file(self, name: str):
+        while True:
+            name = self.storage.get_available_name(name)
+            path = self.storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                # The file may have been created by another request after `get_available_name`
+                file = open(path, 'xb')
+            except FileExistsError:
+                continue
+            if self.storage.file_permissions_mode is not None:
+                os.chmod(path, self.storage.file_permissions_mode)
+            return name, file
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > settings.MAX_DOCUMENT_SIZE_BYTES:
+            raise DocumentTooLargeError(
+                'The document is larger than {} bytes'.format(settings.MAX_DOCUMENT_SIZE_BYTES))
+        self._hash.update(data)
+        if len(self._head) < SNIFF_BYTES:
+            self._head += data[:SNIFF_BYTES - len(self._head)]
+        self._file.write(data)
+
+    def finish(self) -> IngestedDocument:
+        self._file.close()
+        return IngestedDocument(
+            name=self.name,
+            size=self.size,
+            sha256=self._hash.hexdigest(),
+            mime_type=detect_buffer_format(bytes(self._head)),
+        )
+
+    def abort(self):
+        self._file.close()
+        self.storage.delete(self.name)
+
+
+def ingest_stream(readable, file_name: str = 'document') -> IngestedDocument:
+    """
+    Writes the contents of `readable` to the storage. Raises `DocumentTooLargeError`
+    if it is larger than `MAX_DOCUMENT_SIZE_BYTES`, nothing is stored then.
+    """
+
+    writer = DocumentWriter(file_name)
+    try:
+        while chunk := readable.read(CHUNK_SIZE):
+            writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.finish()
+
+
+def create_source_artefact(job: GutenbergJob, document: IngestedDocument, **kwargs) -> JobArtefact:
+    """
+    Creates a SOURCE artefact of `job` from an ingested document, without copying the file.
+    """
+
+    artefact = JobArtefact(job=job, artefact_type=JobArtefactType.SOURCE, sha256=document.sha256, **kwargs)
+    artefact.file.name = document.name
+    if document.mime_type == 'application/pdf':
+        _set_pdf_index(artefact)
+    artefact.save()
+    return artefact
+
+
+def _set_pdf_index(artefact: JobArtefact):
+    try:
+        index = index_pdf(artefact.file.path)
+    except PdfIndexError:
+        # The document is indexed on a best-effort basis, the errors are reported when it is processed
+        logger.warning("Failed to index {}".format(artefact.file.name), exc_info=True)
+        return
+    artefact.page_count = index.page_count
+    artefact.page_sizes = index.page_sizes
+    artefact.page_orientation = index.orientation.value if index.page_count is not None else ''
+    artefact.encrypted = index.encrypted
+
+
+def index_artefact(artefact: JobArtefact):
+    """
+    Indexes an artefact created without `create_source_artefact` if it is a PDF document.
+    The artefact is not saved.
+    """
+
+    if artefact.mime_type == 'application/pdf':
+        _set_pdf_index(artefact)
+
+
+def get_pdf_index(artefact: JobArtefact) -> Optional[PdfIndex]:
+    """
+    Returns the PDF index stored on `artefact` or `None` if the page tree of the document has not been read.
+    """
+
+    if artefact.page_count is None:
+        return None
+    return PdfIndex(
+        page_count=artefact.page_count,
+        page_sizes=artefact.page_sizes or {},
+        orientation=PageOrientation(artefact.page_orientation),
+        encrypted=artefact.encrypted,
+    )
+
+
+class IngestedUploadedFile(UploadedFile):
+    """
+    A file uploaded with `DocumentUploadHandler`.
+
+    The file is deleted from the storage when the request finishes, unless it has been claimed
+    by `claim`, e.g. to create an artefact with `create_source_artefact`.
+    Otherwise it can be used like any other uploaded file.
+    """
+
+    def __init__(self, document: IngestedDocument, name, content_type, charset, content_type_extra):
+        file = _get_storage().open(document.name, 'rb')
+        super().__init__(file, name, content_type, document.size, charset, content_type_extra)
+        self.document = document
+        self.claimed = False
+
+    def claim(self) -> IngestedDocument:
+        self.claimed = True
+        return self.document
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if not self.claimed:
+                _get_storage().delete(self.document.name)
+
+
+class RejectedUploadedFile(UploadedFile):
+    """
+    A file rejected by `DocumentUploadHandler`, its contents have not been stored.
+    """
+
+    def __init__(self, error: str, name, content_type, size, charset, content_type_extra):
+        super().__init__(io.BytesIO(), name, content_type, size, charset, content_type_extra)
+        self.error = error
+
+
+class DocumentUploadHandler(FileUploadHandler):
+    """
+    An upload handler which writes the uploaded files with `DocumentWriter`
+    instead of a temporary file, see `FILE_UPLOAD_HANDLERS`.
+
+    The files larger than `MAX_DOCUMENT_SIZE_BYTES` are returned as `RejectedUploadedFile`,
+    as exceptions raised while the request body is parsed cannot be handled by the views.
+    """
+
+    writer = None
+    error = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.writer = DocumentWriter(os.path.basename(self.file_name))
+        self.error = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return None
+        try:
+            self.writer.write(raw_data)
+        except DocumentTooLargeError as ex:
+            self.upload_interrupted()
+            self.error = str(ex)
+        except BaseException:
+            self.upload_interrupted()
+            raise
+        return None
+
+    def file_complete(self, file_size):
+        if self.error is not None:
+            return RejectedUploadedFile(
+                self.error, self.file_name, self.content_type, file_size, self.charset, self.content_type_extra,
+            )
+        document = self.writer.finish()
+        self.writer = None
+        return IngestedUploadedFile(document, self.file_name, self.content_type, self.charset, self.content_type_extra)
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+from printing.benchmarks import DEFAULT_PAGE_COUNTS, DEFAULT_THRESHOLDS, compare_results, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the document processing on a generated corpus "
+            "and compares the results with a baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, nargs='+', default=DEFAULT_PAGE_COUNTS,
+                            help="The page counts of the generated documents.")
+        parser.add_argument('--output', help="The JSON file to write the results to.")
+        parser.add_argument('--baseline', help="The JSON file with the results to compare with.")
+        parser.add_argument('--update-baseline', action='store_true',
+                            help="Write the results to the baseline file instead of comparing them.")
+        parser.add_argument('--threshold', action='append', default=[], metavar='METRIC=RATIO',
+                            help="The maximum relative increase of a metric, e.g. time_s=0.5.")
+
+    def handle(self, *args, **options):
+        thresholds = dict(DEFAULT_THRESHOLDS)
+        for threshold in options['threshold']:
+            metric, _, ratio = threshold.partition('=')
+            if metric not in DEFAULT_THRESHOLDS:
+                raise CommandError(f"Unknown metric: {metric}")
+            try:
+                thresholds[metric] = float(ratio)
+            except ValueError:
+                raise CommandError(f"Invalid threshold: {threshold}")
+        if options['update_baseline'] and not options['baseline']:
+            raise CommandError("--update-baseline requires --baseline")
+
+        results = run_benchmarks(options['pages'], log=self.stdout.write)
+
+        if options['output']:
+            self._write_results(options['output'], results)
+        if not options['baseline']:
+            return
+        if options['update_baseline']:
+            self._write_results(options['baseline'], results)
+            self.stdout.write(self.style.SUCCESS(f"Updated the baseline {options['baseline']}"))
+            return
+
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, thresholds)
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f"{len(regressions)} regressions compared to {options['baseline']}")
+        self.stdout.write(self.style.SUCCESS(f"No regressions compared to {options['baseline']}"))
+
+    @staticmethod
+    def _write_results(path: str, results: dict):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
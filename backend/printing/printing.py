@@ -3,22 +3,30 @@ import logging
 import os
 import shutil
 import tempfile
-from typing import Optional
+from collections import defaultdict
+from typing import Optional, List, Tuple
 
-from celery import shared_task
+from celery import shared_task, chord
 from django.conf import settings
 from django.core.files import File
+from django.db.models import Exists, OuterRef
 from django.db.models.functions import Greatest, Coalesce
 from django.utils import timezone
 
-from control.models import GutenbergJob, TwoSidedPrinting, JobStatus, PrinterType, Printer, PrintingProperties, \
-    JobArtefact, JobArtefactType, OrientationRequested
-from printing.backends import DisabledPrinter, LocalCupsPrinter
-from printing.processing.converter import detect_file_format, get_converter
-from printing.processing.final_pages import FinalPageProcessor, NoPagesToPrintException
-from printing.processing.imposition import get_imposition_processor
+from control.models import GutenbergJob, TwoSidedPrinting, JobStatus, Printer, PrintingProperties, \
+    JobArtefact, JobArtefactType, OrientationRequested, JobStage, BackendPrintJob
+from printing.backends import get_printer_backend, PrinterBackend
+from printing.ingestion import ingest_stream, create_source_artefact, get_pdf_index, DocumentTooLargeError
+from printing.processing.converter import get_converter, get_converter_queue, is_preconvertible
+from printing.processing.final_pages import FinalPageProcessor, NoPagesToPrintException, count_pages_to_print
+from printing.processing.imposition import get_imposition_processor, ImpositionResult
+from printing.processing.layout import LayoutChunking, LayoutEngine
 from printing.processing.pages import PageSize, PageOrientation
-from printing.utils import JobCanceledException, TASK_TIMEOUT_S, DEFAULT_IPP_FORMAT, \
+from printing.processing.sandbox import sandbox_session
+from printing.cancellation import watch_cancellation
+from printing.converter_slots import converter_slots, ConverterSlotsUnavailableError
+from printing.stage_timing import StageTimer
+from printing.utils import JobCanceledException, TASK_TIMEOUT_S, PRINTING_TIMEOUT_S, DEFAULT_IPP_FORMAT, \
     AUTODETECT_IPP_FORMAT, SUPPORTED_IPP_FORMATS, DocumentFormatError, handle_cancellation
 
 logger = logging.getLogger('gutenberg.worker')
@@ -47,19 +55,20 @@ def submit_print_job(document_buffer,
                      document_type: Optional[str] = None):
     job = GutenbergJob.objects.filter(id=job_id).first()
 
-    with tempfile.TemporaryFile() as tmp:
-        while True:
-            chunk = document_buffer.read(100000)
-            if not chunk:
-                break
-            tmp.write(chunk)
-        artefact = JobArtefact.objects.create(job=job, artefact_type=JobArtefactType.SOURCE, file=File(tmp))
+    try:
+        document = ingest_stream(document_buffer)
+    except DocumentTooLargeError as ex:
+        job.status = JobStatus.ERROR
+        job.status_reason = str(ex)
+        job.save()
+        raise
+    artefact = create_source_artefact(job, document)
 
     file_format = document_type
     if not file_format:
         file_format = DEFAULT_IPP_FORMAT
     if file_format == AUTODETECT_IPP_FORMAT:
-        file_format = detect_file_format(artefact.file.path)
+        file_format = document.mime_type
     if file_format not in SUPPORTED_IPP_FORMATS:
         artefact.delete()
         job.status = JobStatus.ERROR
@@ -71,7 +80,7 @@ def submit_print_job(document_buffer,
 
     job.status = JobStatus.PENDING
     job.save()
-    print_file.delay(job_id)
+    enqueue_print_file(job)
     return job_id
 
 
@@ -82,89 +91,456 @@ def _no_pages_cancel(job):
     raise JobCanceledException()
 
 
+def _process_artefact(job: GutenbergJob, artefact: JobArtefact, artefact_tmpdir: str) -> ImpositionResult:
+    """
+    Runs all processing steps for a single SOURCE artefact of `job` in `artefact_tmpdir`
+    and returns the result of the imposition step.
+
+    The sandboxed commands of all steps are run in a single sandbox session of `artefact_tmpdir`.
+    """
+
+    with sandbox_session(artefact_tmpdir):
+        return _run_processing_steps(job, artefact, artefact_tmpdir)
+
+
+def _copy_source(artefact: JobArtefact, artefact_tmpdir: str) -> str:
+    """
+    Copies the document of a SOURCE artefact to `artefact_tmpdir` and returns the path of the copy.
+    """
+
+    file_path = artefact.file.path
+    ext = os.path.splitext(file_path)[1].lower()
+    if not ext:
+        ext = '.bin'
+    tmp_input = os.path.join(artefact_tmpdir, 'input' + ext)
+    shutil.copyfile(file_path, tmp_input)
+    return tmp_input
+
+
+def _run_processing_steps(job: GutenbergJob, artefact: JobArtefact, artefact_tmpdir: str) -> ImpositionResult:
+    tmp_input = _copy_source(artefact, artefact_tmpdir)
+
+    timer = StageTimer(job, artefact.document_number)
+    conv = get_converter(artefact.mime_type, artefact_tmpdir)
+    if artefact.sha256:
+        conv.set_source_hash(tmp_input, artefact.sha256)
+    pdf_index = get_pdf_index(artefact)
+    if pdf_index is not None:
+        # The documents without any pages to print are not converted at all
+        if count_pages_to_print(job.properties.pages_to_print, pdf_index.page_count) == 0:
+            _no_pages_cancel(job)
+        conv.set_source_index(tmp_input, pdf_index)
+    with timer.measure(JobStage.PREPROCESS, tmp_input) as measurement:
+        preprocess_result = conv.preprocess(tmp_input)
+        measurement.output_file = preprocess_result.preprocess_result_path
+    handle_cancellation(job)
+
+    # TODO: Use proper source for media size
+    media_size = PageSize(width_mm=210, height_mm=297)
+    imposition_processor = get_imposition_processor(job.properties.imposition_template, media_size, artefact_tmpdir)
+    input_page_orientation = {
+        OrientationRequested.AUTO: preprocess_result.orientation,
+        OrientationRequested.LANDSCAPE: PageOrientation.LANDSCAPE,
+        OrientationRequested.PORTRAIT: PageOrientation.PORTRAIT,
+    }[job.properties.orientation_requested]
+    final_page_processor = FinalPageProcessor(
+        artefact_tmpdir,
+        job.properties.n_up,
+        imposition_processor.get_final_page_sizes(),
+        input_page_orientation,
+        job.properties.fit_to_page,
+    )
+
+    with timer.measure(JobStage.INPUT_PDF, preprocess_result.preprocess_result_path) as measurement:
+        input_pages_file = conv.create_input_pdf(preprocess_result, final_page_processor.input_page_size)
+        measurement.output_file = input_pages_file
+    handle_cancellation(job)
+
+    chunking = LayoutChunking(
+        min_pages=settings.LAYOUT_CHUNKING_MIN_PAGES,
+        min_bytes=settings.LAYOUT_CHUNKING_MIN_BYTES,
+        max_media_pages=settings.LAYOUT_CHUNK_MAX_MEDIA_PAGES,
+        max_memory_bytes=settings.LAYOUT_CHUNK_MAX_MEMORY_BYTES,
+        processes=settings.LAYOUT_PROCESSES,
+    )
+    layout_engine = LayoutEngine(
+        artefact_tmpdir, final_page_processor, imposition_processor,
+        allow_passthrough=settings.PRINT_PDF_PASSTHROUGH, chunking=chunking,
+    )
+    try:
+        with timer.measure(JobStage.LAYOUT, input_pages_file) as measurement:
+            imposition_result = layout_engine.create_output_pdf(
+                input_pages_file,
+                job.properties.pages_to_print,
+                job.properties.two_sides != TwoSidedPrinting.ONE_SIDED,
+            )
+            measurement.output_file = imposition_result.output_file
+            measurement.pages = imposition_result.media_sheet_page_count
+            if imposition_result.passthrough:
+                measurement.stage = JobStage.PASSTHROUGH
+    except NoPagesToPrintException:
+        _no_pages_cancel(job)
+    handle_cancellation(job)
+    return imposition_result
+
+
+def _fail_job(job: GutenbergJob, ex: Exception):
+    job.status = JobStatus.ERROR
+    job.status_reason = repr(ex)
+    if hasattr(ex, 'output') and isinstance(ex.output, bytes):
+        job.status_reason += '\nOutput:\n' + ex.output.decode('utf-8', errors='ignore')
+    job.save()
+
+
+def _print_output_files(job: GutenbergJob, output_files: List[Tuple[int, str]], sum_num_pages: int):
+    """
+    Submits the output files to the printer. `output_files` contains pairs of the document number and the file path.
+
+    The job is set to `PRINTING` once all files are submitted. It is then followed by `monitor_print_jobs`,
+    so the worker does not wait for the printer.
+    """
+
+    # The notification of a cancellation may have been lost, so the status is read from the database
+    # before anything is written or sent to the printer
+    handle_cancellation(job, check_database=True)
+    job.status_reason = ''
+    job.date_processed = timezone.now()
+    job.pages = sum_num_pages * job.properties.copies
+    # The status is not saved, it could overwrite a cancellation requested in the meantime
+    job.save(update_fields=['status_reason', 'date_processed', 'pages'])
+    backend = get_printer_backend(job.printer)
+    for document_number, out in output_files:
+        # The documents which have already been submitted are canceled by `monitor_print_jobs`
+        handle_cancellation(job)
+        backend.spool(job, out, StageTimer(job, document_number))
+    GutenbergJob.objects.filter(id=job.id, status=JobStatus.PROCESSING).update(status=JobStatus.PRINTING)
+
+
+def _get_source_artefacts(job: GutenbergJob):
+    return job.artefacts.filter(artefact_type=JobArtefactType.SOURCE).order_by('document_number')
+
+
+def _get_converter_queues(job: GutenbergJob) -> List[str]:
+    mime_types = _get_source_artefacts(job).values_list('mime_type', flat=True)
+    return sorted({queue for queue in map(get_converter_queue, mime_types) if queue is not None})
+
+
+def _get_print_file_queue(job: GutenbergJob, parallel: bool) -> Optional[str]:
+    """
+    Returns the queue of the converter needed by the documents of `job` or `None` to use the default queue.
+    """
+
+    if not settings.PRINT_CONVERTER_QUEUES:
+        return None
+    queues = _get_converter_queues(job)
+    if not queues:
+        return None
+    if parallel and len(queues) > 1:
+        # `print_file` only starts the `process_artefact` tasks, which are sent to the queues of the documents
+        return None
+    # Any worker able to run the most limited converter is most likely able to run the others
+    return min(queues, key=lambda queue: settings.CONVERTER_CONCURRENCY_LIMITS.get(queue, float('inf')))
+
+
+def _is_processed_in_parallel(job: GutenbergJob) -> bool:
+    return settings.PRINT_PARALLEL_DOCUMENT_PROCESSING and _get_source_artefacts(job).count() > 1
+
+
+def enqueue_print_file(job: GutenbergJob):
+    """
+    Sends the `print_file` task of `job` to the queue of the converter it needs, see `PRINT_CONVERTER_QUEUES`.
+    """
+
+    print_file.apply_async((job.id,), queue=_get_print_file_queue(job, _is_processed_in_parallel(job)))
+
+
+def enqueue_preconversion(artefact: JobArtefact):
+    """
+    Sends the `preconvert_artefact` task of an uploaded document if its conversion can be done before
+    the job is submitted, see `PRECONVERT_UPLOADED_DOCUMENTS`.
+    """
+
+    if not settings.PRECONVERT_UPLOADED_DOCUMENTS or not is_preconvertible(artefact.mime_type):
+        return
+    queue = get_converter_queue(artefact.mime_type) if settings.PRINT_CONVERTER_QUEUES else None
+    preconvert_artefact.apply_async((artefact.id,), queue=queue, priority=settings.PRECONVERSION_TASK_PRIORITY)
+
+
 @shared_task
-def print_file(job_id):
+def preconvert_artefact(artefact_id):
+    """
+    Converts an uploaded document of a job which has not been submitted yet and stores the result
+    in the conversion cache, so `print_file` only needs to lay it out and spool it.
+
+    The conversion is skipped if the job has already been submitted or the converter is busy,
+    in which case the document is converted by `print_file`. Errors are left to be reported by `print_file`.
+    """
+
+    artefact = JobArtefact.objects.filter(id=artefact_id, artefact_type=JobArtefactType.SOURCE) \
+        .select_related('job').first()
+    if not artefact or artefact.job.status != JobStatus.INCOMING:
+        return
+    queue = get_converter_queue(artefact.mime_type)
+    try:
+        with converter_slots([queue] if queue else []), tempfile.TemporaryDirectory() as artefact_tmpdir, \
+                sandbox_session(artefact_tmpdir):
+            tmp_input = _copy_source(artefact, artefact_tmpdir)
+            conv = get_converter(artefact.mime_type, artefact_tmpdir)
+            if artefact.sha256:
+                conv.set_source_hash(tmp_input, artefact.sha256)
+            conv.preconvert(tmp_input)
+        logger.info("Preconverted document {} of job {}".format(artefact.document_number, artefact.job))
+    except ConverterSlotsUnavailableError as ex:
+        logger.info("Skipping preconversion of document {} of job {}: {}".format(
+            artefact.document_number, artefact.job, ex))
+    except Exception:
+        logger.exception("Failed to preconvert document {} of job {}".format(artefact.document_number, artefact.job))
+
+
+def _retry_without_slots(task, job: GutenbergJob, ex: ConverterSlotsUnavailableError):
+    """
+    Retries `task` later, unless the job has been finished in the meantime (e.g. canceled by the user
+    or marked as expired by `cleanup_print_jobs`) or has been waiting for longer than `CONVERTER_SLOT_MAX_WAIT_S`.
+    """
+
+    try:
+        handle_cancellation(job, check_database=True)
+    except JobCanceledException:
+        return
+    if job.status in GutenbergJob.COMPLETED_STATUSES:
+        logger.info("Not retrying job {} with status {}".format(job, job.status))
+        return
+    if task.request.retries >= settings.CONVERTER_SLOT_MAX_WAIT_S // settings.CONVERTER_SLOT_RETRY_S:
+        _fail_job(job, ex)
+        raise ex
+    logger.info("Delaying job {}: {}".format(job, ex))
+    raise task.retry(countdown=settings.CONVERTER_SLOT_RETRY_S, max_retries=None)
+
+
+@shared_task(bind=True)
+def print_file(self, job_id):
     job = GutenbergJob.objects.filter(id=job_id).first()
     if not job:
         logger.warning("Job id {} missing.".format(job_id))
         return
-    logger.info("Processing job {}".format(job))
-    handle_cancellation(job)
-    job.status = JobStatus.PROCESSING
-    job.status_reason = ''
-    job.save()
-    try:
-        with (tempfile.TemporaryDirectory() as job_tmpdir):
-            sum_num_pages = 0
-            for idx, artefact in enumerate(job.artefacts.filter(artefact_type=JobArtefactType.SOURCE).order_by('document_number')):
-                with tempfile.TemporaryDirectory() as artefact_tmpdir:
-                    file_path = artefact.file.path
-                    file_format = artefact.mime_type
-                    ext = os.path.splitext(file_path)[1].lower()
-                    if not ext:
-                        ext = '.bin'
-                    tmp_input = os.path.join(artefact_tmpdir, 'input' + ext)
-                    shutil.copyfile(file_path, tmp_input)
-
-                    conv = get_converter(file_format, artefact_tmpdir)
-                    preprocess_result = conv.preprocess(tmp_input)
-                    handle_cancellation(job)
-
-                    # TODO: Use proper source for media size
-                    media_size = PageSize(width_mm=210, height_mm=297)
-                    imposition_processor = get_imposition_processor(job.properties.imposition_template, media_size, artefact_tmpdir)
-                    input_page_orientation = {
-                        OrientationRequested.AUTO: preprocess_result.orientation,
-                        OrientationRequested.LANDSCAPE: PageOrientation.LANDSCAPE,
-                        OrientationRequested.PORTRAIT: PageOrientation.PORTRAIT,
-                    }[job.properties.orientation_requested]
-                    final_page_processor = FinalPageProcessor(
-                        artefact_tmpdir,
-                        job.properties.n_up,
-                        imposition_processor.get_final_page_sizes(),
-                        input_page_orientation,
-                        job.properties.fit_to_page,
+    with watch_cancellation(job):
+        logger.info("Processing job {}".format(job))
+        handle_cancellation(job)
+        if job.completed:
+            # The job has expired while the task was waiting for a retry, see `_retry_without_slots`
+            logger.info("Job {} has already finished with status {}".format(job, job.status))
+            return
+        job.status = JobStatus.PROCESSING
+        job.status_reason = ''
+        job.save()
+
+        artefact_ids = list(_get_source_artefacts(job).values_list('id', flat=True))
+        if settings.PRINT_PARALLEL_DOCUMENT_PROCESSING and len(artefact_ids) > 1:
+            # Each document is processed by a separate task, possibly on a different worker.
+            # The outputs are stored as FINAL artefacts and spooled by the chord callback.
+            logger.info("Processing {} documents of job {} in parallel".format(len(artefact_ids), job))
+            callback = spool_processed_artefacts.s(job_id).on_error(discard_processed_artefacts.si(job_id))
+            chord(
+                process_artefact.s(job_id, artefact_id).set(queue=queue)
+                for artefact_id, queue in _get_process_artefact_queues(job, artefact_ids)
+            )(callback)
+            return
+
+        try:
+            with converter_slots(_get_converter_queues(job)), tempfile.TemporaryDirectory() as job_tmpdir:
+                sum_num_pages = 0
+                output_files = []
+                for idx, artefact in enumerate(_get_source_artefacts(job)):
+                    with tempfile.TemporaryDirectory() as artefact_tmpdir:
+                        imposition_result = _process_artefact(job, artefact, artefact_tmpdir)
+                        output_file = os.path.join(job_tmpdir, f'{idx:03}_output.pdf')
+                        shutil.copyfile(imposition_result.output_file, output_file)
+                        output_files.append((artefact.document_number, output_file))
+                        sum_num_pages += imposition_result.media_sheet_page_count
+                _print_output_files(job, output_files, sum_num_pages)
+        except ConverterSlotsUnavailableError as ex:
+            _retry_without_slots(self, job, ex)
+        except JobCanceledException:
+            # Canceling job
+            pass
+        except Exception as ex:
+            _fail_job(job, ex)
+            raise ex
+
+
+def _get_process_artefact_queues(job: GutenbergJob, artefact_ids: List[int]) -> List[Tuple[int, Optional[str]]]:
+    if not settings.PRINT_CONVERTER_QUEUES:
+        return [(artefact_id, None) for artefact_id in artefact_ids]
+    mime_types = dict(_get_source_artefacts(job).values_list('id', 'mime_type'))
+    return [(artefact_id, get_converter_queue(mime_types[artefact_id])) for artefact_id in artefact_ids]
+
+
+@shared_task(bind=True)
+def process_artefact(self, job_id, artefact_id) -> Optional[int]:
+    """
+    Processes a single SOURCE artefact of a job and stores the result as a FINAL artefact
+    with the same `document_number`.
+
+    Used by `print_file` when `PRINT_PARALLEL_DOCUMENT_PROCESSING` is enabled.
+
+    :return: The number of Media Sheet pages in the output or `None` if the job has been canceled.
+    """
+
+    job = GutenbergJob.objects.filter(id=job_id).first()
+    if not job:
+        logger.warning("Job id {} missing.".format(job_id))
+        return None
+    with watch_cancellation(job):
+        artefact = JobArtefact.objects.get(id=artefact_id, job=job, artefact_type=JobArtefactType.SOURCE)
+        logger.info("Processing document {} of job {}".format(artefact.document_number, job))
+        try:
+            handle_cancellation(job)
+            queue = get_converter_queue(artefact.mime_type)
+            with converter_slots([queue] if queue else []), tempfile.TemporaryDirectory() as artefact_tmpdir:
+                imposition_result = _process_artefact(job, artefact, artefact_tmpdir)
+                with open(imposition_result.output_file, 'rb') as output_file:
+                    JobArtefact.objects.create(
+                        job=job,
+                        artefact_type=JobArtefactType.FINAL,
+                        mime_type='application/pdf',
+                        document_number=artefact.document_number,
+                        file=File(output_file, name='output.pdf'),
                     )
+            return imposition_result.media_sheet_page_count
+        except ConverterSlotsUnavailableError as ex:
+            _retry_without_slots(self, job, ex)
+        except JobCanceledException:
+            return None
+        except Exception as ex:
+            _fail_job(job, ex)
+            raise ex
+
+
+def _delete_final_artefacts(job_id):
+    for artefact in JobArtefact.objects.filter(job_id=job_id, artefact_type=JobArtefactType.FINAL):
+        artefact.file.delete(save=False)
+        artefact.delete()
+
 
-                    input_pages_file = conv.create_input_pdf(preprocess_result, final_page_processor.input_page_size)
-                    handle_cancellation(job)
+@shared_task
+def spool_processed_artefacts(page_counts: List[Optional[int]], job_id):
+    """
+    The chord callback for `process_artefact` tasks.
+    Sends the FINAL artefacts of the job to the printer in the `document_number` order.
+    """
+
+    job = GutenbergJob.objects.filter(id=job_id).first()
+    if not job:
+        logger.warning("Job id {} missing.".format(job_id))
+        return
+    with watch_cancellation(job):
+        try:
+            if None in page_counts:
+                # At least one of the `process_artefact` tasks has canceled the job.
+                return
+            handle_cancellation(job)
+            output_files = [
+                (artefact.document_number, artefact.file.path) for artefact in
+                job.artefacts.filter(artefact_type=JobArtefactType.FINAL).order_by('document_number')
+            ]
+            _print_output_files(job, output_files, sum(page_counts))
+        except JobCanceledException:
+            pass
+        except Exception as ex:
+            _fail_job(job, ex)
+            raise ex
+        finally:
+            _delete_final_artefacts(job_id)
+
+
+@shared_task
+def discard_processed_artefacts(job_id):
+    """
+    The error callback of the `print_file` chord.
+    The job status has already been updated by the failed `process_artefact` task.
+    """
+
+    _delete_final_artefacts(job_id)
+
+
+def _finish_backend_job(backend_job: BackendPrintJob, now: datetime.datetime) -> bool:
+    """
+    Marks the backend job as finished. Returns `False` if it has already been finished by another task.
+    """
+
+    return BackendPrintJob.objects.filter(id=backend_job.id, date_finished=None).update(date_finished=now) > 0
 
-                    try:
-                        final_pages_file = final_page_processor.create_final_pages(input_pages_file, job.properties.pages_to_print)
-                    except NoPagesToPrintException:
-                        _no_pages_cancel(job)
-                    handle_cancellation(job)
 
-                    imposition_result = imposition_processor.create_output_pdf(
-                        final_pages_file,
-                        final_page_processor.final_page_orientation,
-                        job.properties.two_sides != TwoSidedPrinting.ONE_SIDED,
+def _cancel_backend_job(backend: PrinterBackend, backend_job: BackendPrintJob, now: datetime.datetime):
+    try:
+        backend.cancel_job(backend_job.job, backend_job.backend_job_id)
+    except Exception:
+        logger.exception("Failed to cancel {} via {}".format(backend_job, backend.backend_name))
+    _finish_backend_job(backend_job, now)
+
+
+@shared_task
+def monitor_print_jobs():
+    """
+    A periodic task which follows the documents submitted to the printers.
+
+    The statuses of all unfinished backend jobs are checked with a single query to each backend.
+    A job is completed once the backend has finished all its documents. The documents of canceled jobs
+    and the documents which are printed for longer than `PRINTING_TIMEOUT_S` are canceled in the backend.
+    """
+
+    backends = {}
+    backend_jobs_by_backend = defaultdict(list)
+    for backend_job in BackendPrintJob.objects.filter(date_finished=None).select_related('job__printer'):
+        backend = get_printer_backend(backend_job.job.printer)
+        backends.setdefault(type(backend), backend)
+        backend_jobs_by_backend[type(backend)].append(backend_job)
+
+    now = timezone.now()
+    jobs = {}
+    status_reasons = {}
+    for backend_type, backend_jobs in backend_jobs_by_backend.items():
+        backend = backends[backend_type]
+        try:
+            statuses = backend.check_statuses([backend_job.backend_job_id for backend_job in backend_jobs])
+        except Exception:
+            logger.exception("Failed to check the statuses of jobs printed via {}".format(backend.backend_name))
+            continue
+
+        for backend_job in backend_jobs:
+            job = jobs.setdefault(backend_job.job_id, backend_job.job)
+            if job.status in [JobStatus.CANCELING, JobStatus.CANCELED, JobStatus.ERROR]:
+                _cancel_backend_job(backend, backend_job, now)
+            elif backend_job.backend_job_id not in statuses:
+                if _finish_backend_job(backend_job, now):
+                    StageTimer(job, backend_job.document_number).record(
+                        JobStage.PRINT_WAIT, (now - backend_job.date_submitted).total_seconds(),
                     )
+            elif (now - backend_job.date_submitted).total_seconds() > PRINTING_TIMEOUT_S:
+                _cancel_backend_job(backend, backend_job, now)
+                GutenbergJob.objects.filter(
+                    id=job.id, status__in=[JobStatus.PROCESSING, JobStatus.PRINTING],
+                ).update(status=JobStatus.ERROR, status_reason='Job took too long to complete')
+            elif job.status == JobStatus.PRINTING:
+                status_reasons.setdefault(job.id, statuses[backend_job.backend_job_id])
 
-                    shutil.copyfile(imposition_result.output_file, os.path.join(job_tmpdir, f'{idx:03}_output.pdf'))
-                    sum_num_pages += imposition_result.media_sheet_page_count
-                    handle_cancellation(job)
-            job.status = JobStatus.PRINTING
-            job.status_reason = ''
-            job.date_processed = timezone.now()
-            job.pages = sum_num_pages * job.properties.copies
-            job.save()
-            backend = {
-                PrinterType.DISABLED: DisabledPrinter,
-                PrinterType.LOCAL_CUPS: LocalCupsPrinter,
-            }.get(job.printer.printer_type, DisabledPrinter)()
-            for out in os.listdir(job_tmpdir):
-                backend.print(job, os.path.join(job_tmpdir, out))
-    except JobCanceledException:
-        # Canceling job
-        pass
-    except Exception as ex:
-        job.status = JobStatus.ERROR
-        job.status_reason = repr(ex)
-        if hasattr(ex, 'output') and isinstance(ex.output, bytes):
-            job.status_reason += '\nOutput:\n' + ex.output.decode('utf-8', errors='ignore')
-        job.save()
-        raise ex
+    for job_id, status_reason in status_reasons.items():
+        if jobs[job_id].status_reason != status_reason:
+            GutenbergJob.objects.filter(id=job_id, status=JobStatus.PRINTING).update(status_reason=status_reason)
+
+    # The jobs are checked in the database, as the last document may have been finished
+    # before the job was set to `PRINTING` by the worker.
+    submitted_backend_jobs = BackendPrintJob.objects.filter(job=OuterRef('pk'))
+    finished_jobs = GutenbergJob.objects.filter(
+        Exists(submitted_backend_jobs),
+        ~Exists(submitted_backend_jobs.filter(date_finished=None)),
+    )
+    finished_jobs.filter(status=JobStatus.PRINTING).update(
+        status=JobStatus.COMPLETED, status_reason='', date_finished=now,
+    )
+    finished_jobs.filter(status=JobStatus.CANCELING).update(
+        status=JobStatus.CANCELED, status_reason='Canceled by user', date_finished=now,
+    )
 
 
 @shared_task
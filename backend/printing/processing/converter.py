@@ -1,15 +1,153 @@
+import hashlib
+import json
 import os
 import shutil
 import subprocess
+import threading
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List
+from typing import Callable, List, Optional
 
 import magic
-from pypdf import PdfReader
+from django.conf import settings
 
-from printing.processing.pages import PageSize, PageOrientation
-from printing.utils import SANDBOX_PATH, TASK_TIMEOUT_S, logger
+from printing.processing.images import read_image_info, create_image_pdf, UnsupportedImageError
+from printing.processing.pages import PageSize, PageOrientation, MM_PER_PT
+from printing.processing.pdf_engine import get_pdf_engine
+from printing.processing.pdf_index import PdfIndex
+from printing.processing.pwg import convert_pwg_raster, UnsupportedRasterError
+from printing.processing.office_pool import OfficeInstanceError, get_office_pool
+from printing.processing.sandbox import run_in_sandbox
+from printing.utils import logger, file_sha256, handle_current_cancellation
+
+
+@dataclass(frozen=True)
+class CachedConversion:
+    orientation: PageOrientation
+    pdf_path: Optional[str]
+
+
+class ConversionCache:
+    """
+    A content-addressed cache of converter results stored in `cache_dir`.
+
+    Each entry consists of a JSON metadata file with the detected orientation and optionally
+    the converted PDF. When the total size of the entries exceeds `max_size_bytes`,
+    the least recently used entries are evicted.
+    The modification time of the metadata file is used as the last access time,
+    so the cache directory can be shared by multiple worker processes.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # The cached documents are as private as the printed ones
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def make_key(source_hash: str, converter_class: type, *params) -> str:
+        """
+        Creates a cache key from the SHA-256 hash of the source file, the converter class
+        and any additional conversion parameters which affect the result.
+        """
+
+        key_data = json.dumps([source_hash, converter_class.__qualname__, *params])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _pdf_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.pdf')
+
+    def get(self, key: str) -> Optional[CachedConversion]:
+        try:
+            with open(self._meta_path(key), 'r') as meta_file:
+                meta = json.load(meta_file)
+            pdf_path = self._pdf_path(key) if meta['has_pdf'] else None
+            if pdf_path is not None and not os.path.isfile(pdf_path):
+                raise FileNotFoundError(pdf_path)
+            # Mark the entry as recently used
+            os.utime(self._meta_path(key))
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return CachedConversion(orientation=PageOrientation(meta['orientation']), pdf_path=pdf_path)
+
+    def put(self, key: str, orientation: PageOrientation, pdf_path: Optional[str] = None):
+        # The files are first written under temporary names and then atomically renamed,
+        # so that a concurrent `get` never observes a partially written entry.
+        tmp_suffix = '.{}.{}.tmp'.format(os.getpid(), threading.get_ident())
+        if pdf_path is not None:
+            shutil.copyfile(pdf_path, self._pdf_path(key) + tmp_suffix)
+            os.replace(self._pdf_path(key) + tmp_suffix, self._pdf_path(key))
+        with open(self._meta_path(key) + tmp_suffix, 'w') as meta_file:
+            json.dump({'orientation': orientation.value, 'has_pdf': pdf_path is not None}, meta_file)
+        os.replace(self._meta_path(key) + tmp_suffix, self._meta_path(key))
+        self._evict()
+
+    def _evict(self):
+        entries = {}
+        total_size = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                key, ext = os.path.splitext(entry.name)
+                if ext not in ('.json', '.pdf'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                total_size += stat.st_size
+                size, mtime = entries.get(key, (0, 0))
+                entries[key] = (size + stat.st_size, stat.st_mtime if ext == '.json' else mtime)
+
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total_size <= self.max_size_bytes:
+                break
+            for path in (self._meta_path(key), self._pdf_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_conversion_cache: Optional[ConversionCache] = None
+_conversion_cache_lock = threading.Lock()
+
+
+def get_conversion_cache() -> Optional[ConversionCache]:
+    """
+    Returns the conversion cache configured with the `CONVERSION_CACHE_DIR` and `CONVERSION_CACHE_MAX_SIZE_BYTES`
+    settings or `None` if the cache is disabled.
+    """
+
+    global _conversion_cache
+    if not settings.CONVERSION_CACHE_DIR:
+        return None
+    with _conversion_cache_lock:
+        if _conversion_cache is None or _conversion_cache.cache_dir != settings.CONVERSION_CACHE_DIR:
+            _conversion_cache = ConversionCache(settings.CONVERSION_CACHE_DIR, settings.CONVERSION_CACHE_MAX_SIZE_BYTES)
+        return _conversion_cache
 
 
 class Converter(ABC):
@@ -26,9 +164,59 @@ class Converter(ABC):
     supported_types = []
     supported_extensions = []
     output_type = 'application/pdf'
+    cacheable = False
+    """
+    Whether the results of this converter should be stored in the conversion cache.
+    """
+    queue_name = ''
+    """
+    The name of the converter used in the name of its Celery queue, see `get_converter_queue`.
+    """
 
     def __init__(self, work_dir: str):
         self.work_dir = work_dir
+        self._source_hashes = dict()
+        self._source_indexes = dict()
+
+    def set_source_hash(self, input_file: str, sha256: str):
+        """
+        Sets the SHA-256 hash of `input_file` if it is already known, so it is not computed again for the cache key.
+        """
+
+        self._source_hashes[input_file] = sha256
+
+    def set_source_index(self, input_file: str, index: PdfIndex):
+        """
+        Sets the PDF index of `input_file` created when it was uploaded, so its pages are not read again
+        to determine the orientation. It is only used by the converters which do not change the PDF documents.
+        """
+
+        self._source_indexes[input_file] = index
+
+    def _get_cache_key(self, input_file: str, *params) -> Optional[str]:
+        """
+        Returns the conversion cache key for `input_file` and `params` or `None` if the cache should not be used.
+        """
+
+        if not self.cacheable or get_conversion_cache() is None:
+            return None
+        if input_file not in self._source_hashes:
+            self._source_hashes[input_file] = file_sha256(input_file)
+        return ConversionCache.make_key(self._source_hashes[input_file], self.__class__, *params)
+
+    def _copy_cached_pdf(self, cached: CachedConversion) -> Optional[str]:
+        """
+        Copies the cached PDF to the working directory and returns the path of the copy
+        or `None` if the entry has been evicted in the meantime, in which case the document should be converted.
+        """
+
+        out = os.path.join(self.work_dir, 'converted.pdf')
+        try:
+            shutil.copyfile(cached.pdf_path, out)
+        except OSError as ex:
+            logger.info("Failed to copy the cached conversion result {}: {}".format(cached.pdf_path, ex))
+            return None
+        return out
 
     @abstractmethod
     def preprocess(self, input_file: str) -> PreprocessResult:
@@ -59,13 +247,7 @@ class Converter(ABC):
 
 class SandboxConverter(Converter, ABC):
     def run_in_sandbox(self, command: List[str]) -> str:
-        sandboxed_command = [SANDBOX_PATH, self.work_dir] + command
-        return subprocess.check_output(
-            sandboxed_command,
-            text=True,
-            stderr=subprocess.STDOUT,
-            timeout=TASK_TIMEOUT_S,
-        )
+        return run_in_sandbox(self.work_dir, command)
 
     @staticmethod
     def binary_exists(name: str):
@@ -80,8 +262,12 @@ class EarlyConverter(SandboxConverter, ABC):
 
     The resulting PDF will have the orientation and page size of the original document,
     `input_page_size` is ignored.
+
+    The results are stored in the conversion cache, as they only depend on the input file.
     """
 
+    cacheable = True
+
     @abstractmethod
     def convert_to_pdf(self, input_file: str) -> str:
         """
@@ -91,16 +277,49 @@ class EarlyConverter(SandboxConverter, ABC):
         pass
 
     def preprocess(self, input_file: str) -> "EarlyConverter.PreprocessResult":
+        cache_key = self._get_cache_key(input_file)
+        if cache_key is not None:
+            cached = get_conversion_cache().get(cache_key)
+            cached_pdf = self._copy_cached_pdf(cached) if cached is not None and cached.pdf_path is not None else None
+            if cached_pdf is not None:
+                logger.info("Using the cached conversion result of {}".format(input_file))
+                return EarlyConverter.PreprocessResult(
+                    orientation=cached.orientation,
+                    preprocess_result_path=cached_pdf,
+                )
+
+        result = self._convert_and_detect_orientation(input_file)
+        if cache_key is not None:
+            get_conversion_cache().put(cache_key, result.orientation, result.preprocess_result_path)
+        return result
+
+    def preconvert(self, input_file: str):
+        """
+        Converts `input_file` and stores the result in the conversion cache, so the `preprocess` step
+        of the job printing the document only copies it.
+        """
+
+        if self._get_cache_key(input_file) is None:
+            raise ValueError('{} results are not cached'.format(self.__class__.__name__))
+        self.preprocess(input_file)
+
+    def _convert_and_detect_orientation(self, input_file: str) -> "EarlyConverter.PreprocessResult":
         preprocess_result_path = self.convert_to_pdf(input_file)
-        reader = PdfReader(preprocess_result_path)
+        index = self._source_indexes.get(input_file)
+        if preprocess_result_path == input_file and index is not None and index.page_count is not None:
+            return EarlyConverter.PreprocessResult(
+                orientation=index.orientation,
+                preprocess_result_path=preprocess_result_path,
+            )
 
         vertical_page_count = 0
         horizontal_page_count = 0
 
-        for page in reader.pages:
-            if page.mediabox.height > page.mediabox.width:
+        for boxes in get_pdf_engine().read_page_boxes(preprocess_result_path):
+            left, bottom, right, top = boxes.mediabox
+            if top - bottom > right - left:
                 vertical_page_count += 1
-            if page.mediabox.width > page.mediabox.height:
+            if right - left > top - bottom:
                 horizontal_page_count += 1
 
         if horizontal_page_count + vertical_page_count == 0:
@@ -123,18 +342,71 @@ class EarlyConverter(SandboxConverter, ABC):
 class ImageConverter(SandboxConverter):
     supported_types = ['image/png', 'image/jpeg']
     supported_extensions = ['.png', '.jpg', '.jpeg']
+    queue_name = 'image'
+    cacheable = True
 
     def preprocess(self, input_file: str) -> "ImageConverter.PreprocessResult":
-        identify_result = self.run_in_sandbox(
-            ['identify', '-auto-orient', '-format', '%w %h', input_file],
-        )
-        [width, height] = [int(size) for size in identify_result.split(' ')]
+        cache_key = self._get_cache_key(input_file)
+        if cache_key is not None:
+            cached = get_conversion_cache().get(cache_key)
+            if cached is not None:
+                return ImageConverter.PreprocessResult(cached.orientation, input_file)
+
+        try:
+            width, height = read_image_info(input_file).oriented_size()
+        except UnsupportedImageError as ex:
+            self._require_image_magick('identify', input_file, ex)
+            identify_result = self.run_in_sandbox(
+                ['identify', '-auto-orient', '-format', '%w %h', input_file],
+            )
+            [width, height] = [int(size) for size in identify_result.split(' ')]
         orientation = PageOrientation.LANDSCAPE if width > height else PageOrientation.PORTRAIT
+        if cache_key is not None:
+            get_conversion_cache().put(cache_key, orientation)
         return ImageConverter.PreprocessResult(orientation, input_file)
 
     def create_input_pdf(self, preprocess_result: "ImageConverter.PreprocessResult", input_page_size: PageSize) -> str:
+        # The resulting PDF depends on the Input Page size, so it is a part of the cache key.
+        cache_key = self._get_cache_key(
+            preprocess_result.preprocess_result_path,
+            input_page_size.width_mm,
+            input_page_size.height_mm,
+        )
+        if cache_key is not None:
+            cached = get_conversion_cache().get(cache_key)
+            cached_pdf = self._copy_cached_pdf(cached) if cached is not None and cached.pdf_path is not None else None
+            if cached_pdf is not None:
+                logger.info("Using the cached conversion result of {}".format(preprocess_result.preprocess_result_path))
+                return cached_pdf
+
         out = os.path.join(self.work_dir, 'converted.pdf')
+        try:
+            self._embed_image(preprocess_result.preprocess_result_path, input_page_size, out)
+        except UnsupportedImageError as ex:
+            self._require_image_magick('convert', preprocess_result.preprocess_result_path, ex)
+            logger.info("Converting {} with ImageMagick: {}".format(preprocess_result.preprocess_result_path, ex))
+            self._convert_image(preprocess_result.preprocess_result_path, input_page_size, out)
+        if cache_key is not None:
+            get_conversion_cache().put(cache_key, preprocess_result.orientation, out)
+        return out
+
+    @staticmethod
+    def _embed_image(input_file: str, input_page_size: PageSize, out: str):
+        """
+        Places the original JPEG or PNG data on a page of the Input Page size, without decoding the image.
+        """
+
+        create_image_pdf(
+            input_file,
+            read_image_info(input_file),
+            input_page_size.width_pt(),
+            input_page_size.height_pt(),
+            # The same 5 mm margin as in `_convert_image`
+            5 / MM_PER_PT,
+            out,
+        )
 
+    def _convert_image(self, input_file: str, input_page_size: PageSize, out: str):
         pixels_per_inch = 300
         pixels_per_mm = pixels_per_inch / 25.4
 
@@ -148,7 +420,7 @@ class ImageConverter(SandboxConverter):
         # TODO: Use scaling options (like fit to page)
         self.run_in_sandbox(
             [
-                'convert', preprocess_result.preprocess_result_path,
+                'convert', input_file,
                 # Auto-orient the image based on the EXIF orientation tag
                 '-auto-orient',
                 # Resize the image to fit the "fit area"
@@ -161,21 +433,44 @@ class ImageConverter(SandboxConverter):
                 out,
             ],
         )
-        return out
+
+    @classmethod
+    def _require_image_magick(cls, binary: str, input_file: str, ex: UnsupportedImageError):
+        """
+        Only the images which cannot be embedded directly (e.g. interlaced PNGs) are processed by ImageMagick,
+        so it is an optional dependency of the converter.
+        """
+
+        if not cls.binary_exists(binary):
+            raise NoConverterAvailableError(
+                "Unable to convert {}: {} and ImageMagick ({}) is not installed".format(input_file, ex, binary)
+            ) from ex
 
     @classmethod
     def is_available(cls):
-        return cls.binary_exists('convert')
+        # Baseline JPEG and non-interlaced PNG images are embedded without external tools
+        return True
 
 
 class DocConverter(EarlyConverter):
     supported_types = ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
                        'application/rtf', 'application/vnd.oasis.opendocument.text']
     supported_extensions = ['.doc', '.docx', '.rtf', '.odt']
+    queue_name = 'office'
 
     def convert_to_pdf(self, input_file: str) -> str:
         out = os.path.join(self.work_dir, 'converted.pdf')
 
+        pool = get_office_pool()
+        if pool is not None:
+            try:
+                pool.convert(input_file, out)
+                return out
+            except OfficeInstanceError:
+                # The conversion of a canceled job fails as well, as its instance has been stopped
+                handle_current_cancellation()
+                logger.exception('LibreOffice pool conversion failed, falling back to the LibreOffice CLI')
+
         # LibreOffice only allows specifying the output directory, not the output file name.
         # To make sure that the resulting file is identified correctly, we create an empty directory
         # and search for the resulting file there.
@@ -208,14 +503,25 @@ class DocConverter(EarlyConverter):
 class PwgRasterConverter(EarlyConverter):
     supported_types = ['image/pwg-raster']
     supported_extensions = ['.pwg']
+    queue_name = 'pwg'
 
     def convert_to_pdf(self, input_file: str) -> str:
         out = os.path.join(self.work_dir, 'converted.pdf')
-        self.run_in_sandbox(['cupsfilter', '-i', 'image/pwg-raster', '-m', 'application/pdf', input_file, out])
+        try:
+            convert_pwg_raster(input_file, out, threads=settings.PWG_RASTER_ENCODING_THREADS)
+        except UnsupportedRasterError as ex:
+            if not self.cupsfilter_available():
+                raise
+            logger.info("Converting {} with cupsfilter: {}".format(input_file, ex))
+            self.run_in_sandbox(['cupsfilter', '-i', 'image/pwg-raster', '-m', 'application/pdf', input_file, out])
         return out
 
     @classmethod
-    def is_available(cls):
+    def cupsfilter_available(cls):
+        """
+        Whether the rasters which are not supported by `convert_pwg_raster` can be converted with cupsfilter.
+        """
+
         if not cls.binary_exists("cupsfilter"):
             return False
 
@@ -225,13 +531,19 @@ class PwgRasterConverter(EarlyConverter):
                 stderr=subprocess.STDOUT, timeout=5,
             )
             return True
-        except subprocess.CalledProcessError:
+        except (subprocess.SubprocessError, OSError):
+            # Also covers a timeout and a binary which cannot be executed
             return False
 
+    @classmethod
+    def is_available(cls):
+        return True
+
 
 class PostScriptConverter(EarlyConverter):
     supported_types = ['application/postscript']
     supported_extensions = ['.ps']
+    queue_name = 'ps'
 
     def convert_to_pdf(self, input_file: str) -> str:
         out = os.path.join(self.work_dir, 'converted.pdf')
@@ -250,6 +562,9 @@ class PostScriptConverter(EarlyConverter):
 class PdfConverter(EarlyConverter):
     supported_types = ['application/pdf']
     supported_extensions = ['.pdf']
+    queue_name = 'pdf'
+    # Caching would only store a copy of the input file
+    cacheable = False
 
     def convert_to_pdf(self, input_file: str) -> str:
         # no-op, the file is already PDF
@@ -278,17 +593,46 @@ def _create_converter_map() -> dict[str, type[Converter]]:
 
 CONVERTER_FOR_TYPE = _create_converter_map()
 
+CONVERTER_QUEUE_PREFIX = 'convert.'
+
+
+def _find_converter_class(input_type: str) -> Optional[type[Converter]]:
+    # All converters are considered, not only the ones available locally,
+    # as the tasks are usually sent by the web server, which does not run any converters.
+    return next((conv for conv in CONVERTERS_ALL if input_type in conv.supported_types), None)
+
+
+def get_converter_queue(input_type: str) -> Optional[str]:
+    """
+    Returns the name of the Celery queue consumed by the workers which can convert `input_type`,
+    e.g. `convert.office`, or `None` if the type is not supported by any converter.
+    """
+
+    conv_class = _find_converter_class(input_type)
+    if conv_class is None:
+        return None
+    return CONVERTER_QUEUE_PREFIX + conv_class.queue_name
+
+
+def is_preconvertible(input_type: str) -> bool:
+    """
+    Returns `True` if the conversion of `input_type` does not depend on the job properties, so it can be done
+    when the document is uploaded and stored in the conversion cache, see `EarlyConverter.preconvert`.
+    """
+
+    conv_class = _find_converter_class(input_type)
+    return (conv_class is not None and issubclass(conv_class, EarlyConverter) and conv_class.cacheable
+            and bool(settings.CONVERSION_CACHE_DIR))
+
 
 class NoConverterAvailableError(ValueError):
     pass
 
 
-def detect_file_format(input_file: str):
-    mime_detector = magic.Magic(mime=True)
-    input_type = mime_detector.from_file(input_file)
+def _detect_format(detect: Callable[[magic.Magic], str]) -> str:
+    input_type = detect(magic.Magic(mime=True))
     if input_type == 'text/plain' or input_type == 'application/octet-stream':
-        verbose_detector = magic.Magic()
-        verbose_type = verbose_detector.from_file(input_file)
+        verbose_type = detect(magic.Magic())
         if 'PostScript' in verbose_type:
             input_type = 'application/postscript'
         elif 'Cups Raster version 2' in verbose_type:
@@ -296,6 +640,18 @@ def detect_file_format(input_file: str):
     return input_type
 
 
+def detect_file_format(input_file: str):
+    return _detect_format(lambda detector: detector.from_file(input_file))
+
+
+def detect_buffer_format(data: bytes):
+    """
+    Detects the format of a document from its first bytes, see `printing.ingestion.SNIFF_BYTES`.
+    """
+
+    return _detect_format(lambda detector: detector.from_buffer(data))
+
+
 def get_converter(input_type: str, work_dir: str) -> Converter:
     try:
         conv_class = CONVERTER_FOR_TYPE[input_type]
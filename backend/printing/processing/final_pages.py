@@ -1,14 +1,16 @@
 import os
-import subprocess
 from itertools import chain
 from math import isqrt
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
-from pypdf import PdfReader, PdfWriter, Transformation
+from pypdf import Transformation
 from pypdf.generic import RectangleObject
 
 from printing.processing.pages import PageSize, PageSizes, PageOrientation
-from printing.utils import SANDBOX_PATH, TASK_TIMEOUT_S
+from printing.processing.pdf_engine import get_pdf_engine
+from printing.processing.pdf_index import PageBoxes
+from printing.processing.placement import Placement, intersect_rects, rotation_transformation, transform_rect
+from printing.processing.sandbox import run_in_sandbox
 
 
 class NoPagesToPrintException(BaseException):
@@ -16,6 +18,14 @@ class NoPagesToPrintException(BaseException):
         super().__init__("No pages to print")
 
 
+def count_pages_to_print(pages_to_print: Optional[str], input_page_count: int) -> int:
+    """
+    Returns the number of Input Pages printed from a document with `input_page_count` pages.
+    """
+
+    return sum(1 for _ in FinalPageProcessor._create_pages_to_print_iter(pages_to_print, input_page_count))
+
+
 class FinalPageProcessor:
     """
     A utility for creating Final Pages from Input Pages by applying page filter and n-up.
@@ -64,13 +74,7 @@ class FinalPageProcessor:
         )
 
     def run_in_sandbox(self, command: List[str]) -> str:
-        sandboxed_command = [SANDBOX_PATH, self.work_dir] + command
-        return subprocess.check_output(
-            sandboxed_command,
-            text=True,
-            stderr=subprocess.STDOUT,
-            timeout=TASK_TIMEOUT_S,
-        )
+        return run_in_sandbox(self.work_dir, command)
 
     @staticmethod
     def _create_pages_to_print_iter(pages_to_print: Optional[str], input_page_count: int):
@@ -87,91 +91,82 @@ class FinalPageProcessor:
 
         return chain.from_iterable(map(_create_iter_for_range, pages_to_print.split(',')))
 
-    def create_final_pages(self, input_pages_file: str, pages_to_print: str) -> str:
-        out = os.path.join(self.work_dir, 'final_pages.pdf')
-        reader = PdfReader(input_pages_file)
-        writer = PdfWriter()
-
-        used_input_pages = 0
-        next_row = 0
-        next_col = 0
-        dest_page = None
-
-        for page_index in self._create_pages_to_print_iter(pages_to_print, len(reader.pages)):
-            page = reader.pages[page_index]
-            page.transfer_rotation_to_content()
-            if next_row == 0 and next_col == 0:
-                dest_page = writer.add_blank_page(
-                    width=self.final_page_size.width_pt(),
-                    height=self.final_page_size.height_pt(),
-                )
-
-            if self.fit_to_page:
-                scale = min(
-                    self.input_page_size.width_pt() / page.trimbox.width,
-                    self.input_page_size.height_pt() / page.trimbox.height,
-                )
-                page.scale_by(scale)
-
-            left_x = next_col * self.input_page_size.width_pt()
-            right_x = left_x + self.input_page_size.width_pt()
-            target_center_x = (left_x + right_x) / 2
-            # The y-coordinate starts from the bottom of the page
-            bottom_y = (self.rows - 1 - next_row) * self.input_page_size.height_pt()
-            top_y = bottom_y + self.input_page_size.height_pt()
-            target_center_y = (bottom_y + top_y) / 2
-
-            current_center_x = (page.trimbox.left + page.trimbox.right) / 2
-            current_center_y = (page.trimbox.bottom + page.trimbox.top) / 2
-
-            dx = target_center_x - current_center_x
-            dy = target_center_y - current_center_y
-            page.add_transformation(Transformation().translate(dx, dy))
-
-            # Modifying `cropbox` might also appear to modify `trimbox`, `bleedbox` or `artbox`, because
-            # if `trimbox`, `bleedbox` or `artbox` is not defined, then `cropbox` is used as the default value.
-            # In the same manner `mediabox` is used as the default for all others if they are not defined.
-            # Care must be taken to compute all the new values before modifying them.
-            #
-            # This behavior was the source of a bug in `pypdf` discovered while working on Gutenberg:
-            # https://github.com/py-pdf/pypdf/issues/3487
-            new_attrs = dict()
-            for attr in ['trimbox', 'bleedbox', 'artbox', 'cropbox', 'mediabox']:
-                current = getattr(page, attr)
-                new_attrs[attr] = RectangleObject((current.left + dx, current.bottom + dy, current.right + dx, current.top + dy))
-            for attr, value in new_attrs.items():
-                setattr(page, attr, value)
-
-            page.cropbox.bottom = max(page.cropbox.bottom, bottom_y)
-            page.cropbox.top = max(page.cropbox.top, top_y)
-            page.cropbox.left = max(page.cropbox.left, left_x)
-            page.cropbox.right = min(page.cropbox.right, right_x)
-
-            page.trimbox.bottom = max(page.trimbox.bottom, bottom_y)
-            page.trimbox.top = min(page.trimbox.top, top_y)
-            page.trimbox.left = max(page.trimbox.left, left_x)
-            page.trimbox.right = min(page.trimbox.right, right_x)
-
-            # TODO: When borderless printing is added, the bleed box for the outer pages can be expanded here
-            page.bleedbox.bottom = max(page.bleedbox.bottom, bottom_y)
-            page.bleedbox.top = min(page.bleedbox.top, top_y)
-            page.bleedbox.left = max(page.bleedbox.left, left_x)
-            page.bleedbox.right = min(page.bleedbox.right, right_x)
-
-            dest_page.merge_page(page)
-
-            used_input_pages += 1
-            next_col += 1
-            if next_col == self.columns:
-                next_row += 1
-                next_col = 0
-            if next_row == self.rows:
-                next_row = 0
-
-        if used_input_pages == 0:
+    def get_input_page_placement(self, page: PageBoxes, source_index: int, slot: int) -> Optional[Placement]:
+        """
+        Returns the placement of the Input Page `page` in the n-up cell number `slot` of a Final Page
+        or `None` if no part of the page is visible.
+
+        The page is centered in the cell based on its trim box and scaled to fit it if `fit_to_page` is enabled.
+        The visible region is the intersection of the crop box and the cell.
+        """
+
+        row, col = divmod(slot, self.columns)
+        rotation = rotation_transformation(RectangleObject(page.mediabox), page.rotation)
+        trimbox = transform_rect(rotation, RectangleObject(page.trimbox))
+        cropbox = transform_rect(rotation, RectangleObject(page.cropbox))
+
+        scale = 1
+        if self.fit_to_page:
+            scale = min(
+                self.input_page_size.width_pt() / trimbox.width,
+                self.input_page_size.height_pt() / trimbox.height,
+            )
+
+        left_x = col * self.input_page_size.width_pt()
+        right_x = left_x + self.input_page_size.width_pt()
+        target_center_x = (left_x + right_x) / 2
+        # The y-coordinate starts from the bottom of the page
+        bottom_y = (self.rows - 1 - row) * self.input_page_size.height_pt()
+        top_y = bottom_y + self.input_page_size.height_pt()
+        target_center_y = (bottom_y + top_y) / 2
+
+        current_center_x = scale * float(trimbox.left + trimbox.right) / 2
+        current_center_y = scale * float(trimbox.bottom + trimbox.top) / 2
+
+        cell_transformation = Transformation().scale(scale).translate(
+            target_center_x - current_center_x,
+            target_center_y - current_center_y,
+        )
+        clip = intersect_rects(
+            transform_rect(cell_transformation, cropbox),
+            RectangleObject((left_x, bottom_y, right_x, top_y)),
+        )
+        if clip is None:
+            return None
+        return Placement(
+            source_index=source_index,
+            transformation=rotation.transform(cell_transformation),
+            clip=clip,
+        )
+
+    def get_final_page_layouts(self, input_pages: Sequence[PageBoxes], pages_to_print: Optional[str]) -> List[List[Placement]]:
+        """
+        Returns the placements of the Input Pages on each Final Page.
+
+        :raises NoPagesToPrintException: If `pages_to_print` does not select any of the `input_pages`.
+        """
+
+        slots_per_page = self.rows * self.columns
+        layouts = []
+        for slot, page_index in enumerate(self._create_pages_to_print_iter(pages_to_print, len(input_pages))):
+            if slot % slots_per_page == 0:
+                layouts.append([])
+            placement = self.get_input_page_placement(input_pages[page_index], page_index, slot % slots_per_page)
+            if placement is not None:
+                layouts[-1].append(placement)
+
+        if len(layouts) == 0:
             raise NoPagesToPrintException
+        return layouts
 
-        writer.compress_identical_objects()
-        with open(out, "xb") as output_file:
-            writer.write(output_file)
+    def create_final_pages(self, input_pages_file: str, pages_to_print: str) -> str:
+        out = os.path.join(self.work_dir, 'final_pages.pdf')
+        engine = get_pdf_engine()
+        engine.place_pages(
+            input_pages_file,
+            out,
+            self.final_page_size.width_pt(),
+            self.final_page_size.height_pt(),
+            self.get_final_page_layouts(engine.read_page_boxes(input_pages_file), pages_to_print),
+        )
         return out
@@ -0,0 +1,249 @@
+"""
+In-process conversion of JPEG and PNG images to PDF.
+
+The compressed image data is embedded in the PDF unchanged: JPEG files as `DCTDecode` streams
+and PNG files as `FlateDecode` streams with the PNG predictors. Only the headers are parsed here,
+the images are never decoded by the worker. The images which cannot be embedded this way
+(e.g. PNG files with transparency) raise `UnsupportedImageError`, so they can be converted by ImageMagick.
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Tuple
+
+from pypdf import PdfWriter, Transformation
+from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject, StreamObject, ByteStringObject
+
+from printing.processing.placement import add_indirect_object
+
+JPEG_SIGNATURE = b'\xff\xd8'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# The transformations of the image unit square for the EXIF orientations, see `ImageInfo.orientation`
+EXIF_ORIENTATION_TRANSFORMATIONS = {
+    1: (1, 0, 0, 1, 0, 0),
+    2: (-1, 0, 0, 1, 1, 0),
+    3: (-1, 0, 0, -1, 1, 1),
+    4: (1, 0, 0, -1, 0, 1),
+    5: (0, -1, -1, 0, 1, 1),
+    6: (0, -1, 1, 0, 0, 1),
+    7: (0, 1, 1, 0, 0, 0),
+    8: (0, 1, -1, 0, 1, 0),
+}
+
+# The Start Of Frame markers of the JPEG encodings which can be decoded by PDF readers
+JPEG_SOF_MARKERS = {0xc0, 0xc1, 0xc2}
+# The Start Of Frame markers of the other JPEG encodings (lossless, arithmetic coding)
+JPEG_UNSUPPORTED_SOF_MARKERS = {0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+JPEG_COLOR_SPACES = {1: '/DeviceGray', 3: '/DeviceRGB', 4: '/DeviceCMYK'}
+
+PNG_COLOR_TYPE_GRAY = 0
+PNG_COLOR_TYPE_RGB = 2
+PNG_COLOR_TYPE_PALETTE = 3
+PNG_COLORS = {PNG_COLOR_TYPE_GRAY: 1, PNG_COLOR_TYPE_RGB: 3, PNG_COLOR_TYPE_PALETTE: 1}
+
+
+class UnsupportedImageError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    # The size of the stored image in pixels
+    width: int
+    height: int
+    # The EXIF orientation: 1 - the image is displayed as stored, 2 - mirrored horizontally, 3 - rotated by 180°,
+    # 4 - mirrored vertically, 5 - transposed, 6 - rotated 90° clockwise, 7 - transversed, 8 - rotated 90° anticlockwise
+    orientation: int
+    image: DictionaryObject
+
+    def oriented_size(self) -> Tuple[int, int]:
+        """The size of the image after applying the EXIF orientation."""
+        if self.orientation >= 5:
+            return self.height, self.width
+        return self.width, self.height
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise UnsupportedImageError('Unexpected end of the image file')
+    return data
+
+
+def _read_exif_orientation(exif: bytes) -> int:
+    """Reads the orientation tag from IFD0 of the EXIF data (without the `Exif\\0\\0` header)."""
+    try:
+        byte_order = {b'II': '<', b'MM': '>'}[exif[:2]]
+        ifd_offset, = struct.unpack_from(byte_order + 'I', exif, 4)
+        entry_count, = struct.unpack_from(byte_order + 'H', exif, ifd_offset)
+        for i in range(entry_count):
+            tag, value_type, _, value = struct.unpack_from(byte_order + 'HHIH', exif, ifd_offset + 2 + 12 * i)
+            # A SHORT value is stored at the beginning of the value field
+            if tag == 0x0112 and value_type == 3:
+                return value if value in EXIF_ORIENTATION_TRANSFORMATIONS else 1
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def read_jpeg(f: BinaryIO) -> ImageInfo:
+    if _read_exact(f, 2) != JPEG_SIGNATURE:
+        raise UnsupportedImageError('Not a JPEG file')
+    orientation = 1
+    adobe_transform = False
+    while True:
+        marker = _read_exact(f, 1)
+        if marker != b'\xff':
+            raise UnsupportedImageError('Invalid JPEG marker')
+        marker_type = _read_exact(f, 1)[0]
+        # Any number of 0xFF bytes may precede the marker type
+        while marker_type == 0xff:
+            marker_type = _read_exact(f, 1)[0]
+        if 0xd0 <= marker_type <= 0xd7 or marker_type == 0x01:
+            continue
+        if marker_type in [0xd9, 0xda]:
+            raise UnsupportedImageError('Missing JPEG frame header')
+        length, = struct.unpack('>H', _read_exact(f, 2))
+        segment = _read_exact(f, length - 2)
+        if marker_type == 0xe1 and segment.startswith(b'Exif\x00\x00'):
+            orientation = _read_exif_orientation(segment[6:])
+        elif marker_type == 0xee and segment.startswith(b'Adobe'):
+            adobe_transform = True
+        elif marker_type in JPEG_UNSUPPORTED_SOF_MARKERS:
+            raise UnsupportedImageError('Unsupported JPEG encoding')
+        elif marker_type in JPEG_SOF_MARKERS:
+            precision, height, width, components = struct.unpack_from('>BHHB', segment)
+            if precision != 8 or height == 0 or components not in JPEG_COLOR_SPACES:
+                raise UnsupportedImageError('Unsupported JPEG frame')
+            image = DictionaryObject({
+                NameObject('/ColorSpace'): NameObject(JPEG_COLOR_SPACES[components]),
+                NameObject('/BitsPerComponent'): NumberObject(8),
+                NameObject('/Filter'): NameObject('/DCTDecode'),
+            })
+            if components == 4 and adobe_transform:
+                # The CMYK images written by Adobe applications are stored inverted
+                image[NameObject('/Decode')] = ArrayObject([NumberObject(1), NumberObject(0)] * 4)
+            return ImageInfo(width, height, orientation, image)
+
+
+def read_png(f: BinaryIO) -> ImageInfo:
+    if _read_exact(f, 8) != PNG_SIGNATURE:
+        raise UnsupportedImageError('Not a PNG file')
+    length, chunk_type = struct.unpack('>I4s', _read_exact(f, 8))
+    if chunk_type != b'IHDR':
+        raise UnsupportedImageError('Missing PNG header')
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', _read_exact(f, length))
+    _read_exact(f, 4)
+    if color_type not in PNG_COLORS:
+        raise UnsupportedImageError('Unsupported PNG color type {}'.format(color_type))
+    if interlace:
+        raise UnsupportedImageError('Interlaced PNG images are not supported')
+
+    palette: Optional[bytes] = None
+    while True:
+        length, chunk_type = struct.unpack('>I4s', _read_exact(f, 8))
+        if chunk_type == b'IDAT':
+            # The image data is read by `create_image_pdf`
+            break
+        data = _read_exact(f, length)
+        _read_exact(f, 4)
+        if chunk_type == b'PLTE':
+            palette = data
+        elif chunk_type == b'tRNS':
+            raise UnsupportedImageError('PNG images with transparency are not supported')
+        elif chunk_type == b'IEND':
+            raise UnsupportedImageError('Missing PNG image data')
+
+    if color_type == PNG_COLOR_TYPE_PALETTE:
+        if palette is None:
+            raise UnsupportedImageError('Missing PNG palette')
+        color_space = ArrayObject([
+            NameObject('/Indexed'), NameObject('/DeviceRGB'), NumberObject(len(palette) // 3 - 1),
+            ByteStringObject(palette),
+        ])
+    else:
+        color_space = NameObject('/DeviceGray' if color_type == PNG_COLOR_TYPE_GRAY else '/DeviceRGB')
+    image = DictionaryObject({
+        NameObject('/ColorSpace'): color_space,
+        NameObject('/BitsPerComponent'): NumberObject(bit_depth),
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+        NameObject('/DecodeParms'): DictionaryObject({
+            NameObject('/Predictor'): NumberObject(15),
+            NameObject('/Colors'): NumberObject(PNG_COLORS[color_type]),
+            NameObject('/BitsPerComponent'): NumberObject(bit_depth),
+            NameObject('/Columns'): NumberObject(width),
+        }),
+    })
+    return ImageInfo(width, height, 1, image)
+
+
+def _read_png_data(f: BinaryIO) -> bytes:
+    """Concatenates the IDAT chunks of a PNG file, returns the zlib stream of the image."""
+    f.seek(len(PNG_SIGNATURE))
+    data = bytearray()
+    while True:
+        length, chunk_type = struct.unpack('>I4s', _read_exact(f, 8))
+        if chunk_type == b'IEND':
+            return bytes(data)
+        if chunk_type == b'IDAT':
+            data += _read_exact(f, length)
+        else:
+            f.seek(length, 1)
+        f.seek(4, 1)
+
+
+def read_image_info(input_file: str) -> ImageInfo:
+    """
+    Reads the size and the EXIF orientation of a JPEG or PNG image.
+    Raises `UnsupportedImageError` if the image cannot be embedded in a PDF without decoding it.
+    """
+
+    with open(input_file, 'rb') as f:
+        signature = f.read(len(PNG_SIGNATURE))
+        f.seek(0)
+        if signature.startswith(JPEG_SIGNATURE):
+            return read_jpeg(f)
+        if signature == PNG_SIGNATURE:
+            return read_png(f)
+    raise UnsupportedImageError('Unknown image format')
+
+
+def create_image_pdf(input_file: str, info: ImageInfo, page_width: float, page_height: float,
+                     margin: float, out: str):
+    """
+    Creates a single page PDF of the given size (in points) with the image scaled to fit
+    the page without the margins, centered and rotated according to its EXIF orientation.
+    """
+
+    with open(input_file, 'rb') as f:
+        data = f.read() if info.image['/Filter'] == '/DCTDecode' else _read_png_data(f)
+
+    image = StreamObject()
+    image.update(info.image)
+    image.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Image'),
+        NameObject('/Width'): NumberObject(info.width),
+        NameObject('/Height'): NumberObject(info.height),
+    })
+    image.set_data(data)
+
+    image_width, image_height = info.oriented_size()
+    scale = min((page_width - 2 * margin) / image_width, (page_height - 2 * margin) / image_height)
+    width = image_width * scale
+    height = image_height * scale
+    placement = Transformation(EXIF_ORIENTATION_TRANSFORMATIONS[info.orientation]) \
+        .scale(width, height) \
+        .translate((page_width - width) / 2, (page_height - height) / 2)
+
+    writer = PdfWriter()
+    page = writer.add_blank_page(page_width, page_height)
+    content = StreamObject()
+    content.set_data('q {} cm /Im0 Do Q'.format(' '.join('{:.6f}'.format(v) for v in placement.ctm)).encode())
+    page[NameObject('/Contents')] = add_indirect_object(writer, content)
+    page[NameObject('/Resources')] = DictionaryObject({
+        NameObject('/XObject'): DictionaryObject({NameObject('/Im0'): add_indirect_object(writer, image)}),
+    })
+    with open(out, 'wb') as f:
+        writer.write(f)
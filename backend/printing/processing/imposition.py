@@ -1,13 +1,15 @@
 import os
-import subprocess
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import List
 
-from pypdf import PdfReader, PdfWriter, Transformation, PageObject
+from pypdf.generic import RectangleObject
 
 from printing.processing.pages import PageSize, PageSizes, PageOrientation
-from printing.utils import SANDBOX_PATH, TASK_TIMEOUT_S, ceil_div
+from printing.processing.pdf_engine import get_pdf_engine
+from printing.processing.placement import Placement, rotation_transformation, transform_rect
+from printing.processing.sandbox import run_in_sandbox
+from printing.utils import ceil_div
 
 
 @dataclass(frozen=True)
@@ -15,6 +17,19 @@ class ImpositionResult:
     output_file: str
     media_sheet_count: int
     media_sheet_page_count: int
+    # Whether `output_file` is the input file sent to the printer unchanged, see `LayoutEngine`
+    passthrough: bool = False
+
+
+@dataclass(frozen=True)
+class ImpositionLayout:
+    """
+    The placements of the Final Pages on each Media Sheet Page.
+    """
+
+    media_pages: List[List[Placement]]
+    media_sheet_count: int
+    media_sheet_page_count: int
 
 
 class BaseImpositionProcessor(ABC):
@@ -34,6 +49,15 @@ class BaseImpositionProcessor(ABC):
 
         pass
 
+    @abstractmethod
+    def get_imposition_layout(self, final_page_count: int, final_page_orientation: PageOrientation, duplex_enabled: bool) -> ImpositionLayout:
+        """
+        Returns the placements of the Final Pages on the Media Sheet Pages, with Final Pages rotated
+        to exactly match the media size.
+        """
+
+        pass
+
     @abstractmethod
     def create_output_pdf(self, final_pages_file: str, final_page_orientation: PageOrientation, duplex_enabled: bool) -> ImpositionResult:
         """
@@ -51,14 +75,27 @@ class SandboxImpositionProcessor(BaseImpositionProcessor, ABC):
         self.work_dir = work_dir
 
     def run_in_sandbox(self, command: List[str]) -> str:
-        sandboxed_command = [SANDBOX_PATH, self.work_dir] + command
-        return subprocess.check_output(
-            sandboxed_command,
-            text=True,
-            stderr=subprocess.STDOUT,
-            timeout=TASK_TIMEOUT_S,
+        return run_in_sandbox(self.work_dir, command)
+
+    def create_output_pdf(self, final_pages_file: str, final_page_orientation: PageOrientation, duplex_enabled: bool) -> ImpositionResult:
+        out = os.path.join(self.work_dir, 'output.pdf')
+        engine = get_pdf_engine()
+
+        final_page_count = len(engine.read_page_boxes(final_pages_file))
+        layout = self.get_imposition_layout(final_page_count, final_page_orientation, duplex_enabled)
+        engine.place_pages(
+            final_pages_file, out, self.media_size.width_pt(), self.media_size.height_pt(), layout.media_pages,
+        )
+        return ImpositionResult(
+            output_file=out,
+            media_sheet_count=layout.media_sheet_count,
+            media_sheet_page_count=layout.media_sheet_page_count,
         )
 
+    def _final_page_rect(self, final_page_orientation: PageOrientation) -> RectangleObject:
+        final_page_size = self.get_final_page_sizes().get(final_page_orientation)
+        return RectangleObject((0, 0, final_page_size.width_pt(), final_page_size.height_pt()))
+
 
 class StandardImpositionProcessor(SandboxImpositionProcessor):
     def get_final_page_sizes(self) -> PageSizes:
@@ -67,30 +104,21 @@ class StandardImpositionProcessor(SandboxImpositionProcessor):
             landscape=self.media_size.rotated(),
         )
 
-    def create_output_pdf(self, final_pages_file: str, final_page_orientation: PageOrientation, duplex_enabled: bool) -> ImpositionResult:
-        out = os.path.join(self.work_dir, 'output.pdf')
-        reader = PdfReader(final_pages_file)
-        writer = PdfWriter()
-
+    def get_imposition_layout(self, final_page_count: int, final_page_orientation: PageOrientation, duplex_enabled: bool) -> ImpositionLayout:
         rotation = 0 if final_page_orientation == PageOrientation.PORTRAIT else 90
+        final_page_rect = self._final_page_rect(final_page_orientation)
+        transformation = rotation_transformation(final_page_rect, rotation)
+        clip = transform_rect(transformation, final_page_rect)
 
-        for page in reader.pages:
-            dest_page = writer.add_blank_page(width=self.media_size.width_pt(), height=self.media_size.height_pt())
-            page = page.rotate(rotation)
-            page.transfer_rotation_to_content()
-            dest_page.merge_page(page)
-
+        media_pages = [[Placement(i, transformation, clip)] for i in range(final_page_count)]
         # If duplex printing is enabled, make sure that the number of pages in the output PDF is even
-        if duplex_enabled and len(reader.pages) % 2 == 1:
-            writer.add_blank_page(width=self.media_size.width_pt(), height=self.media_size.height_pt())
+        if duplex_enabled and final_page_count % 2 == 1:
+            media_pages.append([])
 
-        writer.compress_identical_objects()
-        with open(out, "xb") as output_file:
-            writer.write(output_file)
-        return ImpositionResult(
-            output_file=out,
-            media_sheet_count=ceil_div(len(reader.pages), 2),
-            media_sheet_page_count=len(reader.pages),
+        return ImpositionLayout(
+            media_pages=media_pages,
+            media_sheet_count=ceil_div(final_page_count, 2),
+            media_sheet_page_count=final_page_count,
         )
 
 
@@ -102,40 +130,34 @@ class BookletImpositionProcessor(SandboxImpositionProcessor):
             landscape=landscape_size,
         )
 
-    def create_output_pdf(self, final_pages_file: str, final_page_orientation: PageOrientation, duplex_enabled: bool) -> ImpositionResult:
-        out = os.path.join(self.work_dir, 'output.pdf')
-        reader = PdfReader(final_pages_file)
-        writer = PdfWriter()
-
+    def get_imposition_layout(self, final_page_count: int, final_page_orientation: PageOrientation, duplex_enabled: bool) -> ImpositionLayout:
         y_midpoint_pt = self.media_size.height_pt()/2
         rotation = 90 if final_page_orientation == PageOrientation.PORTRAIT else 0
+        final_page_rect = self._final_page_rect(final_page_orientation)
+        bottom_transformation = rotation_transformation(final_page_rect, rotation)
+        top_transformation = bottom_transformation.translate(0, y_midpoint_pt)
 
-        def try_add_page(source_index: int, target: PageObject, top = False):
-            if source_index < 0 or source_index >= len(reader.pages):
+        def add_page(source_index: int, media_page: List[Placement], top = False):
+            if source_index < 0 or source_index >= final_page_count:
                 return
-            # Note: This modifies the `PageObject` instance
-            page = reader.pages[source_index].rotate(rotation)
-            page.transfer_rotation_to_content()
-            transformation = Transformation()
-            if top:
-                transformation = transformation.translate(0, y_midpoint_pt)
-            target.merge_transformed_page(page, transformation)
-
-        media_sheet_count = ceil_div(len(reader.pages), 4)
-        for i in range(media_sheet_count):
-            front_page = writer.add_blank_page(width=self.media_size.width_pt(), height=self.media_size.height_pt())
-            try_add_page(2 * media_sheet_count - 1 - 2*i, front_page, True)
-            try_add_page(2 * media_sheet_count + 2*i, front_page, False)
+            transformation = top_transformation if top else bottom_transformation
+            media_page.append(Placement(source_index, transformation, transform_rect(transformation, final_page_rect)))
 
-            rear_page = writer.add_blank_page(width=self.media_size.width_pt(), height=self.media_size.height_pt())
-            try_add_page(2 * media_sheet_count - 2 - 2*i, rear_page, False)
-            try_add_page(2 * media_sheet_count + 1 + 2*i, rear_page, True)
-
-        writer.compress_identical_objects()
-        with open(out, "xb") as output_file:
-            writer.write(output_file)
-        return ImpositionResult(
-            output_file=out,
+        media_sheet_count = ceil_div(final_page_count, 4)
+        media_pages = []
+        for i in range(media_sheet_count):
+            front_page = []
+            add_page(2 * media_sheet_count - 1 - 2*i, front_page, True)
+            add_page(2 * media_sheet_count + 2*i, front_page, False)
+            media_pages.append(front_page)
+
+            rear_page = []
+            add_page(2 * media_sheet_count - 2 - 2*i, rear_page, False)
+            add_page(2 * media_sheet_count + 1 + 2*i, rear_page, True)
+            media_pages.append(rear_page)
+
+        return ImpositionLayout(
+            media_pages=media_pages,
             media_sheet_count=media_sheet_count,
             media_sheet_page_count=2*media_sheet_count,
         )
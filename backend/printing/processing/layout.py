@@ -0,0 +1,274 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from pypdf import PdfReader
+
+from printing.processing.final_pages import FinalPageProcessor
+from printing.processing.imposition import BaseImpositionProcessor, ImpositionResult, StandardImpositionProcessor
+from printing.processing.layout_chunks import LayoutChunk, lay_out_chunk, lay_out_chunk_in_process
+from printing.processing.pages import PageOrientation
+from printing.processing.pdf_engine import get_pdf_engine
+from printing.processing.pdf_index import PageBoxes, PdfIndexError, read_page_boxes
+from printing.processing.pdf_stream import ChunkedPdfWriter, PdfPart
+from printing.processing.placement import Placement, compose_placements
+from printing.utils import ceil_div
+
+# The largest difference between the page size and the media size for which the page is sent to the printer
+# unchanged. The layout would scale such pages by less than 0.1%, e.g. 595x842 pt pages printed on A4.
+PASSTHROUGH_TOLERANCE_PT = 0.5
+# The parsed objects of a page take more memory than their serialized form in the input file,
+# this factor is used to estimate the memory used by a chunk from the size of the input file.
+PARSED_OBJECT_SIZE_FACTOR = 4
+
+
+@dataclass
+class LayoutChunking:
+    """
+    The thresholds of the chunked layout of very large documents, see `LayoutEngine`.
+    """
+
+    # The chunked layout is used for documents with at least `min_pages` Input Pages or `min_bytes` bytes
+    min_pages: int
+    min_bytes: int
+    # The largest number of Media Sheet Pages in a chunk
+    max_media_pages: int
+    # The limit of the estimated memory used by the pages of a chunk
+    max_memory_bytes: int
+    # The number of processes laying out the chunks of a document in parallel, 1 lays them out in the worker
+    processes: int = 1
+
+    def get_chunk_size(self, file_size: int, input_page_count: int, input_pages_per_media_page: float) -> Optional[int]:
+        """
+        :return: The number of Media Sheet Pages in a chunk or `None` if the document should not be chunked.
+        """
+
+        if input_page_count < self.min_pages and file_size < self.min_bytes:
+            return None
+        bytes_per_media_page = (
+            file_size / max(input_page_count, 1) * max(input_pages_per_media_page, 1) * PARSED_OBJECT_SIZE_FACTOR
+        )
+        return max(1, min(self.max_media_pages, int(self.max_memory_bytes // max(bytes_per_media_page, 1))))
+
+
+_layout_pool: Optional[ProcessPoolExecutor] = None
+_layout_pool_processes = 0
+_layout_pool_lock = threading.Lock()
+
+
+def _get_layout_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    Returns the pool of processes laying out the chunks, shared by all jobs processed by the worker.
+    """
+
+    global _layout_pool, _layout_pool_processes
+    with _layout_pool_lock:
+        if _layout_pool is None or _layout_pool_processes != processes:
+            if _layout_pool is not None:
+                _layout_pool.shutdown(wait=False)
+            # The processes are started by a fork server, so they do not inherit the threads and connections of the worker
+            _layout_pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('forkserver'))
+            _layout_pool_processes = processes
+        return _layout_pool
+
+
+def shutdown_layout_pool():
+    """
+    Waits for the processes laying out the chunks to exit. The pool is started again when it is needed.
+    """
+
+    global _layout_pool, _layout_pool_processes
+    with _layout_pool_lock:
+        if _layout_pool is not None:
+            _layout_pool.shutdown(wait=True)
+        _layout_pool = None
+        _layout_pool_processes = 0
+
+
+class LayoutEngine:
+    """
+    Creates the output PDF directly from the Input Pages by combining the n-up, fit-to-page and imposition
+    transformations of every Input Page into a single placement on a Media Sheet Page.
+
+    This gives the same result as `FinalPageProcessor.create_final_pages` followed by
+    `create_output_pdf` of the imposition processor, but every page is parsed and serialized only once
+    and the Final Pages are never written to disk.
+
+    If `allow_passthrough` is enabled and every Input Page would be placed on its own Media Sheet Page
+    without any transformation, the input file is used as the output without reading the page contents.
+
+    If `chunking` is set, very large documents are laid out in chunks of Media Sheet Pages. Every chunk is created
+    with a new `PdfWriter` and written to a part file, and the parts are appended to the output file in order,
+    with the resources shared by the chunks written only once. The parsed objects of the input file are released
+    after each chunk, so the memory used does not grow with the number of pages. If `chunking.processes` is
+    greater than 1, the chunks are laid out in parallel by a pool of processes, each reading the input file itself.
+    The chunks are always laid out with pypdf, the other documents with the engine selected by `PDF_ENGINE`.
+    """
+
+    work_dir: str
+    final_page_processor: FinalPageProcessor
+    imposition_processor: BaseImpositionProcessor
+    allow_passthrough: bool
+    chunking: Optional[LayoutChunking]
+
+    def __init__(self, work_dir: str, final_page_processor: FinalPageProcessor, imposition_processor: BaseImpositionProcessor,
+                 allow_passthrough: bool = False, chunking: Optional[LayoutChunking] = None):
+        self.work_dir = work_dir
+        self.final_page_processor = final_page_processor
+        self.imposition_processor = imposition_processor
+        self.allow_passthrough = allow_passthrough
+        self.chunking = chunking
+
+    def _is_identity_layout(self) -> bool:
+        """
+        Checks if the job settings place every Input Page alone on a Media Sheet Page, without rotating it.
+        """
+
+        return (
+            self.final_page_processor.rows == 1
+            and self.final_page_processor.columns == 1
+            and isinstance(self.imposition_processor, StandardImpositionProcessor)
+            and self.final_page_processor.final_page_orientation == PageOrientation.PORTRAIT
+        )
+
+    def _is_media_sized(self, boxes: PageBoxes) -> bool:
+        """
+        Checks if the page fills the whole Media Sheet Page, so it is neither scaled, moved nor clipped by the layout.
+        """
+
+        media_size = self.imposition_processor.media_size
+        left, bottom, right, top = boxes.mediabox
+        return (
+            boxes.rotation == 0
+            and boxes.cropbox == boxes.mediabox
+            and boxes.trimbox == boxes.mediabox
+            and abs(right - left - media_size.width_pt()) <= PASSTHROUGH_TOLERANCE_PT
+            and abs(top - bottom - media_size.height_pt()) <= PASSTHROUGH_TOLERANCE_PT
+        )
+
+    def _get_passthrough_result(self, input_pages_file: str, pages_to_print: str, duplex_enabled: bool) -> Optional[ImpositionResult]:
+        """
+        Returns the result of the layout if the output would be the same as `input_pages_file`, otherwise `None`.
+        """
+
+        if not self.allow_passthrough or not self._is_identity_layout():
+            return None
+        try:
+            page_boxes = read_page_boxes(input_pages_file)
+        except PdfIndexError:
+            return None
+
+        page_count = len(page_boxes)
+        selected_pages = self.final_page_processor._create_pages_to_print_iter(pages_to_print, page_count)
+        if page_count == 0 or list(selected_pages) != list(range(page_count)):
+            return None
+        # A blank page would be added to make the number of pages even
+        if duplex_enabled and page_count % 2 == 1:
+            return None
+        if not all(self._is_media_sized(boxes) for boxes in page_boxes):
+            return None
+        return ImpositionResult(
+            output_file=input_pages_file,
+            media_sheet_count=ceil_div(page_count, 2),
+            media_sheet_page_count=page_count,
+            passthrough=True,
+        )
+
+    def create_output_pdf(self, input_pages_file: str, pages_to_print: str, duplex_enabled: bool) -> ImpositionResult:
+        """
+        :raises NoPagesToPrintException: If `pages_to_print` does not select any Input Page.
+        """
+
+        passthrough_result = self._get_passthrough_result(input_pages_file, pages_to_print, duplex_enabled)
+        if passthrough_result is not None:
+            return passthrough_result
+
+        out = os.path.join(self.work_dir, 'output.pdf')
+        engine = get_pdf_engine()
+        page_boxes = engine.read_page_boxes(input_pages_file)
+
+        final_page_layouts = self.final_page_processor.get_final_page_layouts(page_boxes, pages_to_print)
+        imposition_layout = self.imposition_processor.get_imposition_layout(
+            len(final_page_layouts),
+            self.final_page_processor.final_page_orientation,
+            duplex_enabled,
+        )
+
+        media_page_placements = [
+            self._get_media_page_placements(media_page, final_page_layouts)
+            for media_page in imposition_layout.media_pages
+        ]
+        media_size = self.imposition_processor.media_size
+
+        chunk_size = None
+        if self.chunking is not None and media_page_placements:
+            input_placements = sum(len(placements) for placements in media_page_placements)
+            chunk_size = self.chunking.get_chunk_size(
+                os.path.getsize(input_pages_file),
+                len(page_boxes),
+                input_placements / len(media_page_placements),
+            )
+            # Both sides of a Media Sheet are laid out in the same chunk
+            if chunk_size is not None and duplex_enabled and chunk_size > 1:
+                chunk_size -= chunk_size % 2
+
+        if chunk_size is None:
+            engine.place_pages(
+                input_pages_file, out, media_size.width_pt(), media_size.height_pt(), media_page_placements,
+            )
+        else:
+            chunks = [
+                LayoutChunk(
+                    input_file=input_pages_file,
+                    media_width_pt=media_size.width_pt(),
+                    media_height_pt=media_size.height_pt(),
+                    media_pages=media_page_placements[start:start + chunk_size],
+                    part_file=os.path.join(self.work_dir, 'output-part-{}.bin'.format(index)),
+                )
+                for index, start in enumerate(range(0, len(media_page_placements), chunk_size))
+            ]
+            with open(out, "xb") as output_file:
+                output = ChunkedPdfWriter(output_file)
+                for part in self._lay_out_chunks(chunks):
+                    output.append_part(part)
+                    os.remove(part.path)
+                output.finish()
+        return ImpositionResult(
+            output_file=out,
+            media_sheet_count=imposition_layout.media_sheet_count,
+            media_sheet_page_count=imposition_layout.media_sheet_page_count,
+        )
+
+    @staticmethod
+    def _get_media_page_placements(media_page: List[Placement], final_page_layouts: List[List[Placement]]) -> List[Placement]:
+        """
+        Returns the placements of the Input Pages on a Media Sheet Page from the placements of its Final Pages.
+        """
+
+        placements = []
+        for final_page_placement in media_page:
+            for input_page_placement in final_page_layouts[final_page_placement.source_index]:
+                placement = compose_placements(input_page_placement, final_page_placement)
+                if placement is not None:
+                    placements.append(placement)
+        return placements
+
+    def _lay_out_chunks(self, chunks: List[LayoutChunk]) -> Iterable[PdfPart]:
+        """
+        Lays out the chunks and yields their parts in order.
+        """
+
+        if self.chunking.processes > 1 and len(chunks) > 1:
+            yield from _get_layout_pool(self.chunking.processes).map(lay_out_chunk_in_process, chunks)
+            return
+
+        reader = PdfReader(chunks[0].input_file)
+        for chunk in chunks:
+            yield lay_out_chunk(reader, chunk)
+            # The input objects parsed for this chunk are parsed again if they are needed by the next chunks.
+            # pypdf has no public method releasing them, the version range with `resolved_objects` is pinned
+            # in pyproject.toml.
+            reader.resolved_objects.clear()
@@ -0,0 +1,68 @@
+"""
+Layout of the chunks of Media Sheet Pages of very large documents, see `LayoutEngine`.
+
+This module only depends on pypdf, so the chunks can be laid out by a pool of processes which do not set up Django.
+"""
+
+import mmap
+from dataclasses import dataclass
+from typing import List
+
+from pypdf import PdfReader, PdfWriter
+
+from printing.processing.pdf_stream import PdfPart, write_pdf_part
+from printing.processing.placement import FormXObjectPlacer, Placement
+
+
+@dataclass(frozen=True)
+class LayoutChunk:
+    input_file: str
+    media_width_pt: float
+    media_height_pt: float
+    # The placements of the Input Pages on each Media Sheet Page of the chunk
+    media_pages: List[List[Placement]]
+    part_file: str
+
+
+def draw_media_pages(reader: PdfReader, writer: PdfWriter, media_width_pt: float, media_height_pt: float,
+                     media_pages: List[List[Placement]]) -> FormXObjectPlacer:
+    """
+    Adds the Media Sheet Pages to `writer`, with the pages of `reader` placed according to `media_pages`.
+    """
+
+    placer = FormXObjectPlacer(writer, reader.pages)
+    for placements in media_pages:
+        dest_page = writer.add_blank_page(width=media_width_pt, height=media_height_pt)
+        placer.draw(dest_page, placements)
+    return placer
+
+
+def lay_out_chunk(reader: PdfReader, chunk: LayoutChunk) -> PdfPart:
+    """
+    Lays out the Media Sheet Pages of `chunk` and writes them to its part file.
+    """
+
+    writer = PdfWriter()
+    placer = draw_media_pages(reader, writer, chunk.media_width_pt, chunk.media_height_pt, chunk.media_pages)
+
+    # The objects copied from the input file are identified by their object number in the input file,
+    # the Form XObjects are modified copies of the content streams, so they are identified by their page.
+    # pypdf has no public mapping of the copied objects, the version range using `_id_translated` is pinned
+    # in pyproject.toml.
+    shared_keys = {
+        writer_idnum: ('object', reader_idnum)
+        for reader_idnum, writer_idnum in writer._id_translated.get(id(reader), {}).items()
+        if reader_idnum != 'PreventGC'
+    }
+    shared_keys.update({form.idnum: ('form', source_index) for source_index, form in placer.forms.items()})
+    return write_pdf_part(writer, shared_keys, chunk.part_file)
+
+
+def lay_out_chunk_in_process(chunk: LayoutChunk) -> PdfPart:
+    """
+    Lays out `chunk` in a process of the layout pool. The input file is read through a read-only memory map,
+    so its pages in the page cache are shared by all processes laying out the chunks of the document.
+    """
+
+    with open(chunk.input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return lay_out_chunk(PdfReader(data), chunk)
@@ -0,0 +1,114 @@
+"""
+The conversion agent of a `printing.processing.office_pool.OfficeInstance`.
+
+This script is started inside the sandbox by the worker and must only depend on the standard library
+and the LibreOffice Python-UNO bridge (the `uno` module, e.g. from the `python3-uno` Debian package),
+because it runs with the system Python interpreter, not in the project virtual environment.
+
+Usage: office_agent.py INSTANCE_DIR
+
+The agent starts a headless LibreOffice instance with its user profile in INSTANCE_DIR/profile,
+listens on the UNIX socket INSTANCE_DIR/agent.sock and prints `READY` to stdout once it accepts requests.
+Each connection carries a single JSON request line `{"input": path, "output": path}` and receives
+a single JSON response line `{"ok": true}` or `{"ok": false, "error": message}`.
+The agent exits when LibreOffice stops responding.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+PIPE_NAME = 'gutenberg_office_agent'
+CONNECT_TIMEOUT_S = 60
+
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+def start_office(instance_dir):
+    profile_url = uno.systemPathToFileUrl(os.path.join(instance_dir, 'profile'))
+    return subprocess.Popen([
+        'soffice', '--headless', '--invisible', '--nologo', '--norestore', '--nodefault', '--nolockcheck',
+        '-env:UserInstallation=' + profile_url,
+        '--accept=pipe,name={};urp;StarOffice.ComponentContext'.format(PIPE_NAME),
+    ])
+
+
+def connect_desktop(office):
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext(
+        'com.sun.star.bridge.UnoUrlResolver', local_context)
+    deadline = time.monotonic() + CONNECT_TIMEOUT_S
+    while True:
+        try:
+            context = resolver.resolve('uno:pipe,name={};urp;StarOffice.ComponentContext'.format(PIPE_NAME))
+            return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+        except NoConnectException:
+            if office.poll() is not None or time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def convert(desktop, input_file, output_file):
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(input_file), '_blank', 0,
+        (_property('Hidden', True), _property('ReadOnly', True)),
+    )
+    if document is None:
+        raise ValueError('LibreOffice failed to load the document')
+    try:
+        document.storeToURL(
+            uno.systemPathToFileUrl(output_file),
+            (_property('FilterName', 'writer_pdf_Export'),),
+        )
+    finally:
+        document.close(True)
+
+
+def serve(instance_dir, office, desktop):
+    socket_path = os.path.join(instance_dir, 'agent.sock')
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    print('READY', flush=True)
+
+    while True:
+        connection, _ = server.accept()
+        with connection, connection.makefile('rwb') as stream:
+            request = json.loads(stream.readline())
+            try:
+                convert(desktop, request['input'], request['output'])
+                response = {'ok': True}
+            except Exception as ex:
+                response = {'ok': False, 'error': repr(ex)}
+            stream.write(json.dumps(response).encode('utf-8') + b'\n')
+            stream.flush()
+        if office.poll() is not None:
+            # The response has already been sent, the worker restarts the instance after noticing the exit.
+            sys.exit(1)
+
+
+def main():
+    instance_dir = sys.argv[1]
+    office = start_office(instance_dir)
+    try:
+        serve(instance_dir, office, connect_desktop(office))
+    finally:
+        office.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+import json
+import os
+import queue
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from django.conf import settings
+
+from printing.cancellation import on_cancel
+from printing.utils import SANDBOX_PATH, TASK_TIMEOUT_S, handle_current_cancellation, logger
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'office_agent.py')
+INSTANCE_START_TIMEOUT_S = 60
+
+
+class OfficeInstanceError(Exception):
+    """
+    Raised when a LibreOffice instance could not be started or stopped responding.
+    """
+    pass
+
+
+class OfficeConversionError(Exception):
+    """
+    Raised when a running LibreOffice instance failed to convert a document.
+    """
+    pass
+
+
+class OfficeInstance:
+    """
+    A single sandboxed LibreOffice process controlled by `office_agent.py`.
+
+    The instance directory is the only directory writable inside the sandbox. It contains the LibreOffice
+    user profile, which is kept between restarts, the UNIX socket of the agent and the files
+    of the current conversion.
+    """
+
+    def __init__(self, instance_dir: str):
+        self.instance_dir = instance_dir
+        self.process: Optional[subprocess.Popen] = None
+        self.conversions = 0
+
+    @property
+    def socket_path(self):
+        return os.path.join(self.instance_dir, 'agent.sock')
+
+    @property
+    def jobs_dir(self):
+        return os.path.join(self.instance_dir, 'jobs')
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        os.makedirs(os.path.join(self.instance_dir, 'profile'), exist_ok=True)
+        # `start_new_session` puts the sandbox in a new process group, so `stop` kills LibreOffice as well.
+        self.process = subprocess.Popen(
+            [SANDBOX_PATH, self.instance_dir, settings.LIBREOFFICE_POOL_PYTHON, AGENT_PATH, self.instance_dir],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self.conversions = 0
+
+        deadline = time.monotonic() + INSTANCE_START_TIMEOUT_S
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stop()
+                raise OfficeInstanceError('Timed out while starting LibreOffice')
+            readable, _, _ = select.select([self.process.stdout], [], [], remaining)
+            if not readable:
+                continue
+            line = self.process.stdout.readline()
+            if line.strip() == b'READY':
+                return
+            if line == b'':
+                self.stop()
+                raise OfficeInstanceError('The LibreOffice agent exited during startup')
+
+    def stop(self):
+        # `stop` can be called from the cancellation listener thread during a conversion
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+        process.stdout.close()
+
+    def convert(self, input_file: str, output_file: str, timeout: float):
+        if os.path.exists(self.jobs_dir):
+            shutil.rmtree(self.jobs_dir)
+        os.makedirs(self.jobs_dir)
+        sandbox_input = os.path.join(self.jobs_dir, 'input' + os.path.splitext(input_file)[1])
+        sandbox_output = os.path.join(self.jobs_dir, 'output.pdf')
+        shutil.copyfile(input_file, sandbox_input)
+
+        request = json.dumps({'input': sandbox_input, 'output': sandbox_output}).encode('utf-8') + b'\n'
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(self.socket_path)
+            connection.sendall(request)
+            with connection.makefile('rb') as stream:
+                response_line = stream.readline()
+        self.conversions += 1
+
+        if not response_line:
+            raise OfficeInstanceError('The LibreOffice agent exited during the conversion')
+        response = json.loads(response_line)
+        if not response['ok']:
+            raise OfficeConversionError(f"LibreOffice failed to convert the document: {response['error']}")
+        if not os.path.isfile(sandbox_output):
+            raise OfficeConversionError('Missing PDF after conversion by LibreOffice')
+        shutil.move(sandbox_output, output_file)
+
+
+class OfficePool:
+    """
+    A pool of warm LibreOffice instances shared by the threads of a worker.
+
+    Starting LibreOffice and creating its user profile takes most of the time of a `libreoffice --convert-to`
+    call, so the instances are kept running between conversions. An instance is restarted after
+    `max_conversions` conversions, to limit the effects of memory leaks, and after it crashes or exceeds
+    the per-conversion `timeout`.
+    """
+
+    def __init__(self, size: int, max_conversions: int, timeout: float, instance_factory=OfficeInstance):
+        self.base_dir = tempfile.mkdtemp(prefix='gutenberg-office-pool-')
+        self.max_conversions = max_conversions
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._instances = [instance_factory(os.path.join(self.base_dir, str(i))) for i in range(size)]
+        self._idle = queue.Queue()
+        for instance in self._instances:
+            self._idle.put(instance)
+
+    @contextmanager
+    def _checkout(self):
+        try:
+            instance = self._idle.get(timeout=TASK_TIMEOUT_S)
+        except queue.Empty:
+            raise OfficeInstanceError('No LibreOffice instance became available')
+        try:
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    @staticmethod
+    def _restart(instance: OfficeInstance):
+        instance.stop()
+        try:
+            instance.start()
+        except OfficeInstanceError:
+            # The next conversion using this instance will try to start it again.
+            logger.exception('Failed to restart a LibreOffice instance')
+
+    def prewarm(self):
+        """
+        Starts all instances which are not running yet.
+        """
+
+        for _ in self._instances:
+            with self._checkout() as instance:
+                if not instance.is_alive():
+                    try:
+                        instance.start()
+                    except OfficeInstanceError:
+                        logger.exception('Failed to start a LibreOffice instance')
+
+    def convert(self, input_file: str, output_file: str):
+        """
+        Converts `input_file` to a PDF stored at `output_file`.
+
+        :raises OfficeInstanceError: If no instance could be started or the instance crashed during the conversion;
+            the caller may fall back to the CLI.
+        :raises OfficeConversionError: If LibreOffice reported an error during the conversion.
+        :raises OSError: If the instance did not respond, e.g. `TimeoutError` if the conversion
+            did not finish within the timeout. The instance is restarted in this case.
+        :raises JobCanceledException: If the job has been canceled. The instance stopped by the cancellation
+            is started by the next conversion, so the canceled job does not wait for it.
+        """
+
+        with self._checkout() as instance:
+            handle_current_cancellation()
+            if not instance.is_alive():
+                instance.start()
+            try:
+                # Stopping the instance interrupts the conversion if the job is canceled
+                with on_cancel(instance.stop):
+                    instance.convert(input_file, output_file, self.timeout)
+            except OfficeConversionError:
+                raise
+            except (OSError, OfficeInstanceError):
+                handle_current_cancellation()
+                # Covers timeouts (`TimeoutError` is a subclass of `OSError`) and crashes of the agent.
+                self._restart(instance)
+                raise
+            finally:
+                if instance.conversions >= self.max_conversions and instance.is_alive():
+                    self._restart(instance)
+
+    def shutdown(self):
+        for instance in self._instances:
+            instance.stop()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+
+_office_pool: Optional[OfficePool] = None
+_office_pool_lock = threading.Lock()
+_office_pool_unavailable = False
+
+
+def _agent_python_available() -> bool:
+    try:
+        subprocess.run(
+            [settings.LIBREOFFICE_POOL_PYTHON, '-c', 'import uno'],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60,
+        )
+        return True
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def get_office_pool() -> Optional[OfficePool]:
+    """
+    Returns the LibreOffice pool of this worker process or `None` if the pool is disabled
+    with `LIBREOFFICE_POOL_SIZE = 0` or `LIBREOFFICE_POOL_PYTHON` cannot import the UNO bridge.
+    """
+
+    global _office_pool, _office_pool_unavailable
+    if not settings.LIBREOFFICE_POOL_SIZE or _office_pool_unavailable or shutil.which('soffice') is None:
+        return None
+    with _office_pool_lock:
+        # A pool inherited from the parent process (e.g. with the prefork worker pool) is not usable,
+        # as its instances are controlled by the parent.
+        if _office_pool is None or _office_pool.pid != os.getpid():
+            if not _agent_python_available():
+                logger.warning(f'{settings.LIBREOFFICE_POOL_PYTHON} cannot import the uno module, '
+                               f'the LibreOffice pool is disabled')
+                _office_pool_unavailable = True
+                return None
+            _office_pool = OfficePool(
+                settings.LIBREOFFICE_POOL_SIZE,
+                settings.LIBREOFFICE_POOL_MAX_CONVERSIONS,
+                settings.LIBREOFFICE_POOL_TIMEOUT_S,
+            )
+        return _office_pool
+
+
+def prewarm_office_pool():
+    pool = get_office_pool()
+    if pool is not None:
+        pool.prewarm()
+
+
+def shutdown_office_pool():
+    global _office_pool
+    with _office_pool_lock:
+        if _office_pool is not None and _office_pool.pid == os.getpid():
+            _office_pool.shutdown()
+        _office_pool = None
@@ -0,0 +1,165 @@
+"""
+The PDF libraries used to read the page geometry of the documents and to place their pages on the output pages.
+
+`PypdfEngine` is the default. `PikepdfEngine` uses libqpdf through pikepdf, which is considerably faster
+for large documents, and is used if `PDF_ENGINE` is set to `'pikepdf'` and pikepdf is installed.
+Both engines produce the same layout, see `printing/tests/printing/processing/test_pdf_engine.py`.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from pypdf import PdfReader, PdfWriter
+
+from printing.processing.layout_chunks import draw_media_pages
+from printing.processing.pdf_index import MAX_PAGE_TREE_DEPTH, PageBoxes, read_box
+from printing.processing.placement import Placement, form_name, format_placement
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+
+class PdfEngine(ABC):
+    """
+    The page geometry and placement operations used by the document processing.
+    """
+
+    name: str
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    @abstractmethod
+    def read_page_boxes(self, path: str) -> List[PageBoxes]:
+        """
+        Returns the boxes and the rotation of every page of the PDF document at `path`,
+        with the inherited attributes and the default boxes resolved.
+        """
+
+        pass
+
+    @abstractmethod
+    def place_pages(self, input_file: str, output_file: str, page_width_pt: float, page_height_pt: float,
+                    pages: List[List[Placement]]):
+        """
+        Creates the PDF document `output_file` with a page of the given size for every item of `pages`.
+        The pages of `input_file` are drawn on each page according to its placements, in order.
+
+        The annotations of the input pages are printed, so e.g. the filled form fields are visible in the output.
+        """
+
+        pass
+
+
+class PypdfEngine(PdfEngine):
+    name = 'pypdf'
+
+    def read_page_boxes(self, path: str) -> List[PageBoxes]:
+        return [
+            PageBoxes(
+                mediabox=read_box(page.mediabox),
+                cropbox=read_box(page.cropbox),
+                trimbox=read_box(page.trimbox),
+                rotation=page.rotation % 360,
+            )
+            for page in PdfReader(path).pages
+        ]
+
+    def place_pages(self, input_file: str, output_file: str, page_width_pt: float, page_height_pt: float,
+                    pages: List[List[Placement]]):
+        reader = PdfReader(input_file)
+        writer = PdfWriter()
+        draw_media_pages(reader, writer, page_width_pt, page_height_pt, pages)
+        with open(output_file, "xb") as f:
+            writer.write(f)
+
+
+def _get_inherited(page: "pikepdf.Dictionary", key: str) -> Optional["pikepdf.Object"]:
+    """
+    Returns the attribute `key` of the page, inherited from the nodes of the page tree if the page does not have it.
+    """
+
+    node = page
+    for _ in range(MAX_PAGE_TREE_DEPTH):
+        if key in node:
+            return node[key]
+        if '/Parent' not in node:
+            return None
+        node = node['/Parent']
+    return None
+
+
+class PikepdfEngine(PdfEngine):
+    name = 'pikepdf'
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return pikepdf is not None
+
+    def read_page_boxes(self, path: str) -> List[PageBoxes]:
+        result = []
+        with pikepdf.open(path) as pdf:
+            for page in pdf.pages:
+                mediabox = read_box(_get_inherited(page.obj, '/MediaBox'))
+                cropbox = _get_inherited(page.obj, '/CropBox')
+                cropbox = read_box(cropbox) if cropbox is not None else mediabox
+                trimbox = read_box(page.obj['/TrimBox']) if '/TrimBox' in page.obj else cropbox
+                rotation = _get_inherited(page.obj, '/Rotate')
+                result.append(PageBoxes(
+                    mediabox=mediabox,
+                    cropbox=cropbox,
+                    trimbox=trimbox,
+                    rotation=int(rotation if rotation is not None else 0) % 360,
+                ))
+        return result
+
+    @staticmethod
+    def _create_form(output: "pikepdf.Pdf", page: "pikepdf.Page") -> "pikepdf.Object":
+        # The placements already include the rotation of the page
+        form = page.as_form_xobject(handle_transformations=False)
+        # qpdf uses the trim box as the bounding box, the placements are clipped to the crop box
+        form['/BBox'] = pikepdf.Array([float(value) for value in read_box(_get_inherited(page.obj, '/MediaBox'))])
+        return output.copy_foreign(form)
+
+    def place_pages(self, input_file: str, output_file: str, page_width_pt: float, page_height_pt: float,
+                    pages: List[List[Placement]]):
+        with pikepdf.open(input_file) as source, pikepdf.new() as output:
+            # The appearances of the printable annotations are drawn into the page contents
+            source.flatten_annotations('print')
+            forms: Dict[int, pikepdf.Object] = {}
+            for placements in pages:
+                output.add_blank_page(page_size=(page_width_pt, page_height_pt))
+                if not placements:
+                    continue
+                xobjects = pikepdf.Dictionary()
+                operations = []
+                for placement in placements:
+                    if placement.source_index not in forms:
+                        forms[placement.source_index] = self._create_form(output, source.pages[placement.source_index])
+                    name = form_name(placement.source_index)
+                    xobjects[name] = forms[placement.source_index]
+                    operations.append(format_placement(placement, name))
+                page = output.pages[-1]
+                page.obj['/Resources'] = pikepdf.Dictionary({'/XObject': xobjects})
+                page.obj['/Contents'] = output.make_stream('\n'.join(operations).encode('ascii'))
+            output.save(output_file)
+
+
+PDF_ENGINES = {engine.name: engine for engine in (PypdfEngine, PikepdfEngine)}
+
+
+def get_pdf_engine() -> PdfEngine:
+    """
+    Returns the PDF engine selected by the `PDF_ENGINE` setting.
+    """
+
+    engine_class = PDF_ENGINES.get(settings.PDF_ENGINE)
+    if engine_class is None:
+        raise ValueError(f"Unknown PDF engine: {settings.PDF_ENGINE}")
+    if not engine_class.is_available():
+        raise ValueError(f"The PDF engine {settings.PDF_ENGINE} is not installed")
+    return engine_class()
@@ -0,0 +1,191 @@
+"""
+A lightweight index of a PDF document: the page count, the page sizes and the dominant orientation.
+
+Only the cross-reference table and the page tree are read, the page contents are never parsed,
+so indexing takes about the same time for a document with simple and complex pages.
+The index of the uploaded documents is stored on `JobArtefact`, see `printing.ingestion`.
+"""
+
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from pypdf import PdfReader, PasswordType
+from pypdf.errors import PyPdfError
+from pypdf.generic import DictionaryObject, IndirectObject
+
+from printing.processing.pages import PageOrientation
+
+logger = logging.getLogger('gutenberg.worker')
+
+# The maximum depth of the page tree, deeper trees are most likely malformed
+MAX_PAGE_TREE_DEPTH = 64
+
+
+class PdfIndexError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class PdfIndex:
+    # `None` if the document is encrypted and cannot be opened without a password
+    page_count: Optional[int]
+    # The number of pages of each media box size, the keys are `<width>x<height>` in points
+    page_sizes: Dict[str, int] = field(default_factory=dict)
+    orientation: PageOrientation = PageOrientation.PORTRAIT
+    encrypted: bool = False
+
+
+def _page_size_key(mediabox) -> Optional[str]:
+    try:
+        left, bottom, right, top = [float(value) for value in mediabox]
+    except (TypeError, ValueError):
+        return None
+    return '{}x{}'.format(round(abs(right - left)), round(abs(top - bottom)))
+
+
+def _get_dominant_orientation(page_sizes: Dict[str, int]) -> PageOrientation:
+    vertical_page_count = 0
+    horizontal_page_count = 0
+    for size, count in page_sizes.items():
+        width, height = [int(value) for value in size.split('x')]
+        if height > width:
+            vertical_page_count += count
+        if width > height:
+            horizontal_page_count += count
+
+    if horizontal_page_count + vertical_page_count == 0:
+        logger.warning("Failed to determine the orientation of the document")
+    return PageOrientation.LANDSCAPE if horizontal_page_count > vertical_page_count else PageOrientation.PORTRAIT
+
+
+# The page attributes inherited from the ancestors of a page, like in `PageObject`
+INHERITABLE_ATTRIBUTES = ('/MediaBox', '/CropBox', '/Rotate')
+
+
+def _iter_pages(root: DictionaryObject):
+    """
+    Yields the dictionary of each page with the values of `INHERITABLE_ATTRIBUTES` set on the page
+    or inherited from its ancestors.
+    """
+
+    visited = set()
+    # The tree is walked with an explicit stack, as documents may have thousands of pages
+    stack = [(root, {}, 0)]
+    while stack:
+        node, inherited, depth = stack.pop()
+        reference = node if isinstance(node, IndirectObject) else node.indirect_reference
+        if reference is not None:
+            if reference.idnum in visited:
+                raise PdfIndexError('The page tree contains a cycle')
+            visited.add(reference.idnum)
+        node = node.get_object()
+        attributes = dict(inherited)
+        for name in INHERITABLE_ATTRIBUTES:
+            if name in node:
+                attributes[name] = node[name].get_object()
+
+        if '/Kids' not in node:
+            yield node, attributes
+            continue
+        if depth >= MAX_PAGE_TREE_DEPTH:
+            raise PdfIndexError('The page tree is too deep')
+        # The kids are pushed in the reverse order, so the stack does not change the order of the pages
+        for kid in reversed(node['/Kids'].get_object()):
+            stack.append((kid, attributes, depth + 1))
+
+
+def _walk_page_tree(root: DictionaryObject) -> Counter:
+    """
+    Returns the number of pages of each media box size, including the `None` size for pages without a media box.
+    """
+
+    page_sizes = Counter()
+    for _, attributes in _iter_pages(root):
+        mediabox = attributes.get('/MediaBox')
+        page_sizes[_page_size_key(mediabox) if mediabox is not None else None] += 1
+    return page_sizes
+
+
+def index_pdf(path: str) -> PdfIndex:
+    """
+    Reads the page tree of the PDF document at `path`.
+    Encrypted documents are opened with the empty user password if possible,
+    otherwise only the `encrypted` flag is set in the result.
+
+    :raises PdfIndexError: If the document cannot be read.
+    """
+
+    try:
+        reader = PdfReader(path)
+        encrypted = reader.is_encrypted
+        if encrypted and reader.decrypt('') == PasswordType.NOT_DECRYPTED:
+            return PdfIndex(page_count=None, encrypted=True)
+        page_sizes = _walk_page_tree(reader.trailer['/Root'].get_object()['/Pages'])
+    except (PyPdfError, OSError, KeyError, TypeError, ValueError, AttributeError, RecursionError) as ex:
+        if isinstance(ex, PdfIndexError):
+            raise
+        raise PdfIndexError('Failed to read the page tree of {}: {!r}'.format(path, ex)) from ex
+
+    page_count = sum(page_sizes.values())
+    page_sizes.pop(None, None)
+    page_sizes = dict(page_sizes)
+    return PdfIndex(
+        page_count=page_count,
+        page_sizes=page_sizes,
+        orientation=_get_dominant_orientation(page_sizes),
+        encrypted=encrypted,
+    )
+
+
+@dataclass(frozen=True)
+class PageBoxes:
+    """
+    The boxes of a page as `(left, bottom, right, top)` in points and its `/Rotate` attribute.
+    The missing boxes have their default values, e.g. the trim box of a page without one is its crop box.
+    """
+
+    mediabox: Tuple[float, float, float, float]
+    cropbox: Tuple[float, float, float, float]
+    trimbox: Tuple[float, float, float, float]
+    rotation: int
+
+
+def read_box(box) -> Tuple[float, float, float, float]:
+    """
+    Returns the rectangle `box` as `(left, bottom, right, top)`, regardless of the order of its corners.
+    """
+
+    x1, y1, x2, y2 = [float(value) for value in box]
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+def read_page_boxes(path: str) -> List[PageBoxes]:
+    """
+    Reads the boxes of every page of the PDF document at `path` from the page tree, without parsing the page contents.
+
+    :raises PdfIndexError: If the document cannot be read, a page does not have a media box
+        or the document is encrypted.
+    """
+
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted:
+            raise PdfIndexError('{} is encrypted'.format(path))
+        result = []
+        for page, attributes in _iter_pages(reader.trailer['/Root'].get_object()['/Pages']):
+            mediabox = read_box(attributes['/MediaBox'])
+            cropbox = read_box(attributes['/CropBox']) if '/CropBox' in attributes else mediabox
+            trimbox = read_box(page['/TrimBox'].get_object()) if '/TrimBox' in page else cropbox
+            result.append(PageBoxes(
+                mediabox=mediabox,
+                cropbox=cropbox,
+                trimbox=trimbox,
+                rotation=int(attributes.get('/Rotate', 0)) % 360,
+            ))
+    except (PyPdfError, OSError, KeyError, TypeError, ValueError, AttributeError, RecursionError) as ex:
+        if isinstance(ex, PdfIndexError):
+            raise
+        raise PdfIndexError('Failed to read the page tree of {}: {!r}'.format(path, ex)) from ex
+    return result
@@ -0,0 +1,243 @@
+"""
+Writing PDF documents object by object, without keeping the written objects in memory.
+"""
+
+import io
+import re
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Hashable, List, Optional
+
+from pypdf import PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, PdfObject, StreamObject
+
+
+class PdfStreamWriter:
+    """
+    Writes a PDF document with a flat page tree directly to `f`.
+
+    The objects are written as soon as they are added, only their offsets are kept for the cross-reference table.
+    The pages must have `/Parent` set to `PAGES_ID`.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.offsets: Dict[int, int] = {}
+        self.next_id = 3
+        self.page_ids: List[int] = []
+        f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def allocate_id(self) -> int:
+        """
+        Reserves the number of an object which is written later with `write_object`,
+        e.g. because it is referenced by an object written earlier.
+        """
+
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+
+    def write_object(self, object_id: int, data: bytes, stream: Optional[bytes] = None):
+        """
+        Writes the object `object_id`, `data` is the serialized object or the dictionary of the stream `stream`.
+        """
+
+        self.offsets[object_id] = self.f.tell()
+        self.f.write('{} 0 obj\n'.format(object_id).encode())
+        self.f.write(data)
+        if stream is not None:
+            self.f.write(b'\nstream\n')
+            self.f.write(stream)
+            self.f.write(b'\nendstream')
+        self.f.write(b'\nendobj\n')
+
+    def add_object(self, data: bytes, stream: Optional[bytes] = None) -> int:
+        object_id = self.allocate_id()
+        self.write_object(object_id, data, stream)
+        return object_id
+
+    def add_stream(self, dictionary: str, data: bytes) -> int:
+        return self.add_object('<< {} /Length {} >>'.format(dictionary, len(data)).encode(), data)
+
+    def add_page_id(self, page_id: int):
+        """
+        Appends the page written as the object `page_id` to the page tree.
+        """
+
+        self.page_ids.append(page_id)
+
+    def finish(self):
+        """
+        Writes the page tree, the catalog and the cross-reference table.
+        """
+
+        self.write_object(self.PAGES_ID, '<< /Type /Pages /Kids [{}] /Count {} >>'.format(
+            ' '.join('{} 0 R'.format(page_id) for page_id in self.page_ids), len(self.page_ids),
+        ).encode())
+        self.write_object(self.CATALOG_ID, '<< /Type /Catalog /Pages {} 0 R >>'.format(self.PAGES_ID).encode())
+
+        xref_offset = self.f.tell()
+        self.f.write('xref\n0 {}\n0000000000 65535 f \n'.format(self.next_id).encode())
+        for object_id in range(1, self.next_id):
+            self.f.write('{:010d} 00000 n \n'.format(self.offsets[object_id]).encode())
+        self.f.write('trailer\n<< /Size {} /Root {} 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+            self.next_id, self.CATALOG_ID, xref_offset,
+        ).encode())
+
+
+# The marker of the reference to the object with the given index in a `PdfPart`.
+# The serialized objects do not contain NUL bytes outside of the stream data, pypdf escapes them in strings and names.
+PART_REFERENCE_RE = re.compile(rb'\x00(\d+)\x00')
+
+
+class _PartReference(IndirectObject):
+    """
+    A reference to the object with the index `idnum` in a `PdfPart`.
+    """
+
+    def write_to_stream(self, stream, encryption_key=None):
+        stream.write(b'\x00%d\x00' % self.idnum)
+
+
+@dataclass(frozen=True)
+class PdfPartObject:
+    # The key identifying the object if it can also be used by the other parts
+    key: Optional[Hashable]
+    # The position of the serialized object in the part file, followed by the stream data if it is a stream
+    offset: int
+    length: int
+    stream_length: Optional[int]
+
+
+@dataclass(frozen=True)
+class PdfPart:
+    """
+    The pages of a part of a document and all objects they reference, written by `write_pdf_part`
+    to be appended to the document by `ChunkedPdfWriter`.
+
+    The object numbers are assigned when the part is appended, so the references in the part file
+    are markers with the index of the object in `objects`.
+    """
+
+    path: str
+    page_indices: List[int]
+    objects: List[PdfPartObject]
+
+
+def write_pdf_part(writer: PdfWriter, shared_keys: Dict[int, Hashable], path: str) -> PdfPart:
+    """
+    Writes the pages of `writer` with all objects they reference to the part file `path`.
+
+    :param shared_keys: The keys of the objects of `writer` which may also be used by the other parts,
+        by their object number in `writer`.
+    """
+
+    pages_idnum = writer.root_object.raw_get('/Pages').idnum
+    catalog_idnum = writer.root_object.indirect_reference.idnum
+    indices: Dict[int, int] = {}
+    objects: List[Optional[PdfPartObject]] = []
+    pending = []
+    # The direct objects which have already been processed, they may be shared by multiple objects
+    visited = set()
+
+    def get_reference(reference: IndirectObject) -> IndirectObject:
+        if reference.pdf is not writer:
+            reference = reference.clone(writer)
+        if reference.idnum == pages_idnum:
+            return IndirectObject(PdfStreamWriter.PAGES_ID, 0, writer)
+        if reference.idnum == catalog_idnum:
+            return IndirectObject(PdfStreamWriter.CATALOG_ID, 0, writer)
+        if reference.idnum not in indices:
+            indices[reference.idnum] = len(objects)
+            objects.append(None)
+            pending.append(reference.idnum)
+        return _PartReference(indices[reference.idnum], 0, writer)
+
+    page_indices = [get_reference(page.indirect_reference).idnum for page in writer.pages]
+    with open(path, 'xb') as f:
+        while pending:
+            idnum = pending.pop()
+            obj = writer.get_object(idnum)
+            _replace_references(obj, get_reference, visited)
+            buffer = io.BytesIO()
+            obj.write_to_stream(buffer)
+            data = buffer.getvalue()
+            stream = None
+            if isinstance(obj, StreamObject):
+                # pypdf writes the dictionary of the stream followed by the data between the `stream` and `endstream` keywords
+                data, _, stream = data.partition(b'\nstream\n')
+                stream = stream[:-len(b'\nendstream')]
+            objects[indices[idnum]] = PdfPartObject(
+                key=shared_keys.get(idnum),
+                offset=f.tell(),
+                length=len(data),
+                stream_length=len(stream) if stream is not None else None,
+            )
+            f.write(data)
+            if stream is not None:
+                f.write(stream)
+    return PdfPart(path, page_indices, objects)
+
+
+def _replace_references(obj: PdfObject, get_reference: Callable[[IndirectObject], IndirectObject], visited: set):
+    """
+    Replaces the references in the direct objects contained in `obj` with the results of `get_reference`.
+    """
+
+    if id(obj) in visited:
+        return
+    visited.add(id(obj))
+    if isinstance(obj, DictionaryObject):
+        items = list(obj.items())
+    elif isinstance(obj, ArrayObject):
+        items = list(enumerate(obj))
+    else:
+        return
+    for key, value in items:
+        if isinstance(value, IndirectObject):
+            obj[key] = get_reference(value)
+        else:
+            _replace_references(value, get_reference, visited)
+
+
+class ChunkedPdfWriter(PdfStreamWriter):
+    """
+    Writes a document from `PdfPart`s, each with a part of its pages, to a single PDF file.
+
+    The objects which are shared by the parts, e.g. the fonts copied from the same source document,
+    are identified by their keys and written only once.
+    """
+
+    def __init__(self, f: BinaryIO):
+        super().__init__(f)
+        self._shared_ids: Dict[Hashable, int] = {}
+
+    def append_part(self, part: PdfPart):
+        """
+        Appends the pages of `part` to the document. The objects written by the earlier parts are not written again.
+        """
+
+        output_ids = []
+        new_objects = []
+        for part_object in part.objects:
+            if part_object.key is not None and part_object.key in self._shared_ids:
+                output_ids.append(self._shared_ids[part_object.key])
+                continue
+            output_ids.append(self.allocate_id())
+            if part_object.key is not None:
+                self._shared_ids[part_object.key] = output_ids[-1]
+            new_objects.append((part_object, output_ids[-1]))
+        for index in part.page_indices:
+            self.add_page_id(output_ids[index])
+
+        def replace_reference(match: re.Match) -> bytes:
+            return b'%d 0 R' % output_ids[int(match.group(1))]
+
+        with open(part.path, 'rb') as f:
+            for part_object, object_id in sorted(new_objects, key=lambda item: item[0].offset):
+                f.seek(part_object.offset)
+                data = PART_REFERENCE_RE.sub(replace_reference, f.read(part_object.length))
+                stream = f.read(part_object.stream_length) if part_object.stream_length is not None else None
+                self.write_object(object_id, data, stream)
@@ -0,0 +1,308 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from pypdf import PageObject, PdfWriter, Transformation
+from pypdf.constants import AnnotationFlag
+from pypdf.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, PdfObject, RectangleObject,
+    StreamObject,
+)
+
+
+@dataclass(frozen=True)
+class Placement:
+    """
+    Describes how a page of a source PDF is drawn on a target page.
+
+    `transformation` maps the coordinates of the source page to the coordinates of the target page.
+    It includes the `/Rotate` attribute of the source page, which is ignored when merging pages.
+    `clip` is the visible region in the coordinates of the target page.
+    """
+
+    source_index: int
+    transformation: Transformation
+    clip: RectangleObject
+
+
+def rotation_transformation(mediabox: RectangleObject, rotation: int) -> Transformation:
+    """
+    Returns the transformation applied by `PageObject.transfer_rotation_to_content` to a page
+    with the given media box and `/Rotate` attribute.
+    """
+
+    transformation = (
+        Transformation()
+        .translate(-float(mediabox.left + mediabox.width / 2), -float(mediabox.bottom + mediabox.height / 2))
+        .rotate(-rotation)
+    )
+    x1, y1 = transformation.apply_on(mediabox.lower_left)
+    x2, y2 = transformation.apply_on(mediabox.upper_right)
+    return transformation.translate(-min(x1, x2), -min(y1, y2))
+
+
+def transform_rect(transformation: Transformation, rect: RectangleObject) -> RectangleObject:
+    """
+    Returns the bounding box of `rect` after applying `transformation`.
+    """
+
+    corners = [
+        transformation.apply_on((float(x), float(y)))
+        for x in (rect.left, rect.right)
+        for y in (rect.bottom, rect.top)
+    ]
+    xs = [corner[0] for corner in corners]
+    ys = [corner[1] for corner in corners]
+    return RectangleObject((min(xs), min(ys), max(xs), max(ys)))
+
+
+def intersect_rects(first: RectangleObject, second: RectangleObject) -> Optional[RectangleObject]:
+    """
+    Returns the intersection of two rectangles or `None` if it is empty.
+    """
+
+    left = max(first.left, second.left)
+    bottom = max(first.bottom, second.bottom)
+    right = min(first.right, second.right)
+    top = min(first.top, second.top)
+    if left >= right or bottom >= top:
+        return None
+    return RectangleObject((left, bottom, right, top))
+
+
+def invert_transformation(transformation: Transformation) -> Transformation:
+    a, b, c, d, e, f = transformation.ctm
+    det = a * d - b * c
+    return Transformation((d / det, -b / det, -c / det, a / det, (c * f - d * e) / det, (b * e - a * f) / det))
+
+
+def compose_placements(inner: Placement, outer: Placement) -> Optional[Placement]:
+    """
+    Combines the placement of a source page on an intermediate page (`inner`) with the placement
+    of the intermediate page on the target page (`outer`).
+
+    Returns `None` if no part of the source page is visible on the target page.
+    """
+
+    clip = intersect_rects(transform_rect(outer.transformation, inner.clip), outer.clip)
+    if clip is None:
+        return None
+    return Placement(
+        source_index=inner.source_index,
+        transformation=inner.transformation.transform(outer.transformation),
+        clip=clip,
+    )
+
+
+def merge_placement(target: PageObject, page: PageObject, placement: Placement):
+    """
+    Draws `page` on `target` according to `placement`.
+
+    `page` is not modified, so it can be placed multiple times.
+    """
+
+    # `merge_transformed_page` clips the merged content to the crop box in the coordinates of the source page,
+    # so the clip region is temporarily set as the crop box.
+    original_cropbox = page.get(NameObject('/CropBox'))
+    page.cropbox = transform_rect(invert_transformation(placement.transformation), placement.clip)
+    try:
+        target.merge_transformed_page(page, placement.transformation)
+    finally:
+        if original_cropbox is None:
+            del page[NameObject('/CropBox')]
+        else:
+            page[NameObject('/CropBox')] = original_cropbox
+
+
+def add_indirect_object(writer: PdfWriter, obj: PdfObject) -> IndirectObject:
+    """
+    Adds a new object to `writer` and returns the reference to it.
+
+    pypdf has no public method adding an object created from scratch, but cloning an object marked as indirect
+    adds the clone to the writer.
+    """
+
+    obj.indirect_reference = None
+    return obj.clone(writer).indirect_reference
+
+
+def _format_number(value: float) -> str:
+    return '{:.6f}'.format(value).rstrip('0').rstrip('.') or '0'
+
+
+def form_name(source_index: int) -> NameObject:
+    """
+    Returns the resource name of the Form XObject with the source page `source_index`.
+    """
+
+    return NameObject('/GbPage{}'.format(source_index))
+
+
+def format_placement(placement: Placement, name: str) -> str:
+    """
+    Returns the content stream operators drawing the Form XObject `name` of the source page according to `placement`.
+    """
+
+    clip = placement.clip
+    return 'q {} {} {} {} re W n {} cm {} Do Q'.format(
+        *(_format_number(float(value)) for value in (clip.left, clip.bottom, clip.width, clip.height)),
+        ' '.join(_format_number(value) for value in placement.transformation.ctm),
+        name,
+    )
+
+
+class FormXObjectPlacer:
+    """
+    Draws the pages of a source PDF on the pages of `writer` as Form XObjects.
+
+    Each source page is copied to the output once, as a Form XObject with its content stream and resources,
+    and every placement only adds a `re W n`, `cm` and `Do` sequence to the content stream of the target page.
+    Unlike `merge_placement`, the content stream of the source page is never parsed or rewritten
+    and the resources shared by the source pages (e.g. fonts) are copied once.
+
+    The appearances of the printable annotations (e.g. the filled form fields) are drawn into the Form XObject,
+    like by `PikepdfEngine`, so they are printed wherever the page is placed. The other annotations
+    (e.g. the links) are not copied to the output.
+    """
+
+    def __init__(self, writer: PdfWriter, source_pages: Sequence[PageObject]):
+        self.writer = writer
+        self.source_pages = source_pages
+        self._forms: Dict[int, IndirectObject] = {}
+
+    @property
+    def forms(self) -> Dict[int, IndirectObject]:
+        """
+        The Form XObjects created so far, by the index of their source page.
+        """
+
+        return self._forms
+
+    @staticmethod
+    def _get_printed_appearance(annotation: DictionaryObject) -> Optional[StreamObject]:
+        """
+        Returns the appearance stream of `annotation` which is printed or `None` if it is not printed.
+        """
+
+        flags = annotation.get('/F', 0)
+        if not flags & AnnotationFlag.PRINT or flags & AnnotationFlag.HIDDEN or '/Rect' not in annotation:
+            return None
+        appearances = annotation.get('/AP')
+        appearance = appearances.get_object().get('/N') if appearances is not None else None
+        appearance = appearance.get_object() if appearance is not None else None
+        if isinstance(appearance, DictionaryObject) and not isinstance(appearance, StreamObject):
+            # The appearances of the states of check boxes and radio buttons
+            appearance = appearance.get(annotation.get('/AS'))
+            appearance = appearance.get_object() if appearance is not None else None
+        if not isinstance(appearance, StreamObject) or '/BBox' not in appearance:
+            return None
+        return appearance
+
+    def _draw_annotations(self, page: PageObject, xobjects: DictionaryObject) -> List[str]:
+        """
+        Adds the printed appearances of the annotations of `page` to `xobjects` and returns the operators drawing them
+        in the coordinates of the page, as described in the PDF specification (12.5.5 Appearance streams).
+        """
+
+        operations = []
+        annotations = page.get('/Annots')
+        for annotation in annotations.get_object() if annotations is not None else []:
+            annotation = annotation.get_object()
+            appearance = self._get_printed_appearance(annotation)
+            if appearance is None:
+                continue
+            bbox = transform_rect(Transformation(tuple(appearance.get('/Matrix', (1, 0, 0, 1, 0, 0)))),
+                                  RectangleObject(appearance['/BBox']))
+            if bbox.width == 0 or bbox.height == 0:
+                continue
+            rect = RectangleObject(annotation['/Rect'])
+            transformation = (
+                Transformation()
+                .translate(-float(bbox.left), -float(bbox.bottom))
+                .scale(float(rect.width / bbox.width), float(rect.height / bbox.height))
+                .translate(float(rect.left), float(rect.bottom))
+            )
+            name = NameObject('/GbAnnot{}'.format(len(operations)))
+            xobjects[name] = appearance.clone(self.writer).indirect_reference
+            operations.append('q {} cm {} Do Q'.format(
+                ' '.join(_format_number(value) for value in transformation.ctm), name,
+            ))
+        return operations
+
+    def _create_form(self, page: PageObject) -> IndirectObject:
+        resources = page.get('/Resources')
+        resources = resources.get_object().clone(self.writer) if resources is not None else None
+        annotation_xobjects = DictionaryObject()
+        annotation_operations = self._draw_annotations(page, annotation_xobjects)
+
+        contents = page.get('/Contents')
+        contents = contents.get_object() if contents is not None else None
+        if isinstance(contents, StreamObject) and not annotation_operations:
+            # The encoded data is copied as it is, the copy is modified, so it must not be shared
+            form = contents.clone(self.writer, force_duplicate=True)
+            form = form.get_object()
+        else:
+            if isinstance(contents, StreamObject):
+                contents = [contents]
+            data = b'\n'.join(stream.get_object().get_data() for stream in contents) if contents is not None else b''
+            if annotation_operations:
+                # The graphics state of the page must not affect the annotations
+                data = b'q\n' + data + b'\nQ\n' + '\n'.join(annotation_operations).encode('ascii')
+            form = DecodedStreamObject()
+            form.set_data(data)
+            form = form.flate_encode()
+
+        form[NameObject('/Type')] = NameObject('/XObject')
+        form[NameObject('/Subtype')] = NameObject('/Form')
+        form[NameObject('/BBox')] = RectangleObject(page.mediabox)
+        if annotation_operations:
+            # The resources of the page may be shared with other pages, so they are copied before the appearances
+            # of the annotations are added
+            resources = DictionaryObject(resources.items()) if resources is not None else DictionaryObject()
+            xobjects = resources.get('/XObject')
+            xobjects = DictionaryObject(xobjects.get_object().items()) if xobjects is not None else DictionaryObject()
+            xobjects.update(annotation_xobjects)
+            resources[NameObject('/XObject')] = xobjects
+        if resources is not None:
+            form[NameObject('/Resources')] = resources
+        # The cloned streams are already added to the writer
+        if getattr(form, 'indirect_reference', None) is not None:
+            return form.indirect_reference
+        return add_indirect_object(self.writer, form)
+
+    def _get_form(self, source_index: int) -> IndirectObject:
+        if source_index not in self._forms:
+            self._forms[source_index] = self._create_form(self.source_pages[source_index])
+        return self._forms[source_index]
+
+    def _append_content(self, target: PageObject, operations: List[str], forms: Dict[NameObject, IndirectObject]):
+        if not operations:
+            return
+        resources = target.setdefault(NameObject('/Resources'), DictionaryObject()).get_object()
+        xobjects = resources.setdefault(NameObject('/XObject'), DictionaryObject()).get_object()
+        xobjects.update(forms)
+
+        content = DecodedStreamObject()
+        content.set_data('\n'.join(operations).encode('ascii'))
+        content_ref = add_indirect_object(self.writer, content.flate_encode())
+        existing = target.get('/Contents')
+        if existing is None:
+            target[NameObject('/Contents')] = content_ref
+            return
+        existing = existing.get_object()
+        if isinstance(existing, ArrayObject):
+            existing.append(content_ref)
+        else:
+            target[NameObject('/Contents')] = ArrayObject([target.raw_get('/Contents'), content_ref])
+
+    def draw(self, target: PageObject, placements: Iterable[Placement]):
+        """
+        Draws the source pages on `target` according to `placements`, in order.
+        """
+
+        operations = []
+        forms = {}
+        for placement in placements:
+            name = form_name(placement.source_index)
+            forms[name] = self._get_form(placement.source_index)
+            operations.append(format_placement(placement, name))
+        self._append_content(target, operations, forms)
@@ -0,0 +1,264 @@
+"""
+In-process conversion of PWG Raster documents (PWG 5102.4) to PDF.
+
+The raster is decoded one page at a time: the page header is parsed, the compressed lines are expanded
+into the raw pixel rows of the page, and the rows are stored in the PDF as a single `FlateDecode` image.
+The PDF is written directly to the output file, so only a single page is kept in memory.
+"""
+
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Tuple
+
+from printing.processing.pdf_stream import PdfStreamWriter
+
+PWG_SYNC_WORD = b'RaS2'
+PWG_HEADER_SIZE = 1796
+READ_BLOCK_SIZE = 256 * 1024
+# The largest page which is decoded, about an A4 page at 600 DPI with 16-bit RGB color
+MAX_PAGE_BYTES = 256 * 1024 * 1024
+ZLIB_LEVEL = 6
+
+# The values of `cupsColorSpace`
+CSPACE_W = 0
+CSPACE_RGB = 1
+CSPACE_K = 3
+CSPACE_CMYK = 6
+CSPACE_SW = 18
+CSPACE_SRGB = 19
+CSPACE_ADOBE_RGB = 20
+
+# The PDF color space and the number of colors of each supported `cupsColorSpace`
+PDF_COLOR_SPACES = {
+    CSPACE_W: ('/DeviceGray', 1),
+    CSPACE_SW: ('/DeviceGray', 1),
+    CSPACE_K: ('/DeviceGray', 1),
+    CSPACE_RGB: ('/DeviceRGB', 3),
+    CSPACE_SRGB: ('/DeviceRGB', 3),
+    CSPACE_ADOBE_RGB: ('/DeviceRGB', 3),
+    CSPACE_CMYK: ('/DeviceCMYK', 4),
+}
+# In these color spaces 0 is no ink, so it is white
+SUBTRACTIVE_COLOR_SPACES = {CSPACE_K, CSPACE_CMYK}
+
+
+class PwgRasterError(ValueError):
+    pass
+
+
+class UnsupportedRasterError(PwgRasterError):
+    """The raster is valid, but uses features which are not supported by the decoder, e.g. banded color order."""
+
+
+@dataclass(frozen=True)
+class PwgPageHeader:
+    # In dots per inch
+    resolution: Tuple[int, int]
+    # In points
+    page_size: Tuple[int, int]
+    width: int
+    height: int
+    bits_per_color: int
+    bits_per_pixel: int
+    bytes_per_line: int
+    color_order: int
+    color_space: int
+    num_colors: int
+
+    @classmethod
+    def parse(cls, data: bytes) -> "PwgPageHeader":
+        resolution = struct.unpack_from('>II', data, 276)
+        page_size = struct.unpack_from('>II', data, 352)
+        width, height, _, bits_per_color, bits_per_pixel, bytes_per_line, color_order, color_space = \
+            struct.unpack_from('>8I', data, 372)
+        num_colors, = struct.unpack_from('>I', data, 420)
+        return cls(
+            resolution=resolution,
+            page_size=page_size,
+            width=width,
+            height=height,
+            bits_per_color=bits_per_color,
+            bits_per_pixel=bits_per_pixel,
+            bytes_per_line=bytes_per_line,
+            color_order=color_order,
+            color_space=color_space,
+            num_colors=num_colors,
+        )
+
+    def validate(self):
+        if self.color_space not in PDF_COLOR_SPACES:
+            raise UnsupportedRasterError('Unsupported color space {}'.format(self.color_space))
+        if self.color_order != 0:
+            raise UnsupportedRasterError('Only the chunky color order is supported')
+        if self.bits_per_color not in (1, 2, 4, 8, 16):
+            raise UnsupportedRasterError('Unsupported number of bits per color {}'.format(self.bits_per_color))
+        colors = PDF_COLOR_SPACES[self.color_space][1]
+        if self.bits_per_pixel != self.bits_per_color * colors:
+            raise UnsupportedRasterError('Unsupported number of bits per pixel {}'.format(self.bits_per_pixel))
+        if self.width == 0 or self.height == 0 or 0 in self.resolution:
+            raise PwgRasterError('Invalid page dimensions')
+        if self.bytes_per_line != (self.width * self.bits_per_pixel + 7) // 8:
+            raise PwgRasterError('Invalid number of bytes per line {}'.format(self.bytes_per_line))
+        if self.bytes_per_line * self.height > MAX_PAGE_BYTES:
+            raise UnsupportedRasterError('The page is too large')
+
+    def pixel_size(self) -> int:
+        """The size of the pixels in the compressed lines, pixels smaller than a byte are compressed as bytes."""
+        return max(1, self.bits_per_pixel // 8)
+
+    def white(self) -> bytes:
+        return b'\x00' if self.color_space in SUBTRACTIVE_COLOR_SPACES else b'\xff'
+
+    def page_size_pt(self) -> Tuple[float, float]:
+        if self.page_size[0] and self.page_size[1]:
+            return self.page_size
+        return self.width * 72 / self.resolution[0], self.height * 72 / self.resolution[1]
+
+    def image_dictionary(self) -> str:
+        color_space, colors = PDF_COLOR_SPACES[self.color_space]
+        entries = [
+            '/Type /XObject', '/Subtype /Image',
+            '/Width {}'.format(self.width),
+            '/Height {}'.format(self.height),
+            '/ColorSpace {}'.format(color_space),
+            '/BitsPerComponent {}'.format(self.bits_per_color),
+            '/Filter /FlateDecode',
+        ]
+        if self.color_space == CSPACE_K:
+            entries.append('/Decode [1 0]')
+        return ' '.join(entries)
+
+
+class _StreamReader:
+    """Reads the raster in blocks, as most reads are only a few bytes long."""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.buffer = b''
+        self.pos = 0
+
+    def _fill(self, size: int) -> bool:
+        self.buffer = self.buffer[self.pos:] + self.f.read(max(size, READ_BLOCK_SIZE))
+        self.pos = 0
+        return len(self.buffer) >= size
+
+    def read(self, size: int) -> bytes:
+        if self.pos + size > len(self.buffer) and not self._fill(size):
+            raise PwgRasterError('Unexpected end of the raster')
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def read_byte(self) -> int:
+        if self.pos >= len(self.buffer) and not self._fill(1):
+            raise PwgRasterError('Unexpected end of the raster')
+        self.pos += 1
+        return self.buffer[self.pos - 1]
+
+    def at_end(self) -> bool:
+        return self.pos >= len(self.buffer) and not self._fill(1)
+
+
+def _read_line(reader: _StreamReader, header: PwgPageHeader) -> bytes:
+    bytes_per_line = header.bytes_per_line
+    pixel_size = header.pixel_size()
+    line = bytearray()
+    while len(line) < bytes_per_line:
+        control = reader.read_byte()
+        if control == 128:
+            # The rest of the line is white
+            line += header.white() * (bytes_per_line - len(line))
+        elif control < 128:
+            line += reader.read(pixel_size) * (control + 1)
+        else:
+            line += reader.read(pixel_size * (257 - control))
+    if len(line) != bytes_per_line:
+        raise PwgRasterError('The line is longer than {} bytes'.format(bytes_per_line))
+    return line
+
+
+def read_page(reader: _StreamReader, header: PwgPageHeader) -> bytes:
+    """Decodes the pixel rows of a page."""
+
+    rows = bytearray()
+    y = 0
+    while y < header.height:
+        repeat = reader.read_byte() + 1
+        if y + repeat > header.height:
+            raise PwgRasterError('The page has more than {} lines'.format(header.height))
+        rows += _read_line(reader, header) * repeat
+        y += repeat
+    return bytes(rows)
+
+
+def read_pages(f: BinaryIO):
+    """
+    Yields the header and the pixel rows of each page of the raster.
+    The rows of a page are decoded only when the next page is requested.
+    """
+
+    reader = _StreamReader(f)
+    if reader.read(len(PWG_SYNC_WORD)) != PWG_SYNC_WORD:
+        raise PwgRasterError('Not a PWG Raster document')
+    while not reader.at_end():
+        header = PwgPageHeader.parse(reader.read(PWG_HEADER_SIZE))
+        header.validate()
+        yield header, read_page(reader, header)
+
+
+class PwgPdfWriter(PdfStreamWriter):
+    """
+    Writes a PDF document with one image per page, without keeping the previous pages in memory.
+    """
+
+    def add_image_page(self, header: PwgPageHeader, image_data: bytes):
+        """Adds a page with the image, `image_data` are the pixel rows compressed with zlib."""
+
+        width, height = header.page_size_pt()
+        image_id = self.add_stream(header.image_dictionary(), image_data)
+        content_id = self.add_stream('', 'q {:.4f} 0 0 {:.4f} 0 0 cm /Im0 Do Q'.format(width, height).encode())
+        self.add_page_id(self.add_object(
+            '<< /Type /Page /Parent {} 0 R /MediaBox [0 0 {:.4f} {:.4f}] /Contents {} 0 R '
+            '/Resources << /XObject << /Im0 {} 0 R >> >> >>'.format(
+                self.PAGES_ID, width, height, content_id, image_id,
+            ).encode()
+        ))
+
+    def finish(self):
+        if not self.page_ids:
+            raise PwgRasterError('The raster does not contain any pages')
+        super().finish()
+
+
+def convert_pwg_raster(input_file: str, out: str, threads: int = 1):
+    """
+    Converts the PWG Raster document to a PDF with one image per page.
+
+    The pages are decoded sequentially, as the size of a compressed page is only known after decoding it.
+    If `threads` is larger than 1, the decoded pages are compressed in a thread pool while the next pages
+    are decoded (`zlib` releases the GIL). At most `threads` compressed pages are waiting to be written.
+
+    :raises UnsupportedRasterError: If the raster uses features which are not supported.
+    :raises PwgRasterError: If the raster is not valid.
+    """
+
+    with open(input_file, 'rb') as f, open(out, 'wb') as output_file:
+        writer = PwgPdfWriter(output_file)
+        if threads <= 1:
+            for header, rows in read_pages(f):
+                writer.add_image_page(header, zlib.compress(rows, ZLIB_LEVEL))
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                pending = deque()
+                for header, rows in read_pages(f):
+                    pending.append((header, executor.submit(zlib.compress, rows, ZLIB_LEVEL)))
+                    if len(pending) >= threads:
+                        header, future = pending.popleft()
+                        writer.add_image_page(header, future.result())
+                while pending:
+                    header, future = pending.popleft()
+                    writer.add_image_page(header, future.result())
+        writer.finish()
@@ -0,0 +1,255 @@
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from printing.cancellation import get_current_token, on_cancel
+from printing.utils import SANDBOX_PATH, TASK_TIMEOUT_S, run_cancellable, handle_cancellation, logger
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox_agent.py')
+SESSION_START_TIMEOUT_S = 30
+
+_sessions: Dict[str, "SandboxSession"] = {}
+_sessions_lock = threading.Lock()
+_thread_usage = threading.local()
+
+
+class SandboxSessionError(Exception):
+    """
+    Raised when the sandbox session could not be started or its agent stopped responding.
+    """
+    pass
+
+
+def sandbox_cpu_time() -> float:
+    """
+    :return: The CPU time of the commands run by the sandbox sessions of the current thread.
+        The agent reaps these commands, so they are not included in the `RUSAGE_CHILDREN` of the worker.
+    """
+
+    return getattr(_thread_usage, 'cpu_time_s', 0.0)
+
+
+def _add_sandbox_cpu_time(cpu_time_s: float):
+    _thread_usage.cpu_time_s = sandbox_cpu_time() + cpu_time_s
+
+
+class SandboxSession:
+    """
+    A single sandbox with the `work_dir` of a document, running `sandbox_agent.py`, which runs
+    all sandboxed commands of the document.
+
+    Setting up the namespaces and mounts of the sandbox is paid once per document instead of once per command.
+    The sandbox is started on the first command, so documents which do not need any sandboxed commands
+    (e.g. PDF documents) do not start it at all.
+    """
+
+    def __init__(self, work_dir: str):
+        self.work_dir = work_dir
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at: Optional[float] = None
+        self.closed_at: Optional[float] = None
+        self.exit_status: Optional[int] = None
+        self.commands = 0
+        self.command_wall_time_s = 0.0
+        self.command_cpu_time_s = 0.0
+        self.max_rss_kb = 0
+
+    def _agent_command(self) -> List[str]:
+        return [SANDBOX_PATH, self.work_dir, sys.executable, AGENT_PATH]
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def _read_line(self, timeout: float) -> Optional[bytes]:
+        """
+        :return: The next line written by the agent or `None` if the timeout expired.
+        """
+
+        readable, _, _ = select.select([self.process.stdout], [], [], max(timeout, 0))
+        if not readable:
+            return None
+        return self.process.stdout.readline()
+
+    def start(self):
+        # `start_new_session` puts the sandbox in a new process group, so `kill` stops the running command as well.
+        self.process = subprocess.Popen(
+            self._agent_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+
+        deadline = time.monotonic() + SESSION_START_TIMEOUT_S
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.kill()
+                self._reap()
+                raise SandboxSessionError('Timed out while starting the sandbox')
+            line = self._read_line(remaining)
+            if line is None:
+                continue
+            if line.strip() == b'READY':
+                return
+            if line == b'':
+                self._reap()
+                raise SandboxSessionError('The sandbox agent exited during startup')
+
+    def kill(self):
+        """
+        Kills the sandbox with the running command. The pipes are left open, so this can be called
+        from the cancellation listener thread while another thread waits for the command.
+        """
+
+        process = self.process
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+        self.exit_status = process.wait()
+        process.stdin.close()
+        process.stdout.close()
+
+    def close(self):
+        """
+        Stops the agent by closing its input and logs the statistics of the session.
+        """
+
+        process = self.process
+        if process is not None:
+            process.stdin.close()
+            try:
+                process.wait(timeout=SESSION_START_TIMEOUT_S)
+            except subprocess.TimeoutExpired:
+                self.kill()
+            self._reap()
+        self.closed_at = time.monotonic()
+        if self.commands:
+            logger.info('Sandbox session of {} finished: {}'.format(self.work_dir, self.stats()))
+
+    def stats(self) -> dict:
+        """
+        :return: The lifetime of the session, the number of commands it ran, their total wall-clock and CPU time,
+            the largest resident set size of a single command and the exit status of the sandbox.
+        """
+
+        lifetime_s = None
+        if self.started_at is not None:
+            lifetime_s = (self.closed_at or time.monotonic()) - self.started_at
+        return {
+            'lifetime_s': lifetime_s,
+            'commands': self.commands,
+            'wall_time_s': self.command_wall_time_s,
+            'cpu_time_s': self.command_cpu_time_s,
+            'max_rss_kb': self.max_rss_kb,
+            'exit_status': self.exit_status,
+        }
+
+    def _request(self, command: List[str], timeout: float) -> dict:
+        try:
+            self.process.stdin.write(json.dumps({'command': command}).encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            line = b''
+        else:
+            line = self._read_line(timeout)
+        if line is None:
+            self.kill()
+            self._reap()
+            raise subprocess.TimeoutExpired(command, timeout)
+        if not line:
+            self._reap()
+            raise SandboxSessionError('The sandbox agent exited while running a command')
+        return json.loads(line)
+
+    def run(self, command: List[str], timeout: float = TASK_TIMEOUT_S) -> str:
+        """
+        Runs `command` in the sandbox and returns its output like `run_cancellable`.
+
+        :raises subprocess.CalledProcessError: If the command failed.
+        :raises subprocess.TimeoutExpired: If the command did not finish within the timeout.
+            The sandbox is stopped and started again by the next command.
+        :raises SandboxSessionError: If the sandbox could not be started or stopped during the command,
+            e.g. because the job was canceled.
+        """
+
+        if not self.is_alive():
+            self.start()
+
+        wall_start = time.monotonic()
+        with on_cancel(self.kill):
+            response = self._request(command, timeout)
+        self.commands += 1
+        self.command_wall_time_s += time.monotonic() - wall_start
+        self.command_cpu_time_s += response['cpu_time_s']
+        self.max_rss_kb = max(self.max_rss_kb, response['max_rss_kb'])
+        _add_sandbox_cpu_time(response['cpu_time_s'])
+
+        if response['returncode'] != 0:
+            raise subprocess.CalledProcessError(response['returncode'], command, output=response['output'])
+        return response['output']
+
+
+@contextmanager
+def sandbox_session(work_dir: str):
+    """
+    Runs the sandboxed commands with `work_dir` called by `run_in_sandbox` in the `with` block
+    in a single `SandboxSession`. Does nothing if `SANDBOX_SESSIONS` is disabled.
+    """
+
+    if not settings.SANDBOX_SESSIONS:
+        yield None
+        return
+
+    session = SandboxSession(work_dir)
+    with _sessions_lock:
+        _sessions[work_dir] = session
+    try:
+        yield session
+    finally:
+        with _sessions_lock:
+            del _sessions[work_dir]
+        session.close()
+
+
+def run_in_sandbox(work_dir: str, command: List[str], timeout: float = TASK_TIMEOUT_S) -> str:
+    """
+    Runs `command` in a sandbox in which only `work_dir` is writable and returns its output.
+
+    The command is run by the `sandbox_session` of `work_dir` if there is one, otherwise a new sandbox
+    is created for the command. The job processed by the current thread is canceled like in `run_cancellable`.
+    """
+
+    with _sessions_lock:
+        session = _sessions.get(work_dir)
+    if session is None:
+        return run_cancellable([SANDBOX_PATH, work_dir] + command, timeout=timeout)
+
+    token = get_current_token()
+    if token is not None and token.is_canceled():
+        handle_cancellation(token.job)
+    try:
+        return session.run(command, timeout)
+    except (subprocess.CalledProcessError, SandboxSessionError):
+        if token is not None and token.is_canceled():
+            handle_cancellation(token.job)
+        raise
@@ -0,0 +1,44 @@
+"""
+The command agent of a `printing.sandbox.SandboxSession`.
+
+This script is started inside the sandbox by the worker and must only depend on the standard library.
+It prints `READY` to stdout and then reads JSON requests from stdin, one per line: `{"command": [args]}`.
+Each command is run to completion and a single JSON response line is written to stdout:
+`{"returncode": int, "output": str, "cpu_time_s": float, "max_rss_kb": int}`, where `output` contains
+the stdout and stderr of the command. The agent exits when stdin is closed.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+
+def run(command):
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as ex:
+        return {'returncode': 127, 'output': repr(ex), 'cpu_time_s': 0, 'max_rss_kb': 0}
+    with process.stdout:
+        output = process.stdout.read()
+    # `wait4` is used instead of `Popen.wait` to get the resource usage of this command only
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        'returncode': process.returncode,
+        'output': output.decode('utf-8', errors='replace'),
+        'cpu_time_s': usage.ru_utime + usage.ru_stime,
+        'max_rss_kb': usage.ru_maxrss,
+    }
+
+
+def main():
+    print('READY', flush=True)
+    for line in sys.stdin:
+        request = json.loads(line)
+        sys.stdout.write(json.dumps(run(request['command'])) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
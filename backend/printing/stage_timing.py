@@ -0,0 +1,88 @@
+import os
+import resource
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from control.models import GutenbergJob, JobStage, JobStageTiming
+from printing.processing.sandbox import sandbox_cpu_time
+
+
+def _children_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # The commands run by sandbox sessions are reaped by the agent, so their usage is reported separately
+    return usage.ru_utime + usage.ru_stime + sandbox_cpu_time()
+
+
+def _file_size(path: Optional[str]) -> Optional[int]:
+    if path is None or not os.path.isfile(path):
+        return None
+    return os.path.getsize(path)
+
+
+class StageMeasurement:
+    """
+    The values of a stage which are only known after it finishes. They are set by the measured code.
+    """
+
+    def __init__(self, stage: JobStage, input_file: Optional[str]):
+        # The measured code can change the stage, e.g. if the stage was skipped
+        self.stage = stage
+        self.input_file = input_file
+        self.output_file: Optional[str] = None
+        self.pages: Optional[int] = None
+
+
+class StageTimer:
+    """
+    Records the wall-clock and CPU time of the processing stages of a job as `JobStageTiming` objects.
+
+    The CPU time is the time of the current thread and of the subprocesses which finished during the stage.
+    When a worker runs multiple threads, the latter can include subprocesses started by other jobs.
+    """
+
+    def __init__(self, job: GutenbergJob, document_number: int = 0):
+        self.job = job
+        self.document_number = document_number
+
+    @contextmanager
+    def measure(self, stage: JobStage, input_file: Optional[str] = None):
+        """
+        Measures the code in the `with` block. The timing is saved even if the block raises an exception.
+
+        Usage::
+
+            with timer.measure(JobStage.PREPROCESS, input_file) as measurement:
+                result = convert(input_file)
+                measurement.output_file = result
+        """
+
+        measurement = StageMeasurement(stage, input_file)
+        wall_start = time.monotonic()
+        cpu_start = time.thread_time() + _children_cpu_time()
+        try:
+            yield measurement
+        finally:
+            JobStageTiming.objects.create(
+                job=self.job,
+                document_number=self.document_number,
+                stage=measurement.stage,
+                wall_time_s=time.monotonic() - wall_start,
+                cpu_time_s=time.thread_time() + _children_cpu_time() - cpu_start,
+                input_bytes=_file_size(measurement.input_file),
+                output_bytes=_file_size(measurement.output_file),
+                pages=measurement.pages,
+            )
+
+    def record(self, stage: JobStage, wall_time_s: float):
+        """
+        Saves the timing of a stage which was not measured by the worker, e.g. waiting for the printer.
+        """
+
+        JobStageTiming.objects.create(
+            job=self.job,
+            document_number=self.document_number,
+            stage=stage,
+            wall_time_s=wall_time_s,
+            cpu_time_s=0,
+        )
@@ -7,7 +7,7 @@ from itertools import chain
 from celery.worker.control import control_command
 
 from printing.backends import LocalCupsPrinter
-from printing.processing.converter import CONVERTERS_LOCAL
+from printing.processing.converter import CONVERTERS_LOCAL, get_conversion_cache
 
 logger = logging.getLogger('gutenberg.worker')
 
@@ -28,3 +28,15 @@ def get_own_supported_formats(state) -> dict:
 @control_command(name="gutenberg_list_cups_printer_names")
 def list_cups_printer_names(state) -> list[str]:
     return LocalCupsPrinter.list_cups_printer_names()
+
+
+@control_command(name="gutenberg_get_conversion_cache_stats")
+def get_conversion_cache_stats(state) -> dict:
+    """
+    A Celery command to get the hit and miss counters of the conversion cache in the current worker.
+    """
+
+    cache = get_conversion_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
@@ -0,0 +1,97 @@
+"""
+The fixtures shared by the tests of printing
+"""
+
+import io
+from typing import Callable, Dict, Iterable, List, Tuple
+from unittest.mock import patch
+
+import pytest
+from django.core.files.base import ContentFile
+from pypdf import PdfWriter
+
+from common.models import User
+from control.models import GutenbergJob, JobArtefact, JobStatus, Printer, PrinterType, PrintingProperties
+from printing.backends import PrinterBackend
+
+
+class FakePrinter(PrinterBackend):
+    """
+    A printer backend which records the submitted files and prints the jobs until they are removed from `statuses`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.submitted: List[str] = []
+        self.statuses: Dict[str, str] = {}
+        self.status_checks: List[List[str]] = []
+        self.canceled: List[str] = []
+
+    def check_statuses(self, backend_job_ids: List[str]) -> Dict[str, str]:
+        self.status_checks.append(backend_job_ids)
+        return {job_id: self.statuses[job_id] for job_id in backend_job_ids if job_id in self.statuses}
+
+    def submit_job(self, job: GutenbergJob, file_path: str):
+        self.submitted.append(file_path)
+        backend_job_id = 'printer-{}'.format(len(self.submitted))
+        self.statuses[backend_job_id] = 'job-printing'
+        return backend_job_id
+
+    def cancel_job(self, job: GutenbergJob, backend_job_id: str):
+        self.statuses.pop(backend_job_id, None)
+        self.canceled.append(backend_job_id)
+
+
+def _create_pdf(page_count: int = 1, width: int = 595, height: int = 842) -> bytes:
+    writer = PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=width, height=height)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def create_pdf() -> Callable[..., bytes]:
+    """Returns a function creating a PDF document with `page_count` blank pages of the given size, A4 by default."""
+    return _create_pdf
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    """A temporary directory for the uploaded documents."""
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    return tmp_path / 'media'
+
+
+@pytest.fixture
+def create_job(db, media_root) -> Callable[..., GutenbergJob]:
+    """
+    Returns a function creating a job with a SOURCE artefact for each `(mime_type, content)` pair of `documents`,
+    numbered in order. The other keyword arguments are the printing properties of the job.
+    """
+
+    def create(documents: Iterable[Tuple[str, bytes]] = (), printer_type: PrinterType = PrinterType.DISABLED,
+               status: JobStatus = JobStatus.PENDING, **properties) -> GutenbergJob:
+        owner, _ = User.objects.get_or_create(username='owner')
+        printer, _ = Printer.objects.get_or_create(name='printer', printer_type=printer_type)
+        job = GutenbergJob.objects.create(name='job', owner=owner, printer=printer, status=status)
+        PrintingProperties.objects.create(job=job, **properties)
+        for document_number, (mime_type, content) in enumerate(documents, start=1):
+            JobArtefact.objects.create(
+                job=job,
+                file=ContentFile(content, name='document'),
+                mime_type=mime_type,
+                document_number=document_number,
+            )
+        return job
+
+    return create
+
+
+@pytest.fixture
+def printer_backend():
+    """A FakePrinter used for all printers."""
+    backend = FakePrinter()
+    with patch('printing.printing.get_printer_backend', return_value=backend):
+        yield backend
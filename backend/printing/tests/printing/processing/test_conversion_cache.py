@@ -0,0 +1,178 @@
+"""
+Tests for the conversion cache in printing.processing.converter
+"""
+
+import os
+import stat
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from printing.processing.converter import ConversionCache, EarlyConverter, PdfConverter, DocConverter
+from printing.processing.pages import PageOrientation
+
+
+@pytest.fixture
+def work_dir():
+    """A temporary working directory for converter tests."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+@pytest.fixture
+def cache_dir(settings):
+    """A temporary conversion cache directory enabled in the settings."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        settings.CONVERSION_CACHE_DIR = tmpdir
+        settings.CONVERSION_CACHE_MAX_SIZE_BYTES = 1024 * 1024
+        yield tmpdir
+
+
+def _write_file(path, content: bytes):
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+class CountingConverter(EarlyConverter):
+    calls = 0
+
+    def convert_to_pdf(self, input_file: str) -> str:
+        CountingConverter.calls += 1
+        return _write_file(os.path.join(self.work_dir, 'converted.pdf'), b'%PDF-converted')
+
+    def _convert_and_detect_orientation(self, input_file: str):
+        return EarlyConverter.PreprocessResult(
+            orientation=PageOrientation.LANDSCAPE,
+            preprocess_result_path=self.convert_to_pdf(input_file),
+        )
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+
+class TestConversionCache:
+    """Tests for the ConversionCache storage."""
+
+    def test_missing_entry_counts_as_miss(self, cache_dir):
+        """Getting an unknown key returns None and increments the miss counter."""
+        cache = ConversionCache(cache_dir, 1024)
+
+        assert cache.get('unknown') is None
+        assert cache.stats() == {'hits': 0, 'misses': 1, 'evictions': 0}
+
+    def test_stored_entry_is_returned(self, cache_dir, work_dir):
+        """A stored PDF and orientation are returned on the next lookup."""
+        cache = ConversionCache(cache_dir, 1024)
+        pdf = _write_file(os.path.join(work_dir, 'out.pdf'), b'%PDF-test')
+
+        cache.put('key', PageOrientation.LANDSCAPE, pdf)
+        cached = cache.get('key')
+
+        assert cached.orientation == PageOrientation.LANDSCAPE
+        with open(cached.pdf_path, 'rb') as f:
+            assert f.read() == b'%PDF-test'
+        assert cache.stats()['hits'] == 1
+
+    def test_orientation_only_entry(self, cache_dir):
+        """Entries can be stored without a PDF."""
+        cache = ConversionCache(cache_dir, 1024)
+
+        cache.put('key', PageOrientation.PORTRAIT)
+        cached = cache.get('key')
+
+        assert cached.orientation == PageOrientation.PORTRAIT
+        assert cached.pdf_path is None
+
+    def test_least_recently_used_entry_is_evicted(self, cache_dir, work_dir):
+        """Exceeding the size limit removes the least recently used entries first."""
+        cache = ConversionCache(cache_dir, 1200)
+        pdf = _write_file(os.path.join(work_dir, 'out.pdf'), b'x' * 500)
+
+        cache.put('first', PageOrientation.PORTRAIT, pdf)
+        os.utime(os.path.join(cache_dir, 'first.json'), (1, 1))
+        cache.put('second', PageOrientation.PORTRAIT, pdf)
+        os.utime(os.path.join(cache_dir, 'second.json'), (2, 2))
+        cache.put('third', PageOrientation.PORTRAIT, pdf)
+
+        assert cache.get('first') is None
+        assert cache.get('second') is not None
+        assert cache.get('third') is not None
+        assert cache.stats()['evictions'] == 1
+
+    def test_directory_is_private(self, work_dir):
+        """The cache directory is only accessible to the worker user."""
+        cache_dir = os.path.join(work_dir, 'cache')
+
+        ConversionCache(cache_dir, 1024)
+
+        assert stat.S_IMODE(os.stat(cache_dir).st_mode) & 0o077 == 0
+
+    def test_key_depends_on_converter_and_params(self):
+        """Cache keys differ between converter classes and conversion parameters."""
+        keys = {
+            ConversionCache.make_key('hash', DocConverter),
+            ConversionCache.make_key('hash', PdfConverter),
+            ConversionCache.make_key('hash', DocConverter, 210, 297),
+            ConversionCache.make_key('other', DocConverter),
+        }
+
+        assert len(keys) == 4
+
+
+class TestConverterCaching:
+    """Tests for the use of the conversion cache in converters."""
+
+    def test_second_conversion_of_same_content_uses_cache(self, cache_dir, work_dir):
+        """A cache hit skips the conversion and restores the orientation."""
+        CountingConverter.calls = 0
+        input_file = _write_file(os.path.join(work_dir, 'input.docx'), b'document')
+
+        with tempfile.TemporaryDirectory() as first_dir, tempfile.TemporaryDirectory() as second_dir:
+            first = CountingConverter(first_dir).preprocess(input_file)
+            second = CountingConverter(second_dir).preprocess(input_file)
+
+            assert CountingConverter.calls == 1
+            assert second.orientation == first.orientation == PageOrientation.LANDSCAPE
+            assert os.path.dirname(second.preprocess_result_path) == second_dir
+            with open(second.preprocess_result_path, 'rb') as f:
+                assert f.read() == b'%PDF-converted'
+
+    def test_entry_evicted_after_lookup_is_converted(self, cache_dir, work_dir):
+        """A PDF removed by a concurrent eviction after the lookup falls back to the conversion."""
+        CountingConverter.calls = 0
+        input_file = _write_file(os.path.join(work_dir, 'input.docx'), b'document')
+        with tempfile.TemporaryDirectory() as first_dir:
+            CountingConverter(first_dir).preprocess(input_file)
+
+        original_get = ConversionCache.get
+
+        def get_and_evict(cache, key):
+            cached = original_get(cache, key)
+            os.remove(cached.pdf_path)
+            return cached
+
+        with tempfile.TemporaryDirectory() as second_dir, patch.object(ConversionCache, 'get', get_and_evict):
+            result = CountingConverter(second_dir).preprocess(input_file)
+
+            assert CountingConverter.calls == 2
+            with open(result.preprocess_result_path, 'rb') as f:
+                assert f.read() == b'%PDF-converted'
+
+    def test_cache_disabled_in_settings(self, settings, work_dir):
+        """Every call runs the conversion when CONVERSION_CACHE_DIR is None."""
+        settings.CONVERSION_CACHE_DIR = None
+        CountingConverter.calls = 0
+        input_file = _write_file(os.path.join(work_dir, 'input.docx'), b'document')
+
+        CountingConverter(work_dir).preprocess(input_file)
+        os.remove(os.path.join(work_dir, 'converted.pdf'))
+        CountingConverter(work_dir).preprocess(input_file)
+
+        assert CountingConverter.calls == 2
+
+    def test_pdf_converter_is_not_cached(self):
+        """PDF inputs are not copied to the cache."""
+        assert PdfConverter.cacheable is False
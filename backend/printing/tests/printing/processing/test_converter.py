@@ -21,7 +21,10 @@ from printing.processing.converter import (
     detect_file_format, get_converter, NoConverterAvailableError,
     CONVERTER_FOR_TYPE, CONVERTERS_LOCAL
 )
+from printing.processing.images import UnsupportedImageError
 from printing.processing.pages import PageSize, PageOrientation
+from printing.processing.pdf_index import PageBoxes
+from printing.processing.pwg import UnsupportedRasterError
 
 
 @pytest.fixture
@@ -31,6 +34,14 @@ def work_dir():
         yield tmpdir
 
 
+@pytest.fixture(autouse=True)
+def unsupported_image():
+    """The images in these tests do not exist, so they are not embedded directly and ImageMagick is used."""
+    with patch('printing.processing.converter.read_image_info', side_effect=UnsupportedImageError('unsupported')), \
+            patch.object(ImageConverter, 'binary_exists', return_value=True):
+        yield
+
+
 @pytest.fixture
 def sample_page_size():
     """Standard A4 page size fixture."""
@@ -38,23 +49,25 @@ def sample_page_size():
 
 
 @pytest.fixture
-def mock_pdf_reader():
-    """Mock PdfReader with configurable pages."""
-    def _create_reader(page_configs):
+def mock_pdf_engine():
+    """Mock PdfEngine with configurable pages."""
+    def _create_engine(page_configs):
         """
         Args:
             page_configs: List of tuples (width, height) for each page
         """
-        mock_reader = Mock()
-        pages = []
-        for width, height in page_configs:
-            page = Mock()
-            page.mediabox.width = width
-            page.mediabox.height = height
-            pages.append(page)
-        mock_reader.pages = pages
-        return mock_reader
-    return _create_reader
+        mock_engine = Mock()
+        mock_engine.read_page_boxes.return_value = [
+            PageBoxes(
+                mediabox=(0, 0, width, height),
+                cropbox=(0, 0, width, height),
+                trimbox=(0, 0, width, height),
+                rotation=0,
+            )
+            for width, height in page_configs
+        ]
+        return mock_engine
+    return _create_engine
 
 
 class TestFileFormatDetection:
@@ -264,18 +277,28 @@ class TestImageConverter:
         assert int(height) > 3300 and int(height) < 3400
 
     @patch('shutil.which')
-    def test_converter_available_when_imagemagick_installed(self, mock_which):
-        """ImageConverter is available when convert binary exists."""
-        mock_which.return_value = '/usr/bin/convert'
+    def test_converter_available_without_imagemagick(self, mock_which):
+        """ImageConverter embeds JPEG and PNG images without ImageMagick, so it is always available."""
+        mock_which.return_value = None
 
         assert ImageConverter.is_available() is True
 
-    @patch('shutil.which')
-    def test_converter_unavailable_when_imagemagick_missing(self, mock_which):
-        """ImageConverter is unavailable when convert binary is missing."""
-        mock_which.return_value = None
+    @patch.object(ImageConverter, 'run_in_sandbox')
+    def test_unsupported_image_fails_without_imagemagick(self, mock_run, work_dir, sample_page_size):
+        """Images which cannot be embedded fail with a clear error when ImageMagick is missing."""
+        converter = ImageConverter(work_dir)
+        preprocess_result = ImageConverter.PreprocessResult(
+            orientation=PageOrientation.PORTRAIT,
+            preprocess_result_path='/path/to/image.png'
+        )
+
+        with patch.object(ImageConverter, 'binary_exists', return_value=False):
+            with pytest.raises(NoConverterAvailableError, match='ImageMagick'):
+                converter.preprocess('/path/to/image.png')
+            with pytest.raises(NoConverterAvailableError, match='ImageMagick'):
+                converter.create_input_pdf(preprocess_result, sample_page_size)
 
-        assert ImageConverter.is_available() is False
+        assert not mock_run.called
 
 class TestDocConverter:
     """Tests for DocConverter (LibreOffice) functionality."""
@@ -424,9 +447,11 @@ class TestPostScriptConverter:
 class TestPwgRasterConverter:
     """Tests for PwgRasterConverter (CUPS) functionality."""
 
+    @patch.object(PwgRasterConverter, 'cupsfilter_available', return_value=True)
+    @patch('printing.processing.converter.convert_pwg_raster', side_effect=UnsupportedRasterError('banded'))
     @patch.object(PwgRasterConverter, 'run_in_sandbox')
-    def test_pwg_raster_converted_using_cupsfilter(self, mock_run, work_dir):
-        """PWG Raster files are converted using cupsfilter."""
+    def test_unsupported_pwg_raster_converted_using_cupsfilter(self, mock_run, mock_convert, mock_available, work_dir):
+        """PWG Raster files which cannot be decoded in-process are converted using cupsfilter."""
         converter = PwgRasterConverter(work_dir)
         result = converter.convert_to_pdf('/path/to/file.pwg')
 
@@ -437,60 +462,82 @@ class TestPwgRasterConverter:
         assert 'image/pwg-raster' in call_args
         assert result == os.path.join(work_dir, 'converted.pdf')
 
+    @patch('shutil.which')
+    def test_converter_available_without_cupsfilter(self, mock_which):
+        """The converter does not depend on CUPS."""
+        mock_which.return_value = None
+
+        assert PwgRasterConverter.is_available() is True
+
     @patch('subprocess.check_output')
     @patch('shutil.which')
     def test_converter_checks_cupsfilter_filter_support(
         self, mock_which, mock_check_output
     ):
-        """Converter availability checks if cupsfilter supports PWG format."""
+        """The cupsfilter fallback checks if cupsfilter supports PWG format."""
         mock_which.return_value = '/usr/bin/cupsfilter'
         mock_check_output.return_value = b'Filter list'
 
-        result = PwgRasterConverter.is_available()
+        result = PwgRasterConverter.cupsfilter_available()
 
         assert result is True
         assert mock_check_output.called
 
     @patch('shutil.which')
-    def test_converter_unavailable_when_cupsfilter_missing(self, mock_which):
-        """Converter is unavailable when cupsfilter is not installed."""
+    def test_cupsfilter_unavailable_when_missing(self, mock_which):
+        """The cupsfilter fallback is unavailable when cupsfilter is not installed."""
         mock_which.return_value = None
 
-        assert PwgRasterConverter.is_available() is False
+        assert PwgRasterConverter.cupsfilter_available() is False
 
     @patch('subprocess.check_output')
     @patch('shutil.which')
-    def test_converter_unavailable_when_cupsfilter_lacks_pwg_support(
+    def test_cupsfilter_unavailable_when_it_lacks_pwg_support(
         self, mock_which, mock_check_output
     ):
-        """Converter is unavailable when cupsfilter doesn't support PWG format."""
+        """The cupsfilter fallback is unavailable when cupsfilter doesn't support PWG format."""
         mock_which.return_value = '/usr/bin/cupsfilter'
         mock_check_output.side_effect = subprocess.CalledProcessError(
             returncode=1,
             cmd=['cupsfilter', '--list-filters']
         )
 
-        result = PwgRasterConverter.is_available()
+        result = PwgRasterConverter.cupsfilter_available()
 
         assert result is False
         assert mock_check_output.called
 
+    @pytest.mark.parametrize('error', [
+        subprocess.TimeoutExpired(cmd=['cupsfilter', '--list-filters'], timeout=5),
+        PermissionError('Permission denied'),
+    ])
+    @patch('subprocess.check_output')
+    @patch('shutil.which')
+    def test_cupsfilter_unavailable_when_it_cannot_be_run(
+        self, mock_which, mock_check_output, error
+    ):
+        """The cupsfilter fallback is unavailable when cupsfilter times out or cannot be executed."""
+        mock_which.return_value = '/usr/bin/cupsfilter'
+        mock_check_output.side_effect = error
+
+        assert PwgRasterConverter.cupsfilter_available() is False
+
 class TestEarlyConverter:
     """Tests for EarlyConverter base class functionality."""
 
-    @patch('printing.processing.converter.PdfReader')
+    @patch('printing.processing.converter.get_pdf_engine')
     def test_landscape_orientation_detected_from_pdf_pages(
-        self, mock_pdf_reader_class, work_dir, mock_pdf_reader
+        self, mock_get_pdf_engine, work_dir, mock_pdf_engine
     ):
         """Landscape orientation is detected when most pages are horizontal."""
         # 3 landscape pages, 1 portrait page
-        mock_reader = mock_pdf_reader([
+        mock_engine = mock_pdf_engine([
             (297, 210),  # landscape
             (297, 210),  # landscape
             (297, 210),  # landscape
             (210, 297),  # portrait
         ])
-        mock_pdf_reader_class.return_value = mock_reader
+        mock_get_pdf_engine.return_value = mock_engine
 
         class TestConverter(EarlyConverter):
             def convert_to_pdf(self, input_file: str) -> str:
@@ -504,19 +551,19 @@ class TestEarlyConverter:
 
         assert result.orientation == PageOrientation.LANDSCAPE
 
-    @patch('printing.processing.converter.PdfReader')
+    @patch('printing.processing.converter.get_pdf_engine')
     def test_portrait_orientation_detected_from_pdf_pages(
-        self, mock_pdf_reader_class, work_dir, mock_pdf_reader
+        self, mock_get_pdf_engine, work_dir, mock_pdf_engine
     ):
         """Portrait orientation is detected when most pages are vertical."""
         # 1 landscape page, 3 portrait pages
-        mock_reader = mock_pdf_reader([
+        mock_engine = mock_pdf_engine([
             (297, 210),  # landscape
             (210, 297),  # portrait
             (210, 297),  # portrait
             (210, 297),  # portrait
         ])
-        mock_pdf_reader_class.return_value = mock_reader
+        mock_get_pdf_engine.return_value = mock_engine
 
         class TestConverter(EarlyConverter):
             def convert_to_pdf(self, input_file: str) -> str:
@@ -530,16 +577,16 @@ class TestEarlyConverter:
 
         assert result.orientation == PageOrientation.PORTRAIT
 
-    @patch('printing.processing.converter.PdfReader')
+    @patch('printing.processing.converter.get_pdf_engine')
     def test_portrait_default_when_all_pages_square(
-        self, mock_pdf_reader_class, work_dir, mock_pdf_reader
+        self, mock_get_pdf_engine, work_dir, mock_pdf_engine
     ):
         """Portrait is the default orientation for square pages."""
-        mock_reader = mock_pdf_reader([
+        mock_engine = mock_pdf_engine([
             (210, 210),  # square
             (210, 210),  # square
         ])
-        mock_pdf_reader_class.return_value = mock_reader
+        mock_get_pdf_engine.return_value = mock_engine
 
         class TestConverter(EarlyConverter):
             def convert_to_pdf(self, input_file: str) -> str:
@@ -577,8 +624,8 @@ class TestEarlyConverter:
 class TestSandboxConverter:
     """Tests for SandboxConverter sandbox execution."""
 
-    @patch('subprocess.check_output')
-    @patch('printing.processing.converter.SANDBOX_PATH', '/path/to/sandbox.sh')
+    @patch('printing.processing.sandbox.run_cancellable')
+    @patch('printing.processing.sandbox.SANDBOX_PATH', '/path/to/sandbox.sh')
     def test_command_executed_in_sandbox_successfully(
         self, mock_check_output, work_dir
     ):
@@ -605,7 +652,7 @@ class TestSandboxConverter:
         assert 'echo' in call_args
         assert 'test' in call_args
 
-    @patch('subprocess.check_output')
+    @patch('printing.processing.sandbox.run_cancellable')
     def test_timeout_enforced_in_sandbox_execution(
         self, mock_check_output, work_dir
     ):
@@ -696,14 +743,14 @@ class TestEdgeCases:
 
         assert result.orientation == PageOrientation.PORTRAIT
 
-    @patch('printing.processing.converter.PdfReader')
+    @patch('printing.processing.converter.get_pdf_engine')
     def test_pdf_with_no_pages_defaults_to_portrait(
-        self, mock_pdf_reader_class, work_dir
+        self, mock_get_pdf_engine, work_dir
     ):
         """Empty PDFs default to portrait orientation."""
-        mock_reader = Mock()
-        mock_reader.pages = []
-        mock_pdf_reader_class.return_value = mock_reader
+        mock_engine = Mock()
+        mock_engine.read_page_boxes.return_value = []
+        mock_get_pdf_engine.return_value = mock_engine
 
         class TestConverter(EarlyConverter):
             def convert_to_pdf(self, input_file: str) -> str:
@@ -723,7 +770,7 @@ class TestEdgeCases:
 class TestSecurityConstraints:
     """Tests for security-related functionality."""
 
-    @patch('subprocess.check_output')
+    @patch('printing.processing.sandbox.run_cancellable')
     def test_sandbox_timeout_is_enforced(self, mock_check_output, work_dir):
         """Sandbox enforces timeout to prevent infinite loops."""
         mock_check_output.side_effect = subprocess.TimeoutExpired(
@@ -745,8 +792,7 @@ class TestSecurityConstraints:
         with pytest.raises(subprocess.TimeoutExpired):
             converter.run_in_sandbox(['sleep', '1000'])
 
-    @patch('subprocess.check_output')
-    def test_sandbox_stderr_is_captured(self, mock_check_output, work_dir):
+    def test_sandbox_stderr_is_captured(self, work_dir):
         """Sandbox captures stderr along with stdout."""
         class TestSandboxConverter(SandboxConverter):
             def preprocess(self, input_file: str):
@@ -757,11 +803,18 @@ class TestSecurityConstraints:
             def is_available(cls):
                 return True
 
+        # A sandbox wrapper which runs the command without isolation
+        fake_sandbox = os.path.join(work_dir, 'sandbox.sh')
+        with open(fake_sandbox, 'w') as f:
+            f.write('#!/bin/sh\nshift\nexec "$@"\n')
+        os.chmod(fake_sandbox, 0o755)
+
         converter = TestSandboxConverter(work_dir)
-        converter.run_in_sandbox(['test_command'])
+        with patch('printing.processing.sandbox.SANDBOX_PATH', fake_sandbox):
+            output = converter.run_in_sandbox(['sh', '-c', 'echo out; echo err >&2'])
 
-        # Verify stderr is set to STDOUT
-        assert mock_check_output.call_args[1]['stderr'] == subprocess.STDOUT
+        assert 'out' in output
+        assert 'err' in output
 
 
 @pytest.mark.slow
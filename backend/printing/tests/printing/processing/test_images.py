@@ -0,0 +1,143 @@
+"""
+Tests for the in-process image embedding in printing.processing.images
+"""
+
+import os
+import struct
+import tempfile
+import zlib
+
+import pytest
+from pypdf import PdfReader
+
+from printing.processing.converter import ImageConverter
+from printing.processing.images import read_image_info, UnsupportedImageError
+from printing.processing.pages import PageSize, PageOrientation, MM_PER_PT
+
+A4 = PageSize(width_mm=210, height_mm=297)
+MARGIN = 5 / MM_PER_PT
+
+
+@pytest.fixture
+def work_dir():
+    """A temporary working directory for image tests."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _create_png(path, width, height, color_type=2, extra_chunks=b''):
+    """Creates an RGB (or RGBA) PNG image and returns its raw pixel data."""
+    channels = {2: 3, 6: 4}[color_type]
+    rows = [bytes((x * 7 + y * 3 + c) % 256 for x in range(width) for c in range(channels)) for y in range(height)]
+    data = zlib.compress(b''.join(b'\x00' + row for row in rows))
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+        f.write(extra_chunks)
+        # The image data may be split into multiple chunks
+        f.write(_png_chunk(b'IDAT', data[:10]))
+        f.write(_png_chunk(b'IDAT', data[10:]))
+        f.write(_png_chunk(b'IEND', b''))
+    return b''.join(rows)
+
+
+def _create_jpeg(path, width, height, orientation=None):
+    """Creates the headers of a baseline JPEG image. The entropy-coded data is not valid."""
+    segments = b''
+    if orientation is not None:
+        tiff = b'MM\x00\x2a' + struct.pack('>I', 8) + struct.pack('>H', 1) + \
+            struct.pack('>HHIHH', 0x0112, 3, 1, orientation, 0) + struct.pack('>I', 0)
+        exif = b'Exif\x00\x00' + tiff
+        segments += b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif
+    sof = struct.pack('>BHHB', 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    segments += b'\xff\xc0' + struct.pack('>H', len(sof) + 2) + sof
+    data = b'\xff\xd8' + segments + b'\xff\xda\x00\x02' + b'\x12\x34' * 10 + b'\xff\xd9'
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def _image_placement(path):
+    page = PdfReader(path).pages[0]
+    image = page['/Resources']['/XObject']['/Im0'].get_object()
+    matrix = [float(v) for v in page.get_contents().get_data().split()[1:7]]
+    return page, image, matrix
+
+
+def _placed_box(matrix):
+    """Returns the bounding box of the image unit square transformed by `matrix`."""
+    a, b, c, d, e, f = matrix
+    points = [(a * x + c * y + e, b * x + d * y + f) for x, y in [(0, 0), (1, 0), (0, 1), (1, 1)]]
+    return (min(p[0] for p in points), min(p[1] for p in points),
+            max(p[0] for p in points), max(p[1] for p in points))
+
+
+class TestJpegEmbedding:
+    """Tests for placing JPEG images in a PDF without re-encoding them."""
+
+    def test_jpeg_data_embedded_unchanged(self, work_dir):
+        """The JPEG file is stored in the PDF byte for byte, scaled to fit the page with 5 mm margins."""
+        input_file = os.path.join(work_dir, 'image.jpg')
+        data = _create_jpeg(input_file, 400, 300)
+
+        result = ImageConverter(work_dir).create_input_pdf(
+            ImageConverter.PreprocessResult(PageOrientation.LANDSCAPE, input_file), A4,
+        )
+
+        page, image, matrix = _image_placement(result)
+        assert image['/Filter'] == '/DCTDecode'
+        assert image._data == data
+        assert (image['/Width'], image['/Height']) == (400, 300)
+        assert float(page.mediabox.width) == pytest.approx(A4.width_pt())
+        left, bottom, right, top = _placed_box(matrix)
+        assert left == pytest.approx(MARGIN)
+        assert right == pytest.approx(A4.width_pt() - MARGIN)
+        assert (top - bottom) / (right - left) == pytest.approx(300 / 400)
+        assert (top + bottom) / 2 == pytest.approx(A4.height_pt() / 2)
+
+    @pytest.mark.parametrize('orientation', [6, 8])
+    def test_exif_rotation(self, work_dir, orientation):
+        """Images rotated by the EXIF orientation tag are rotated on the page and change the orientation."""
+        input_file = os.path.join(work_dir, 'image.jpg')
+        _create_jpeg(input_file, 400, 300, orientation)
+        converter = ImageConverter(work_dir)
+
+        preprocess_result = converter.preprocess(input_file)
+        result = converter.create_input_pdf(preprocess_result, A4)
+
+        assert preprocess_result.orientation == PageOrientation.PORTRAIT
+        _, _, matrix = _image_placement(result)
+        left, bottom, right, top = _placed_box(matrix)
+        assert (top - bottom) / (right - left) == pytest.approx(400 / 300)
+        # The top edge of the stored image is on the right side for a clockwise rotation
+        top_left_x = matrix[2] + matrix[4]
+        assert top_left_x == pytest.approx(right if orientation == 6 else left)
+
+
+class TestPngEmbedding:
+    """Tests for placing PNG images in a PDF without decoding them."""
+
+    def test_png_data_decodes_to_original_pixels(self, work_dir):
+        """The PNG image data is stored with the PNG predictors and decodes to the original pixels."""
+        input_file = os.path.join(work_dir, 'image.png')
+        pixels = _create_png(input_file, 20, 30)
+
+        result = ImageConverter(work_dir).create_input_pdf(
+            ImageConverter.PreprocessResult(PageOrientation.PORTRAIT, input_file), A4,
+        )
+
+        _, image, _ = _image_placement(result)
+        assert image['/DecodeParms']['/Predictor'] == 15
+        assert image.get_data() == pixels
+
+    def test_png_with_alpha_not_supported(self, work_dir):
+        """PNG images with transparency are left to ImageMagick."""
+        input_file = os.path.join(work_dir, 'image.png')
+        _create_png(input_file, 4, 4, color_type=6)
+
+        with pytest.raises(UnsupportedImageError):
+            read_image_info(input_file)
@@ -0,0 +1,481 @@
+"""
+Tests for the single-pass layout engine in printing.processing.layout
+"""
+
+import os
+import tempfile
+
+import pytest
+from pypdf import PageObject, PdfReader, PdfWriter, Transformation
+from pypdf.constants import AnnotationFlag
+from pypdf.generic import ContentStream, DecodedStreamObject, DictionaryObject, NameObject, NumberObject, \
+    RectangleObject, StreamObject
+
+from printing.processing.final_pages import FinalPageProcessor, NoPagesToPrintException
+from printing.processing.imposition import get_imposition_processor
+from printing.processing.layout import LayoutChunking, LayoutEngine
+from printing.processing.pages import PageSize, PageOrientation
+from printing.processing.pdf_index import PageBoxes
+from printing.processing.placement import FormXObjectPlacer, Placement, add_indirect_object, merge_placement
+
+A4 = PageSize(width_mm=210, height_mm=297)
+
+
+@pytest.fixture
+def work_dir():
+    """A temporary working directory for layout tests."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+def _create_input_pdf(path, page_specs):
+    """
+    Creates a PDF with a text label in two corners of every page.
+    `page_specs` is a list of `(width, height, rotation)` tuples.
+    """
+    writer = PdfWriter()
+    font = add_indirect_object(writer, DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for i, (width, height, rotation) in enumerate(page_specs):
+        page = writer.add_blank_page(width, height)
+        content = StreamObject()
+        content.set_data(
+            f'BT /F1 12 Tf 10 10 Td (A{i}) Tj ET BT /F1 12 Tf {width - 40} {height - 30} Td (B{i}) Tj ET'.encode()
+        )
+        page[NameObject('/Contents')] = add_indirect_object(writer, content)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+        if rotation:
+            page.rotate(rotation)
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+def _multiply(m, n):
+    """Returns the matrix of applying `m` and then `n`, both as `(a, b, c, d, e, f)` tuples."""
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D, e * A + f * C + E, e * B + f * D + F)
+
+
+def _collect_text(content_owner, resources, ctm, items):
+    """Collects the labels drawn by the content of a page or a Form XObject with their positions on the page."""
+    stack = []
+    text_position = (0, 0)
+    for operands, operator in ContentStream(content_owner.get_contents() if isinstance(content_owner, PageObject)
+                                            else content_owner, None).operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q':
+            ctm = stack.pop()
+        elif operator == b'cm':
+            ctm = _multiply([float(value) for value in operands], ctm)
+        elif operator == b'BT':
+            text_position = (0, 0)
+        elif operator == b'Td':
+            text_position = (text_position[0] + float(operands[0]), text_position[1] + float(operands[1]))
+        elif operator == b'Tj':
+            x, y = text_position
+            items.append((
+                operands[0].strip(),
+                round(x * ctm[0] + y * ctm[2] + ctm[4], 2),
+                round(x * ctm[1] + y * ctm[3] + ctm[5], 2),
+            ))
+        elif operator == b'Do':
+            xobject = resources['/XObject'][operands[0]].get_object()
+            matrix = [float(value) for value in xobject.get('/Matrix', [1, 0, 0, 1, 0, 0])]
+            _collect_text(xobject, xobject['/Resources'], _multiply(matrix, ctm), items)
+
+
+def _text_positions(path):
+    """Returns the sorted labels with their positions on every page of the PDF."""
+    result = []
+    for page in PdfReader(path).pages:
+        items = []
+        if page.get_contents() is not None:
+            _collect_text(page, page['/Resources'], (1, 0, 0, 1, 0, 0), items)
+        result.append(sorted(items))
+    return result
+
+
+def _create_processors(work_dir, imposition_template, n, orientation, fit_to_page):
+    imposition_processor = get_imposition_processor(imposition_template, A4, work_dir)
+    final_page_processor = FinalPageProcessor(
+        work_dir, n, imposition_processor.get_final_page_sizes(), orientation, fit_to_page,
+    )
+    return final_page_processor, imposition_processor
+
+
+class TestLayoutEngine:
+    """Tests for LayoutEngine.create_output_pdf."""
+
+    @pytest.mark.parametrize('imposition_template', ['none', 'booklet'])
+    @pytest.mark.parametrize('n', [1, 2, 4])
+    @pytest.mark.parametrize('fit_to_page', [True, False])
+    def test_same_result_as_final_pages_and_imposition(self, work_dir, imposition_template, n, fit_to_page):
+        """The fused layout places all pages like create_final_pages followed by create_output_pdf."""
+        input_file = _create_input_pdf(
+            os.path.join(work_dir, 'input.pdf'),
+            [(595, 842, 0), (842, 595, 0), (595, 842, 90), (300, 400, 270), (595, 842, 180)],
+        )
+
+        with tempfile.TemporaryDirectory() as two_pass_dir:
+            final_page_processor, imposition_processor = _create_processors(
+                two_pass_dir, imposition_template, n, PageOrientation.PORTRAIT, fit_to_page,
+            )
+            final_pages_file = final_page_processor.create_final_pages(input_file, '')
+            expected = imposition_processor.create_output_pdf(
+                final_pages_file, final_page_processor.final_page_orientation, True,
+            )
+            expected_positions = _text_positions(expected.output_file)
+
+        with tempfile.TemporaryDirectory() as fused_dir:
+            final_page_processor, imposition_processor = _create_processors(
+                fused_dir, imposition_template, n, PageOrientation.PORTRAIT, fit_to_page,
+            )
+            result = LayoutEngine(fused_dir, final_page_processor, imposition_processor).create_output_pdf(
+                input_file, '', True,
+            )
+
+            assert not os.path.exists(os.path.join(fused_dir, 'final_pages.pdf'))
+            assert _text_positions(result.output_file) == expected_positions
+        assert result.media_sheet_count == expected.media_sheet_count
+        assert result.media_sheet_page_count == expected.media_sheet_page_count
+
+    def test_no_pages_to_print(self, work_dir):
+        """NoPagesToPrintException is raised when the page filter selects no pages."""
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842, 0)])
+        final_page_processor, imposition_processor = _create_processors(
+            work_dir, 'none', 1, PageOrientation.PORTRAIT, True,
+        )
+
+        with pytest.raises(NoPagesToPrintException):
+            LayoutEngine(work_dir, final_page_processor, imposition_processor).create_output_pdf(
+                input_file, '5-6', False,
+            )
+
+    def test_duplex_adds_blank_page(self, work_dir):
+        """An odd number of pages is padded with a blank page when duplex printing is enabled."""
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842, 0)] * 3)
+        final_page_processor, imposition_processor = _create_processors(
+            work_dir, 'none', 1, PageOrientation.PORTRAIT, True,
+        )
+
+        result = LayoutEngine(work_dir, final_page_processor, imposition_processor).create_output_pdf(
+            input_file, '', True,
+        )
+
+        assert len(PdfReader(result.output_file).pages) == 4
+        assert result.media_sheet_page_count == 3
+        assert result.media_sheet_count == 2
+
+
+class TestPassthrough:
+    """Tests for sending the input file to the printer when the layout would not change it."""
+
+    def _create_output_pdf(self, work_dir, page_specs, n=1, imposition_template='none', pages_to_print='',
+                           duplex_enabled=False, fit_to_page=True):
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), page_specs)
+        final_page_processor, imposition_processor = _create_processors(
+            work_dir, imposition_template, n, PageOrientation.PORTRAIT, fit_to_page,
+        )
+        engine = LayoutEngine(work_dir, final_page_processor, imposition_processor, allow_passthrough=True)
+        return input_file, engine.create_output_pdf(input_file, pages_to_print, duplex_enabled)
+
+    @pytest.mark.parametrize('fit_to_page', [True, False])
+    @pytest.mark.parametrize('page_size', [(A4.width_pt(), A4.height_pt()), (595, 842)])
+    def test_a4_document_passed_through(self, work_dir, fit_to_page, page_size):
+        """A4 portrait pages printed without n-up and imposition are not rewritten."""
+        input_file, result = self._create_output_pdf(
+            work_dir, [(*page_size, 0)] * 4, pages_to_print='1-2,3-10', duplex_enabled=True, fit_to_page=fit_to_page,
+        )
+
+        assert result.passthrough
+        assert result.output_file == input_file
+        assert not os.path.exists(os.path.join(work_dir, 'output.pdf'))
+        assert result.media_sheet_page_count == 4
+        assert result.media_sheet_count == 2
+
+    def test_same_positions_as_layout(self, work_dir):
+        """The pages passed through look the same as the pages created by the layout."""
+        page_specs = [(595, 842, 0)] * 2
+        with tempfile.TemporaryDirectory() as layout_dir:
+            final_page_processor, imposition_processor = _create_processors(
+                layout_dir, 'none', 1, PageOrientation.PORTRAIT, True,
+            )
+            input_file = _create_input_pdf(os.path.join(layout_dir, 'input.pdf'), page_specs)
+            expected = LayoutEngine(layout_dir, final_page_processor, imposition_processor).create_output_pdf(
+                input_file, '', False,
+            )
+            expected_positions = _text_positions(expected.output_file)
+
+        _, result = self._create_output_pdf(work_dir, page_specs)
+
+        assert result.passthrough
+        for expected_page, page in zip(expected_positions, _text_positions(result.output_file)):
+            for (expected_text, expected_x, expected_y), (text, x, y) in zip(expected_page, page):
+                assert text == expected_text
+                assert abs(x - expected_x) < 0.5 and abs(y - expected_y) < 0.5
+
+    @pytest.mark.parametrize('page_specs, options', [
+        ([(595, 842, 0)] * 2, {'n': 2}),
+        ([(595, 842, 0)] * 2, {'imposition_template': 'booklet'}),
+        ([(595, 842, 0)] * 3, {'pages_to_print': '2-3'}),
+        ([(595, 842, 0)] * 3, {'pages_to_print': '1,1-3'}),
+        ([(595, 842, 0)] * 3, {'duplex_enabled': True}),
+        ([(595, 842, 0), (595, 842, 90)], {}),
+        ([(595, 842, 0), (842, 595, 0)], {}),
+        ([(612, 792, 0)], {}),
+    ])
+    def test_layout_needed(self, work_dir, page_specs, options):
+        """Documents changed by the layout are rewritten."""
+        input_file, result = self._create_output_pdf(work_dir, page_specs, **options)
+
+        assert not result.passthrough
+        assert result.output_file != input_file
+
+    def test_disabled(self, work_dir):
+        """The input file is rewritten if the passthrough is not allowed."""
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842, 0)])
+        final_page_processor, imposition_processor = _create_processors(
+            work_dir, 'none', 1, PageOrientation.PORTRAIT, True,
+        )
+
+        result = LayoutEngine(work_dir, final_page_processor, imposition_processor).create_output_pdf(
+            input_file, '', False,
+        )
+
+        assert not result.passthrough
+
+
+class TestChunking:
+    """Tests for the chunked layout of very large documents."""
+
+    @pytest.mark.parametrize('imposition_template', ['none', 'booklet'])
+    @pytest.mark.parametrize('n', [1, 2])
+    def test_same_result_as_single_writer(self, work_dir, imposition_template, n):
+        """The chunks are concatenated into the same pages as created without chunking."""
+        input_file = _create_input_pdf(
+            os.path.join(work_dir, 'input.pdf'),
+            [(595, 842, 0), (842, 595, 0), (595, 842, 90), (300, 400, 270), (595, 842, 180)] * 3,
+        )
+        results = []
+        for name, chunking in [
+            ('single', None),
+            ('chunked', LayoutChunking(min_pages=1, min_bytes=0, max_media_pages=2, max_memory_bytes=10 ** 9)),
+            ('parallel', LayoutChunking(
+                min_pages=1, min_bytes=0, max_media_pages=2, max_memory_bytes=10 ** 9, processes=2,
+            )),
+        ]:
+            output_dir = os.path.join(work_dir, name)
+            os.mkdir(output_dir)
+            final_page_processor, imposition_processor = _create_processors(
+                output_dir, imposition_template, n, PageOrientation.PORTRAIT, True,
+            )
+            result = LayoutEngine(output_dir, final_page_processor, imposition_processor, chunking=chunking) \
+                .create_output_pdf(input_file, '', True)
+            results.append((_text_positions(result.output_file), result.media_sheet_page_count))
+            assert os.listdir(output_dir) == ['output.pdf']
+
+        assert results[0] == results[1] == results[2]
+
+    def test_shared_resources_written_once(self, work_dir):
+        """The font used by the pages of all chunks is written to the output once."""
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842, 0)] * 6)
+        final_page_processor, imposition_processor = _create_processors(
+            work_dir, 'none', 1, PageOrientation.PORTRAIT, True,
+        )
+        chunking = LayoutChunking(min_pages=1, min_bytes=0, max_media_pages=1, max_memory_bytes=10 ** 9)
+
+        result = LayoutEngine(work_dir, final_page_processor, imposition_processor, chunking=chunking) \
+            .create_output_pdf(input_file, '', False)
+
+        reader = PdfReader(result.output_file)
+        fonts = {
+            page['/Resources']['/XObject']['/GbPage{}'.format(i)]['/Resources']['/Font'].raw_get('/F1').idnum
+            for i, page in enumerate(reader.pages)
+        }
+        assert len(reader.pages) == 6
+        assert len(fonts) == 1
+        with open(result.output_file, 'rb') as f:
+            assert f.read().count(b'/Helvetica') == 1
+
+    def test_parallel_output_identical_to_serial(self, work_dir):
+        """The parts laid out by the pool are appended in order, so the output does not depend on the processes."""
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842, 0), (842, 595, 90)] * 5)
+        outputs = []
+        for processes in [1, 3]:
+            output_dir = os.path.join(work_dir, str(processes))
+            os.mkdir(output_dir)
+            final_page_processor, imposition_processor = _create_processors(
+                output_dir, 'booklet', 2, PageOrientation.PORTRAIT, True,
+            )
+            chunking = LayoutChunking(
+                min_pages=1, min_bytes=0, max_media_pages=2, max_memory_bytes=10 ** 9, processes=processes,
+            )
+            result = LayoutEngine(output_dir, final_page_processor, imposition_processor, chunking=chunking) \
+                .create_output_pdf(input_file, '', True)
+            with open(result.output_file, 'rb') as f:
+                outputs.append(f.read())
+
+        assert outputs[0] == outputs[1]
+
+    def test_chunk_size(self):
+        """Small documents are not chunked and the chunks of large pages are limited by the memory limit."""
+        chunking = LayoutChunking(min_pages=1000, min_bytes=10 ** 8, max_media_pages=100, max_memory_bytes=10 ** 7)
+
+        assert chunking.get_chunk_size(10 ** 6, 100, 1) is None
+        assert chunking.get_chunk_size(10 ** 6, 1000, 1) == 100
+        assert chunking.get_chunk_size(10 ** 8, 100, 2) == 1
+        assert chunking.get_chunk_size(2 * 10 ** 8, 10000, 4) == 31
+
+
+class TestPypdfInternals:
+    """
+    Tests for the pypdf internals used by the chunked layout, so upgrading pypdf past the range pinned
+    in pyproject.toml fails here instead of silently duplicating or leaking the objects of the input file.
+    """
+
+    def test_translated_ids(self, work_dir):
+        """`PdfWriter._id_translated` maps the object numbers of a reader to the numbers of their copies."""
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842, 0)])
+        reader = PdfReader(input_file)
+        writer = PdfWriter()
+        font_reference = reader.pages[0]['/Resources'].raw_get('/Font').raw_get('/F1')
+
+        copy = font_reference.clone(writer)
+
+        assert writer._id_translated[id(reader)][font_reference.idnum] == copy.idnum
+
+    def test_resolved_objects(self, work_dir):
+        """`PdfReader.resolved_objects` is the cache of the parsed objects, which can be cleared."""
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842, 0)])
+        reader = PdfReader(input_file)
+        reader.pages[0]['/Resources']['/Font']['/F1'].get_object()
+
+        assert reader.resolved_objects
+        reader.resolved_objects.clear()
+        assert reader.pages[0]['/Resources']['/Font']['/F1']['/BaseFont'] == '/Helvetica'
+
+
+class TestPlacement:
+    """Tests for the placement computations."""
+
+    def test_oversized_page_is_clipped_to_cell(self, work_dir):
+        """A page larger than its n-up cell is clipped to the cell on all sides."""
+        final_page_processor, _ = _create_processors(work_dir, 'none', 2, PageOrientation.PORTRAIT, False)
+        page = PageBoxes(
+            mediabox=(0, 0, 1000, 1000), cropbox=(0, 0, 1000, 1000), trimbox=(0, 0, 1000, 1000), rotation=0,
+        )
+
+        placement = final_page_processor.get_input_page_placement(page, 0, 0)
+
+        cell_width = final_page_processor.input_page_size.width_pt()
+        cell_height = final_page_processor.input_page_size.height_pt()
+        assert placement.clip.left == pytest.approx(0)
+        assert placement.clip.bottom == pytest.approx(0)
+        assert placement.clip.right == pytest.approx(cell_width)
+        assert placement.clip.top == pytest.approx(cell_height)
+
+    def test_merge_placement_keeps_source_page(self):
+        """Merging a placement does not modify the crop box of the source page."""
+        writer = PdfWriter()
+        page = writer.add_blank_page(100, 100)
+        target = writer.add_blank_page(200, 200)
+        placement = Placement(0, Transformation().translate(50, 50), RectangleObject((60, 60, 100, 100)))
+
+        merge_placement(target, page, placement)
+
+        assert '/CropBox' not in page
+        assert page.cropbox == RectangleObject((0, 0, 100, 100))
+
+    def test_page_placed_as_form_xobject_once(self, work_dir):
+        """A page placed multiple times is copied once and every placement is clipped to its cell."""
+        input_file = _create_input_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842, 0)] * 2)
+        final_page_processor, imposition_processor = _create_processors(
+            work_dir, 'none', 4, PageOrientation.PORTRAIT, True,
+        )
+
+        result = LayoutEngine(work_dir, final_page_processor, imposition_processor).create_output_pdf(
+            input_file, '1,1,1,2', False,
+        )
+
+        page = PdfReader(result.output_file).pages[0]
+        xobjects = page['/Resources']['/XObject']
+        assert len(xobjects) == 2
+        assert all(xobject.get_object()['/Subtype'] == '/Form' for xobject in xobjects.values())
+        operators = [operator for _, operator in ContentStream(page.get_contents(), None).operations]
+        assert operators.count(b'Do') == 4
+        assert operators.count(b'W') == 4
+        assert [label for label, _, _ in _text_positions(result.output_file)[0]] == ['A0'] * 3 + ['A1'] + ['B0'] * 3 + ['B1']
+
+    @staticmethod
+    def _add_annotation(writer, page_index, subtype, flags, appearance=None):
+        annotation = DictionaryObject({
+            NameObject('/Type'): NameObject('/Annot'),
+            NameObject('/Subtype'): NameObject(subtype),
+            NameObject('/Rect'): RectangleObject((10, 10, 30, 20)),
+            NameObject('/F'): NumberObject(flags),
+        })
+        if appearance is not None:
+            annotation[NameObject('/AP')] = DictionaryObject({NameObject('/N'): add_indirect_object(writer, appearance)})
+        writer.add_annotation(page_index, annotation)
+
+    def test_annotation_appearance_drawn_in_form(self):
+        """The appearances of the printable annotations are drawn into the Form XObject of the page."""
+        writer = PdfWriter()
+        page = writer.add_blank_page(100, 100)
+        page[NameObject('/Resources')] = DictionaryObject({NameObject('/XObject'): DictionaryObject()})
+        appearance = DecodedStreamObject()
+        appearance.set_data(b'0 0 1 rg 0 0 10 5 re f')
+        appearance[NameObject('/Type')] = NameObject('/XObject')
+        appearance[NameObject('/Subtype')] = NameObject('/Form')
+        appearance[NameObject('/BBox')] = RectangleObject((0, 0, 10, 5))
+        self._add_annotation(writer, 0, '/Square', AnnotationFlag.PRINT, appearance)
+        target = writer.add_blank_page(200, 200)
+        placement = Placement(0, Transformation().translate(50, 50), RectangleObject((50, 50, 150, 150)))
+
+        FormXObjectPlacer(writer, [page]).draw(target, [placement])
+
+        assert '/Annots' not in target
+        form = target['/Resources']['/XObject']['/GbPage0'].get_object()
+        assert form['/Resources']['/XObject']['/GbAnnot0'].get_object().get_data() == b'0 0 1 rg 0 0 10 5 re f'
+        # The 10x5 appearance is scaled to the 20x10 rectangle of the annotation
+        assert form.get_data().endswith(b'q 2 0 0 2 10 10 cm /GbAnnot0 Do Q')
+        assert '/GbAnnot0' not in page['/Resources']['/XObject']
+
+    def test_annotations_not_printed_are_dropped(self, work_dir):
+        """Links and the annotations without the print flag are not copied to the output."""
+        writer = PdfWriter()
+        page = writer.add_blank_page(100, 100)
+        appearance = DecodedStreamObject()
+        appearance[NameObject('/BBox')] = RectangleObject((0, 0, 10, 5))
+        self._add_annotation(writer, 0, '/Link', 0)
+        self._add_annotation(writer, 0, '/Square', 0, appearance)
+        self._add_annotation(writer, 0, '/Square', AnnotationFlag.PRINT | AnnotationFlag.HIDDEN, appearance)
+        target = writer.add_blank_page(200, 200)
+        placement = Placement(0, Transformation().translate(50, 50), RectangleObject((50, 50, 150, 150)))
+
+        FormXObjectPlacer(writer, [page]).draw(target, [placement])
+
+        assert '/Annots' not in target
+        form = target['/Resources']['/XObject']['/GbPage0'].get_object()
+        assert b'Do' not in form.get_data()
+
+    def test_page_without_contents(self):
+        """Blank pages without a content stream are placed as empty Form XObjects."""
+        writer = PdfWriter()
+        page = writer.add_blank_page(100, 100)
+        target = writer.add_blank_page(200, 200)
+        placement = Placement(0, Transformation().translate(50, 50), RectangleObject((50, 50, 150, 150)))
+
+        FormXObjectPlacer(writer, [page]).draw(target, [placement])
+
+        xobject = target['/Resources']['/XObject']['/GbPage0'].get_object()
+        assert xobject['/Subtype'] == '/Form'
+        assert xobject.get_data() == b''
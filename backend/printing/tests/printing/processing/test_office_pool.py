@@ -0,0 +1,221 @@
+"""
+Tests for the LibreOffice instance pool in printing.processing.office_pool
+"""
+
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from control.models import JobStatus
+from printing.cancellation import watch_cancellation
+from printing.processing.converter import DocConverter
+from printing.processing.office_pool import OfficePool, OfficeInstanceError, OfficeConversionError
+from printing.utils import JobCanceledException
+
+
+@pytest.fixture
+def work_dir():
+    """A temporary working directory for converter tests."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+class FakeInstance:
+    """An instance which records its lifecycle instead of starting LibreOffice."""
+
+    def __init__(self, instance_dir):
+        self.instance_dir = instance_dir
+        self.alive = False
+        self.conversions = 0
+        self.starts = 0
+        self.fail_with = None
+        # Called during the conversion, e.g. to cancel the job
+        self.on_convert = None
+
+    def is_alive(self):
+        return self.alive
+
+    def start(self):
+        self.alive = True
+        self.conversions = 0
+        self.starts += 1
+
+    def stop(self):
+        self.alive = False
+
+    def convert(self, input_file, output_file, timeout):
+        self.conversions += 1
+        if self.on_convert is not None:
+            self.on_convert()
+        if self.fail_with is not None:
+            raise self.fail_with
+        with open(output_file, 'wb') as f:
+            f.write(b'%PDF-converted')
+
+
+@pytest.fixture
+def pool():
+    pool = OfficePool(size=1, max_conversions=3, timeout=5, instance_factory=FakeInstance)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture
+def canceled_job(create_job):
+    """A job whose cancellation has been requested."""
+    return create_job(status=JobStatus.CANCELING)
+
+
+def _instance(pool):
+    return pool._instances[0]
+
+
+class TestOfficePool:
+    """Tests for the OfficePool instance management."""
+
+    def test_prewarm_starts_instances(self):
+        """All instances are running after prewarm."""
+        pool = OfficePool(size=3, max_conversions=3, timeout=5, instance_factory=FakeInstance)
+        pool.prewarm()
+
+        assert all(instance.alive for instance in pool._instances)
+        assert all(instance.starts == 1 for instance in pool._instances)
+        pool.shutdown()
+
+    def test_instance_is_reused(self, pool, work_dir):
+        """Consecutive conversions use the same running instance."""
+        output = os.path.join(work_dir, 'out.pdf')
+
+        pool.convert('input.docx', output)
+        pool.convert('input.docx', output)
+
+        assert _instance(pool).starts == 1
+        assert _instance(pool).conversions == 2
+        assert os.path.isfile(output)
+
+    def test_instance_restarted_after_max_conversions(self, pool, work_dir):
+        """An instance is restarted after max_conversions conversions."""
+        output = os.path.join(work_dir, 'out.pdf')
+
+        for _ in range(3):
+            pool.convert('input.docx', output)
+
+        assert _instance(pool).starts == 2
+        assert _instance(pool).conversions == 0
+
+    def test_instance_restarted_after_timeout(self, pool, work_dir):
+        """A conversion exceeding the timeout raises TimeoutError and restarts the instance."""
+        pool.prewarm()
+        _instance(pool).fail_with = TimeoutError('timed out')
+
+        with pytest.raises(TimeoutError):
+            pool.convert('input.docx', os.path.join(work_dir, 'out.pdf'))
+
+        assert _instance(pool).starts == 2
+        assert _instance(pool).alive
+
+    def test_instance_restarted_after_crash(self, pool, work_dir):
+        """A crashed agent is restarted and the error is propagated."""
+        pool.prewarm()
+        _instance(pool).fail_with = OfficeInstanceError('crashed')
+
+        with pytest.raises(OfficeInstanceError):
+            pool.convert('input.docx', os.path.join(work_dir, 'out.pdf'))
+
+        assert _instance(pool).starts == 2
+
+    def test_conversion_error_keeps_instance(self, pool, work_dir):
+        """A document which LibreOffice cannot convert does not restart the instance."""
+        pool.prewarm()
+        _instance(pool).fail_with = OfficeConversionError('invalid document')
+
+        with pytest.raises(OfficeConversionError):
+            pool.convert('input.docx', os.path.join(work_dir, 'out.pdf'))
+
+        assert _instance(pool).starts == 1
+
+    def test_instance_returned_to_pool_after_error(self, pool, work_dir):
+        """The instance can be checked out again after a failed conversion."""
+        _instance(pool).fail_with = OfficeConversionError('invalid document')
+        with pytest.raises(OfficeConversionError):
+            pool.convert('input.docx', os.path.join(work_dir, 'out.pdf'))
+
+        _instance(pool).fail_with = None
+        pool.convert('input.docx', os.path.join(work_dir, 'out.pdf'))
+
+
+    def test_instance_not_restarted_for_canceled_job(self, pool, work_dir, canceled_job):
+        """The instance stopped by a cancellation is started by the next conversion instead of the canceled job."""
+        pool.prewarm()
+        with watch_cancellation(canceled_job) as token:
+            _instance(pool).on_convert = token.cancel
+            _instance(pool).fail_with = OfficeInstanceError('The LibreOffice agent exited during the conversion')
+
+            with pytest.raises(JobCanceledException):
+                pool.convert('input.docx', os.path.join(work_dir, 'out.pdf'))
+
+        assert not _instance(pool).alive
+        assert _instance(pool).starts == 1
+        canceled_job.refresh_from_db()
+        assert canceled_job.status == JobStatus.CANCELED
+
+        _instance(pool).on_convert = None
+        _instance(pool).fail_with = None
+        pool.convert('input.docx', os.path.join(work_dir, 'out.pdf'))
+        assert _instance(pool).starts == 2
+
+    def test_instance_not_started_for_canceled_job(self, pool, work_dir, canceled_job):
+        """A stopped instance is not started for a job canceled before its conversion."""
+        with watch_cancellation(canceled_job) as token:
+            token.cancel()
+
+            with pytest.raises(JobCanceledException):
+                pool.convert('input.docx', os.path.join(work_dir, 'out.pdf'))
+
+        assert _instance(pool).starts == 0
+
+
+class TestDocConverterWithPool:
+    """Tests for the use of the LibreOffice pool in DocConverter."""
+
+    def test_pool_used_when_available(self, pool, work_dir):
+        """DocConverter converts documents using the pool instead of the CLI."""
+        with patch('printing.processing.converter.get_office_pool', return_value=pool), \
+                patch.object(DocConverter, 'run_in_sandbox') as mock_run:
+            result = DocConverter(work_dir).convert_to_pdf('/path/to/document.docx')
+
+        assert not mock_run.called
+        assert result == os.path.join(work_dir, 'converted.pdf')
+        assert os.path.isfile(result)
+
+    def test_cli_used_when_pool_fails(self, pool, work_dir):
+        """DocConverter falls back to the LibreOffice CLI if the pool has no working instance."""
+        _instance(pool).fail_with = OfficeInstanceError('crashed')
+
+        def fake_libreoffice(command):
+            out_dir = command[command.index('--outdir') + 1]
+            with open(os.path.join(out_dir, 'document.pdf'), 'wb') as f:
+                f.write(b'%PDF-cli')
+
+        with patch('printing.processing.converter.get_office_pool', return_value=pool), \
+                patch.object(DocConverter, 'run_in_sandbox', side_effect=fake_libreoffice) as mock_run:
+            result = DocConverter(work_dir).convert_to_pdf('/path/to/document.docx')
+
+        assert mock_run.called
+        with open(result, 'rb') as f:
+            assert f.read() == b'%PDF-cli'
+
+    def test_cli_not_used_for_canceled_job(self, pool, work_dir, canceled_job):
+        """A canceled job is not converted again with the CLI after its instance has been stopped."""
+        with watch_cancellation(canceled_job) as token, \
+                patch('printing.processing.converter.get_office_pool', return_value=pool), \
+                patch.object(pool, 'convert', side_effect=OfficeInstanceError('crashed')), \
+                patch.object(DocConverter, 'run_in_sandbox') as mock_run:
+            token.cancel()
+
+            with pytest.raises(JobCanceledException):
+                DocConverter(work_dir).convert_to_pdf('/path/to/document.docx')
+
+        assert not mock_run.called
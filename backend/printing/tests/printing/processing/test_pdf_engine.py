@@ -0,0 +1,232 @@
+"""
+Conformance tests of the PDF engines in printing.processing.pdf_engine
+
+Every test is run with each engine, the engines which are not installed are skipped.
+"""
+
+import os
+import tempfile
+import time
+
+import pytest
+from pypdf import PdfReader, PdfWriter, Transformation
+from pypdf.generic import ContentStream, DictionaryObject, NameObject, NumberObject, RectangleObject, StreamObject
+
+from printing.processing.pdf_engine import PDF_ENGINES, get_pdf_engine, PypdfEngine
+from printing.processing.pdf_index import PageBoxes
+from printing.processing.placement import Placement
+
+ENGINES = [
+    pytest.param(name, marks=pytest.mark.skipif(not engine.is_available(), reason=f'{name} is not installed'))
+    for name, engine in PDF_ENGINES.items()
+]
+
+
+@pytest.fixture(params=ENGINES)
+def engine(request):
+    return PDF_ENGINES[request.param]()
+
+
+@pytest.fixture
+def work_dir():
+    """A temporary working directory for engine tests."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+def _create_labeled_pdf(path, sizes):
+    """Creates a PDF with the label `P<index>` at (10, 10) on every page, `sizes` is a list of `(width, height)`."""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for i, (width, height) in enumerate(sizes):
+        page = writer.add_blank_page(width, height)
+        content = StreamObject()
+        content.set_data(f'BT /F1 12 Tf 10 10 Td (P{i}) Tj ET'.encode())
+        page[NameObject('/Contents')] = writer._add_object(content)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+def _label_positions(page, content_owner=None, resources=None, ctm=(1, 0, 0, 1, 0, 0)):
+    """Returns the labels drawn on `page`, including the Form XObjects, with their positions on the page."""
+    if content_owner is None:
+        content_owner, resources = page.get_contents(), page['/Resources']
+    if content_owner is None:
+        return []
+
+    def multiply(m, n):
+        a, b, c, d, e, f = m
+        A, B, C, D, E, F = n
+        return a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D, e * A + f * C + E, e * B + f * D + F
+
+    result = []
+    stack = []
+    x = y = 0
+    for operands, operator in ContentStream(content_owner, None).operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q':
+            ctm = stack.pop()
+        elif operator == b'cm':
+            ctm = multiply([float(value) for value in operands], ctm)
+        elif operator == b'Td':
+            x, y = float(operands[0]), float(operands[1])
+        elif operator == b'Tj':
+            result.append((operands[0], round(x * ctm[0] + y * ctm[2] + ctm[4], 2), round(x * ctm[1] + y * ctm[3] + ctm[5], 2)))
+        elif operator == b'Do':
+            form = resources['/XObject'][operands[0]].get_object()
+            matrix = [float(value) for value in form.get('/Matrix', [1, 0, 0, 1, 0, 0])]
+            result.extend(_label_positions(page, form, form['/Resources'], multiply(matrix, ctm)))
+    return sorted(result)
+
+
+class TestReadPageBoxes:
+    """Tests for reading the page geometry."""
+
+    def test_default_boxes(self, engine, work_dir):
+        """The crop box defaults to the media box and the trim box to the crop box."""
+        writer = PdfWriter()
+        writer.add_blank_page(595, 842)
+        page = writer.add_blank_page(842, 595)
+        page.cropbox = RectangleObject((10, 20, 800, 500))
+        page = writer.add_blank_page(300, 400)
+        page.trimbox = RectangleObject((5, 5, 295, 395))
+        page[NameObject('/Rotate')] = NumberObject(-90)
+        path = os.path.join(work_dir, 'boxes.pdf')
+        with open(path, 'wb') as f:
+            writer.write(f)
+
+        assert engine.read_page_boxes(path) == [
+            PageBoxes(mediabox=(0, 0, 595, 842), cropbox=(0, 0, 595, 842), trimbox=(0, 0, 595, 842), rotation=0),
+            PageBoxes(mediabox=(0, 0, 842, 595), cropbox=(10, 20, 800, 500), trimbox=(10, 20, 800, 500), rotation=0),
+            PageBoxes(mediabox=(0, 0, 300, 400), cropbox=(0, 0, 300, 400), trimbox=(5, 5, 295, 395), rotation=270),
+        ]
+
+    def test_inherited_attributes(self, engine, work_dir):
+        """The media box and the rotation are inherited from the page tree."""
+        writer = PdfWriter()
+        page = writer.add_blank_page(100, 100)
+        del page[NameObject('/MediaBox')]
+        pages = writer.root_object['/Pages']
+        pages[NameObject('/MediaBox')] = RectangleObject((0, 0, 200, 300))
+        pages[NameObject('/Rotate')] = NumberObject(90)
+        path = os.path.join(work_dir, 'inherited.pdf')
+        with open(path, 'wb') as f:
+            writer.write(f)
+
+        assert engine.read_page_boxes(path) == [
+            PageBoxes(mediabox=(0, 0, 200, 300), cropbox=(0, 0, 200, 300), trimbox=(0, 0, 200, 300), rotation=90),
+        ]
+
+
+class TestPlacePages:
+    """Tests for placing the source pages on the output pages."""
+
+    def test_pages_placed_by_transformation(self, engine, work_dir):
+        """Every source page is drawn with its transformation, the output pages have the requested size."""
+        input_file = _create_labeled_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842), (842, 595)])
+        output_file = os.path.join(work_dir, 'output.pdf')
+        full_page = RectangleObject((0, 0, 842, 842))
+
+        engine.place_pages(input_file, output_file, 842, 842, [
+            [Placement(0, Transformation().translate(100, 200), full_page)],
+            [
+                Placement(1, Transformation().scale(0.5), full_page),
+                Placement(0, Transformation().rotate(90).translate(842, 0), full_page),
+            ],
+        ])
+
+        reader = PdfReader(output_file)
+        assert [(float(page.mediabox.width), float(page.mediabox.height)) for page in reader.pages] == [(842, 842)] * 2
+        assert _label_positions(reader.pages[0]) == [('P0', 110, 210)]
+        assert _label_positions(reader.pages[1]) == [('P0', 832, 10), ('P1', 5, 5)]
+
+    def test_page_without_placements(self, engine, work_dir):
+        """Pages without placements are blank."""
+        input_file = _create_labeled_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842)])
+        output_file = os.path.join(work_dir, 'output.pdf')
+
+        engine.place_pages(input_file, output_file, 595, 842, [[]])
+
+        reader = PdfReader(output_file)
+        assert len(reader.pages) == 1
+        assert _label_positions(reader.pages[0]) == []
+
+    def test_page_copied_once(self, engine, work_dir):
+        """A source page placed multiple times is copied to the output once."""
+        input_file = _create_labeled_pdf(os.path.join(work_dir, 'input.pdf'), [(595, 842)])
+        output_file = os.path.join(work_dir, 'output.pdf')
+        placement = Placement(0, Transformation(), RectangleObject((0, 0, 595, 842)))
+
+        engine.place_pages(input_file, output_file, 595, 842, [[placement], [placement]])
+
+        forms = {
+            xobject.idnum
+            for page in PdfReader(output_file).pages
+            for xobject in page['/Resources']['/XObject'].values()
+        }
+        assert len(forms) == 1
+
+
+class TestGetPdfEngine:
+    """Tests for selecting the engine in the settings."""
+
+    def test_default_engine(self, settings):
+        """pypdf is used by default."""
+        assert isinstance(get_pdf_engine(), PypdfEngine)
+
+    def test_unknown_engine(self, settings):
+        """An unknown engine name is rejected."""
+        settings.PDF_ENGINE = 'unknown'
+
+        with pytest.raises(ValueError):
+            get_pdf_engine()
+
+
+@pytest.mark.slow
+class TestEngineBenchmark:
+    """Compares the speed of the engines on documents with the page sizes used by the converter tests."""
+
+    # The page sizes of the orientation detection tests in test_converter.py, in millimeters
+    PAGE_SIZES_MM = [(297, 210), (210, 297), (210, 210)]
+    PAGE_COUNT = 300
+    # An order of magnitude above the time of both engines, so only a severe regression fails the test
+    MAX_S_PER_PAGE = 0.01
+
+    def test_compare_engines(self, work_dir, record_property):
+        """Both engines lay out the same document 2-up within the time limit, the timings are reported by pytest."""
+        sizes = [
+            (width * 72 / 25.4, height * 72 / 25.4)
+            for width, height in self.PAGE_SIZES_MM * (self.PAGE_COUNT // len(self.PAGE_SIZES_MM))
+        ]
+        input_file = _create_labeled_pdf(os.path.join(work_dir, 'input.pdf'), sizes)
+        layout = [
+            [
+                Placement(index, Transformation().scale(0.5).translate(0, 421), RectangleObject((0, 421, 595, 842))),
+                Placement(index + 1, Transformation().scale(0.5), RectangleObject((0, 0, 595, 421))),
+            ]
+            for index in range(0, len(sizes), 2)
+        ]
+
+        for name, engine_class in PDF_ENGINES.items():
+            if not engine_class.is_available():
+                continue
+            engine = engine_class()
+            output_file = os.path.join(work_dir, f'{name}.pdf')
+            start = time.perf_counter()
+            page_boxes = engine.read_page_boxes(input_file)
+            engine.place_pages(input_file, output_file, 595, 842, layout)
+            duration = time.perf_counter() - start
+            record_property(f'{name}_duration_s', duration)
+
+            assert len(page_boxes) == len(sizes)
+            assert len(PdfReader(output_file).pages) == len(layout)
+            assert duration < self.MAX_S_PER_PAGE * len(sizes)
@@ -0,0 +1,156 @@
+"""
+Tests for the PDF page tree index in printing.processing.pdf_index
+"""
+
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytest
+from pypdf import PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject, RectangleObject
+
+from printing.processing.converter import PdfConverter
+from printing.processing.pages import PageOrientation
+from printing.processing.pdf_index import PageBoxes, PdfIndex, PdfIndexError, index_pdf, read_page_boxes
+
+
+@pytest.fixture
+def work_dir():
+    """A temporary working directory for index tests."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+def _write_pdf(work_dir, page_sizes, user_password=None):
+    writer = PdfWriter()
+    for width, height in page_sizes:
+        writer.add_blank_page(width=width, height=height)
+    if user_password is not None:
+        writer.encrypt(user_password, 'owner')
+    path = os.path.join(work_dir, 'document.pdf')
+    writer.write(path)
+    return path
+
+
+class TestIndexPdf:
+    """Tests for reading the page count and sizes."""
+
+    def test_page_sizes(self, work_dir):
+        """The pages are counted by their size and the orientation of most pages is used."""
+        path = _write_pdf(work_dir, [(595, 842), (842, 595), (842, 595), (595.3, 841.9)])
+
+        index = index_pdf(path)
+
+        assert index == PdfIndex(
+            page_count=4,
+            page_sizes={'595x842': 2, '842x595': 2},
+            orientation=PageOrientation.PORTRAIT,
+            encrypted=False,
+        )
+
+    def test_landscape_document(self, work_dir):
+        """Documents with mostly horizontal pages are landscape."""
+        path = _write_pdf(work_dir, [(842, 595), (842, 595), (595, 842)])
+
+        assert index_pdf(path).orientation == PageOrientation.LANDSCAPE
+
+    def test_inherited_media_box(self, work_dir):
+        """Pages without their own media box use the one of the page tree node."""
+        writer = PdfWriter()
+        for _ in range(3):
+            page = writer.add_blank_page(width=100, height=100)
+            del page[NameObject('/MediaBox')]
+        writer._root_object['/Pages'][NameObject('/MediaBox')] = RectangleObject((0, 0, 842, 595))
+        path = os.path.join(work_dir, 'document.pdf')
+        writer.write(path)
+
+        index = index_pdf(path)
+
+        assert index.page_count == 3
+        assert index.page_sizes == {'842x595': 3}
+
+    def test_nested_page_tree(self, work_dir):
+        """Pages in nested page tree nodes are counted."""
+        writer = PdfWriter()
+        pages = [writer.add_blank_page(width=200, height=100) for _ in range(4)]
+        root = writer._root_object['/Pages']
+        node = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject([page.indirect_reference for page in pages[2:]]),
+            NameObject('/Count'): NumberObject(2),
+            NameObject('/Parent'): root.indirect_reference,
+        })
+        root[NameObject('/Kids')] = ArrayObject(
+            [page.indirect_reference for page in pages[:2]] + [writer._add_object(node)])
+        path = os.path.join(work_dir, 'document.pdf')
+        writer.write(path)
+
+        assert index_pdf(path).page_sizes == {'200x100': 4}
+
+    def test_encrypted_with_empty_password(self, work_dir):
+        """Documents encrypted with the empty user password are indexed."""
+        path = _write_pdf(work_dir, [(595, 842)], user_password='')
+
+        index = index_pdf(path)
+
+        assert index.encrypted
+        assert index.page_count == 1
+
+    def test_encrypted_with_password(self, work_dir):
+        """Only the encrypted flag is set when the document requires a password."""
+        path = _write_pdf(work_dir, [(595, 842)], user_password='secret')
+
+        assert index_pdf(path) == PdfIndex(page_count=None, encrypted=True)
+
+    def test_invalid_document(self, work_dir):
+        """PdfIndexError is raised for files which are not PDF documents."""
+        path = os.path.join(work_dir, 'document.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'not a PDF document')
+
+        with pytest.raises(PdfIndexError):
+            index_pdf(path)
+
+
+class TestReadPageBoxes:
+    """Tests for reading the boxes of the pages."""
+
+    def test_default_boxes(self, work_dir):
+        """The crop box defaults to the media box and the trim box to the crop box."""
+        writer = PdfWriter()
+        writer.add_blank_page(width=595, height=842)
+        page = writer.add_blank_page(width=595, height=842)
+        page.cropbox = RectangleObject((10, 10, 500, 800))
+        page.rotate(90)
+        writer._root_object['/Pages'][NameObject('/Rotate')] = NumberObject(180)
+        path = os.path.join(work_dir, 'document.pdf')
+        writer.write(path)
+
+        assert read_page_boxes(path) == [
+            PageBoxes((0, 0, 595, 842), (0, 0, 595, 842), (0, 0, 595, 842), 180),
+            PageBoxes((0, 0, 595, 842), (10, 10, 500, 800), (10, 10, 500, 800), 90),
+        ]
+
+    def test_encrypted(self, work_dir):
+        """Encrypted documents are rejected, even if they can be opened without a password."""
+        path = _write_pdf(work_dir, [(595, 842)], user_password='')
+
+        with pytest.raises(PdfIndexError):
+            read_page_boxes(path)
+
+
+class TestPreprocessWithIndex:
+    """Tests for using the index in the preprocessing of PDF documents."""
+
+    def test_index_used_for_orientation(self, work_dir):
+        """The orientation is taken from the index without reading the document."""
+        path = _write_pdf(work_dir, [(595, 842)])
+        converter = PdfConverter(work_dir)
+        converter.set_source_index(path, PdfIndex(page_count=1, orientation=PageOrientation.LANDSCAPE))
+
+        with patch('printing.processing.converter.get_pdf_engine') as mock_engine:
+            result = converter.preprocess(path)
+
+        assert result.orientation == PageOrientation.LANDSCAPE
+        assert not mock_engine.called
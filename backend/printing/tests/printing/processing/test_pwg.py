@@ -0,0 +1,181 @@
+"""
+Tests for the PWG Raster decoder in printing.processing.pwg
+"""
+
+import os
+import struct
+import tempfile
+
+import pytest
+from pypdf import PdfReader
+
+from printing.processing.pwg import convert_pwg_raster, PwgRasterError, UnsupportedRasterError, \
+    PWG_SYNC_WORD, PWG_HEADER_SIZE, CSPACE_SW, CSPACE_SRGB, CSPACE_K, CSPACE_CMYK
+
+
+@pytest.fixture
+def work_dir():
+    """A temporary working directory for PWG tests."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+def _header(width, height, color_space, bits_per_color, colors, resolution=72, page_size=None, color_order=0):
+    header = bytearray(PWG_HEADER_SIZE)
+    bits_per_pixel = bits_per_color * colors
+    struct.pack_into('>II', header, 276, resolution, resolution)
+    struct.pack_into('>II', header, 352, *(page_size or (0, 0)))
+    struct.pack_into('>8I', header, 372, width, height, 0, bits_per_color, bits_per_pixel,
+                     (width * bits_per_pixel + 7) // 8, color_order, color_space)
+    struct.pack_into('>I', header, 420, colors)
+    return bytes(header)
+
+
+def _encode_line(line: bytes, pixel_size: int) -> bytes:
+    """Encodes a line with runs of repeated pixels and literal pixels."""
+    pixels = [line[i:i + pixel_size] for i in range(0, len(line), pixel_size)]
+    encoded = bytearray()
+    i = 0
+    while i < len(pixels):
+        run = 1
+        while i + run < len(pixels) and run < 128 and pixels[i + run] == pixels[i]:
+            run += 1
+        if run > 1:
+            encoded.append(run - 1)
+            encoded += pixels[i]
+            i += run
+            continue
+        literal = 1
+        while i + literal < len(pixels) and literal < 128 and pixels[i + literal] != pixels[i + literal - 1]:
+            literal += 1
+        # A single pixel is encoded as a run of length 1
+        encoded.append(257 - literal if literal > 1 else 0)
+        encoded += b''.join(pixels[i:i + literal])
+        i += literal
+    return bytes(encoded)
+
+
+def _encode_page(rows, pixel_size) -> bytes:
+    encoded = bytearray()
+    y = 0
+    while y < len(rows):
+        repeat = 1
+        while y + repeat < len(rows) and repeat < 256 and rows[y + repeat] == rows[y]:
+            repeat += 1
+        encoded.append(repeat - 1)
+        encoded += _encode_line(rows[y], pixel_size)
+        y += repeat
+    return bytes(encoded)
+
+
+def _gradient_rows(width, height, pixel_size):
+    # Repeated lines and pixels are used to test both kinds of runs
+    return [bytes((x // 3 * 16 + y // 2 + c) % 256 for x in range(width) for c in range(pixel_size))
+            for y in range(height)]
+
+
+def _write_raster(work_dir, pages) -> str:
+    path = os.path.join(work_dir, 'input.pwg')
+    with open(path, 'wb') as f:
+        f.write(PWG_SYNC_WORD)
+        for header, data in pages:
+            f.write(header)
+            f.write(data)
+    return path
+
+
+def _convert(work_dir, path, threads=1):
+    out = os.path.join(work_dir, 'converted.pdf')
+    convert_pwg_raster(path, out, threads)
+    return PdfReader(out)
+
+
+def _page_image(page):
+    return page['/Resources']['/XObject']['/Im0'].get_object()
+
+
+class TestConvertPwgRaster:
+    """Tests for converting PWG Raster documents to PDF."""
+
+    @pytest.mark.parametrize('color_space, colors', [(CSPACE_SW, 1), (CSPACE_SRGB, 3), (CSPACE_CMYK, 4)])
+    def test_pixels_decoded(self, work_dir, color_space, colors):
+        """Each page is stored as an image with the decoded pixels."""
+        rows = _gradient_rows(40, 30, colors)
+        path = _write_raster(work_dir, [(_header(40, 30, color_space, 8, colors), _encode_page(rows, colors))])
+
+        reader = _convert(work_dir, path)
+
+        image = _page_image(reader.pages[0])
+        assert (image['/Width'], image['/Height']) == (40, 30)
+        assert image.get_data() == b''.join(rows)
+
+    def test_black_bitmap(self, work_dir):
+        """1-bit black rasters are stored with inverted colors, as 0 is white."""
+        rows = [bytes([0b10100000, 0]), bytes([0, 0b11000000])]
+        path = _write_raster(work_dir, [(_header(10, 2, CSPACE_K, 1, 1), _encode_page(rows, 1))])
+
+        image = _page_image(_convert(work_dir, path).pages[0])
+
+        assert image['/BitsPerComponent'] == 1
+        assert list(image['/Decode']) == [1, 0]
+        assert image.get_data() == b''.join(rows)
+
+    def test_white_fill(self, work_dir):
+        """The rest of the line is filled with white by the 128 control byte."""
+        data = bytes([0, 0, 0x10, 0x10, 0x10, 128])
+        path = _write_raster(work_dir, [(_header(5, 1, CSPACE_SRGB, 8, 3), data)])
+
+        image = _page_image(_convert(work_dir, path).pages[0])
+
+        assert image.get_data() == b'\x10' * 3 + b'\xff' * 12
+
+    def test_page_sizes(self, work_dir):
+        """The page size is taken from the header or computed from the resolution."""
+        rows = _gradient_rows(8, 4, 1)
+        path = _write_raster(work_dir, [
+            (_header(8, 4, CSPACE_SW, 8, 1, page_size=(595, 842)), _encode_page(rows, 1)),
+            (_header(8, 4, CSPACE_SW, 8, 1, resolution=4), _encode_page(rows, 1)),
+        ])
+
+        reader = _convert(work_dir, path)
+
+        assert [(float(page.mediabox.width), float(page.mediabox.height)) for page in reader.pages] == \
+            [(595, 842), (144, 72)]
+
+    def test_threads_give_same_result(self, work_dir):
+        """Compressing the pages in a thread pool keeps the order of the pages."""
+        pages = []
+        for page in range(5):
+            rows = _gradient_rows(16, 8 + page, 3)
+            pages.append((_header(16, 8 + page, CSPACE_SRGB, 8, 3), _encode_page(rows, 3)))
+        path = _write_raster(work_dir, pages)
+
+        sequential = [_page_image(page).get_data() for page in _convert(work_dir, path).pages]
+        threaded = [_page_image(page).get_data() for page in _convert(work_dir, path, threads=2).pages]
+
+        assert threaded == sequential
+        assert len(threaded) == 5
+
+    def test_invalid_sync_word(self, work_dir):
+        """Files which are not PWG rasters are rejected."""
+        path = os.path.join(work_dir, 'input.pwg')
+        with open(path, 'wb') as f:
+            f.write(b'RaS3' + _header(1, 1, CSPACE_SW, 8, 1) + b'\x00\x00\x00')
+
+        with pytest.raises(PwgRasterError):
+            _convert(work_dir, path)
+
+    def test_truncated_page(self, work_dir):
+        """A page with missing lines is rejected."""
+        rows = _gradient_rows(8, 4, 1)
+        path = _write_raster(work_dir, [(_header(8, 4, CSPACE_SW, 8, 1), _encode_page(rows, 1)[:-4])])
+
+        with pytest.raises(PwgRasterError):
+            _convert(work_dir, path)
+
+    def test_banded_color_order_not_supported(self, work_dir):
+        """Rasters with other color orders are left to cupsfilter."""
+        path = _write_raster(work_dir, [(_header(1, 1, CSPACE_SRGB, 8, 3, color_order=1), b'\x00\x00\x00\x00\x00')])
+
+        with pytest.raises(UnsupportedRasterError):
+            _convert(work_dir, path)
@@ -0,0 +1,150 @@
+"""
+Tests for the per-document sandbox sessions in printing.processing.sandbox
+"""
+
+import os
+import subprocess
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from common.models import User
+from control.models import GutenbergJob, JobStatus
+from printing import cancellation
+from printing.cancellation import CancellationListener, watch_cancellation
+from printing.processing.sandbox import SandboxSession, sandbox_session, run_in_sandbox, sandbox_cpu_time
+from printing.utils import JobCanceledException
+
+
+@pytest.fixture
+def fake_sandbox(tmp_path):
+    """A sandbox wrapper which runs the command without isolation, as bwrap is not available in tests."""
+    path = tmp_path / 'sandbox.sh'
+    path.write_text('#!/bin/sh\nshift\nexec "$@"\n')
+    path.chmod(0o755)
+    with patch('printing.processing.sandbox.SANDBOX_PATH', str(path)):
+        yield str(path)
+
+
+@pytest.fixture
+def work_dir(tmp_path):
+    path = tmp_path / 'work'
+    path.mkdir()
+    return str(path)
+
+
+class TestSandboxSession:
+    """Tests for running commands with the sandbox agent."""
+
+    def test_commands_run_by_single_agent(self, fake_sandbox, work_dir):
+        """All commands are started by the same agent process."""
+        session = SandboxSession(work_dir)
+        try:
+            parents = {session.run(['sh', '-c', 'echo $PPID']) for _ in range(3)}
+            agent_pid = session.process.pid
+        finally:
+            session.close()
+
+        assert parents == {'{}\n'.format(agent_pid)}
+
+    def test_output_and_errors(self, fake_sandbox, work_dir):
+        """The output includes stderr and failed commands raise CalledProcessError like run_cancellable."""
+        session = SandboxSession(work_dir)
+        try:
+            assert session.run(['sh', '-c', 'echo out; echo err >&2']) == 'out\nerr\n'
+            with pytest.raises(subprocess.CalledProcessError) as exc_info:
+                session.run(['sh', '-c', 'echo failed; exit 3'])
+        finally:
+            session.close()
+
+        assert exc_info.value.returncode == 3
+        assert exc_info.value.output == 'failed\n'
+
+    def test_stats(self, fake_sandbox, work_dir):
+        """The statistics of the commands and the exit status of the agent are recorded."""
+        session = SandboxSession(work_dir)
+        cpu_time_before = sandbox_cpu_time()
+        session.run(['true'])
+        session.run(['sh', '-c', 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done'])
+        session.close()
+
+        stats = session.stats()
+        assert stats['commands'] == 2
+        assert stats['exit_status'] == 0
+        assert stats['max_rss_kb'] > 0
+        assert stats['lifetime_s'] >= stats['wall_time_s'] > 0
+        assert sandbox_cpu_time() - cpu_time_before == pytest.approx(stats['cpu_time_s'])
+
+    def test_timeout_restarts_agent(self, fake_sandbox, work_dir):
+        """The agent is killed when a command exceeds the timeout and started again by the next command."""
+        session = SandboxSession(work_dir)
+        try:
+            with pytest.raises(subprocess.TimeoutExpired):
+                session.run(['sleep', '30'], timeout=0.2)
+            assert session.process is None
+
+            assert session.run(['echo', 'test']) == 'test\n'
+        finally:
+            session.close()
+
+    def test_not_started_without_commands(self, fake_sandbox, work_dir):
+        """Documents which do not run any commands do not start the sandbox."""
+        with patch('subprocess.Popen') as mock_popen, sandbox_session(work_dir) as session:
+            pass
+
+        assert not mock_popen.called
+        assert session.stats()['lifetime_s'] is None
+
+
+class TestRunInSandbox:
+    """Tests for choosing between the session and a separate sandbox."""
+
+    def test_session_used_for_work_dir(self, fake_sandbox, work_dir):
+        """Commands with the work dir of an active session are run by it."""
+        with sandbox_session(work_dir) as session, \
+                patch('printing.processing.sandbox.run_cancellable') as mock_run:
+            assert run_in_sandbox(work_dir, ['echo', 'test']) == 'test\n'
+
+        assert not mock_run.called
+        assert session.stats()['commands'] == 1
+
+    def test_separate_sandbox_without_session(self, fake_sandbox, work_dir):
+        """Commands outside of a session and with other work dirs create a new sandbox."""
+        with sandbox_session(os.path.join(work_dir, 'other')), \
+                patch('printing.processing.sandbox.run_cancellable', return_value='output') as mock_run:
+            assert run_in_sandbox(work_dir, ['echo', 'test']) == 'output'
+
+        assert mock_run.call_args[0][0] == [fake_sandbox, work_dir, 'echo', 'test']
+
+    def test_sessions_disabled(self, fake_sandbox, work_dir, settings):
+        """Each command creates a new sandbox when the sessions are disabled."""
+        settings.SANDBOX_SESSIONS = False
+        with sandbox_session(work_dir) as session, \
+                patch('printing.processing.sandbox.run_cancellable', return_value='output'):
+            assert run_in_sandbox(work_dir, ['echo', 'test']) == 'output'
+
+        assert session is None
+
+    def test_command_killed_on_cancellation(self, fake_sandbox, work_dir, db, settings):
+        """The session is killed as soon as the job is canceled."""
+        owner = User.objects.create(username='owner')
+        job = GutenbergJob.objects.create(name='job', owner=owner, status=JobStatus.CANCELING)
+        settings.JOB_CANCELLATION_REDIS_URL = 'redis://localhost:6379'
+        listener = CancellationListener(settings.JOB_CANCELLATION_REDIS_URL)
+        listener.connected = True
+        listener.generation = 1
+
+        with patch.object(cancellation, '_listener', listener), watch_cancellation(job), \
+                sandbox_session(work_dir) as session:
+            threading.Timer(0.2, listener._dispatch, args=(job.id,)).start()
+            start = time.monotonic()
+
+            with pytest.raises(JobCanceledException):
+                run_in_sandbox(work_dir, ['sleep', '30'])
+
+        assert time.monotonic() - start < 10
+        assert session.process is None
+        job.refresh_from_db()
+        assert job.status == JobStatus.CANCELED
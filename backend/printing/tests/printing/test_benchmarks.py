@@ -0,0 +1,127 @@
+"""
+Tests for the document processing benchmark in printing.benchmarks
+"""
+
+import json
+import os
+import tempfile
+
+import pytest
+from django.core.management import call_command, CommandError
+from pypdf import PdfReader
+
+from printing.benchmarks import LAYOUT_MODES, _create_layout, compare_results, create_corpus, run_benchmarks, \
+    valid_n_up_values, write_pdf
+
+
+def _results(**cases):
+    return {'cases': cases}
+
+
+@pytest.fixture
+def work_dir():
+    """A temporary working directory for the generated corpus."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+class TestCompareResults:
+    """Tests for detecting the regressions compared to a baseline."""
+
+    def test_regression_over_threshold(self):
+        """A metric which increased by more than its threshold is reported."""
+        baseline = _results(case={'time_s': 1.0, 'peak_rss_kb': 100000, 'output_bytes': 10000})
+        results = _results(case={'time_s': 1.5, 'peak_rss_kb': 100000, 'output_bytes': 10000})
+
+        regressions = compare_results(results, baseline, {'time_s': 0.25, 'peak_rss_kb': 0.15})
+
+        assert len(regressions) == 1
+        assert regressions[0].startswith('case time_s')
+
+    def test_within_threshold(self):
+        """Increases within the thresholds and improvements are not reported."""
+        baseline = _results(case={'time_s': 1.0, 'peak_rss_kb': 100000})
+        results = _results(case={'time_s': 1.2, 'peak_rss_kb': 50000})
+
+        assert compare_results(results, baseline) == []
+
+    def test_small_absolute_increase(self):
+        """A large relative increase of a tiny value is measurement noise."""
+        baseline = _results(case={'time_s': 0.001, 'output_bytes': 100})
+        results = _results(case={'time_s': 0.01, 'output_bytes': 200})
+
+        assert compare_results(results, baseline) == []
+
+    def test_cases_missing_in_baseline(self):
+        """The cases without a baseline are skipped."""
+        assert compare_results(_results(new={'time_s': 10.0}), _results(old={'time_s': 1.0})) == []
+
+
+class TestBenchmarks:
+    """Tests for the corpus and the benchmark run."""
+
+    def test_valid_n_up_values(self):
+        assert valid_n_up_values() == [1, 2, 4, 8, 9, 16]
+
+    def test_corpus_page_counts(self, work_dir):
+        """The generated PDF documents have the requested page counts."""
+        documents = [document for document in create_corpus(work_dir, [1, 10]) if document.name.startswith('pdf-')]
+
+        assert [(document.name, len(PdfReader(document.path).pages)) for document in documents] == [
+            ('pdf-1', 1), ('pdf-10', 10),
+        ]
+
+    @pytest.mark.parametrize('mode', LAYOUT_MODES)
+    def test_layout_modes(self, work_dir, settings, mode):
+        """Every layout mode creates the same pages, also when the document is split into several chunks."""
+        settings.LAYOUT_CHUNK_MAX_MEDIA_PAGES = 2
+        settings.LAYOUT_PROCESSES = 2
+        input_file = os.path.join(work_dir, 'input.pdf')
+        write_pdf(input_file, 10)
+
+        output_file = _create_layout(input_file, work_dir, 'none', 2, mode)
+
+        assert len(PdfReader(output_file).pages) == 5
+
+    def test_run_benchmarks(self):
+        """Every case is measured."""
+        results = run_benchmarks([1])
+
+        assert 'converter/PdfConverter/pdf-1' in results['cases']
+        assert 'layout/passthrough/pdf-a4-1' in results['cases']
+        for mode in LAYOUT_MODES:
+            assert f'layout/booklet/n1/{mode}/pdf-1' in results['cases']
+            for n in valid_n_up_values():
+                assert f'layout/none/n{n}/{mode}/pdf-1' in results['cases']
+        for metrics in results['cases'].values():
+            assert metrics['time_s'] >= 0
+            assert metrics['peak_rss_kb'] > 0
+            assert metrics['output_bytes'] > 0
+
+
+class TestCommand:
+    """Tests for the benchmark_processing management command."""
+
+    def test_update_and_compare_baseline(self, tmp_path):
+        baseline = tmp_path / 'baseline.json'
+        call_command('benchmark_processing', '--pages', '1', '--baseline', str(baseline), '--update-baseline')
+        assert 'cases' in json.loads(baseline.read_text())
+
+        call_command('benchmark_processing', '--pages', '1', '--baseline', str(baseline),
+                     '--threshold', 'time_s=100', '--threshold', 'peak_rss_kb=100')
+
+    def test_regression_fails(self, tmp_path):
+        """The command fails if the results are worse than the baseline."""
+        baseline = tmp_path / 'baseline.json'
+        call_command('benchmark_processing', '--pages', '1', '--output', str(baseline))
+        data = json.loads(baseline.read_text())
+        for metrics in data['cases'].values():
+            metrics['output_bytes'] = 1
+        baseline.write_text(json.dumps(data))
+
+        with pytest.raises(CommandError):
+            call_command('benchmark_processing', '--pages', '1', '--baseline', str(baseline))
+
+    def test_unknown_metric(self):
+        with pytest.raises(CommandError):
+            call_command('benchmark_processing', '--threshold', 'unknown=1')
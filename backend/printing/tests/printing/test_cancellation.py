@@ -0,0 +1,184 @@
+"""
+Tests for the push-based job cancellation in printing.cancellation
+"""
+
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from common.models import User
+from control.models import GutenbergJob, JobStatus, PrinterType
+from printing import cancellation
+from printing.cancellation import CancellationListener, notify_job_canceled, watch_cancellation
+from printing.printing import print_file, _process_artefact
+from printing.utils import JobCanceledException, handle_cancellation, run_cancellable
+
+
+@pytest.fixture
+def job(db):
+    """A job which is being processed."""
+    owner = User.objects.create(username='owner')
+    return GutenbergJob.objects.create(name='job', owner=owner, status=JobStatus.PROCESSING)
+
+
+@pytest.fixture
+def listener(settings):
+    """A connected listener which does not connect to Redis."""
+    settings.JOB_CANCELLATION_REDIS_URL = 'redis://localhost:6379'
+    listener = CancellationListener(settings.JOB_CANCELLATION_REDIS_URL)
+    listener.connected = True
+    listener.generation = 1
+    with patch.object(cancellation, '_listener', listener):
+        yield listener
+
+
+def _cancel_in_database(job):
+    GutenbergJob.objects.filter(id=job.id).update(status=JobStatus.CANCELING)
+
+
+class TestHandleCancellation:
+    """Tests for handle_cancellation with the cancellation listener."""
+
+    def test_status_checked_only_once_while_listener_connected(self, job, listener, django_assert_num_queries):
+        """The database is only queried on the first check when no notification was received."""
+        with watch_cancellation(job):
+            with django_assert_num_queries(1):
+                handle_cancellation(job)
+                handle_cancellation(job)
+                handle_cancellation(job)
+
+    def test_status_checked_after_reconnection(self, job, listener, django_assert_num_queries):
+        """Notifications may have been lost while disconnected, so the status is checked again."""
+        with watch_cancellation(job):
+            handle_cancellation(job)
+            listener.generation += 1
+            with django_assert_num_queries(1):
+                handle_cancellation(job)
+
+    def test_status_rechecked_periodically(self, job, listener, settings, django_assert_num_queries):
+        """A lost notification is noticed by the periodic database check."""
+        settings.JOB_CANCELLATION_RECHECK_S = 30
+        with watch_cancellation(job) as token:
+            handle_cancellation(job)
+            _cancel_in_database(job)
+            handle_cancellation(job)
+            token.checked_at -= 30
+
+            with pytest.raises(JobCanceledException):
+                handle_cancellation(job)
+
+    def test_database_check_forced(self, job, listener):
+        """The status is read from the database when `check_database` is set, even without a notification."""
+        with watch_cancellation(job):
+            handle_cancellation(job)
+            _cancel_in_database(job)
+
+            with pytest.raises(JobCanceledException):
+                handle_cancellation(job, check_database=True)
+
+    def test_status_polled_without_listener(self, job, settings, django_assert_num_queries):
+        """Every check queries the database when Redis is not configured."""
+        settings.JOB_CANCELLATION_REDIS_URL = None
+        with watch_cancellation(job):
+            with django_assert_num_queries(2):
+                handle_cancellation(job)
+                handle_cancellation(job)
+
+    def test_notification_cancels_job(self, job, listener):
+        """A received notification makes the next check cancel the job."""
+        with watch_cancellation(job):
+            handle_cancellation(job)
+            _cancel_in_database(job)
+            listener._dispatch(job.id)
+
+            with pytest.raises(JobCanceledException):
+                handle_cancellation(job)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.CANCELED
+
+    def test_notification_for_other_job_is_ignored(self, job, listener):
+        """Notifications for jobs processed by other threads or workers are ignored."""
+        with watch_cancellation(job) as token:
+            listener._dispatch(job.id + 1)
+
+            assert not token.is_canceled()
+
+
+class TestRunCancellable:
+    """Tests for running subprocesses which are killed on cancellation."""
+
+    def test_returns_output(self):
+        """The output of a successful command is returned."""
+        assert run_cancellable(['echo', 'test']) == 'test\n'
+
+    def test_process_killed_on_cancellation(self, job, listener):
+        """A running subprocess is killed as soon as the job is canceled."""
+        _cancel_in_database(job)
+        with watch_cancellation(job):
+            threading.Timer(0.2, listener._dispatch, args=(job.id,)).start()
+            start = time.monotonic()
+
+            with pytest.raises(JobCanceledException):
+                run_cancellable(['sleep', '30'])
+
+        assert time.monotonic() - start < 10
+        job.refresh_from_db()
+        assert job.status == JobStatus.CANCELED
+
+    def test_not_started_after_cancellation(self, job, listener):
+        """No subprocess is started for a job which has already been canceled."""
+        _cancel_in_database(job)
+        with watch_cancellation(job) as token:
+            token.cancel()
+
+            with patch('subprocess.Popen') as mock_popen, pytest.raises(JobCanceledException):
+                run_cancellable(['sleep', '30'])
+
+        assert not mock_popen.called
+
+
+class TestPrintFileCancellation:
+    """Tests for the cancellations noticed by print_file."""
+
+    def test_lost_notification_before_spooling(self, create_job, create_pdf, printer_backend, listener):
+        """A job canceled without a notification is not sent to the printer."""
+        job = create_job([('application/pdf', create_pdf())], printer_type=PrinterType.LOCAL_CUPS)
+
+        def cancel_after_processing(job, artefact, artefact_tmpdir):
+            result = _process_artefact(job, artefact, artefact_tmpdir)
+            _cancel_in_database(job)
+            return result
+
+        with patch('printing.printing._process_artefact', side_effect=cancel_after_processing):
+            print_file(job.id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.CANCELED
+        assert printer_backend.submitted == []
+        assert not job.backend_jobs.exists()
+
+
+class TestNotifyJobCanceled:
+    """Tests for publishing cancellation notifications."""
+
+    def test_job_id_published(self, settings):
+        """The job id is published on the cancellation channel."""
+        settings.JOB_CANCELLATION_REDIS_URL = 'redis://localhost:6379'
+        publisher = Mock()
+
+        with patch.object(cancellation, '_get_publisher', return_value=publisher):
+            notify_job_canceled(42)
+
+        publisher.publish.assert_called_once_with(cancellation.CHANNEL, '42')
+
+    def test_nothing_published_when_disabled(self, settings):
+        """Nothing is published when Redis is not configured."""
+        settings.JOB_CANCELLATION_REDIS_URL = None
+
+        with patch.object(cancellation, '_get_publisher') as get_publisher:
+            notify_job_canceled(42)
+
+        assert not get_publisher.called
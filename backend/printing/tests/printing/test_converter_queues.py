@@ -0,0 +1,159 @@
+"""
+Tests for routing the print tasks to the converter queues and the converter limits in printing.converter_slots
+"""
+
+import os
+from unittest.mock import patch
+
+import pytest
+from celery.exceptions import Retry
+
+from control.models import GutenbergJob, JobStatus
+from gutenberg.worker_capabilities import update_supported_document_formats
+from printing.converter_slots import HostSemaphore, converter_slots, ConverterSlotsUnavailableError
+from printing.printing import enqueue_print_file, print_file, process_artefact
+from printing.processing.converter import get_converter_queue
+
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+@pytest.fixture
+def slots_dir(settings, tmp_path):
+    settings.CONVERTER_SLOTS_DIR = str(tmp_path / 'slots')
+    settings.CONVERTER_CONCURRENCY_LIMITS = {'convert.office': 1, 'convert.pdf': 2}
+    return settings.CONVERTER_SLOTS_DIR
+
+
+@pytest.fixture
+def create_queued_job(create_job):
+    """Returns a function creating a pending job with a document of each of `mime_types`."""
+
+    def create(*mime_types: str) -> GutenbergJob:
+        return create_job([(mime_type, b'document') for mime_type in mime_types])
+
+    return create
+
+
+def _enqueued_queue(job):
+    with patch('printing.printing.print_file.apply_async') as apply_async:
+        enqueue_print_file(job)
+    return apply_async.call_args.kwargs['queue']
+
+
+class TestConverterQueues:
+    """Tests for choosing the queue of the print tasks."""
+
+    def test_converter_queue(self):
+        """The queue is chosen by the converter of the document format."""
+        assert get_converter_queue('application/pdf') == 'convert.pdf'
+        assert get_converter_queue(DOCX_TYPE) == 'convert.office'
+        assert get_converter_queue('application/x-unknown') is None
+
+    def test_job_sent_to_converter_queue(self, create_queued_job, slots_dir):
+        """Jobs are sent to the queue of the converter of their documents."""
+        job = create_queued_job('application/pdf', 'application/pdf')
+
+        assert _enqueued_queue(job) == 'convert.pdf'
+
+    def test_mixed_job_sent_to_most_limited_queue(self, create_queued_job, slots_dir):
+        """Jobs with documents of different formats are sent to the queue with the lowest limit."""
+        job = create_queued_job('application/pdf', DOCX_TYPE)
+
+        assert _enqueued_queue(job) == 'convert.office'
+
+    def test_mixed_job_processed_in_parallel(self, settings, create_queued_job, slots_dir):
+        """The documents processed in parallel are routed separately, so the job uses the default queue."""
+        settings.PRINT_PARALLEL_DOCUMENT_PROCESSING = True
+        job = create_queued_job('application/pdf', DOCX_TYPE)
+
+        assert _enqueued_queue(job) is None
+
+    def test_formats_supported_by_all_workers(self, settings):
+        """Without parallel processing a format is only supported if all workers support it."""
+        replies = {
+            'pdf-worker': {'mime_types': ['application/pdf'], 'extensions': ['.pdf']},
+            'office-worker': {'mime_types': ['application/pdf', DOCX_TYPE], 'extensions': ['.pdf', '.docx']},
+        }
+
+        with patch('gutenberg.celery.app.control.broadcast', return_value=[replies]), \
+                patch('gutenberg.worker_capabilities.sleep'):
+            assert update_supported_document_formats()['mime_types'] == ['application/pdf']
+            settings.PRINT_PARALLEL_DOCUMENT_PROCESSING = True
+            assert update_supported_document_formats()['mime_types'] == ['application/pdf', DOCX_TYPE]
+
+    def test_queues_disabled(self, settings, create_queued_job, slots_dir):
+        """The default queue is used when the converter queues are disabled."""
+        settings.PRINT_CONVERTER_QUEUES = False
+        job = create_queued_job(DOCX_TYPE)
+
+        assert _enqueued_queue(job) is None
+
+
+class TestConverterSlots:
+    """Tests for the per-host converter limits."""
+
+    def test_host_semaphore(self, tmp_path):
+        """The semaphore has `limit` slots, which are released by closing them."""
+        semaphore = HostSemaphore('convert.pdf', 2, str(tmp_path))
+
+        first = semaphore.try_acquire()
+        second = semaphore.try_acquire()
+
+        assert first is not None and second is not None
+        assert semaphore.try_acquire() is None
+        os.close(first)
+        third = semaphore.try_acquire()
+        assert third is not None
+        os.close(second)
+        os.close(third)
+
+    def test_slots_released(self, slots_dir):
+        """The slots are released when the context exits."""
+        with converter_slots(['convert.office']):
+            with pytest.raises(ConverterSlotsUnavailableError):
+                with converter_slots(['convert.office', 'convert.pdf']):
+                    pass
+
+        with converter_slots(['convert.office', 'convert.pdf']):
+            pass
+
+    def test_unlimited_queue(self, slots_dir):
+        """Queues without a limit never wait."""
+        with converter_slots(['convert.image']), converter_slots(['convert.image']):
+            pass
+
+    def test_job_retried_when_converter_busy(self, create_queued_job, slots_dir):
+        """A job is retried later instead of waiting for a busy converter."""
+        job = create_queued_job(DOCX_TYPE)
+
+        with converter_slots(['convert.office']), patch('printing.printing._process_artefact') as process:
+            with pytest.raises(Retry):
+                print_file(job.id)
+
+        assert not process.called
+
+    def test_job_failed_after_waiting_too_long(self, settings, create_queued_job, slots_dir):
+        """A job is not retried forever when the converter stays busy."""
+        settings.CONVERTER_SLOT_MAX_WAIT_S = 0
+        job = create_queued_job(DOCX_TYPE)
+
+        with converter_slots(['convert.office']):
+            with pytest.raises(ConverterSlotsUnavailableError):
+                print_file(job.id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.ERROR
+
+    def test_expired_job_not_retried(self, create_queued_job, slots_dir):
+        """A job which has been marked as expired while waiting for a converter is not retried."""
+        job = create_queued_job(DOCX_TYPE)
+        GutenbergJob.objects.filter(id=job.id).update(status=JobStatus.ERROR)
+        artefact = job.artefacts.get()
+
+        with converter_slots(['convert.office']), patch('printing.printing._process_artefact') as process:
+            assert process_artefact(job.id, artefact.id) is None
+            print_file(job.id)
+
+        assert not process.called
+        job.refresh_from_db()
+        assert job.status == JobStatus.ERROR
@@ -0,0 +1,131 @@
+"""
+Tests for writing the uploaded documents to the storage in printing.ingestion
+"""
+
+import hashlib
+import io
+import os
+from unittest.mock import patch
+
+import pytest
+from django.core.files.storage import default_storage
+from django.http.multipartparser import MultiPartParser
+
+from control.models import JobArtefact, JobStatus
+from printing.ingestion import ingest_stream, DocumentTooLargeError, DocumentUploadHandler, IngestedUploadedFile, \
+    RejectedUploadedFile
+from printing.printing import submit_print_job
+
+BOUNDARY = 'boundary'
+
+
+def _stored_files(media_root):
+    return [os.path.join(root, name) for root, _, files in os.walk(media_root) for name in files]
+
+
+def _parse_upload(content: bytes):
+    body = (
+        '--{0}\r\nContent-Disposition: form-data; name="file"; filename="document.pdf"\r\n'
+        'Content-Type: application/pdf\r\n\r\n'.format(BOUNDARY).encode()
+        + content + '\r\n--{0}--\r\n'.format(BOUNDARY).encode()
+    )
+    meta = {
+        'CONTENT_TYPE': 'multipart/form-data; boundary={}'.format(BOUNDARY),
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    _, files = MultiPartParser(meta, io.BytesIO(body), [DocumentUploadHandler()]).parse()
+    return files['file']
+
+
+@pytest.fixture(autouse=True)
+def max_document_size(settings):
+    settings.MAX_DOCUMENT_SIZE_BYTES = 1024 * 1024
+
+
+class TestIngestStream:
+    """Tests for ingest_stream."""
+
+    def test_document_is_stored(self, media_root, create_pdf):
+        """The document is written to the storage with its hash, size and format."""
+        content = create_pdf()
+
+        document = ingest_stream(io.BytesIO(content))
+
+        with default_storage.open(document.name, 'rb') as f:
+            assert f.read() == content
+        assert document.name.startswith('artefacts/')
+        assert document.size == len(content)
+        assert document.sha256 == hashlib.sha256(content).hexdigest()
+        assert document.mime_type == 'application/pdf'
+
+    def test_too_large_document_is_not_stored(self, media_root):
+        """DocumentTooLargeError is raised and the partially written file is deleted."""
+        with pytest.raises(DocumentTooLargeError):
+            ingest_stream(io.BytesIO(b'x' * (1024 * 1024 + 1)))
+
+        assert _stored_files(media_root) == []
+
+
+class TestDocumentUploadHandler:
+    """Tests for the upload handler used by the REST API."""
+
+    def test_uploaded_file_is_stored(self, media_root, create_pdf):
+        """The uploaded file is written to the storage and the result is returned with the file."""
+        content = create_pdf()
+
+        uploaded_file = _parse_upload(content)
+
+        assert isinstance(uploaded_file, IngestedUploadedFile)
+        assert uploaded_file.size == len(content)
+        assert uploaded_file.read() == content
+        document = uploaded_file.claim()
+        uploaded_file.close()
+        assert default_storage.exists(document.name)
+        assert document.mime_type == 'application/pdf'
+
+    def test_unclaimed_file_is_deleted(self, media_root, create_pdf):
+        """The file is deleted at the end of the request if it has not been used."""
+        uploaded_file = _parse_upload(create_pdf())
+
+        uploaded_file.close()
+
+        assert _stored_files(media_root) == []
+
+    def test_too_large_file_is_rejected(self, media_root):
+        """Files larger than MAX_DOCUMENT_SIZE_BYTES are rejected without being stored."""
+        uploaded_file = _parse_upload(b'x' * (2 * 1024 * 1024))
+
+        assert isinstance(uploaded_file, RejectedUploadedFile)
+        assert _stored_files(media_root) == []
+
+
+class TestSubmitPrintJob:
+    """Tests for the documents sent with IPP."""
+
+    def test_document_is_stored_as_artefact(self, media_root, create_job, create_pdf):
+        """The request body becomes the SOURCE artefact and its format is detected during the upload."""
+        job = create_job(status=JobStatus.INCOMING)
+        content = create_pdf()
+
+        with patch('printing.printing.print_file.apply_async'):
+            submit_print_job(io.BytesIO(content), job.id, job.owner, 'application/octet-stream')
+
+        artefact = JobArtefact.objects.get(job=job)
+        assert artefact.mime_type == 'application/pdf'
+        assert artefact.sha256 == hashlib.sha256(content).hexdigest()
+        with artefact.file.open('rb') as f:
+            assert f.read() == content
+        assert len(_stored_files(media_root)) == 1
+
+    def test_pdf_document_is_indexed(self, create_job, create_pdf):
+        """The page count and orientation of PDF documents are stored on the artefact."""
+        job = create_job(status=JobStatus.INCOMING)
+
+        with patch('printing.printing.print_file.apply_async'):
+            submit_print_job(io.BytesIO(create_pdf()), job.id, job.owner, 'application/pdf')
+
+        artefact = JobArtefact.objects.get(job=job)
+        assert artefact.page_count == 1
+        assert artefact.page_sizes == {'595x842': 1}
+        assert artefact.page_orientation == 'portrait'
+        assert not artefact.encrypted
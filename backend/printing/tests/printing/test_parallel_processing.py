@@ -0,0 +1,213 @@
+"""
+Tests for processing the documents of a job in parallel in printing.printing
+"""
+
+import os
+from typing import List
+from unittest.mock import patch
+
+import pytest
+from celery import signature
+from django.core.files.base import ContentFile
+
+from control.models import GutenbergJob, JobArtefact, JobArtefactType, JobStatus, PrinterType
+from printing.printing import print_file, process_artefact, spool_processed_artefacts, discard_processed_artefacts, \
+    _process_artefact
+
+
+class EagerChord:
+    """
+    Replaces `celery.chord` to run the header tasks in the current process.
+
+    The tasks are run in the reverse order to check that the results do not depend on the order in which
+    the workers finish them. Like in a worker, the error callback is run instead of the callback
+    if any of the tasks fails.
+    """
+
+    def __init__(self, header):
+        self.header = list(header)
+
+    def __call__(self, callback):
+        results = [task.apply() for task in reversed(self.header)][::-1]
+        if any(result.failed() for result in results):
+            for errback in callback.options.get('link_error', []):
+                signature(errback).apply()
+            return
+        callback.apply(([result.get() for result in results],))
+
+
+@pytest.fixture
+def eager_chord():
+    with patch('printing.printing.chord', EagerChord):
+        yield
+
+
+@pytest.fixture
+def job(create_job, create_pdf, settings):
+    """A pending job with three PDF documents of 1, 2 and 3 pages, processed in parallel."""
+    settings.PRINT_PARALLEL_DOCUMENT_PROCESSING = True
+    return create_job(
+        [('application/pdf', create_pdf(page_count)) for page_count in range(1, 4)],
+        printer_type=PrinterType.LOCAL_CUPS,
+    )
+
+
+def _source_artefact(job, document_number) -> JobArtefact:
+    return job.artefacts.get(artefact_type=JobArtefactType.SOURCE, document_number=document_number)
+
+
+def _final_artefacts(job):
+    return JobArtefact.objects.filter(job=job, artefact_type=JobArtefactType.FINAL)
+
+
+def _create_final_artefacts(job, create_pdf) -> List[str]:
+    """
+    Creates the FINAL artefacts of the three documents in the reverse order, like the tasks finishing out of order.
+    Returns the paths of their files in the `document_number` order.
+    """
+
+    paths = []
+    for document_number in range(3, 0, -1):
+        artefact = JobArtefact.objects.create(
+            job=job,
+            artefact_type=JobArtefactType.FINAL,
+            file=ContentFile(create_pdf(), name='output.pdf'),
+            mime_type='application/pdf',
+            document_number=document_number,
+        )
+        paths.append(artefact.file.path)
+    return paths[::-1]
+
+
+class TestProcessArtefact:
+    """Tests for the process_artefact task."""
+
+    def test_output_stored_as_final_artefact(self, job):
+        """The output is stored as a FINAL artefact with the number of its document."""
+        page_count = process_artefact(job.id, _source_artefact(job, 2).id)
+
+        assert page_count == 2
+        final_artefact = _final_artefacts(job).get()
+        assert final_artefact.document_number == 2
+        assert final_artefact.mime_type == 'application/pdf'
+        assert os.path.exists(final_artefact.file.path)
+
+    def test_canceled_job(self, job):
+        """No output is stored for a canceled job."""
+        GutenbergJob.objects.filter(id=job.id).update(status=JobStatus.CANCELING)
+
+        assert process_artefact(job.id, _source_artefact(job, 1).id) is None
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.CANCELED
+        assert not _final_artefacts(job).exists()
+
+    def test_failed_document(self, job):
+        """A failure of a single document fails the whole job."""
+        with patch('printing.printing._process_artefact', side_effect=ValueError('broken document')):
+            with pytest.raises(ValueError):
+                process_artefact(job.id, _source_artefact(job, 1).id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.ERROR
+        assert 'broken document' in job.status_reason
+
+
+class TestSpoolProcessedArtefacts:
+    """Tests for the spool_processed_artefacts chord callback."""
+
+    def test_spooled_in_document_order(self, job, create_pdf, printer_backend):
+        """The FINAL artefacts are submitted in the `document_number` order and deleted afterwards."""
+        GutenbergJob.objects.filter(id=job.id).update(status=JobStatus.PROCESSING)
+        paths = _create_final_artefacts(job, create_pdf)
+
+        spool_processed_artefacts([1, 2, 3], job.id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.PRINTING
+        assert job.pages == 6
+        assert printer_backend.submitted == paths
+        assert list(job.backend_jobs.order_by('id').values_list('document_number', flat=True)) == [1, 2, 3]
+        assert not _final_artefacts(job).exists()
+        assert not any(map(os.path.exists, paths))
+
+    def test_canceled_document(self, job, create_pdf, printer_backend):
+        """Nothing is printed if any of the documents has been canceled, but the outputs are deleted."""
+        GutenbergJob.objects.filter(id=job.id).update(status=JobStatus.CANCELED)
+        paths = _create_final_artefacts(job, create_pdf)
+
+        spool_processed_artefacts([1, None, 3], job.id)
+
+        assert printer_backend.submitted == []
+        assert not _final_artefacts(job).exists()
+        assert not any(map(os.path.exists, paths))
+
+    def test_canceled_before_spooling(self, job, create_pdf, printer_backend):
+        """The job canceled after its documents have been processed is not printed."""
+        GutenbergJob.objects.filter(id=job.id).update(status=JobStatus.CANCELING)
+        _create_final_artefacts(job, create_pdf)
+
+        spool_processed_artefacts([1, 2, 3], job.id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.CANCELED
+        assert printer_backend.submitted == []
+        assert not _final_artefacts(job).exists()
+
+
+class TestDiscardProcessedArtefacts:
+    """Tests for the discard_processed_artefacts error callback."""
+
+    def test_final_artefacts_deleted(self, job, create_pdf):
+        """The FINAL artefacts are deleted with their files and the SOURCE artefacts are kept."""
+        paths = _create_final_artefacts(job, create_pdf)
+
+        discard_processed_artefacts(job.id)
+
+        assert not _final_artefacts(job).exists()
+        assert not any(map(os.path.exists, paths))
+        assert job.artefacts.filter(artefact_type=JobArtefactType.SOURCE).count() == 3
+
+
+class TestParallelPrintFile:
+    """Tests for print_file with `PRINT_PARALLEL_DOCUMENT_PROCESSING` enabled."""
+
+    def test_documents_printed_in_order(self, job, printer_backend, eager_chord):
+        """The documents processed out of order are printed in the `document_number` order."""
+        print_file(job.id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.PRINTING
+        assert job.pages == 6
+        assert list(job.backend_jobs.order_by('id').values_list('document_number', flat=True)) == [1, 2, 3]
+        assert not _final_artefacts(job).exists()
+
+    def test_canceled_during_processing(self, job, printer_backend, eager_chord):
+        """The job canceled while its documents are processed is not printed and the outputs are deleted."""
+        def cancel_on_second_document(job, artefact, artefact_tmpdir):
+            if artefact.document_number == 2:
+                GutenbergJob.objects.filter(id=job.id).update(status=JobStatus.CANCELING)
+            return _process_artefact(job, artefact, artefact_tmpdir)
+
+        with patch('printing.printing._process_artefact', side_effect=cancel_on_second_document):
+            print_file(job.id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.CANCELED
+        assert printer_backend.submitted == []
+        assert not _final_artefacts(job).exists()
+
+    def test_failed_document_discards_outputs(self, job, printer_backend, eager_chord):
+        """The outputs of the other documents are deleted by the error callback when a document fails."""
+        def fail_on_second_document(job, artefact, artefact_tmpdir):
+            if artefact.document_number == 2:
+                raise ValueError('broken document')
+            return _process_artefact(job, artefact, artefact_tmpdir)
+
+        with patch('printing.printing._process_artefact', side_effect=fail_on_second_document):
+            print_file(job.id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.ERROR
+        assert printer_backend.submitted == []
+        assert not _final_artefacts(job).exists()
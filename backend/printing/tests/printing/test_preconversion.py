@@ -0,0 +1,123 @@
+"""
+Tests for converting the uploaded documents before the job is submitted in printing.printing
+"""
+
+import os
+from unittest.mock import patch
+
+import pytest
+
+from control.models import JobArtefact, JobStatus
+from printing.converter_slots import converter_slots
+from printing.printing import enqueue_preconversion, preconvert_artefact
+from printing.processing import converter
+from printing.processing.converter import DocConverter
+from printing.processing.pages import PageOrientation
+
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+@pytest.fixture
+def conversion_settings(settings, tmp_path):
+    settings.CONVERSION_CACHE_DIR = str(tmp_path / 'cache')
+    settings.CONVERTER_SLOTS_DIR = str(tmp_path / 'slots')
+    settings.CONVERTER_CONCURRENCY_LIMITS = {'convert.office': 1}
+    return settings
+
+
+@pytest.fixture
+def fake_libreoffice(create_pdf):
+    """Makes DocConverter available and replaces LibreOffice with a function writing a landscape PDF."""
+
+    def convert_to_pdf(self, input_file):
+        out = os.path.join(self.work_dir, 'converted.pdf')
+        with open(out, 'wb') as f:
+            f.write(create_pdf(width=842, height=595))
+        return out
+
+    with patch.dict(converter.CONVERTER_FOR_TYPE, {DOCX_TYPE: DocConverter}), \
+            patch.object(DocConverter, 'convert_to_pdf', autospec=True, side_effect=convert_to_pdf) as mock_convert:
+        yield mock_convert
+
+
+@pytest.fixture
+def create_artefact(create_job):
+    """Returns a function creating a job with a single document of `mime_type` and returning its artefact."""
+
+    def create(mime_type: str, status: JobStatus = JobStatus.INCOMING) -> JobArtefact:
+        return create_job([(mime_type, b'document')], status=status).artefacts.get()
+
+    return create
+
+
+class TestEnqueuePreconversion:
+    """Tests for choosing the documents which are converted at upload time."""
+
+    def test_office_document_enqueued_with_low_priority(self, conversion_settings, create_artefact):
+        """Office documents are sent to the queue of their converter with the preconversion priority."""
+        artefact = create_artefact(DOCX_TYPE)
+
+        with patch('printing.printing.preconvert_artefact.apply_async') as apply_async:
+            enqueue_preconversion(artefact)
+
+        apply_async.assert_called_once_with(
+            (artefact.id,), queue='convert.office', priority=conversion_settings.PRECONVERSION_TASK_PRIORITY,
+        )
+
+    @pytest.mark.parametrize('mime_type', ['application/pdf', 'image/jpeg'])
+    def test_documents_converted_with_job_properties_not_enqueued(self, conversion_settings, create_artefact,
+                                                                  mime_type):
+        """Documents which are not converted by an EarlyConverter with a cached result are not preconverted."""
+        artefact = create_artefact(mime_type)
+
+        with patch('printing.printing.preconvert_artefact.apply_async') as apply_async:
+            enqueue_preconversion(artefact)
+
+        assert not apply_async.called
+
+    def test_not_enqueued_without_cache(self, conversion_settings, create_artefact):
+        """The preconversion result could not be reused without the conversion cache."""
+        conversion_settings.CONVERSION_CACHE_DIR = None
+        artefact = create_artefact(DOCX_TYPE)
+
+        with patch('printing.printing.preconvert_artefact.apply_async') as apply_async:
+            enqueue_preconversion(artefact)
+
+        assert not apply_async.called
+
+
+class TestPreconvertArtefact:
+    """Tests for the preconversion task."""
+
+    def test_result_reused_by_print_job(self, conversion_settings, create_artefact, fake_libreoffice, tmp_path):
+        """The document is only converted once, by the preconversion task."""
+        artefact = create_artefact(DOCX_TYPE)
+
+        preconvert_artefact(artefact.id)
+        work_dir = tmp_path / 'work'
+        work_dir.mkdir()
+        input_file = str(work_dir / 'input.docx')
+        with open(input_file, 'wb') as f:
+            f.write(b'document')
+        result = DocConverter(str(work_dir)).preprocess(input_file)
+
+        assert fake_libreoffice.call_count == 1
+        assert result.preprocess_result_path == str(work_dir / 'converted.pdf')
+        assert result.orientation == PageOrientation.LANDSCAPE
+
+    def test_skipped_for_submitted_job(self, conversion_settings, create_artefact, fake_libreoffice):
+        """The print task converts the documents of the jobs which have already been submitted."""
+        artefact = create_artefact(DOCX_TYPE, status=JobStatus.PENDING)
+
+        preconvert_artefact(artefact.id)
+
+        assert not fake_libreoffice.called
+
+    def test_skipped_when_converter_busy(self, conversion_settings, create_artefact, fake_libreoffice):
+        """The preconversion does not wait for the converter slots used by the submitted jobs."""
+        artefact = create_artefact(DOCX_TYPE)
+
+        with converter_slots(['convert.office']):
+            preconvert_artefact(artefact.id)
+
+        assert not fake_libreoffice.called
@@ -0,0 +1,132 @@
+"""
+Tests for following the jobs submitted to the printers in printing.printing.monitor_print_jobs
+"""
+
+import datetime
+from unittest.mock import patch
+
+import pytest
+from django.utils import timezone
+
+from control.models import GutenbergJob, JobStage, JobStageTiming, JobStatus, PrinterType, BackendPrintJob
+from printing.backends import LocalCupsPrinter
+from printing.printing import print_file, monitor_print_jobs
+from printing.utils import PRINTING_TIMEOUT_S
+
+
+@pytest.fixture
+def create_printed_job(create_job, create_pdf):
+    """Returns a function creating a pending job with `document_count` PDF documents sent to a CUPS printer."""
+
+    def create(document_count: int = 1):
+        return create_job([('application/pdf', create_pdf(2))] * document_count, printer_type=PrinterType.LOCAL_CUPS)
+
+    return create
+
+
+@pytest.fixture
+def job(create_printed_job):
+    """A pending job with two PDF documents."""
+    return create_printed_job(document_count=2)
+
+
+class TestPrintFile:
+    """Tests for submitting the jobs to the printer."""
+
+    def test_worker_does_not_wait_for_printer(self, job, printer_backend):
+        """print_file returns after the submission and leaves the job to the monitor."""
+        print_file(job.id)
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.PRINTING
+        backend_jobs = job.backend_jobs.order_by('document_number').values_list('document_number', 'backend_job_id')
+        assert list(backend_jobs) == [(1, 'printer-1'), (2, 'printer-2')]
+        assert printer_backend.status_checks == []
+
+
+class TestMonitorPrintJobs:
+    """Tests for the monitor_print_jobs periodic task."""
+
+    def test_job_completed_when_all_documents_printed(self, job, printer_backend):
+        """The job is completed once the backend has finished all its documents."""
+        print_file(job.id)
+
+        del printer_backend.statuses['printer-1']
+        monitor_print_jobs()
+        job.refresh_from_db()
+        assert job.status == JobStatus.PRINTING
+
+        del printer_backend.statuses['printer-2']
+        monitor_print_jobs()
+        job.refresh_from_db()
+        assert job.status == JobStatus.COMPLETED
+        assert job.date_finished is not None
+        assert list(
+            JobStageTiming.objects.filter(job=job, stage=JobStage.PRINT_WAIT).values_list('document_number', flat=True)
+        ) == [1, 2]
+
+    def test_single_status_check_for_all_jobs(self, job, create_printed_job, printer_backend):
+        """The statuses of the documents of all jobs are checked with a single query."""
+        other_job = create_printed_job()
+        print_file(job.id)
+        print_file(other_job.id)
+
+        monitor_print_jobs()
+
+        assert len(printer_backend.status_checks) == 1
+        assert sorted(printer_backend.status_checks[0]) == ['printer-1', 'printer-2', 'printer-3']
+
+    def test_status_reason_updated(self, job, printer_backend):
+        """The status reported by the backend is stored as the status reason of the job."""
+        print_file(job.id)
+        printer_backend.statuses['printer-1'] = 'media-empty'
+
+        monitor_print_jobs()
+
+        job.refresh_from_db()
+        assert job.status_reason == 'media-empty'
+
+    def test_canceled_job(self, job, printer_backend):
+        """The documents of a canceled job are canceled in the backend."""
+        print_file(job.id)
+        GutenbergJob.objects.filter(id=job.id).update(status=JobStatus.CANCELING)
+
+        monitor_print_jobs()
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.CANCELED
+        assert sorted(printer_backend.canceled) == ['printer-1', 'printer-2']
+        assert not job.backend_jobs.filter(date_finished=None).exists()
+
+    def test_timeout(self, job, printer_backend):
+        """Documents printed for too long are canceled and the job fails."""
+        print_file(job.id)
+        BackendPrintJob.objects.filter(job=job).update(
+            date_submitted=timezone.now() - datetime.timedelta(seconds=PRINTING_TIMEOUT_S + 1),
+        )
+
+        monitor_print_jobs()
+
+        job.refresh_from_db()
+        assert job.status == JobStatus.ERROR
+        assert sorted(printer_backend.canceled) == ['printer-1', 'printer-2']
+
+
+class TestLocalCupsPrinter:
+    """Tests for reading the job statuses from lpstat."""
+
+    def test_check_statuses(self):
+        """The statuses of the requested jobs are read from a single lpstat call."""
+        output = (
+            b'printer-12              user              1024   Mon 01 Jan 2024 10:00:00 CET\n'
+            b'\tStatus: Printing page 1\n'
+            b'\tAlerts: job-printing\n'
+            b'printer-13              user              2048   Mon 01 Jan 2024 10:01:00 CET\n'
+            b'\tAlerts: job-incoming\n'
+        )
+
+        with patch('subprocess.check_output', return_value=output) as check_output:
+            statuses = LocalCupsPrinter().check_statuses(['printer-12', 'printer-11'])
+
+        assert statuses == {'printer-12': 'Status: Printing page 1\nAlerts: job-printing'}
+        assert check_output.call_count == 1
@@ -0,0 +1,85 @@
+"""
+Tests for the per-stage timing of print jobs in printing.stage_timing
+"""
+
+import pytest
+
+from api.serializers import GutenbergJobDetailSerializer
+from control.models import JobStage, JobStageTiming
+from printing.printing import print_file
+from printing.stage_timing import StageTimer
+
+
+@pytest.fixture
+def job(create_job, create_pdf):
+    """A pending job with two PDF documents sent to a disabled printer."""
+    return create_job([('application/pdf', create_pdf(3)), ('application/pdf', create_pdf(5))], n_up=2)
+
+
+class TestStageTimer:
+    """Tests for recording the stage timings."""
+
+    def test_measurement_is_saved(self, job, tmp_path):
+        """A measured stage is saved with the sizes of its input and output files."""
+        input_file = tmp_path / 'input.bin'
+        input_file.write_bytes(b'x' * 10)
+        output_file = tmp_path / 'output.bin'
+        output_file.write_bytes(b'x' * 25)
+
+        with StageTimer(job, 2).measure(JobStage.LAYOUT, str(input_file)) as measurement:
+            measurement.output_file = str(output_file)
+            measurement.pages = 4
+
+        timing = JobStageTiming.objects.get(job=job)
+        assert timing.document_number == 2
+        assert timing.stage == JobStage.LAYOUT
+        assert timing.wall_time_s >= 0
+        assert timing.cpu_time_s >= 0
+        assert (timing.input_bytes, timing.output_bytes, timing.pages) == (10, 25, 4)
+
+    def test_measurement_is_saved_on_exception(self, job):
+        """The time spent in a failed stage is recorded as well."""
+        with pytest.raises(ValueError):
+            with StageTimer(job).measure(JobStage.PREPROCESS):
+                raise ValueError()
+
+        assert JobStageTiming.objects.filter(job=job, stage=JobStage.PREPROCESS).count() == 1
+
+
+class TestPrintFileTiming:
+    """Tests for the stage timings recorded by print_file."""
+
+    def test_stages_recorded_for_each_document(self, job):
+        """Every processing stage of every document and the printer submission are recorded."""
+        print_file(job.id)
+
+        stages = list(JobStageTiming.objects.filter(job=job).order_by('id').values_list('document_number', 'stage'))
+        assert stages == [
+            (1, JobStage.PREPROCESS), (1, JobStage.INPUT_PDF), (1, JobStage.LAYOUT),
+            (2, JobStage.PREPROCESS), (2, JobStage.INPUT_PDF), (2, JobStage.LAYOUT),
+            # The disabled printer cancels the job during the submission
+            (1, JobStage.SUBMIT),
+        ]
+        layout_pages = JobStageTiming.objects.filter(job=job, stage=JobStage.LAYOUT).order_by('document_number')
+        assert [timing.pages for timing in layout_pages] == [2, 3]
+
+    def test_passthrough_recorded(self, job):
+        """Documents sent to the printer without the layout have the passthrough stage instead of the layout stage."""
+        job.properties.n_up = 1
+        job.properties.save()
+
+        print_file(job.id)
+
+        assert JobStageTiming.objects.filter(job=job, stage=JobStage.PASSTHROUGH).count() == 2
+        assert not JobStageTiming.objects.filter(job=job, stage=JobStage.LAYOUT).exists()
+
+    def test_stage_timings_in_job_details(self, job):
+        """The job details returned by the API include the stage timings."""
+        print_file(job.id)
+
+        data = GutenbergJobDetailSerializer(job).data
+
+        assert len(data['stage_timings']) == 7
+        assert set(data['stage_timings'][0].keys()) == {
+            'document_number', 'stage', 'wall_time_s', 'cpu_time_s', 'input_bytes', 'output_bytes', 'pages',
+        }
@@ -1,8 +1,13 @@
+import hashlib
 import logging
 import os
-from typing import Optional, Callable
+import signal
+import subprocess
+from typing import Optional, Callable, List
 
 from control.models import GutenbergJob, JobStatus
+from printing.cancellation import is_status_check_needed, mark_status_checked, get_listener_generation, \
+    get_current_token, on_cancel
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SANDBOX_PATH = os.path.join(BASE_DIR, 'sandbox.sh')
@@ -25,10 +30,22 @@ class DocumentFormatError(ValueError):
     pass
 
 
-def handle_cancellation(job: GutenbergJob, handler: Optional[Callable[[], None]] = None):
+def handle_cancellation(job: GutenbergJob, handler: Optional[Callable[[], None]] = None,
+                        check_database: bool = False):
+    """
+    Raises `JobCanceledException` if `job` has been canceled, after setting its status to `CANCELED`.
+
+    The status is only read from the database when a cancellation notification could have been missed,
+    see `printing.cancellation`, unless `check_database` is set.
+    """
+
     # We allow a low possibility of a race condition here as the impact would be negligible
     # (ie. ignored request) and the probability is low.
+    if not check_database and not is_status_check_needed(job):
+        return
+    generation = get_listener_generation()
     job.refresh_from_db()
+    mark_status_checked(job, generation)
     if job.status == JobStatus.CANCELING:
         logger.info("Canceling job {}".format(job))
         if handler:
@@ -38,9 +55,70 @@ def handle_cancellation(job: GutenbergJob, handler: Optional[Callable[[], None]]
         job.save()
         raise JobCanceledException()
 
+
+def handle_current_cancellation():
+    """
+    Raises `JobCanceledException` if the job processed by the current thread has been canceled
+    while it was watched with `watch_cancellation`, after setting its status to `CANCELED`.
+    """
+
+    token = get_current_token()
+    if token is not None and token.is_canceled():
+        handle_cancellation(token.job)
+
+
+def _kill_process_group(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_cancellable(command: List[str], timeout: float = TASK_TIMEOUT_S) -> str:
+    """
+    Runs `command` and returns its output like `subprocess.check_output` with `text=True`
+    and `stderr=subprocess.STDOUT`.
+
+    The command runs in a new process group, which is killed when the timeout expires
+    or when the job processed by the current thread is canceled.
+    In the latter case the job is marked as canceled and `JobCanceledException` is raised.
+    """
+
+    handle_current_cancellation()
+
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        start_new_session=True,
+    )
+    with on_cancel(lambda: _kill_process_group(process)):
+        try:
+            output, _ = process.communicate(timeout=timeout)
+        except BaseException:
+            _kill_process_group(process)
+            process.communicate()
+            raise
+
+    if process.returncode != 0:
+        handle_current_cancellation()
+        raise subprocess.CalledProcessError(process.returncode, command, output=output)
+    return output
+
+
 def ceil_div(a: int, b: int) -> int:
     """
     :return: ceil(a / b)
     """
 
     return -(a // -b)
+
+
+def file_sha256(path: str) -> str:
+    """
+    :return: The hex digest of the SHA-256 hash of the file contents.
+    """
+
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()